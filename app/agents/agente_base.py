@@ -3,6 +3,9 @@
 # Classe-base para todos os agentes DOMO
 # - Garante que sentimento seja armazenado.
 # - Mantém método para carregar intents.
+# - Respostas vão para o outbox (core/outbox.py) na MESMA gravação do
+#   contexto (`saidas` + `ultimo_texto_bot`); a entrega é feita pelo pool
+#   de remetentes. Se a gravação falha, nada é enviado por fora.
 # ===========================================================
 from __future__ import annotations
 
@@ -13,10 +16,13 @@ from typing import Dict, Any, Optional
 
 # Assume que intents.py está em core
 from app.core.intents import obter_intent
-# Assume que mensageria.py está em utils
-from app.utils.mensageria import enviar_mensagem
+# Outbox transacional: entrega/retentativa/DLQ desacopladas da geração
+from app.core import outbox
+from app.core.outbox import remetente as remetente_outbox
 # Assume que contexto.py está em utils
 from app.utils.contexto import salvar_contexto, obter_contexto # Adicionado obter_contexto
+# Pools de variações pré-geradas (evita IA no caminho quente)
+from app.utils.variantes import variante_ou_gerar
 
 logger = logging.getLogger("famdomes.agente_base") # Logger específico
 
@@ -40,41 +46,41 @@ class AgenteBase:
         # Garante que sentimento seja sempre um dicionário, mesmo que vazio
         self.sentimento: Dict[str, Any] = sentimento if sentimento is not None else {}
         self.nome: str = self.__class__.__name__
+        # Trecho já entregue antecipadamente por agentes em streaming (ver DomoGenerativo)
+        self._prefixo_enviado: str = ""
         logger.debug(f"Agente '{self.nome}' inicializado com intent '{self.intent}' e sentimento {self.sentimento}")
 
     # ------------------------------------------------------
-    async def executar(self, telefone: str, mensagem_original: str) -> None:
+    async def executar(self, telefone: str, mensagem_original: str) -> bool:
         """
         Método principal chamado pelo MCP Orquestrador.
         1. Chama _gerar_resposta() para obter o texto da resposta.
-        2. Envia a resposta via mensageria (se houver).
-        3. Salva a resposta do bot no contexto para evitar loops.
+        2. Grava no contexto, em uma única atualização do documento, a
+           resposta do bot (evita loops) e a entrada do outbox.
+        Retorna False se a resposta não pôde ser gravada (nada foi enviado).
         """
         resposta_texto: str | None = None
         try:
             # Chama o método que cada agente implementa para definir sua lógica
             resposta_texto = await self._gerar_resposta(telefone, mensagem_original)
 
-            if resposta_texto:
-                logger.info(f"Agente '{self.nome}': Enviando resposta para {telefone}: '{resposta_texto[:60]}...'")
-                # Envia a mensagem para o usuário
-                resultado_envio = await enviar_mensagem(telefone, resposta_texto)
-
-                # Verifica se o envio foi bem-sucedido antes de salvar no contexto
-                if resultado_envio.get("status") == "enviado" or resultado_envio.get("code") == 200:
-                    # Salva a resposta enviada no contexto para referência e anti-loop
-                    # É importante que o Orquestrador também salve o estado final após a execução
-                    salvar_contexto(telefone=telefone, ultimo_texto_bot=resposta_texto)
-                    logger.debug(f"Agente '{self.nome}': Resposta salva no contexto de {telefone}.")
-                else:
-                    logger.error(f"Agente '{self.nome}': Falha ao enviar mensagem para {telefone}. Status: {resultado_envio.get('status')}, Erro: {resultado_envio.get('erro')}")
-                    # Não salva ultimo_texto_bot se o envio falhou
-
-            else:
+            if self._prefixo_enviado and not resposta_texto:
+                # Streaming entregou a resposta inteira no primeiro trecho
+                return await salvar_contexto(telefone=telefone, ultimo_texto_bot=self._prefixo_enviado)
+            if not resposta_texto:
                 # Loga se o agente decidiu não responder
                 logger.info(f"Agente '{self.nome}' optou por não responder para {telefone} (intent='{self.intent}').")
-                # Garante que o ultimo_texto_bot seja limpo ou mantido como estava
-                # salvar_contexto(telefone=telefone, ultimo_texto_bot=None) # Ou não fazer nada
+                return True
+
+            logger.info(f"Agente '{self.nome}': Enfileirando resposta para {telefone}: '{resposta_texto[:60]}...'")
+            # Outbox + contexto na mesma gravação: ou a resposta fica registrada e na fila, ou nenhuma das duas
+            texto_completo = f"{self._prefixo_enviado} {resposta_texto}".strip()
+            entrada = outbox.montar_entrada(telefone, resposta_texto, agente=self.nome, intent=self.intent)
+            if await salvar_contexto(telefone=telefone, ultimo_texto_bot=texto_completo, saida=entrada):
+                logger.debug(f"Agente '{self.nome}': Resposta enfileirada e salva no contexto de {telefone}.")
+                return True
+            logger.error(f"Agente '{self.nome}': ❌ Resposta para {telefone} não foi gravada; nada enviado.")
+            return False
 
         except NotImplementedError:
              logger.error(f"Agente '{self.nome}' não implementou o método _gerar_resposta().")
@@ -82,8 +88,10 @@ class AgenteBase:
              raise # Re-levanta a exceção para o Orquestrador tratar
         except Exception as e:
             logger.exception(f"Agente '{self.nome}': Erro inesperado durante _gerar_resposta ou envio para {telefone}: {e}")
-            # Considerar enviar uma mensagem de erro genérica
-            await enviar_mensagem(telefone, "Desculpe, ocorreu um erro interno ao processar sua solicitação.")
+            # Aviso genérico também pelo outbox (sem envio direto)
+            await remetente_outbox.enfileirar(
+                telefone, "Desculpe, ocorreu um erro interno ao processar sua solicitação.", agente=self.nome, intent=self.intent
+            )
             # Levanta a exceção para o Orquestrador registrar o erro
             raise
 
@@ -129,23 +137,32 @@ class AgenteBase:
     # Métodos utilitários adicionais podem ser adicionados aqui,
     # como chamar a IA para tarefas específicas, formatar dados, etc.
     # Exemplo: Chamar IA para refrasear (pode ficar aqui ou em um utilitário separado)
-    async def _refrasear_com_ia(self, texto_original: str, telefone: str, contexto_breve: str = "geral") -> str:
-        """Tenta refrasear uma mensagem padrão usando a IA para soar mais natural."""
+    async def _refrasear_com_ia(self, texto_original: str, telefone: str, contexto_breve: str = "geral",
+                                template_id: Optional[str] = None) -> str:
+        """
+        Tenta refrasear uma mensagem padrão usando a IA para soar mais natural.
+        Com `template_id` (texto estático de uma intent/etapa), usa o pool de
+        variações pré-geradas; sem ele, chama a IA ao vivo e nada é registrado.
+        """
         # Importa aqui para evitar dependência circular ou coloca em utils/ia_utils.py
         from app.core.ia_direct import gerar_resposta_ia # Ou outra função de IA
 
         if not texto_original: return ""
 
-        try:
-            # Ajuste o prompt conforme necessário para sua IA
-            prompt = f"""
+        # Ajuste o prompt conforme necessário para sua IA
+        prompt = f"""
             Contexto: {contexto_breve}.
             Reescreva a mensagem abaixo para soar um pouco mais natural e empática, mantendo o sentido original e o tamanho similar.
             Mensagem Original: "{texto_original}"
             Mensagem Reescrevida:
             """
-            # Use um contexto específico para a chamada da IA se necessário
-            resposta_ia = await gerar_resposta_ia({"prompt_context": prompt})
+
+        try:
+            if template_id:
+                # Texto estático: pool pré-gerado (geração ao vivo compartilhada se vazio)
+                resposta_ia = await variante_ou_gerar(f"refrasear:{template_id}", prompt)
+            else:
+                resposta_ia = await gerar_resposta_ia({"prompt_context": prompt})
 
             if resposta_ia and len(resposta_ia) > 5: # Verifica se a resposta é minimamente válida
                 logger.debug(f"Agente '{self.nome}': Texto refraseado para {telefone}: '{resposta_ia[:60]}...'")
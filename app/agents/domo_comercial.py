@@ -13,6 +13,7 @@ from app.agents.agente_base import AgenteBase
 from app.core.scoring import score_lead
 from app.utils.contexto import salvar_contexto, obter_contexto
 from app.core.ia_direct import gerar_resposta_ia # Ou app.utils.ollama
+from app.utils.variantes import variante_ou_gerar, bucket_sentimento
 
 logger = logging.getLogger("famdomes.domo_comercial")
 
@@ -59,7 +60,7 @@ class DomoComercial(AgenteBase):
     async def _gerar_validacao_curta(self, telefone: str, mensagem_original: str) -> str:
         """Gera validação empática curta para a resposta anterior."""
         # Não valida a primeira resposta (após micro-compromisso)
-        ctx = obter_contexto(telefone)
+        ctx = await obter_contexto(telefone)
         etapa_quali = ctx.get("meta_conversa", {}).get("etapa_quali", 0)
         if etapa_quali <= 1: # Não valida antes da Q1 ou após Q1
              return ""
@@ -67,9 +68,7 @@ class DomoComercial(AgenteBase):
         if not self.sentimento or not mensagem_original:
              return "Ok. " # Fallback muito curto
 
-        sentimento_desc = "neutro"
-        if self.sentimento.get('negativo', 0) > 0.6: sentimento_desc = "negativo"
-        elif self.sentimento.get('positivo', 0) > 0.6: sentimento_desc = "positivo"
+        sentimento_desc = bucket_sentimento(self.sentimento)
 
         try:
             prompt = f"""
@@ -77,7 +76,8 @@ class DomoComercial(AgenteBase):
             Gere uma ÚNICA PALAVRA de validação (ex: "Entendido.", "Compreendo.", "Perfeito.", "Certo.").
             Validação Curta:
             """
-            validacao = await gerar_resposta_ia({"prompt_context": prompt})
+            # Pool pré-gerado por sentimento; IA ao vivo só se o pool estiver vazio
+            validacao = await variante_ou_gerar("validacao_curta", prompt, sentimento_desc) or ""
             # Garante que a validação seja curta e termine com ponto e espaço
             validacao_limpa = "".join(c for c in validacao if c.isalnum() or c in ['.', ' ']).strip().split('.')[0]
             return f"{validacao_limpa}. " if validacao_limpa else "Ok. "
@@ -105,7 +105,8 @@ class DomoComercial(AgenteBase):
             4. FINALIZE perguntando DIRETAMENTE se o usuário deseja o link de pagamento para iniciar. (ex: "Deseja o link de pagamento para começar agora?")
             Resposta Focada em Valor e CTA:
             """
-            resposta_valor = await gerar_resposta_ia({"prompt_context": prompt})
+            # Prompt sem dados do usuário: mesmo pitch por plano, pode usar o cache da IA
+            resposta_valor = await gerar_resposta_ia({"prompt_context": prompt}, usar_cache=True, site="pitch_plano")
             if resposta_valor and len(resposta_valor) > 20:
                 logger.info(f"DomoComercial: Resposta de valor/preço gerada para {telefone}.")
                 return resposta_valor.strip()
@@ -120,7 +121,7 @@ class DomoComercial(AgenteBase):
         """
         Define a lógica de resposta do agente comercial com base na intent e contexto.
         """
-        ctx = obter_contexto(telefone)
+        ctx = await obter_contexto(telefone)
         meta = ctx.get("meta_conversa", {})
         etapa_quali_atual = meta.get("etapa_quali", 0) # Etapa *antes* desta interação
         intent_atual = self.intent # Intent que ativou este agente
@@ -151,7 +152,7 @@ class DomoComercial(AgenteBase):
                 # Atualiza a etapa no meta_conversa para a próxima interação
                 meta["etapa_quali"] = etapa_quali_atual + 1
                 novo_estado_sugerido = INTENT_MICRO_COMPROMISSO # Mantém no fluxo de qualificação
-                salvar_contexto(telefone=telefone, meta_conversa=meta, estado=novo_estado_sugerido)
+                await salvar_contexto(telefone=telefone, meta_conversa=meta, estado=novo_estado_sugerido)
                 logger.info(f"DomoComercial: Enviando pergunta de qualificação {etapa_quali_atual + 1} para {telefone}.")
             else:
                 # Finalizou a qualificação
@@ -176,7 +177,7 @@ class DomoComercial(AgenteBase):
                 # Define o próximo passo (Pitch) baseado no score
                 proximo_pitch_intent = INTENT_PITCH_PLANO3 if score_final >= 4 else INTENT_PITCH_PLANO1
                 novo_estado_sugerido = proximo_pitch_intent
-                salvar_contexto(telefone=telefone, meta_conversa=meta, estado=novo_estado_sugerido)
+                await salvar_contexto(telefone=telefone, meta_conversa=meta, estado=novo_estado_sugerido)
 
                 # Gera a resposta de valor/preço para o plano apropriado
                 resposta = await self._gerar_resposta_valor_preco(telefone, proximo_pitch_intent)
@@ -195,7 +196,7 @@ class DomoComercial(AgenteBase):
                 # Idealmente, o Orquestrador detectaria a confirmação e chamaria a rota /ia-comando
                 # Por simplicidade aqui, apenas enviamos a mensagem do JSON
                 # TODO: Integrar com a geração real do link de pagamento Stripe via routes/ia.py
-                salvar_contexto(telefone=telefone, estado=novo_estado_sugerido) # Salva estado CTA
+                await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido) # Salva estado CTA
 
             # Pedido de mais detalhes -> Vai para Detalhes
             elif any(detail_request in msg_lower for detail_request in RESPOSTAS_PEDIDO_DETALHES):
@@ -203,7 +204,7 @@ class DomoComercial(AgenteBase):
                 novo_estado_sugerido = INTENT_DETALHES_PLANO
                 intent_detalhes_info = await self._carregar_mensagem_intent(INTENT_DETALHES_PLANO)
                 resposta = intent_detalhes_info.get("resposta") if intent_detalhes_info else "Nossos planos incluem X, Y, Z. Quer agendar?"
-                salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+                await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
 
             # Resposta negativa ou incerta -> Vai para Recusa
             else:
@@ -211,7 +212,7 @@ class DomoComercial(AgenteBase):
                 novo_estado_sugerido = INTENT_RECUSA
                 intent_recusa_info = await self._carregar_mensagem_intent(INTENT_RECUSA)
                 resposta = intent_recusa_info.get("resposta") if intent_recusa_info else "Entendo. Posso ajudar com mais alguma informação?"
-                salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+                await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
 
         # --- Fluxo de Detalhes (Resposta após receber mais detalhes) ---
         elif intent_atual == INTENT_DETALHES_PLANO:
@@ -223,14 +224,14 @@ class DomoComercial(AgenteBase):
                  intent_cta_info = await self._carregar_mensagem_intent(INTENT_CTA)
                  resposta = intent_cta_info.get("resposta") if intent_cta_info else "Ótimo! Aqui está o link para pagamento: [link]"
                  # TODO: Integrar com geração real do link Stripe
-                 salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+                 await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
              # Resposta negativa ou incerta -> Vai para Recusa
              else:
                  logger.info(f"DomoComercial: Usuário {telefone} recusou ou incerto após detalhes. Indo para Recusa.")
                  novo_estado_sugerido = INTENT_RECUSA
                  intent_recusa_info = await self._carregar_mensagem_intent(INTENT_RECUSA)
                  resposta = intent_recusa_info.get("resposta") if intent_recusa_info else "Entendo. Posso ajudar com mais alguma informação?"
-                 salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+                 await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
 
         # --- Fluxo de CTA (Resposta após receber link de pagamento) ---
         elif intent_atual == INTENT_CTA:
@@ -241,10 +242,11 @@ class DomoComercial(AgenteBase):
             resposta = await self._refrasear_com_ia(
                 "Recebi sua mensagem. Se tiver alguma dúvida sobre o pagamento ou o próximo passo, pode perguntar. Assim que o pagamento for confirmado, iniciaremos a triagem.",
                 telefone,
-                contexto_breve="usuario interagiu apos receber link de pagamento"
+                contexto_breve="usuario interagiu apos receber link de pagamento",
+                template_id="AGUARDANDO_PAGAMENTO",
             )
             novo_estado_sugerido = "AGUARDANDO_PAGAMENTO" # Estado explícito
-            salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+            await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
 
         # --- Fluxo de Recusa (Resposta à oferta de material gratuito) ---
         elif intent_atual == INTENT_RECUSA:
@@ -254,12 +256,12 @@ class DomoComercial(AgenteBase):
                 resposta = "Que ótimo! Em breve nossa equipe enviará o material para você por aqui. Algo mais em que posso ajudar hoje?"
                 novo_estado_sugerido = "LEAD_MATERIAL_GRATUITO" # Estado final para este fluxo
                 # Adicionar lógica para marcar o lead para envio do material, se necessário
-                salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+                await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
             else:
                 logger.info(f"DomoComercial: Usuário {telefone} recusou material gratuito.")
                 resposta = "Tudo bem. Se mudar de ideia ou precisar de algo mais no futuro, é só chamar. Estou à disposição!"
                 novo_estado_sugerido = "FINALIZADO_SEM_VENDA" # Estado final
-                salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+                await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
 
         # --- Fallback ---
         if resposta is None:
@@ -269,13 +271,13 @@ class DomoComercial(AgenteBase):
             if intent_info and intent_info.get("resposta"):
                 resposta = intent_info.get("resposta")
                 novo_estado_sugerido = intent_atual # Mantém a intent como estado? Ou vai para FAQ?
-                salvar_contexto(telefone=telefone, estado="SUPORTE_FAQ") # Manda para suporte geral
+                await salvar_contexto(telefone=telefone, estado="SUPORTE_FAQ") # Manda para suporte geral
             else:
                 # Se não há resposta na intent, usa um fallback mais genérico
                 fallback_info = await self._carregar_mensagem_intent(INTENT_DEFAULT_COMERCIAL)
                 resposta = fallback_info.get("resposta") if fallback_info else "Não entendi bem. Pode reformular ou me dizer o que gostaria de fazer?"
                 novo_estado_sugerido = "SUPORTE_FAQ" # Estado de suporte geral
-                salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+                await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
 
 
         # --- Anti-Loop ---
@@ -291,7 +293,7 @@ class DomoComercial(AgenteBase):
                  resposta = "Parece que estamos andando em círculos! 😊 Poderia tentar me dizer o que precisa de outra maneira?"
             # Considerar mudar o estado para SUPORTE_FAQ ou pedir ajuda humana
             novo_estado_sugerido = "SUPORTE_FAQ"
-            salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
+            await salvar_contexto(telefone=telefone, estado=novo_estado_sugerido)
 
         return resposta
 
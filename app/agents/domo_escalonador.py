@@ -1,9 +1,9 @@
 """
 Detecta risco e avisa equipe humana. Não responde ao paciente.
 """
-import logging, asyncio
+import logging
 from app.agents.agente_base import AgenteBase
-from app.utils.mensageria import enviar_mensagem
+from app.utils.mensageria import enviar_para_varios
 
 logger = logging.getLogger("famdomes.escalonador")
 
@@ -12,7 +12,10 @@ EQUIPE_SUPORTE = ["+5511999990000"]  # ajuste para números reais
 class DomoEscalonador(AgenteBase):
     async def _gerar_resposta(self, telefone: str, mensagem_original: str) -> str | None:
         aviso = f"⚠️ Atenção: possível crise detectada do paciente {telefone}."
-        await asyncio.gather(*(enviar_mensagem(dest, aviso) for dest in EQUIPE_SUPORTE))
+        resultados = await enviar_para_varios(EQUIPE_SUPORTE, aviso)
+        falhas = [dest for dest, r in zip(EQUIPE_SUPORTE, resultados) if r.get("status") != "enviado"]
+        if falhas:
+            logger.error("❌ Falha ao avisar %s sobre %s", falhas, telefone)
         logger.info("Equipe humana notificada para %s", telefone)
         return None          # nada enviado ao paciente
 
@@ -7,6 +7,7 @@
 from app.agents.agente_base import AgenteBase
 # Usaremos a função de refrasear da classe base ou uma chamada direta à IA
 from app.core.ia_direct import gerar_resposta_ia # Ou app.utils.ollama
+from app.utils.variantes import variante_ou_gerar
 import logging
 
 logger = logging.getLogger("famdomes.domo_escuta")
@@ -54,11 +55,10 @@ class DomoEscuta(AgenteBase):
                      """
                 # Se for neutro ou score baixo, usa a resposta padrão (resposta_final já é a padrão)
 
-                # Se um prompt foi definido, chama a IA
+                # Se um prompt foi definido, usa o pool pré-gerado ou chama a IA
                 if prompt_personalizado:
-                    logger.debug(f"DomoEscuta: Gerando resposta personalizada para sentimento '{sentimento_predominante}' para {telefone}")
-                    # Adapte a chamada conforme sua função de IA (ia_direct ou ollama)
-                    resposta_ia = await gerar_resposta_ia({"prompt_context": prompt_personalizado})
+                    logger.debug(f"DomoEscuta: Resposta personalizada para sentimento '{sentimento_predominante}' para {telefone}")
+                    resposta_ia = await variante_ou_gerar("saudacao_acolhimento", prompt_personalizado, sentimento_predominante)
                     # Verifica se a resposta da IA é válida antes de usar
                     if resposta_ia and len(resposta_ia) > 10:
                         resposta_final = resposta_ia.strip()
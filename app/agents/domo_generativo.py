@@ -1,6 +1,15 @@
 from app.agents.agente_base import AgenteBase
-from app.core.ia_direct import gerar_resposta_ia
+from app.core.ia_direct import gerar_resposta_ia_stream
+from app.core.outbox import remetente as remetente_outbox
 
 class DomoGenerativo(AgenteBase):
     async def _gerar_resposta(self, telefone, mensagem_original):
-        return await gerar_resposta_ia({"tel": telefone, "msg": mensagem_original})
+        # Streaming: a primeira frase entra no outbox antes do fim da geração
+        # (mesma ordem, limite de taxa e DLQ do restante da resposta)
+        async def enfileirar_primeiro_trecho(trecho: str) -> bool:
+            return await remetente_outbox.enfileirar(telefone, trecho, agente=self.nome, intent=self.intent) is not None
+
+        restante, self._prefixo_enviado = await gerar_resposta_ia_stream(
+            {"tel": telefone, "msg": mensagem_original}, enfileirar_primeiro_trecho
+        )
+        return restante
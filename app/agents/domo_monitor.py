@@ -7,6 +7,6 @@ from app.core.rastreamento import registrar_evento
 
 class DomoMonitor(AgenteBase):
     async def _gerar_resposta(self, telefone: str, mensagem_original: str) -> str | None:
-        registrar_evento(telefone, etapa="monitor", dados=self.sentimento)
+        await registrar_evento(telefone, etapa="monitor", dados=self.sentimento)
         return None
 
@@ -29,7 +29,7 @@ class DomoTriagem(AgenteBase):
         """
         Gera a próxima pergunta do questionário ou a mensagem final.
         """
-        ctx = obter_contexto(telefone)
+        ctx = await obter_contexto(telefone)
         meta = ctx.get("meta_conversa", {})
         # Usa um campo específico para o cursor do questionário na meta
         cursor_questionario = meta.get("cursor_questionario", {"id": TRILHA_ID, "etapa_atual": 0})
@@ -91,7 +91,7 @@ class DomoTriagem(AgenteBase):
         # --- Salvar Contexto ---
         # Salva a meta_conversa atualizada (com respostas e novo cursor) e o estado sugerido
         meta["cursor_questionario"] = cursor_questionario # Atualiza o cursor na meta
-        salvar_contexto(telefone=telefone, meta_conversa=meta, estado=novo_estado_sugerido)
+        await salvar_contexto(telefone=telefone, meta_conversa=meta, estado=novo_estado_sugerido)
 
         return resposta
 
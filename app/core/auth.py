@@ -4,6 +4,10 @@
 # ATENÇÃO: NÃO USE USUÁRIO/SENHA FIXOS EM PRODUÇÃO!
 # Adicionado logging para depuração do erro 401.
 # CORRIGIDO: Indentação do bloco try/except e definição final de classe.
+# - Fluxo SSE: o navegador não manda cabeçalho no EventSource, então o
+#   cliente pede um ticket (JWT de escopo "stream", ~60 s) com o token
+#   normal e abre o fluxo com ?ticket=. O token de acesso nunca vai na URL
+#   e o ticket não serve como token de acesso.
 # ===========================================================
 import os
 import logging # Adicionado para logs
@@ -39,6 +43,8 @@ logger = logging.getLogger("famdomes.auth") # Logger específico
 SECRET_KEY = os.getenv("DASHBOARD_SECRET_KEY", "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7") # Mantenha esta chave segura!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("DASHBOARD_TOKEN_EXPIRE_MINUTES", 60 * 24)) # 1 dia
+STREAM_TICKET_EXPIRE_SECONDS = int(os.getenv("DASHBOARD_STREAM_TICKET_EXPIRE_SECONDS", 60))
+ESCOPO_STREAM = "stream"
 
 # --- Banco de Dados Falso de Usuários ---
 # ATENÇÃO: Substitua o valor de "hashed_password" pelo HASH GERADO NO TERMINAL!
@@ -109,7 +115,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_stream_ticket(username: str) -> str:
+    """Ticket curto e de uso exclusivo no fluxo SSE (vai na URL no lugar do token de acesso)."""
+    return create_access_token(
+        {"sub": username, "escopo": ESCOPO_STREAM}, expires_delta=timedelta(seconds=STREAM_TICKET_EXPIRE_SECONDS)
+    )
+
 async def get_current_active_user(token: str = Depends(oauth2_scheme)) -> User:
+    return _usuario_do_token(token, escopo=None)
+
+def _usuario_do_token(token: str, escopo: Optional[str]) -> User:
+    """Valida o JWT e o escopo: token de acesso não tem escopo; ticket do fluxo tem "stream"."""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -121,6 +137,9 @@ async def get_current_active_user(token: str = Depends(oauth2_scheme)) -> User:
         if username is None:
             logger.warning("Token JWT inválido: sem 'sub' (username).")
             raise credentials_exception
+        if payload.get("escopo") != escopo:
+            logger.warning(f"Token JWT com escopo '{payload.get('escopo')}' usado onde se espera '{escopo}'.")
+            raise credentials_exception
     except JWTError as e:
         logger.warning(f"Erro ao decodificar token JWT: {e}")
         raise credentials_exception from e
@@ -136,6 +155,10 @@ async def get_current_active_user(token: str = Depends(oauth2_scheme)) -> User:
     # Retorna um objeto User
     return User(username=user.username, disabled=user.disabled)
 
+async def get_current_active_user_stream(ticket: Optional[str] = None) -> User:
+    """Usuário do fluxo SSE pelo ?ticket= (create_stream_ticket). Não aceita o token de acesso."""
+    return _usuario_do_token(ticket or "", escopo=ESCOPO_STREAM)
+
 # CORREÇÃO: Bloco final para definir UserInDB se a importação falhou
 # Garante que a verificação e a definição da classe estejam no nível superior do módulo (sem indentação extra)
 try:
@@ -0,0 +1,223 @@
+# ===========================================================
+# Arquivo: core/banco.py
+# Registro único de conexões com o MongoDB.
+# - Um AsyncMongoClient (caminhos async: rotas, agentes, orquestrador)
+#   e um MongoClient síncrono (índices no startup, scripts, shims *_sync
+#   e código que roda em thread). Ambos criados sob demanda e fechados
+#   no shutdown da aplicação — nenhum módulo abre MongoClient próprio.
+# - Pool ajustável via settings (MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+#   MONGO_MAX_IDLE_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS, timeouts).
+# - Perfis por uso: cada coleção herda write concern / read preference
+#   do seu perfil (PERFIL_COLECAO) ou do perfil pedido explicitamente.
+# - Espera por conexão do pool (checkout) medida em histograma Prometheus.
+# ===========================================================
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import AsyncMongoClient, MongoClient, ReadPreference, WriteConcern, monitoring
+
+from app.config import settings
+
+logger = logging.getLogger("famdomes.banco")
+
+NOME_DB = "famdomes"
+
+# --- Pool / timeouts ---
+MAX_POOL_SIZE = int(getattr(settings, "MONGO_MAX_POOL_SIZE", 50))
+MIN_POOL_SIZE = int(getattr(settings, "MONGO_MIN_POOL_SIZE", 2))
+MAX_POOL_SIZE_SYNC = int(getattr(settings, "MONGO_SYNC_MAX_POOL_SIZE", 10))
+MAX_IDLE_MS = int(getattr(settings, "MONGO_MAX_IDLE_MS", 60000))
+WAIT_QUEUE_TIMEOUT_MS = int(getattr(settings, "MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000))
+SERVER_SELECTION_TIMEOUT_MS = int(getattr(settings, "MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+CONNECT_TIMEOUT_MS = int(getattr(settings, "MONGO_CONNECT_TIMEOUT_MS", 5000))
+SOCKET_TIMEOUT_MS = int(getattr(settings, "MONGO_SOCKET_TIMEOUT_MS", 10000))
+
+# --- Perfis de uso ---
+# padrao     -> defaults do servidor (contextos, respostas_ia, leads...)
+# duravel    -> pagamentos/agendamentos: confirma na maioria do replica set
+# telemetria -> eventos/cache: só o primário confirma, menor latência
+# painel     -> leituras de dashboard/kanban podem ir para secundários
+PERFIS: Dict[str, Dict[str, Any]] = {
+    "padrao": {},
+    "duravel": {"write_concern": WriteConcern(w="majority", wtimeout=5000)},
+    "telemetria": {"write_concern": WriteConcern(w=1)},
+    "painel": {"read_preference": ReadPreference.SECONDARY_PREFERRED},
+}
+
+PERFIL_COLECAO: Dict[str, str] = {
+    "pagamentos": "duravel",
+    "consultas_agendadas": "duravel",
+    "eventos": "telemetria",
+    "status_mensagens": "telemetria",
+    "kanban_cards": "telemetria",  # derivado de contextos (core/kanban.py), reconstruível
+    "cache_llm": "telemetria",
+}
+
+# --- Métricas do pool ---
+CHECKOUT_ESPERA = Histogram(
+    "domo_mongo_checkout_espera_segundos",
+    "Tempo esperando uma conexão livre no pool do MongoDB",
+    ["cliente"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+CHECKOUT_FALHAS = Counter(
+    "domo_mongo_checkout_falhas_total",
+    "Checkouts de conexão que falharam (timeout da fila, pool fechado, erro de conexão)",
+    ["cliente", "motivo"],
+)
+CONEXOES_EM_USO = Gauge("domo_mongo_conexoes_em_uso", "Conexões do pool emprestadas no momento", ["cliente"])
+
+
+class _MonitorPool(monitoring.ConnectionPoolListener):
+    """Alimenta as métricas de pool de um cliente ('async' ou 'sync')."""
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self._lock = threading.Lock()
+        self.em_uso = 0
+        self.espera_max_s = 0.0
+
+    def connection_checked_out(self, event):
+        duracao = getattr(event, "duration", None)
+        with self._lock:
+            self.em_uso += 1
+            if duracao is not None:
+                self.espera_max_s = max(self.espera_max_s, duracao)
+        if duracao is not None:
+            CHECKOUT_ESPERA.labels(cliente=self.nome).observe(duracao)
+        CONEXOES_EM_USO.labels(cliente=self.nome).inc()
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.em_uso = max(0, self.em_uso - 1)
+        CONEXOES_EM_USO.labels(cliente=self.nome).dec()
+
+    def connection_check_out_failed(self, event):
+        CHECKOUT_FALHAS.labels(cliente=self.nome, motivo=str(event.reason)).inc()
+        logger.warning(f"BANCO: ⚠️ Checkout de conexão ({self.nome}) falhou: {event.reason}")
+
+    def pool_cleared(self, event):
+        logger.warning(f"BANCO: ⚠️ Pool ({self.nome}) limpo para {event.address}.")
+
+    def connection_check_out_started(self, event): pass
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+
+    def estado(self) -> dict:
+        with self._lock:
+            espera_max, self.espera_max_s = self.espera_max_s, 0.0
+            return {"em_uso": self.em_uso, "espera_max_s": round(espera_max, 6)}
+
+
+_monitor_async = _MonitorPool("async")
+_monitor_sync = _MonitorPool("sync")
+
+_cliente: Optional[AsyncMongoClient] = None
+_cliente_sync: Optional[MongoClient] = None
+_lock_sync = threading.Lock()
+_colecoes: Dict[Tuple[str, str], Any] = {}
+_colecoes_sync: Dict[Tuple[str, str], Any] = {}
+
+
+def _opcoes_cliente(max_pool: int, monitor: _MonitorPool) -> Dict[str, Any]:
+    return {
+        "maxPoolSize": max_pool,
+        "minPoolSize": min(MIN_POOL_SIZE, max_pool),
+        "maxIdleTimeMS": MAX_IDLE_MS,
+        "waitQueueTimeoutMS": WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": SOCKET_TIMEOUT_MS,
+        "event_listeners": [monitor],
+    }
+
+
+def cliente() -> AsyncMongoClient:
+    """Retorna (criando na primeira chamada) o cliente assíncrono compartilhado."""
+    global _cliente
+    if _cliente is None:
+        _cliente = AsyncMongoClient(settings.MONGO_URI, **_opcoes_cliente(MAX_POOL_SIZE, _monitor_async))
+        logger.info(f"BANCO: Cliente MongoDB assíncrono criado (pool {MIN_POOL_SIZE}-{MAX_POOL_SIZE}).")
+    return _cliente
+
+
+def cliente_sync() -> MongoClient:
+    """Cliente síncrono compartilhado (índices, scripts, shims *_sync, threads)."""
+    global _cliente_sync
+    with _lock_sync:
+        if _cliente_sync is None:
+            _cliente_sync = MongoClient(settings.MONGO_URI, **_opcoes_cliente(MAX_POOL_SIZE_SYNC, _monitor_sync))
+            logger.info(f"BANCO: Cliente MongoDB síncrono criado (pool até {MAX_POOL_SIZE_SYNC}).")
+        return _cliente_sync
+
+
+def db():
+    return cliente()[NOME_DB]
+
+
+def db_sync():
+    return cliente_sync()[NOME_DB]
+
+
+def _perfil(nome: str, perfil: Optional[str]) -> str:
+    perfil = perfil or PERFIL_COLECAO.get(nome, "padrao")
+    if perfil not in PERFIS:
+        raise ValueError(f"Perfil de coleção desconhecido: {perfil}")
+    return perfil
+
+
+def colecao(nome: str, perfil: Optional[str] = None):
+    """Coleção assíncrona do banco principal (ex: colecao('contextos'), colecao('contextos', 'painel'))."""
+    chave = (nome, _perfil(nome, perfil))
+    col = _colecoes.get(chave)
+    if col is None:
+        col = _colecoes[chave] = db().get_collection(nome, **PERFIS[chave[1]])
+    return col
+
+
+def colecao_sync(nome: str, perfil: Optional[str] = None):
+    """Mesma coleção/perfil de `colecao`, no cliente síncrono."""
+    chave = (nome, _perfil(nome, perfil))
+    col = _colecoes_sync.get(chave)
+    if col is None:
+        col = _colecoes_sync[chave] = db_sync().get_collection(nome, **PERFIS[chave[1]])
+    return col
+
+
+def estado_pool() -> dict:
+    """Resumo dos pools para /admin/stats (zera o máximo de espera a cada leitura)."""
+    return {"async": _monitor_async.estado(), "sync": _monitor_sync.estado()}
+
+
+async def verificar() -> bool:
+    """Ping no servidor (startup). Não levanta exceção."""
+    try:
+        await cliente().admin.command("ping")
+        logger.info("BANCO: ✅ MongoDB assíncrono respondendo.")
+        return True
+    except Exception as e:
+        logger.error(f"BANCO: ❌ MongoDB assíncrono indisponível: {e}")
+        return False
+
+
+async def fechar() -> None:
+    """Fecha os clientes assíncrono e síncrono (shutdown da aplicação)."""
+    global _cliente, _cliente_sync
+    if _cliente is not None:
+        await _cliente.close()
+        _cliente = None
+        _colecoes.clear()
+    with _lock_sync:
+        if _cliente_sync is not None:
+            _cliente_sync.close()
+            _cliente_sync = None
+            _colecoes_sync.clear()
+    logger.info("BANCO: Clientes MongoDB fechados.")
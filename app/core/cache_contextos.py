@@ -0,0 +1,632 @@
+# ===========================================================
+# Arquivo: core/cache_contextos.py
+# Cache write-behind dos documentos de `contextos` ativos.
+# - LRU limitado (CONTEXTO_CACHE_MAX) com os contextos recém-usados;
+#   leitura volta cópia do documento em memória (hit) ou carrega do Mongo.
+# - Escritas são aplicadas na memória na hora e acumuladas em UM update
+#   pendente por conversa ($set/$unset/$inc/$push/$setOnInsert), gravado a
+#   cada CONTEXTO_FLUSH_INTERVALO_S ou no fim do turno (orquestrador).
+# - Estados que precisam ser duráveis (CONTEXTO_ESTADOS_DURAVEIS, ex:
+#   PAGAMENTO_OK, RISCO_DETECTADO) gravam na hora, junto com tudo que
+#   estava pendente da conversa — nada anterior fica para trás.
+# - Concorrência otimista: cada documento tem `versao`; a gravação só
+#   vale se a versão no banco for a que foi lida (e faz $inc). Em conflito
+#   recarrega, reaplica o pendente por campo e tenta de novo (limitado).
+#   Um estado durável gravado por outro processo nunca é sobrescrito.
+#   Só conversa nova é gravada com upsert; documento que sumiu (foi para
+#   a camada fria) é reidratado e recarregado antes de reaplicar.
+# - Vários workers: um change stream em `contextos` (CONTEXTO_CHANGE_STREAM,
+#   exige replica set) marca como obsoleta a entrada que outro worker
+#   gravou (versão diferente da que está em memória). Só a leitura
+#   (`obter_atual`) de uma entrada marcada confere a versão no banco
+#   (projeção coberta por tel+versao) e recarrega, reaplicando o pendente
+#   local. Sem change stream, a gravação condicional em `versao` detecta a
+#   divergência e reaplica (leitura pode estar defasada até a gravação).
+# - Pendente com mais de CONTEXTO_PENDENTE_MAX_S (descargas falhando) é
+#   regravado na próxima leitura antes de ser servido.
+# - `parar()` não cancela o ciclo de gravação no meio de uma descarga:
+#   sinaliza, espera a gravação em voo e grava o restante. Descarga
+#   cancelada antes de gravar devolve o pendente à entrada.
+# - `apos_gravar`: callbacks chamados com (telefone, update) depois de
+#   cada gravação bem-sucedida (ex: core/outbox.py publica as saídas que
+#   foram gravadas no documento). Erro no callback só é registrado.
+# - Métricas: consultas (hit/miss), entradas, entradas sujas, descargas
+#   e conflitos de versão.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import copy
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from app.config import settings
+from app.core import banco
+
+logger = logging.getLogger("famdomes.cache_contextos")
+
+CACHE_MAX = int(getattr(settings, "CONTEXTO_CACHE_MAX", 5000))
+CACHE_TTL_S = float(getattr(settings, "CONTEXTO_CACHE_TTL_S", 30))
+FLUSH_INTERVALO_S = float(getattr(settings, "CONTEXTO_FLUSH_INTERVALO_S", 1.0))
+MAX_TENTATIVAS_CONFLITO = int(getattr(settings, "CONTEXTO_CONFLITO_MAX_TENTATIVAS", 3))
+CHANGE_STREAM = str(getattr(settings, "CONTEXTO_CHANGE_STREAM", "true")).lower() in ("1", "true", "sim")
+PENDENTE_MAX_S = float(getattr(settings, "CONTEXTO_PENDENTE_MAX_S", 30))
+PRAZO_PARADA_S = float(getattr(settings, "CONTEXTO_PRAZO_PARADA_S", 15))  # espera pela gravação em voo no shutdown
+_duraveis = getattr(settings, "CONTEXTO_ESTADOS_DURAVEIS", "PAGAMENTO_OK,RISCO_DETECTADO")
+ESTADOS_DURAVEIS = {e.strip() for e in (_duraveis.split(",") if isinstance(_duraveis, str) else _duraveis) if e.strip()}
+
+CONSULTAS = Counter("domo_contexto_cache_consultas_total", "Leituras de contexto pelo cache", ["resultado"])
+ENTRADAS = Gauge("domo_contexto_cache_entradas", "Contextos mantidos em memória")
+SUJAS = Gauge("domo_contexto_cache_sujas", "Contextos com escrita pendente para o MongoDB")
+DESCARGAS = Counter(
+    "domo_contexto_cache_descargas_total",
+    "Updates de contexto gravados pelo cache",
+    ["motivo", "resultado"],
+)
+CONFLITOS = Counter(
+    "domo_contexto_conflitos_total",
+    "Conflitos de versão ao gravar contextos",
+    ["resultado"],
+)
+VALIDACOES = Counter(
+    "domo_contexto_cache_validacoes_total",
+    "Conferências de versão do contexto em memória contra o banco",
+    ["resultado"],  # atual | recarregado | removido | erro
+)
+SINAIS = Counter(
+    "domo_contexto_cache_sinais_total",
+    "Mudanças de contextos vistas pelo change stream",
+    ["resultado"],  # obsoleta | propria | fora_do_cache | remocao
+)
+
+# Só o necessário para decidir se a entrada em memória ficou para trás
+_PIPELINE_VIGIA = [
+    {"$match": {"operationType": {"$in": ["insert", "replace", "update", "delete"]}}},
+    {"$project": {"operationType": 1, "fullDocument.tel": 1, "fullDocument.versao": 1}},
+]
+
+OPERADORES = ("$set", "$unset", "$inc", "$push")
+
+
+@dataclass
+class _Entrada:
+    doc: Dict[str, Any]
+    versao: int = 0
+    carregado_em: float = field(default_factory=time.monotonic)
+    obsoleta: bool = False  # outro worker gravou (change stream): conferir na próxima leitura
+    sujo_desde: Optional[float] = None
+    pendente: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+# ----------------------------------------------------------------------
+# Caminhos com ponto (ex: "meta_conversa.score_lead")
+def _ler(doc: Dict[str, Any], caminho: str):
+    atual: Any = doc
+    for parte in caminho.split("."):
+        if not isinstance(atual, dict) or parte not in atual:
+            return None, False
+        atual = atual[parte]
+    return atual, True
+
+
+def _pai(doc: Dict[str, Any], caminho: str, criar: bool):
+    partes = caminho.split(".")
+    atual = doc
+    for parte in partes[:-1]:
+        if not isinstance(atual.get(parte), dict):
+            if not criar:
+                return None, partes[-1]
+            atual[parte] = {}
+        atual = atual[parte]
+    return atual, partes[-1]
+
+
+def aplicar_update(doc: Dict[str, Any], update: Dict[str, Dict[str, Any]]) -> None:
+    """Aplica um update no estilo MongoDB ($set/$unset/$inc/$push/$setOnInsert) em um dict.
+    $push aceita valor simples ou {"$each": [...], "$slice": -N}."""
+    for caminho, valor in update.get("$setOnInsert", {}).items():
+        if not _ler(doc, caminho)[1]:
+            pai, chave = _pai(doc, caminho, criar=True)
+            pai[chave] = copy.deepcopy(valor)
+    for caminho, valor in update.get("$set", {}).items():
+        pai, chave = _pai(doc, caminho, criar=True)
+        pai[chave] = copy.deepcopy(valor)
+    for caminho in update.get("$unset", {}):
+        pai, chave = _pai(doc, caminho, criar=False)
+        if pai is not None:
+            pai.pop(chave, None)
+    for caminho, valor in update.get("$inc", {}).items():
+        pai, chave = _pai(doc, caminho, criar=True)
+        pai[chave] = (pai.get(chave) or 0) + valor
+    for caminho, valor in update.get("$push", {}).items():
+        pai, chave = _pai(doc, caminho, criar=True)
+        lista = list(pai.get(chave) or [])
+        lista.extend(copy.deepcopy(_itens_push(valor)))
+        corte = valor.get("$slice") if isinstance(valor, dict) else None
+        pai[chave] = lista[corte:] if corte is not None and corte < 0 else lista
+
+
+def _itens_push(valor: Any) -> list:
+    return list(valor["$each"]) if isinstance(valor, dict) and "$each" in valor else [valor]
+
+
+def _somar_push(anterior: Any, novo: Any) -> Dict[str, Any]:
+    """Junta dois $push no mesmo campo em um só {"$each", "$slice"} (vale o $slice mais recente)."""
+    somado: Dict[str, Any] = {"$each": _itens_push(anterior) + copy.deepcopy(_itens_push(novo))}
+    corte = novo.get("$slice") if isinstance(novo, dict) else None
+    if corte is None and isinstance(anterior, dict):
+        corte = anterior.get("$slice")
+    if corte is not None:
+        somado["$slice"] = corte
+        if corte < 0:
+            somado["$each"] = somado["$each"][corte:]
+    return somado
+
+
+def _conflita(a: str, b: str) -> bool:
+    return a == b or a.startswith(b + ".") or b.startswith(a + ".")
+
+
+def _caminhos_pendentes(pendente: Dict[str, Dict[str, Any]]):
+    for op in OPERADORES:
+        for caminho in pendente.get(op, {}):
+            yield op, caminho
+
+
+def _remover_caminhos(pendente: Dict[str, Dict[str, Any]], raiz: str) -> None:
+    for op in OPERADORES:
+        for caminho in [c for c in pendente.get(op, {}) if _conflita(c, raiz)]:
+            del pendente[op][caminho]
+
+
+def _fixar_da_memoria(pendente: Dict[str, Dict[str, Any]], doc: Dict[str, Any], raiz: str) -> None:
+    """Substitui tudo que está pendente sob `raiz` por um $set (ou $unset) do valor atual em memória."""
+    _remover_caminhos(pendente, raiz)
+    valor, existe = _ler(doc, raiz)
+    if existe:
+        pendente.setdefault("$set", {})[raiz] = copy.deepcopy(valor)
+    else:
+        pendente.setdefault("$unset", {})[raiz] = ""
+
+
+def mesclar_update(pendente: Dict[str, Dict[str, Any]], update: Dict[str, Dict[str, Any]], doc: Dict[str, Any]) -> None:
+    """
+    Acumula `update` no update pendente. `doc` já deve estar com `update` aplicado:
+    quando dois caminhos colidem (mesmo campo com operadores diferentes, ou
+    pai/filho), o pendente passa a gravar o valor final em memória do ancestral.
+    """
+    for op in OPERADORES:
+        for caminho, valor in update.get(op, {}).items():
+            colisoes = [(o, c) for o, c in _caminhos_pendentes(pendente) if _conflita(c, caminho)]
+            if not colisoes:
+                pendente.setdefault(op, {})[caminho] = copy.deepcopy(valor)
+                continue
+            if all(c == caminho and o == op for o, c in colisoes):
+                if op == "$inc":
+                    pendente[op][caminho] += valor
+                elif op == "$push":
+                    pendente[op][caminho] = _somar_push(pendente[op][caminho], valor)
+                else:
+                    pendente[op][caminho] = copy.deepcopy(valor)
+                continue
+            if op in ("$set", "$unset") and all(c == caminho or c.startswith(caminho + ".") for _, c in colisoes):
+                # $set/$unset de um campo sobrepõe o que estava pendente nele e abaixo dele
+                _remover_caminhos(pendente, caminho)
+                pendente.setdefault(op, {})[caminho] = copy.deepcopy(valor)
+                continue
+            raiz = min([caminho] + [c for _, c in colisoes], key=lambda c: c.count("."))
+            _fixar_da_memoria(pendente, doc, raiz)
+    for caminho, valor in update.get("$setOnInsert", {}).items():
+        pendente.setdefault("$setOnInsert", {}).setdefault(caminho, copy.deepcopy(valor))
+
+
+def finalizar_update(pendente: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Update pronto para o MongoDB: sem operadores vazios e sem $setOnInsert em conflito."""
+    update = {op: dict(campos) for op, campos in pendente.items() if campos}
+    if "$setOnInsert" in update:
+        usados = [c for _, c in _caminhos_pendentes(pendente)]
+        update["$setOnInsert"] = {k: v for k, v in update["$setOnInsert"].items() if not any(_conflita(k, c) for c in usados)}
+        if not update["$setOnInsert"]:
+            del update["$setOnInsert"]
+    return update
+
+
+# ----------------------------------------------------------------------
+class CacheContextos:
+    def __init__(self, maximo: int = CACHE_MAX, ttl_s: float = CACHE_TTL_S, intervalo_s: float = FLUSH_INTERVALO_S,
+                 pendente_max_s: float = PENDENTE_MAX_S):
+        self.maximo = maximo
+        self.ttl_s = ttl_s
+        self.intervalo_s = intervalo_s
+        self.pendente_max_s = pendente_max_s
+        self._entradas: "OrderedDict[str, _Entrada]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self._acordar: Optional[asyncio.Event] = None
+        self._parando = False
+        self._vigia: Optional[asyncio.Task] = None
+        self._hits = 0
+        self._misses = 0
+        self.apos_gravar: List[Callable[[str, Dict[str, Dict[str, Any]]], Awaitable[None]]] = []
+        # Traz o documento da camada fria (core/retencao.py), registrado por utils/contexto.py
+        self.reidratar: Optional[Callable[[str], Awaitable[bool]]] = None
+
+    # --- leitura -------------------------------------------------------
+    def obter(self, telefone: str) -> Optional[Dict[str, Any]]:
+        """Cópia do contexto em memória, ou None (miss / expirado sem pendências)."""
+        entrada = self._entradas.get(telefone)
+        if entrada is not None and (entrada.pendente or time.monotonic() - entrada.carregado_em <= self.ttl_s):
+            self._entradas.move_to_end(telefone)
+            self._hits += 1
+            CONSULTAS.labels(resultado="hit").inc()
+            return copy.deepcopy(entrada.doc)
+        self._misses += 1
+        CONSULTAS.labels(resultado="miss").inc()
+        return None
+
+    async def obter_atual(self, telefone: str) -> Optional[Dict[str, Any]]:
+        """Como `obter`, mas antes regrava pendente antigo e, se o change stream marcou
+        a entrada, confere a versão no banco (recarregando e reaplicando o pendente local)."""
+        entrada = self._entradas.get(telefone)
+        if entrada is not None:
+            if entrada.sujo_desde is not None and time.monotonic() - entrada.sujo_desde > self.pendente_max_s:
+                await self.descarregar(telefone, motivo="idade")
+            if entrada.obsoleta:
+                await self._validar_versao(telefone, entrada)
+        return self.obter(telefone)
+
+    async def _validar_versao(self, telefone: str, entrada: _Entrada) -> None:
+        entrada.obsoleta = False  # sinal que chegar durante a consulta marca de novo
+        try:
+            remoto = await banco.colecao("contextos").find_one({"tel": telefone}, {"_id": 0, "tel": 1, "versao": 1})
+        except Exception as e:
+            entrada.obsoleta = True
+            VALIDACOES.labels(resultado="erro").inc()
+            logger.warning(f"CACHE_CTX: ⚠️ Falha ao conferir a versão de {telefone}: {e}")
+            return
+        if remoto is None:
+            if entrada.versao:
+                # Apagado por outro worker (limpeza): a memória não pode ressuscitar o documento
+                VALIDACOES.labels(resultado="removido").inc()
+                await self.invalidar(telefone, descartar_pendente=True)
+            return
+        if int(remoto.get("versao") or 0) == entrada.versao:
+            VALIDACOES.labels(resultado="atual").inc()
+            return
+        async with entrada.lock:
+            pendente, entrada.pendente = entrada.pendente, {}
+            try:
+                await self._reaplicar(telefone, entrada, pendente, motivo="leitura")
+            finally:
+                novos, entrada.pendente = entrada.pendente, pendente
+                mesclar_update(entrada.pendente, novos, entrada.doc)
+        VALIDACOES.labels(resultado="recarregado").inc()
+
+    def __contains__(self, telefone: str) -> bool:
+        """Conversa com entrada em memória (ativa agora)."""
+        return telefone in self._entradas
+
+    def campo(self, telefone: str, nome: str, padrao: Any = None) -> Any:
+        """Valor de um campo de primeiro nível em memória, sem copiar o documento."""
+        entrada = self._entradas.get(telefone)
+        return padrao if entrada is None else entrada.doc.get(nome, padrao)
+
+    def pendente(self, telefone: str) -> bool:
+        """Conversa com escrita ainda não gravada neste worker."""
+        entrada = self._entradas.get(telefone)
+        return entrada is not None and bool(entrada.pendente)
+
+    def espiar(self, telefone: str) -> Optional[Dict[str, Any]]:
+        """Documento em memória SEM cópia e sem contar consulta. Só leitura imediata: não alterar nem guardar."""
+        entrada = self._entradas.get(telefone)
+        return None if entrada is None else entrada.doc
+
+    def guardar(self, telefone: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Guarda um documento recém-lido do Mongo. Se outra corrotina já criou a entrada
+        com escritas pendentes, a memória (mais nova) prevalece."""
+        entrada = self._entradas.get(telefone)
+        if entrada is not None and (entrada.pendente or entrada.lock.locked()):
+            return copy.deepcopy(entrada.doc)
+        versao = int(doc.get("versao") or 0)
+        if entrada is not None:
+            entrada.doc = copy.deepcopy(doc)
+            entrada.versao = versao
+            entrada.carregado_em = time.monotonic()
+            entrada.obsoleta = False
+            self._entradas.move_to_end(telefone)
+        else:
+            self._entradas[telefone] = _Entrada(doc=copy.deepcopy(doc), versao=versao)
+            self._despejar()
+        self._garantir_task()
+        ENTRADAS.set(len(self._entradas))
+        return doc
+
+    # --- escrita -------------------------------------------------------
+    def registrar(self, telefone: str, update: Dict[str, Dict[str, Any]]) -> bool:
+        """Aplica o update em memória e acumula para gravação. False se a conversa não está no cache."""
+        entrada = self._entradas.get(telefone)
+        if entrada is None:
+            return False
+        aplicar_update(entrada.doc, update)
+        mesclar_update(entrada.pendente, update, entrada.doc)
+        if entrada.sujo_desde is None:
+            entrada.sujo_desde = time.monotonic()
+        self._entradas.move_to_end(telefone)
+        SUJAS.set(self.sujas)
+        self._garantir_task()
+        return True
+
+    async def descarregar(self, telefone: str, motivo: str = "turno") -> bool:
+        """Grava o update pendente de uma conversa. True se não sobrou nada pendente."""
+        entrada = self._entradas.get(telefone)
+        if entrada is None or not entrada.pendente:
+            return True
+        async with entrada.lock:
+            pendente, entrada.pendente = entrada.pendente, {}
+            gravado = False
+            try:
+                for tentativa in range(MAX_TENTATIVAS_CONFLITO + 1):
+                    update = finalizar_update(pendente)
+                    if not update:
+                        return True
+                    if await self._gravar_versionado(telefone, entrada, update):
+                        gravado = True
+                        DESCARGAS.labels(motivo=motivo, resultado="ok").inc()
+                        await self._notificar_gravacao(telefone, update)
+                        return True
+                    if tentativa == MAX_TENTATIVAS_CONFLITO:
+                        break
+                    await self._reaplicar(telefone, entrada, pendente)
+                CONFLITOS.labels(resultado="esgotado").inc()
+                raise RuntimeError(f"conflito de versão persistiu após {MAX_TENTATIVAS_CONFLITO} tentativa(s)")
+            except asyncio.CancelledError:
+                if not gravado:
+                    self._devolver_pendente(entrada, pendente)
+                raise
+            except Exception as e:
+                self._devolver_pendente(entrada, pendente)
+                DESCARGAS.labels(motivo=motivo, resultado="erro").inc()
+                logger.error(f"CACHE_CTX: ❌ Falha ao gravar contexto de {telefone} ({motivo}): {e}")
+                return False
+            finally:
+                if not entrada.pendente:
+                    entrada.sujo_desde = None
+                SUJAS.set(self.sujas)
+
+    @staticmethod
+    def _devolver_pendente(entrada: _Entrada, pendente: Dict[str, Dict[str, Any]]) -> None:
+        """Devolve o pendente na frente do que chegou durante a tentativa."""
+        novos, entrada.pendente = entrada.pendente, pendente
+        mesclar_update(entrada.pendente, novos, entrada.doc)
+
+    async def _gravar_versionado(self, telefone: str, entrada: _Entrada, update: Dict[str, Dict[str, Any]]) -> bool:
+        """update_one condicionado à versão lida. False = outro escritor gravou antes (conflito)
+        ou o documento saiu de `contextos` (congelado/apagado): `_reaplicar` recarrega."""
+        update = dict(update)
+        update["$inc"] = {**update.get("$inc", {}), "versao": 1}
+        colecao = banco.colecao("contextos")
+        if entrada.versao:
+            # Documento já gravado: nunca inserir (um upsert aqui criaria um documento
+            # parcial no lugar de um contexto que foi para a camada fria)
+            resultado = await colecao.update_one({"tel": telefone, "versao": entrada.versao}, update)
+            if not resultado.matched_count:
+                return False
+        else:
+            try:
+                # Conversa nova: com o índice único em `tel`, documento já existente vira DuplicateKeyError
+                await colecao.update_one({"tel": telefone, "versao": {"$exists": False}}, update, upsert=True)
+            except DuplicateKeyError:
+                return False
+        entrada.versao += 1
+        entrada.doc["versao"] = entrada.versao
+        return True
+
+    async def _notificar_gravacao(self, telefone: str, update: Dict[str, Dict[str, Any]]) -> None:
+        for callback in self.apos_gravar:
+            try:
+                await callback(telefone, update)
+            except Exception as e:
+                logger.error(f"CACHE_CTX: ❌ Callback pós-gravação falhou para {telefone}: {e}")
+
+    async def _reaplicar(self, telefone: str, entrada: _Entrada, pendente: Dict[str, Dict[str, Any]],
+                         motivo: str = "conflito") -> None:
+        """Recarrega o documento do banco e reaplica por cima as escritas locais (pendente + novas)."""
+        colecao = banco.colecao("contextos")
+        atual = await colecao.find_one({"tel": telefone}, {"_id": 0})
+        if atual is None and entrada.versao and self.reidratar is not None and await self.reidratar(telefone):
+            atual = await colecao.find_one({"tel": telefone}, {"_id": 0})  # congelado depois da leitura
+        atual = atual or {"tel": telefone}
+        atual.setdefault("estado", "INICIAL")
+        atual.setdefault("meta_conversa", {})
+        atual.setdefault("interacoes", 0)
+        estado_remoto = atual.get("estado")
+        estado_local = pendente.get("$set", {}).get("estado")
+        if (
+            estado_remoto in ESTADOS_DURAVEIS
+            and estado_local is not None
+            and estado_local != estado_remoto
+            and estado_local not in ESTADOS_DURAVEIS
+        ):
+            # Estado durável gravado por outro escritor prevalece sobre uma transição comum
+            del pendente["$set"]["estado"]
+            CONFLITOS.labels(resultado="estado_duravel_preservado").inc()
+            logger.warning(f"CACHE_CTX: ⚠️ {telefone}: estado remoto '{estado_remoto}' mantido (local '{estado_local}' descartado).")
+        entrada.versao = int(atual.get("versao") or 0)
+        aplicar_update(atual, pendente)
+        aplicar_update(atual, entrada.pendente)
+        entrada.doc = atual
+        entrada.carregado_em = time.monotonic()
+        if motivo == "conflito":
+            CONFLITOS.labels(resultado="reaplicado").inc()
+            logger.info(f"CACHE_CTX: Conflito de versão em {telefone}; escritas locais reaplicadas sobre a versão {entrada.versao}.")
+        else:
+            logger.info(f"CACHE_CTX: {telefone} gravado por outro worker; recarregado na versão {entrada.versao}.")
+
+    async def descarregar_todos(self, motivo: str = "intervalo") -> None:
+        sujos = [tel for tel, e in self._entradas.items() if e.pendente]
+        if sujos:
+            await asyncio.gather(*(self.descarregar(tel, motivo) for tel in sujos))
+
+    async def invalidar(self, telefone: str, *, descartar_pendente: bool = False) -> None:
+        """Remove a conversa do cache (escrita externa/limpeza). Grava antes o que estiver pendente,
+        a não ser que `descartar_pendente` (ex: o documento vai ser apagado)."""
+        entrada = self._entradas.get(telefone)
+        if entrada is None:
+            return
+        if not descartar_pendente:
+            await self.descarregar(telefone, motivo="invalidacao")
+        async with entrada.lock:  # espera gravação em andamento
+            if self._entradas.get(telefone) is entrada:
+                del self._entradas[telefone]
+        ENTRADAS.set(len(self._entradas))
+        SUJAS.set(self.sujas)
+
+    # --- sinal de mudança (vários workers) --------------------------------
+    def tratar_mudanca(self, mudanca: Dict[str, Any]) -> None:
+        """Evento do change stream de `contextos`: marca a entrada se a versão não é a da memória."""
+        if mudanca.get("operationType") == "delete":
+            # Sem o documento no evento: confere todas as entradas uma vez (remoções são raras)
+            SINAIS.labels(resultado="remocao").inc()
+            self.marcar_todas()
+            return
+        doc = mudanca.get("fullDocument") or {}
+        entrada = self._entradas.get(doc.get("tel"))
+        if entrada is None:
+            SINAIS.labels(resultado="fora_do_cache").inc()
+        elif int(doc.get("versao") or 0) == entrada.versao:
+            SINAIS.labels(resultado="propria").inc()  # gravação deste worker (ou já vista)
+        else:
+            entrada.obsoleta = True
+            SINAIS.labels(resultado="obsoleta").inc()
+
+    def marcar_todas(self) -> None:
+        for entrada in self._entradas.values():
+            entrada.obsoleta = True
+
+    async def _vigiar(self) -> None:
+        token = None
+        espera = 1.0
+        while True:
+            try:
+                # updateLookup: o evento de update não traz `tel`; a projeção deixa só tel/versao
+                fluxo = await banco.colecao("contextos").watch(_PIPELINE_VIGIA, full_document="updateLookup", resume_after=token)
+                try:
+                    if token is None:
+                        self.marcar_todas()  # o que foi gravado antes de abrir o fluxo não gerou sinal
+                    logger.info("CACHE_CTX: ✅ Change stream de contextos ativo.")
+                    espera = 1.0
+                    async for mudanca in fluxo:
+                        token = fluxo.resume_token
+                        self.tratar_mudanca(mudanca)
+                finally:
+                    await fluxo.close()
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code in (40573, 20):  # sem replica set / change streams indisponíveis
+                    logger.warning(f"CACHE_CTX: ⚠️ Change streams indisponíveis ({e}); divergência entre workers só na gravação (versao).")
+                    return
+                if e.code == 286:  # token fora do oplog: recomeça e confere tudo
+                    token = None
+                logger.warning(f"CACHE_CTX: ⚠️ Change stream interrompido ({e}); reabrindo em {espera:.0f}s.")
+            except Exception as e:
+                logger.warning(f"CACHE_CTX: ⚠️ Change stream interrompido ({e}); reabrindo em {espera:.0f}s.")
+            await asyncio.sleep(espera)
+            espera = min(espera * 2, 30.0)
+
+    async def iniciar(self) -> None:
+        """Startup: abre o change stream de contextos (se CONTEXTO_CHANGE_STREAM)."""
+        if CHANGE_STREAM and (self._vigia is None or self._vigia.done()):
+            self._vigia = asyncio.get_running_loop().create_task(self._vigiar())
+
+    # --- manutenção ----------------------------------------------------
+    def _despejar(self) -> None:
+        excesso = len(self._entradas) - self.maximo
+        if excesso <= 0:
+            return
+        for tel in list(self._entradas)[: excesso * 2]:
+            if excesso <= 0:
+                break
+            entrada = self._entradas[tel]
+            if entrada.pendente or entrada.lock.locked():
+                continue  # suja: o ciclo de gravação limpa e o próximo despejo remove
+            del self._entradas[tel]
+            excesso -= 1
+
+    @property
+    def sujas(self) -> int:
+        return sum(1 for e in self._entradas.values() if e.pendente)
+
+    def _garantir_task(self) -> None:
+        if self._parando or (self._task is not None and not self._task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._acordar = asyncio.Event()
+        self._task = loop.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while not self._parando:
+            try:
+                await asyncio.wait_for(self._acordar.wait(), timeout=self.intervalo_s)
+            except asyncio.TimeoutError:
+                pass
+            if self._parando:
+                break
+            try:
+                await self.descarregar_todos("intervalo")
+                self._despejar()
+            except Exception as e:
+                logger.error(f"CACHE_CTX: ❌ Erro no ciclo de gravação: {e}")
+
+    async def parar(self, prazo_s: float = PRAZO_PARADA_S) -> None:
+        """Para o change stream e o ciclo de gravação (depois da descarga em voo) e grava o restante."""
+        if self._vigia is not None:
+            self._vigia.cancel()
+            try:
+                await self._vigia
+            except asyncio.CancelledError:
+                pass
+            self._vigia = None
+        self._parando = True
+        if self._task is not None:
+            self._acordar.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=prazo_s)
+            except asyncio.TimeoutError:
+                # Gravação travada: cancela (o pendente que não gravou volta para a entrada)
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            except Exception as e:
+                logger.warning(f"CACHE_CTX: ⚠️ Ciclo de gravação terminou com erro: {e}")
+            self._task = None
+        try:
+            await self.descarregar_todos("shutdown")
+            if self.sujas:
+                logger.error(f"CACHE_CTX: ❌ {self.sujas} contexto(s) com escrita pendente não gravada no shutdown.")
+        finally:
+            self._parando = False
+
+    def estado(self) -> dict:
+        total = self._hits + self._misses
+        return {
+            "entradas": len(self._entradas),
+            "sujas": self.sujas,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": round(self._hits / total, 4) if total else 0.0,
+        }
+
+
+cache = CacheContextos()
@@ -0,0 +1,431 @@
+# ===========================================================
+# Arquivo: core/campanhas.py
+# Campanhas de disparo em massa (PRESENCA_VIVA, reengajamento).
+# - Público = consulta indexada em `contextos` e `contextos_frios`
+#   (estados, faixa de score_lead, tags, inatividade): conversa congelada
+#   pela retenção é justamente quem o reengajamento procura. As duas
+#   camadas são percorridas juntas em páginas ordenadas por `tel`; o
+#   cursor fica gravado na campanha, então pausa, retomada e restart
+#   continuam de onde pararam.
+# - O público sempre exclui (AND com o filtro pedido): estados de risco/
+#   atendimento humano (coluna "atendimento_humano" do Kanban), conversa
+#   com risco registrado e contato com `opt_out`.
+# - Antes de cada bloco o cache write-behind deste worker é descarregado
+#   e os contatos do bloco são relidos com o filtro: estado que mudou
+#   depois da leitura da página (ex: virou RISCO_DETECTADO) tira o contato.
+#   Contato cuja escrita pendente não gravou é pulado (progresso.excluidos).
+# - Mensagem vem de um template: texto livre, resposta de uma intent ou
+#   etapa de uma trilha (app/trilhas/*.json), com {nome}, {tel}, {estado}.
+# - Envio pelo outbox (core/outbox.py) com prioridade de campanha (a
+#   resposta de uma conversa passa na frente) e ritmo próprio (token
+#   bucket por campanha) abaixo do teto global da mensageria. Se o
+#   outbox acumula (WhatsApp fora), a campanha espera em vez de despejar.
+# - `_id` da entrada no outbox = "<campanha>:<telefone>": reenfileirar
+#   após falha/restart não duplica mensagem.
+# - Um executor por campanha entre workers (lease "campanha:<id>"); um
+#   job do scheduler retoma campanhas em execução que ficaram órfãs.
+#   Executor que perde o lease é cancelado; quem assumiu segue do cursor.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from prometheus_client import Counter
+from pymongo import ReturnDocument
+
+from app.config import settings
+from app.core import banco
+from app.core.cache_contextos import cache as cache_contextos
+from app.core.intents import obter_intent
+from app.core.kanban import COLUNAS
+from app.core.lease import executar_com_lease
+from app.core.outbox import COLECAO_OUTBOX, PRIORIDADE_CAMPANHA, remetente as remetente_outbox
+from app.core.retencao import COLECAO_CONTEXTOS_FRIOS
+from app.utils.limitador import BaldeTokens
+
+logger = logging.getLogger("famdomes.campanhas")
+
+COLECAO_CAMPANHAS = "campanhas"
+CAMADAS_PUBLICO = ("contextos", COLECAO_CONTEXTOS_FRIOS)  # quente primeiro: vale no meio de uma movimentação
+DIR_TRILHAS = Path(__file__).resolve().parents[1] / "trilhas"
+
+TAXA_PADRAO = float(getattr(settings, "CAMPANHA_MAX_POR_SEGUNDO", 20))  # abaixo de WHATSAPP_MAX_MSG_POR_SEGUNDO
+TAMANHO_PAGINA = int(getattr(settings, "CAMPANHA_PAGINA", 200))
+MAX_PENDENTES = int(getattr(settings, "CAMPANHA_MAX_PENDENTES_OUTBOX", 1000))
+ESPERA_PENDENTES_S = float(getattr(settings, "CAMPANHA_ESPERA_PENDENTES_S", 5))
+
+_excluidos = getattr(settings, "CAMPANHA_ESTADOS_EXCLUIDOS", None)
+ESTADOS_EXCLUIDOS = (
+    {e.strip() for e in _excluidos.split(",") if e.strip()} if isinstance(_excluidos, str)
+    else set(_excluidos) if _excluidos
+    else {e for col_id, _, estados in COLUNAS if col_id == "atendimento_humano" for e in estados}
+)
+CAMPO_OPT_OUT = "opt_out"
+
+MENSAGENS = Counter("domo_campanha_mensagens_total", "Mensagens de campanha processadas", ["resultado"])
+
+_executores: Dict[str, asyncio.Task] = {}
+
+
+class CampanhaInvalida(ValueError):
+    """Template ou público que não dá para usar."""
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _utc(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _oid(id_campanha: str) -> ObjectId:
+    if not ObjectId.is_valid(id_campanha):
+        raise CampanhaInvalida(f"Id de campanha inválido: {id_campanha}")
+    return ObjectId(id_campanha)
+
+
+# ----------------------------------------------------------------------
+# Público e template
+def filtro_exclusoes() -> Dict[str, Any]:
+    """Quem nunca recebe campanha: risco/crise, atendimento humano e opt-out."""
+    return {
+        "estado": {"$nin": sorted(ESTADOS_EXCLUIDOS)},
+        "meta_conversa.ultimo_risco": {"$in": [None, ""]},
+        CAMPO_OPT_OUT: {"$ne": True},
+    }
+
+
+def filtro_publico(publico: Dict[str, Any]) -> Dict[str, Any]:
+    """Filtro de `contextos`/`contextos_frios` para o público (usa estado_tel_idx /
+    tags_tel_idx), sempre combinado com `filtro_exclusoes`."""
+    filtro: Dict[str, Any] = {}
+    estados = publico.get("estados") or []
+    excluir = publico.get("excluir_estados") or []
+    if estados:
+        filtro["estado"] = {"$in": [e for e in estados if e not in excluir]}
+    elif excluir:
+        filtro["estado"] = {"$nin": excluir}
+    score: Dict[str, Any] = {}
+    if publico.get("score_min") is not None: score["$gte"] = publico["score_min"]
+    if publico.get("score_max") is not None: score["$lte"] = publico["score_max"]
+    if score:
+        filtro["meta_conversa.score_lead"] = score
+    if publico.get("tags"):
+        filtro["tags"] = {"$all": list(publico["tags"])}
+    if publico.get("inativo_ha_horas"):
+        filtro["ts"] = {"$lte": _agora() - timedelta(hours=float(publico["inativo_ha_horas"]))}
+    if not filtro:
+        raise CampanhaInvalida("Público sem critério: informe estados, score, tags ou inatividade.")
+    return {"$and": [filtro, filtro_exclusoes()]}
+
+
+def resolver_template(template: Dict[str, Any]) -> str:
+    """Texto-base da campanha: {"texto": ...} | {"intent": ID} | {"trilha": nome, "etapa": n}."""
+    if template.get("texto"):
+        texto = template["texto"]
+    elif template.get("intent"):
+        dados = obter_intent(template["intent"]) or {}
+        texto = dados.get("resposta")
+        if not texto:
+            raise CampanhaInvalida(f"Intent '{template['intent']}' sem resposta.")
+    elif template.get("trilha"):
+        arquivo = DIR_TRILHAS / f"trilha_{template['trilha']}.json"
+        try:
+            etapas = json.loads(arquivo.read_text(encoding="utf-8")).get("etapas", {})
+        except (OSError, ValueError) as e:
+            raise CampanhaInvalida(f"Trilha '{template['trilha']}' ilegível: {e}") from e
+        texto = (etapas.get(str(template.get("etapa", "1"))) or {}).get("mensagem")
+        if not texto:
+            raise CampanhaInvalida(f"Etapa {template.get('etapa', '1')} não existe na trilha '{template['trilha']}'.")
+    else:
+        raise CampanhaInvalida("Template precisa de 'texto', 'intent' ou 'trilha'.")
+    try:
+        renderizar(texto, {"tel": "5500000000000"})
+    except (KeyError, IndexError, ValueError) as e:
+        raise CampanhaInvalida(f"Template com marcador inválido: {e}") from e
+    return texto
+
+
+class _Campos(dict):
+    def __missing__(self, chave: str) -> str:
+        return ""
+
+
+def renderizar(texto: str, contexto: Dict[str, Any]) -> str:
+    meta = contexto.get("meta_conversa") or {}
+    nome = contexto.get("nome") or meta.get("nome_paciente") or ""
+    return texto.format_map(_Campos(
+        nome=nome,
+        primeiro_nome=nome.split()[0] if nome else "",
+        tel=contexto.get("tel", ""),
+        estado=contexto.get("estado", ""),
+    )).strip()
+
+
+_PROJECAO_PUBLICO = {"tel": 1, "nome": 1, "estado": 1, "meta_conversa.nome_paciente": 1, "_id": 0}
+
+
+def _mesclar(listas: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Um contato por telefone, ordenado por `tel` (a camada quente prevalece)."""
+    por_tel: Dict[str, Dict[str, Any]] = {}
+    for lista in listas:
+        for contato in lista:
+            if contato.get("tel"):
+                por_tel.setdefault(contato["tel"], contato)
+    return [por_tel[tel] for tel in sorted(por_tel)]
+
+
+async def pagina_publico(filtro: Dict[str, Any], apos_tel: Optional[str], limite: int,
+                         perfil: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Próximos `limite` contatos depois de `apos_tel`, somando as camadas quente e fria."""
+    pagina_filtro = dict(filtro, tel={"$gt": apos_tel}) if apos_tel else filtro
+    paginas = await asyncio.gather(*(
+        banco.colecao(nome, perfil).find(pagina_filtro, _PROJECAO_PUBLICO).sort("tel", 1).limit(limite).to_list(limite)
+        for nome in CAMADAS_PUBLICO
+    ))
+    return _mesclar(paginas)[:limite]
+
+
+# ----------------------------------------------------------------------
+# CRUD / controle (rascunho -> executando <-> pausada -> concluida | cancelada)
+async def criar(nome: str, publico: Dict[str, Any], template: Dict[str, Any], *,
+                taxa_por_s: Optional[float] = None, criado_por: Optional[str] = None) -> Dict[str, Any]:
+    filtro_publico(publico)
+    resolver_template(template)
+    doc = {
+        "nome": nome,
+        "publico": publico,
+        "template": template,
+        "taxa_por_s": float(taxa_por_s or TAXA_PADRAO),
+        "status": "rascunho",
+        "cursor": None,
+        "progresso": {"enfileirados": 0, "duplicados": 0, "sem_texto": 0, "excluidos": 0, "cancelados": 0},
+        "criado_por": criado_por,
+        "criado_em": _agora(),
+    }
+    resultado = await banco.colecao(COLECAO_CAMPANHAS, "duravel").insert_one(doc)
+    doc["_id"] = resultado.inserted_id
+    logger.info(f"CAMPANHAS: Campanha '{nome}' criada ({resultado.inserted_id}).")
+    return doc
+
+
+async def previa(publico: Dict[str, Any], template: Dict[str, Any], amostra: int = 5) -> Dict[str, Any]:
+    filtro = filtro_publico(publico)
+    texto = resolver_template(template)
+    *totais, exemplos = await asyncio.gather(
+        *(banco.colecao(nome, "painel").count_documents(filtro) for nome in CAMADAS_PUBLICO),
+        pagina_publico(filtro, None, amostra, "painel"),
+    )
+    return {"publico_total": sum(totais), "exemplos": [{"tel": c.get("tel"), "mensagem": renderizar(texto, c)} for c in exemplos]}
+
+
+async def _transicionar(id_campanha: str, de: List[str], para: str, extra: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    atualizacao: Dict[str, Any] = {"$set": {"status": para, "atualizado_em": _agora(), **(extra or {})}}
+    return await banco.colecao(COLECAO_CAMPANHAS, "duravel").find_one_and_update(
+        {"_id": _oid(id_campanha), "status": {"$in": de}}, atualizacao, return_document=ReturnDocument.AFTER
+    )
+
+
+async def iniciar(id_campanha: str) -> Optional[Dict[str, Any]]:
+    """rascunho/pausada -> executando e dispara o executor (None se a transição não vale)."""
+    doc = await _transicionar(id_campanha, ["rascunho", "pausada"], "executando")
+    if doc is None:
+        return None
+    if not doc.get("iniciado_em"):
+        await banco.colecao(COLECAO_CAMPANHAS).update_one({"_id": doc["_id"]}, {"$set": {"iniciado_em": _agora()}})
+    _disparar_executor(id_campanha)
+    return doc
+
+
+async def pausar(id_campanha: str) -> Optional[Dict[str, Any]]:
+    """O executor percebe na próxima página e para; o cursor fica onde estava."""
+    return await _transicionar(id_campanha, ["executando"], "pausada")
+
+
+async def cancelar(id_campanha: str) -> Optional[Dict[str, Any]]:
+    doc = await _transicionar(id_campanha, ["rascunho", "executando", "pausada"], "cancelada", {"concluido_em": _agora()})
+    if doc is None:
+        return None
+    # O que ainda não saiu do outbox não sai mais
+    removidos = await banco.colecao(COLECAO_OUTBOX).delete_many({"campanha_id": id_campanha, "status": "pendente"})
+    await banco.colecao(COLECAO_CAMPANHAS).update_one(
+        {"_id": doc["_id"]}, {"$inc": {"progresso.cancelados": removidos.deleted_count}}
+    )
+    logger.info(f"CAMPANHAS: Campanha {id_campanha} cancelada ({removidos.deleted_count} mensagem(ns) retiradas do outbox).")
+    return doc
+
+
+async def _entregas(id_campanha: str) -> Dict[str, Any]:
+    """Contagem por status no outbox + vazão efetiva de entrega."""
+    por_status: Dict[str, int] = {}
+    primeiro = ultimo = None
+    cursor = await banco.colecao(COLECAO_OUTBOX, "painel").aggregate([
+        {"$match": {"campanha_id": id_campanha}},
+        {"$group": {"_id": "$status", "n": {"$sum": 1}, "primeiro": {"$min": "$enviado_em"}, "ultimo": {"$max": "$enviado_em"}}},
+    ])
+    async for grupo in cursor:
+        por_status[grupo["_id"]] = grupo["n"]
+        if grupo["_id"] == "enviado":
+            primeiro, ultimo = _utc(grupo["primeiro"]), _utc(grupo["ultimo"])
+    por_status["dlq"] = await banco.colecao("outbox_dlq", "painel").count_documents({"campanha_id": id_campanha})
+    duracao = (ultimo - primeiro).total_seconds() if primeiro and ultimo else 0
+    return {
+        "por_status": por_status,
+        "entregues_por_s": round(por_status.get("enviado", 0) / duracao, 2) if duracao > 0 else None,
+    }
+
+
+async def obter(id_campanha: str) -> Optional[Dict[str, Any]]:
+    doc = await banco.colecao(COLECAO_CAMPANHAS, "painel").find_one({"_id": _oid(id_campanha)})
+    if doc is None:
+        return None
+    inicio, ultimo_lote = _utc(doc.get("iniciado_em")), _utc(doc.get("ultimo_lote_em"))
+    duracao = (ultimo_lote - inicio).total_seconds() if inicio and ultimo_lote else 0
+    enfileirados = doc.get("progresso", {}).get("enfileirados", 0)
+    doc["vazao"] = {"enfileirados_por_s": round(enfileirados / duracao, 2) if duracao > 0 else None}
+    doc["entregas"] = await _entregas(id_campanha)
+    doc["executando_neste_worker"] = id_campanha in _executores
+    return doc
+
+
+async def listar(limite: int = 50) -> List[Dict[str, Any]]:
+    cursor = banco.colecao(COLECAO_CAMPANHAS, "painel").find({}, {"cursor": 0}).sort("criado_em", -1).limit(limite)
+    return await cursor.to_list(limite)
+
+
+# ----------------------------------------------------------------------
+# Executor
+async def _status(oid: ObjectId) -> Optional[str]:
+    doc = await banco.colecao(COLECAO_CAMPANHAS).find_one({"_id": oid}, {"status": 1})
+    return doc.get("status") if doc else None
+
+
+async def _aguardar_outbox(id_campanha: str, oid: ObjectId) -> bool:
+    """Segura a campanha enquanto o outbox dela está cheio. False se saiu de 'executando'."""
+    while await banco.colecao(COLECAO_OUTBOX).count_documents(
+        {"campanha_id": id_campanha, "status": "pendente"}, limit=MAX_PENDENTES
+    ) >= MAX_PENDENTES:
+        await asyncio.sleep(ESPERA_PENDENTES_S)
+        if await _status(oid) != "executando":
+            return False
+    return True
+
+
+async def _executar(id_campanha: str) -> None:
+    oid = _oid(id_campanha)
+    campanha = await banco.colecao(COLECAO_CAMPANHAS).find_one({"_id": oid})
+    if not campanha or campanha.get("status") != "executando":
+        return
+    texto = resolver_template(campanha["template"])
+    filtro = filtro_publico(campanha["publico"])
+    taxa = float(campanha.get("taxa_por_s") or TAXA_PADRAO)
+    bloco = max(1, int(taxa))  # ~1 s de envios por insert_many
+    limitador = BaldeTokens(taxa, capacidade=bloco)
+    cursor_tel = campanha.get("cursor")
+    logger.info(f"CAMPANHAS: ▶️ Executando '{campanha['nome']}' ({id_campanha}) a {taxa:.0f} msg/s a partir de {cursor_tel or 'o início'}.")
+
+    while True:
+        pagina = await pagina_publico(filtro, cursor_tel, TAMANHO_PAGINA)
+        if not pagina:
+            await _transicionar(id_campanha, ["executando"], "concluida", {"concluido_em": _agora()})
+            logger.info(f"CAMPANHAS: ✅ Campanha {id_campanha} concluída.")
+            return
+        for inicio in range(0, len(pagina), bloco):
+            # Pausa/cancelamento valem em ~1 s; outbox cheio segura a campanha
+            if await _status(oid) != "executando" or not await _aguardar_outbox(id_campanha, oid):
+                logger.info(f"CAMPANHAS: ⏸️ Campanha {id_campanha} interrompida em {cursor_tel}.")
+                return
+            contatos = pagina[inicio:inicio + bloco]
+            elegiveis = await _ainda_elegiveis(filtro, contatos)
+            docs, sem_texto = [], 0
+            for contato in elegiveis:
+                mensagem = renderizar(texto, contato)
+                if not mensagem or not contato.get("tel"):
+                    sem_texto += 1
+                    continue
+                docs.append({
+                    "_id": f"{id_campanha}:{contato['tel']}",
+                    "telefone": contato["tel"],
+                    "texto": mensagem,
+                    "agente": "Campanha",
+                    "intent": campanha["template"].get("intent", "CAMPANHA"),
+                    "campanha_id": id_campanha,
+                })
+            await limitador.aguardar(len(contatos))
+            inseridos = await remetente_outbox.enfileirar_lote(docs, prioridade=PRIORIDADE_CAMPANHA)
+            cursor_tel = contatos[-1].get("tel") or cursor_tel
+            await banco.colecao(COLECAO_CAMPANHAS).update_one({"_id": oid}, {
+                "$set": {"cursor": cursor_tel, "ultimo_lote_em": _agora()},
+                "$inc": {
+                    "progresso.enfileirados": inseridos,
+                    "progresso.duplicados": len(docs) - inseridos,
+                    "progresso.sem_texto": sem_texto,
+                    "progresso.excluidos": len(contatos) - len(elegiveis),
+                },
+            })
+            MENSAGENS.labels("excluida").inc(len(contatos) - len(elegiveis))
+            MENSAGENS.labels("enfileirada").inc(inseridos)
+            MENSAGENS.labels("duplicada").inc(len(docs) - inseridos)
+            MENSAGENS.labels("sem_texto").inc(sem_texto)
+
+
+async def _ainda_elegiveis(filtro: Dict[str, Any], contatos: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Relê o bloco com o filtro depois de gravar as escritas pendentes deste worker
+    (cache write-behind), para não enviar a quem mudou de estado desde a página."""
+    await cache_contextos.descarregar_todos(motivo="campanha")
+    tels = [c["tel"] for c in contatos if c.get("tel") and not cache_contextos.pendente(c["tel"])]
+    if not tels:
+        return []
+    consulta = {"$and": [filtro, {"tel": {"$in": tels}}]}
+    return _mesclar(await asyncio.gather(*(
+        banco.colecao(nome).find(consulta, _PROJECAO_PUBLICO).to_list(len(tels)) for nome in CAMADAS_PUBLICO
+    )))
+
+
+def _disparar_executor(id_campanha: str) -> None:
+    """Task local do executor (se ainda não há uma); o lease garante um executor no cluster."""
+    task = _executores.get(id_campanha)
+    if task is not None and not task.done():
+        return
+
+    async def rodar():
+        try:
+            await executar_com_lease(f"campanha:{id_campanha}", lambda: _executar(id_campanha))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"CAMPANHAS: ❌ Executor da campanha {id_campanha} falhou: {e}")
+        finally:
+            _executores.pop(id_campanha, None)
+
+    _executores[id_campanha] = asyncio.get_running_loop().create_task(rodar())
+
+
+async def retomar_orfas() -> int:
+    """Job do scheduler: garante executor para campanhas 'executando' (ex.: após restart)."""
+    retomadas = 0
+    async for doc in banco.colecao(COLECAO_CAMPANHAS).find({"status": "executando"}, {"_id": 1}):
+        id_campanha = str(doc["_id"])
+        if id_campanha not in _executores:
+            _disparar_executor(id_campanha)
+            retomadas += 1
+    return retomadas
+
+
+async def parar() -> None:
+    """Shutdown: cancela os executores locais (o cursor gravado permite retomar)."""
+    tarefas = list(_executores.values())
+    for task in tarefas:
+        task.cancel()
+    if tarefas:
+        await asyncio.gather(*tarefas, return_exceptions=True)
+    _executores.clear()
@@ -0,0 +1,226 @@
+# ===========================================================
+# Arquivo: core/escritor_lote.py
+# Escrita em lote (write-behind) para coleções de telemetria.
+# - `adicionar(doc)` só enfileira em memória (microssegundos); uma task
+#   de fundo grava com insert_many(ordered=False) quando o buffer atinge
+#   o tamanho do lote ou quando o intervalo expira.
+# - Buffer limitado. Sob sobrecarga aplica a política configurada:
+#   descartar_antigos | descartar_novos | amostrar.
+# - `parar()` não cancela a task no meio de um insert_many: sinaliza,
+#   espera a gravação em voo e grava o que restou (shutdown). Se ainda
+#   assim a task for cancelada, o lote em voo volta para o buffer.
+# - `apos_gravar` (opcional) recebe cada lote gravado, para quem precisa
+#   derivar algo dos documentos (ex.: core/status_entrega.py).
+# - Backlog, gravados e descartados expostos no Prometheus.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo.errors import BulkWriteError
+
+from app.core import banco
+
+logger = logging.getLogger("famdomes.escritor_lote")
+
+POLITICAS = ("descartar_antigos", "descartar_novos", "amostrar")
+LIMIAR_AMOSTRAGEM = 0.5  # fração do buffer a partir da qual "amostrar" passa a descartar
+PRAZO_PARADA_S = 15.0  # espera máxima pela gravação em voo no shutdown
+
+BACKLOG = Gauge("domo_escritor_backlog", "Documentos aguardando gravação em lote", ["colecao"])
+GRAVADOS = Counter("domo_escritor_gravados_total", "Documentos gravados pelo escritor em lote", ["colecao"])
+DESCARTADOS = Counter(
+    "domo_escritor_descartados_total",
+    "Documentos descartados pelo escritor em lote",
+    ["colecao", "motivo"],
+)
+DURACAO_LOTE = Histogram(
+    "domo_escritor_lote_duracao_segundos",
+    "Duração de cada insert_many do escritor em lote",
+    ["colecao"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+class EscritorEmLote:
+    """
+    Buffer limitado que grava documentos em uma coleção via insert_many.
+
+    Args:
+        colecao: Nome da coleção (resolvida em core/banco.py com o perfil dela).
+        tamanho_lote: Documentos por insert_many (também dispara a gravação).
+        intervalo_s: Tempo máximo que um documento espera no buffer.
+        capacidade: Tamanho máximo do buffer.
+        politica: O que fazer com o buffer cheio (ver POLITICAS).
+        taxa_amostragem: Fração aceita na política "amostrar" acima do limiar.
+        apos_gravar: Corrotina chamada com cada lote gravado (erros só são logados).
+    """
+
+    def __init__(
+        self,
+        colecao: str,
+        *,
+        tamanho_lote: int = 200,
+        intervalo_s: float = 1.0,
+        capacidade: int = 10000,
+        politica: str = "descartar_antigos",
+        taxa_amostragem: float = 0.1,
+        apos_gravar: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]] = None,
+    ):
+        if politica not in POLITICAS:
+            raise ValueError(f"Política de descarte desconhecida: {politica}")
+        self.colecao = colecao
+        self.tamanho_lote = max(1, tamanho_lote)
+        self.intervalo_s = intervalo_s
+        self.capacidade = max(self.tamanho_lote, capacidade)
+        self.politica = politica
+        self.taxa_amostragem = taxa_amostragem
+        self.apos_gravar = apos_gravar
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self._acordar: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._parando = False
+
+    # ------------------------------------------------------------------
+    def adicionar(self, doc: Dict[str, Any]) -> bool:
+        """Enfileira um documento. Nunca faz I/O. Retorna False se foi descartado."""
+        ocupacao = len(self._buffer)
+        if self.politica == "amostrar" and ocupacao >= self.capacidade * LIMIAR_AMOSTRAGEM:
+            if ocupacao >= self.capacidade or random.random() >= self.taxa_amostragem:
+                DESCARTADOS.labels(colecao=self.colecao, motivo="amostragem").inc()
+                return False
+        elif ocupacao >= self.capacidade:
+            if self.politica == "descartar_novos":
+                DESCARTADOS.labels(colecao=self.colecao, motivo="buffer_cheio").inc()
+                return False
+            self._buffer.popleft()
+            DESCARTADOS.labels(colecao=self.colecao, motivo="buffer_cheio").inc()
+
+        self._buffer.append(doc)
+        BACKLOG.labels(colecao=self.colecao).set(len(self._buffer))
+        self._garantir_task()
+        if len(self._buffer) >= self.tamanho_lote and self._acordar is not None:
+            self._acordar.set()
+        return True
+
+    @property
+    def backlog(self) -> int:
+        return len(self._buffer)
+
+    # ------------------------------------------------------------------
+    def _garantir_task(self) -> None:
+        if self._parando or (self._task is not None and not self._task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Fora do event loop (scripts): grava no próximo iniciar()/parar()
+        self._acordar = asyncio.Event()
+        self._task = loop.create_task(self._loop())
+
+    async def iniciar(self) -> None:
+        self._parando = False
+        self._garantir_task()
+        logger.info(f"ESCRITOR: Escritor em lote de '{self.colecao}' iniciado (lote={self.tamanho_lote}, intervalo={self.intervalo_s}s, política={self.politica}).")
+
+    async def _loop(self) -> None:
+        while not self._parando:
+            try:
+                await asyncio.wait_for(self._acordar.wait(), timeout=self.intervalo_s)
+            except asyncio.TimeoutError:
+                pass
+            self._acordar.clear()
+            while self._buffer and not self._parando:
+                gravou = await self._gravar_lote()
+                if not gravou or len(self._buffer) < self.tamanho_lote:
+                    break
+
+    async def _gravar_lote(self) -> bool:
+        lote = [self._buffer.popleft() for _ in range(min(self.tamanho_lote, len(self._buffer)))]
+        BACKLOG.labels(colecao=self.colecao).set(len(self._buffer))
+        if not lote:
+            return True
+        inicio = time.perf_counter()
+        try:
+            await banco.colecao(self.colecao).insert_many(lote, ordered=False)
+            GRAVADOS.labels(colecao=self.colecao).inc(len(lote))
+            await self._apos_gravar(lote)
+            return True
+        except BulkWriteError as e:
+            # ordered=False: os documentos válidos já foram gravados
+            gravados = e.details.get("nInserted", 0)
+            GRAVADOS.labels(colecao=self.colecao).inc(gravados)
+            DESCARTADOS.labels(colecao=self.colecao, motivo="erro_gravacao").inc(len(lote) - gravados)
+            logger.warning(f"ESCRITOR: ⚠️ Lote de '{self.colecao}' parcialmente gravado ({gravados}/{len(lote)}).")
+            await self._apos_gravar(lote)
+            return True
+        except asyncio.CancelledError:
+            # Cancelada no meio do insert_many: o lote pode não ter sido gravado
+            self._devolver(lote)
+            raise
+        except Exception as e:
+            self._devolver(lote)
+            logger.warning(f"ESCRITOR: ⚠️ Falha ao gravar lote em '{self.colecao}' ({len(lote)} docs): {e}")
+            return False
+        finally:
+            DURACAO_LOTE.labels(colecao=self.colecao).observe(time.perf_counter() - inicio)
+
+    def _devolver(self, lote: List[Dict[str, Any]]) -> None:
+        """Devolve o lote para a frente do buffer (respeitando a capacidade) e tenta no próximo ciclo."""
+        espaco = self.capacidade - len(self._buffer)
+        devolvidos = lote[-espaco:] if espaco > 0 else []
+        self._buffer.extendleft(reversed(devolvidos))
+        if len(devolvidos) < len(lote):
+            DESCARTADOS.labels(colecao=self.colecao, motivo="erro_gravacao").inc(len(lote) - len(devolvidos))
+        BACKLOG.labels(colecao=self.colecao).set(len(self._buffer))
+
+    async def _apos_gravar(self, lote: List[Dict[str, Any]]) -> None:
+        if self.apos_gravar is None:
+            return
+        try:
+            await self.apos_gravar(lote)
+        except Exception as e:
+            logger.warning(f"ESCRITOR: ⚠️ Pós-processamento do lote de '{self.colecao}' falhou: {e}")
+
+    async def descarregar(self) -> None:
+        """Grava tudo que está no buffer agora (para na primeira falha)."""
+        while self._buffer:
+            if not await self._gravar_lote():
+                break
+
+    async def parar(self, prazo_s: float = PRAZO_PARADA_S) -> None:
+        """Para a task de fundo depois da gravação em voo e grava o restante do buffer."""
+        self._parando = True
+        if self._task is not None:
+            if self._acordar is not None:
+                self._acordar.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=prazo_s)
+            except asyncio.TimeoutError:
+                # Gravação travada: cancela (o lote em voo volta para o buffer)
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            except Exception as e:
+                logger.warning(f"ESCRITOR: ⚠️ Task de '{self.colecao}' terminou com erro: {e}")
+            self._task = None
+        pendentes = len(self._buffer)
+        await self.descarregar()
+        if self._buffer:
+            DESCARTADOS.labels(colecao=self.colecao, motivo="shutdown").inc(len(self._buffer))
+            logger.error(f"ESCRITOR: ❌ {len(self._buffer)} documento(s) de '{self.colecao}' perdidos no shutdown.")
+            self._buffer.clear()
+            BACKLOG.labels(colecao=self.colecao).set(0)
+        elif pendentes:
+            logger.info(f"ESCRITOR: ✅ {pendentes} documento(s) de '{self.colecao}' gravados no shutdown.")
+
+    def estado(self) -> dict:
+        return {"colecao": self.colecao, "backlog": len(self._buffer), "capacidade": self.capacidade, "politica": self.politica}
@@ -3,43 +3,101 @@
 # ===========================================================
 from __future__ import annotations
 
-import httpx, json, logging
-from typing import Dict
+import json, logging
+from typing import Dict, List, Optional
 from app.config import settings
+from app.core.llm_lote import LoteClassificacao
 
 logger = logging.getLogger("famdomes.ia")
 
+# Frases curtas e comuns ("ok", "sim, quero") se repetem muito; só elas usam cache
+CACHE_MAX_CHARS = int(getattr(settings, "LLM_CACHE_CLASSIFICACAO_MAX_CHARS", 40))
 
-async def _chamar_ollama(prompt: str) -> str | None:
-    url = f"{str(settings.OLLAMA_API_URL).rstrip('/')}/api/generate"
-    body = {"model": settings.OLLAMA_MODEL, "prompt": prompt, "stream": False}
 
+SISTEMA_INTENCAO = (
+    "Você é um classificador. Responda SOMENTE com uma "
+    "das opções: ESCALONAR_HUMANO, TRIAGEM_INICIAL, PRESENCA_VIVA, ACOLHIMENTO."
+)
+
+
+def _prompt_intencao(texto: str) -> str:
+    return f"{SISTEMA_INTENCAO}\n\nUsuário: {texto}\nIntenção:"
+
+
+def _prompt_sentimento(texto: str) -> str:
+    return (
+        "Avalie o sentimento do texto em JSON no formato "
+        "{'positivo':0‑1,'negativo':0‑1,'neutro':0‑1}:\n" + texto
+    )
+
+
+def _textos_numerados(textos: List[str]) -> str:
+    return "\n".join(f"{i}. {json.dumps(t, ensure_ascii=False)}" for i, t in enumerate(textos, 1))
+
+
+def _prompt_lote_intencao(textos: List[str]) -> str:
+    return (
+        f"{SISTEMA_INTENCAO}\nClassifique CADA mensagem abaixo, na mesma ordem. "
+        'Responda em JSON: {"itens": ["INTENCAO_1", "INTENCAO_2", ...]} '
+        f"com exatamente {len(textos)} itens.\n\n{_textos_numerados(textos)}"
+    )
+
+
+def _prompt_lote_sentimento(textos: List[str]) -> str:
+    return (
+        "Avalie o sentimento de CADA texto abaixo, na mesma ordem. Responda em JSON: "
+        '{"itens": [{"positivo":0-1,"negativo":0-1,"neutro":0-1}, ...]} '
+        f"com exatamente {len(textos)} itens.\n\n{_textos_numerados(textos)}"
+    )
+
+
+def _itens_lote(resp: str, n: int) -> Optional[list]:
     try:
-        async with httpx.AsyncClient(timeout=settings.MCP_TIMEOUT_S) as cli:
-            resp = await cli.post(url, json=body)
-        resp.raise_for_status()
-        return resp.json().get("response")
-    except Exception as exc:  # pragma: no cover
-        logger.warning("OLLAMA: ❌ %s", exc)
+        itens = json.loads(resp).get("itens")
+    except Exception:
+        return None
+    return itens if isinstance(itens, list) and len(itens) == n else None
+
+
+def _interpretar_lote_intencao(resp: str, n: int) -> Optional[List[Optional[str]]]:
+    itens = _itens_lote(resp, n)
+    if itens is None:
         return None
+    return [str(i) if i else None for i in itens]
+
+
+def _interpretar_lote_sentimento(resp: str, n: int) -> Optional[List[Optional[str]]]:
+    itens = _itens_lote(resp, n)
+    if itens is None or not all(isinstance(i, dict) for i in itens):
+        return None
+    # Devolve no mesmo formato da chamada avulsa (texto JSON) para reaproveitar o parsing
+    return [json.dumps(i) for i in itens]
+
+
+# Micro-batching: mensagens concorrentes viram um único prompt por janela
+_lote_intencao = LoteClassificacao(
+    "intencao",
+    prompt_item=_prompt_intencao,
+    prompt_lote=_prompt_lote_intencao,
+    interpretar_lote=_interpretar_lote_intencao,
+)
+_lote_sentimento = LoteClassificacao(
+    "sentimento",
+    prompt_item=_prompt_sentimento,
+    prompt_lote=_prompt_lote_sentimento,
+    interpretar_lote=_interpretar_lote_sentimento,
+)
 
 
 async def detectar_intencao(texto: str) -> str:
-    sistema = (
-        "Você é um classificador. Responda SOMENTE com uma "
-        "das opções: ESCALONAR_HUMANO, TRIAGEM_INICIAL, PRESENCA_VIVA, ACOLHIMENTO."
-    )
-    resp = await _chamar_ollama(f"{sistema}\n\nUsuário: {texto}\nIntenção:")
-    intent = (resp or "").strip().split()[0].upper()
+    resp = await _lote_intencao.classificar(texto, usar_cache=len(texto) <= CACHE_MAX_CHARS)
+    palavras = (resp or "").strip().split()
+    intent = palavras[0].upper() if palavras else ""  # resposta vazia (IA falhou): intenção padrão
     return intent if intent in {"ESCALONAR_HUMANO", "TRIAGEM_INICIAL", "PRESENCA_VIVA"} else "ACOLHIMENTO"
 
 
 async def analisar_sentimento(texto: str) -> Dict[str, float]:
-    prompt = (
-        "Avalie o sentimento do texto em JSON no formato "
-        "{'positivo':0‑1,'negativo':0‑1,'neutro':0‑1}:\n" + texto
-    )
-    resp = await _chamar_ollama(prompt)
+    resp = await _lote_sentimento.classificar(texto, usar_cache=len(texto) <= CACHE_MAX_CHARS)
     try:
         dados = json.loads(resp) if resp else {}
         if all(k in dados for k in ("positivo", "negativo", "neutro")):
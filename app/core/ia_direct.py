@@ -2,24 +2,65 @@
 # Gera resposta alternativa curta via Ollama local
 # ===========================================================
 from __future__ import annotations
-import httpx, logging
-from app.config import settings
+import logging
+from typing import Any, Awaitable, Callable, Tuple
+from app.core import llm
+from app.utils.ollama import extrair_json_final
 
 logger = logging.getLogger("famdomes.ia-fallback")
 
-async def gerar_resposta_ia(contexto: dict) -> str:
-    prompt = (
+RESPOSTA_FALLBACK = "Entendo! Quer mais detalhes ou ajuda humana?"
+# Fecho quando o stream cai depois do primeiro trecho já ter saído
+RESPOSTA_CONTINUACAO = "Quer mais detalhes ou ajuda humana?"
+
+def _montar_prompt(contexto: dict) -> str:
+    return (
         "Você é um vendedor empático. Responda em até 140 caracteres, "
         "sem jargões técnicos, incentivando o próximo passo.\n\n"
         f"{contexto}\nResposta:"
     )
-    body = {"model": settings.OLLAMA_MODEL, "prompt": prompt, "stream": False}
+
+async def gerar_resposta_ia(contexto: dict, *, usar_cache: bool = False, site: str = "ia_direct") -> str:
+    """
+    Gera uma resposta curta. `usar_cache=True` só para prompts sem dados
+    pessoais (ex: pitch de plano), pois a resposta é reaproveitada entre usuários.
+    """
+    prompt = _montar_prompt(contexto)
 
     try:
-        async with httpx.AsyncClient(timeout=20, follow_redirects=True) as cli:
-            r = await cli.post(f"{settings.OLLAMA_API_URL.rstrip('/')}/api/generate", json=body)
-            r.raise_for_status()
-            return r.json().get("response", "").strip()
+        dados = await llm.gerar(prompt, timeout=20, cache=usar_cache, site=site, afinidade=contexto.get("tel"))
+        return dados.get("response", "").strip()
     except Exception as exc:
         logger.warning("IA-fallback falhou: %s", exc)
-        return "Entendo! Quer mais detalhes ou ajuda humana?"
+        return RESPOSTA_FALLBACK
+
+async def gerar_resposta_ia_stream(
+    contexto: dict,
+    ao_primeiro_trecho: Callable[[str], Awaitable[Any]],
+) -> Tuple[str, str]:
+    """
+    Igual a `gerar_resposta_ia`, mas em streaming: a primeira frase completa
+    é entregue via `ao_primeiro_trecho` antes do fim da geração.
+
+    Se o stream cair depois do primeiro trecho, o restante são só as frases
+    completas que chegaram (ou RESPOSTA_CONTINUACAO), nunca o fallback inteiro.
+    Bloco JSON no final (com ou sem ```json) é retirado do restante, como em
+    `chamar_ollama`; o primeiro trecho nunca inclui JSON (llm.primeiro_trecho).
+
+    Returns:
+        (restante, prefixo_entregue) — restante pode ser "" se tudo já foi entregue.
+    """
+    try:
+        texto, prefixo = await llm.gerar_com_envio_antecipado(
+            _montar_prompt(contexto), ao_primeiro_trecho, timeout=20, afinidade=contexto.get("tel")
+        )
+        restante, _ = extrair_json_final(texto[len(prefixo):].strip(), contexto.get("tel"))
+        return restante.strip(), prefixo.strip()
+    except llm.StreamInterrompido as exc:
+        logger.warning("IA-fallback (stream) interrompido após o primeiro trecho: %s", exc)
+        resto = exc.parcial[len(exc.prefixo):]
+        resto = resto[:llm.ultimo_fim_frase(resto)].strip()
+        return resto or RESPOSTA_CONTINUACAO, exc.prefixo.strip()
+    except Exception as exc:
+        logger.warning("IA-fallback (stream) falhou: %s", exc)
+        return RESPOSTA_FALLBACK, ""
@@ -0,0 +1,467 @@
+# ===========================================================
+# Arquivo: core/indices.py
+# Migrações versionadas de índices + formas de consulta da aplicação.
+# - MIGRACOES: lista ordenada; cada versão aplicada fica registrada em
+#   `_migracoes_indices` e não roda de novo. Aplicadas no startup
+#   (`aplicar_migracoes`), também pelo script scripts/analisar_indices.py.
+# - FORMAS_CONSULTA: as consultas quentes que a aplicação emite (filtro,
+#   ordenação, limite). `analisar_formas` roda explain(executionStats)
+#   em cada uma e aponta COLLSCAN, SORT em memória e a razão
+#   documentos examinados / retornados.
+# - Todo índice da aplicação entra aqui; módulos não fazem I/O no import.
+#   (Exceções: coleções de arquivo/TTL em core/retencao.py e leases em
+#   core/lease.py, preparadas no startup.)
+# ===========================================================
+from __future__ import annotations
+
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.core import banco
+
+logger = logging.getLogger("famdomes.indices")
+
+COLECAO_MIGRACOES = "_migracoes_indices"
+
+# Códigos do servidor quando um índice equivalente já existe com outro nome/opções
+_JA_EXISTE = {85, 86}
+
+
+@dataclass
+class Migracao:
+    versao: int
+    descricao: str
+    colecao: str
+    criar: List[IndexModel] = field(default_factory=list)
+    remover: List[str] = field(default_factory=list)
+    preparar: Optional[Callable[[Any], None]] = None  # recebe a coleção (síncrona); roda antes de `criar`
+
+
+def _uma_enviando_por_telefone(colecao) -> None:
+    """Antes do índice único parcial: telefones com várias entradas 'enviando' (reivindicadas
+    antes da ordem por telefone) ficam com a mais antiga; as demais voltam a 'pendente'."""
+    repetidos = colecao.aggregate([
+        {"$match": {"status": "enviando"}},
+        {"$sort": {"criado_em": 1, "_id": 1}},
+        {"$group": {"_id": "$telefone", "ids": {"$push": "$_id"}}},
+        {"$match": {"ids.1": {"$exists": True}}},
+    ])
+    devolvidas = 0
+    for grupo in repetidos:
+        resultado = colecao.update_many(
+            {"_id": {"$in": grupo["ids"][1:]}, "status": "enviando"},
+            {"$set": {"status": "pendente", "disponivel_em": datetime.now(timezone.utc)}, "$unset": {"dono": "", "reivindicado_ate": ""}},
+        )
+        devolvidas += resultado.modified_count
+    if devolvidas:
+        logger.warning(f"INDICES: ⚠️ {devolvidas} entrada(s) 'enviando' repetidas por telefone devolvidas à fila do outbox.")
+
+
+MIGRACOES: List[Migracao] = [
+    Migracao(
+        1, "respostas_ia: histórico por telefone ordenado por data (substitui telefone_idx)",
+        "respostas_ia",
+        criar=[IndexModel([("telefone", ASCENDING), ("criado_em", DESCENDING)], name="telefone_criado_em_idx")],
+        remover=["telefone_idx"],
+    ),
+    Migracao(
+        2, "respostas_ia: turnos com risco recentes (/kanban/risco_ativos)",
+        "respostas_ia",
+        criar=[IndexModel(
+            [("risco_detectado", ASCENDING), ("criado_em", DESCENDING)],
+            name="risco_criado_em_idx",
+            partialFilterExpression={"risco_detectado": True},
+        )],
+    ),
+    Migracao(
+        3, "contextos: follow-ups do scheduler e KPIs por estado dentro de uma janela de ts",
+        "contextos",
+        criar=[IndexModel([("estado", ASCENDING), ("ts", ASCENDING)], name="estado_ts_idx")],
+    ),
+    Migracao(
+        4, "eventos: trilha de um telefone ordenada por data",
+        "eventos",
+        criar=[IndexModel([("telefone", ASCENDING), ("timestamp", DESCENDING)], name="telefone_timestamp_idx")],
+    ),
+    Migracao(
+        5, "historico_buckets: buckets mais antigos primeiro (arquivamento da retenção)",
+        "historico_buckets",
+        criar=[IndexModel([("fim", ASCENDING)], name="fim_idx")],
+    ),
+    Migracao(
+        6, "contextos: fila de vencimento dos follow-ups (core/temporizador.py)",
+        "contextos",
+        criar=[IndexModel([("proximo_followup_em", ASCENDING)], name="proximo_followup_em_idx", sparse=True)],
+    ),
+    Migracao(
+        7, "outbox: fila de entrega por prioridade e vez (core/outbox.py)",
+        "outbox",
+        criar=[IndexModel([("status", ASCENDING), ("prioridade", ASCENDING), ("disponivel_em", ASCENDING)], name="fila_idx")],
+    ),
+    Migracao(
+        8, "contextos: público de campanhas paginado por tel (por estado ou por tags)",
+        "contextos",
+        criar=[
+            IndexModel([("estado", ASCENDING), ("tel", ASCENDING)], name="estado_tel_idx"),
+            IndexModel([("tags", ASCENDING), ("tel", ASCENDING)], name="tags_tel_idx", sparse=True),
+        ],
+    ),
+    Migracao(
+        9, "outbox: mensagens de uma campanha por status (progresso, cancelamento)",
+        "outbox",
+        criar=[IndexModel([("campanha_id", ASCENDING), ("status", ASCENDING)], name="campanha_status_idx", sparse=True)],
+    ),
+    Migracao(
+        10, "outbox: vínculo dos status do WhatsApp pela wamid",
+        "outbox",
+        criar=[IndexModel([("wamid", ASCENDING)], name="wamid_idx", sparse=True)],
+    ),
+    Migracao(
+        11, "status_mensagens: eventos de uma mensagem",
+        "status_mensagens",
+        criar=[IndexModel([("wamid", ASCENDING), ("timestamp", ASCENDING)], name="wamid_timestamp_idx")],
+    ),
+    Migracao(
+        12, "kanban_cards: coluna do quadro paginada por última mensagem (core/kanban.py)",
+        "kanban_cards",
+        criar=[IndexModel([("coluna", ASCENDING), ("ts", DESCENDING), ("_id", DESCENDING)], name="coluna_ts_idx")],
+    ),
+    Migracao(
+        13, "kanban_cards: delta do dashboard por hora de gravação (core/sincronizacao.py)",
+        "kanban_cards",
+        criar=[IndexModel([("atualizado_em", ASCENDING), ("_id", ASCENDING)], name="atualizado_em_idx")],
+    ),
+    Migracao(
+        14, "contextos: conferência de versão coberta pelo índice (core/cache_contextos.py)",
+        "contextos",
+        criar=[IndexModel([("tel", ASCENDING), ("versao", ASCENDING)], name="tel_versao_idx")],
+    ),
+    Migracao(
+        15, "historico_buckets: no máximo um bucket aberto por telefone (utils/historico.py)",
+        "historico_buckets",
+        criar=[IndexModel(
+            [("telefone", ASCENDING), ("aberto", ASCENDING)],
+            name="telefone_aberto_uniq",
+            unique=True,
+            partialFilterExpression={"aberto": True},
+        )],
+    ),
+    Migracao(
+        16, "contextos: saídas recentes gravadas no contexto (recuperação do outbox)",
+        "contextos",
+        criar=[IndexModel([("saidas.criado_em", ASCENDING)], name="saidas_criado_em_idx", sparse=True)],
+    ),
+    Migracao(
+        17, "outbox: ordem por telefone (entrada mais antiga não resolvida; uma em voo por telefone)",
+        "outbox",
+        criar=[
+            IndexModel(
+                [("telefone", ASCENDING), ("status", ASCENDING), ("criado_em", ASCENDING), ("_id", ASCENDING)],
+                name="telefone_status_criado_idx",
+            ),
+            IndexModel(
+                [("telefone", ASCENDING)],
+                name="telefone_enviando_uniq",
+                unique=True,
+                partialFilterExpression={"status": "enviando"},
+            ),
+        ],
+        preparar=_uma_enviando_por_telefone,
+    ),
+    Migracao(
+        18, "status_sem_vinculo: status à espera da wamid no outbox (core/status_entrega.py)",
+        "status_sem_vinculo",
+        criar=[IndexModel([("wamid", ASCENDING)], name="wamid_idx")],
+    ),
+    Migracao(
+        19, "cache_llm: expiração por TTL e purga por call-site (core/llm.py)",
+        "cache_llm",
+        criar=[
+            IndexModel([("expira_em", ASCENDING)], name="expira_em_ttl_idx", expireAfterSeconds=0),
+            IndexModel([("site", ASCENDING)], name="site_idx"),
+        ],
+    ),
+    # 20-23: índices que os módulos criavam no import (mesmos nomes e opções)
+    Migracao(
+        20, "contextos: um documento por telefone, ts e estado (antes em utils/contexto.py)",
+        "contextos",
+        criar=[
+            IndexModel([("tel", ASCENDING)], name="tel_unique_idx", unique=True),
+            IndexModel([("ts", ASCENDING)], name="ts_idx"),
+            IndexModel([("estado", ASCENDING)], name="estado_idx"),
+        ],
+    ),
+    Migracao(
+        21, "respostas_ia: turnos por data (antes em utils/contexto.py)",
+        "respostas_ia",
+        criar=[IndexModel([("criado_em", ASCENDING)], name="criado_em_idx")],
+    ),
+    Migracao(
+        22, "historico_buckets: bucket mais recente por telefone (antes em utils/contexto.py)",
+        "historico_buckets",
+        criar=[IndexModel([("telefone", ASCENDING), ("fim", DESCENDING)], name="telefone_fim_idx")],
+    ),
+    Migracao(
+        23, "consultas_agendadas: um agendamento por horário (antes em utils/agenda.py)",
+        "consultas_agendadas",
+        criar=[
+            IndexModel([("horario_utc", ASCENDING)], name="horario_utc_1", unique=True),
+            IndexModel([("telefone", ASCENDING)], name="telefone_1"),
+            IndexModel([("status", ASCENDING), ("horario_utc", ASCENDING)], name="status_1_horario_utc_1"),
+        ],
+    ),
+    Migracao(
+        24, "pagamentos: sessão do Stripe única, por telefone/status/data (antes em utils/followup.py)",
+        "pagamentos",
+        criar=[
+            IndexModel([("telefone", ASCENDING)], name="telefone_1"),
+            IndexModel([("id_sessao_stripe", ASCENDING)], name="id_sessao_stripe_1", sparse=True, unique=True),
+            IndexModel([("status", ASCENDING)], name="status_1"),
+            IndexModel([("criado_em", ASCENDING)], name="criado_em_1"),
+        ],
+    ),
+]
+
+
+def _registrar(db, migracao: Migracao) -> None:
+    db[COLECAO_MIGRACOES].update_one(
+        {"_id": migracao.versao},
+        {"$set": {"descricao": migracao.descricao, "colecao": migracao.colecao, "aplicada_em": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+
+
+def _aplicar(db, migracao: Migracao) -> None:
+    colecao = db[migracao.colecao]
+    if migracao.preparar is not None:
+        migracao.preparar(colecao)
+    for modelo in migracao.criar:
+        try:
+            colecao.create_indexes([modelo])
+        except OperationFailure as e:
+            if e.code not in _JA_EXISTE:
+                raise
+            logger.info(f"INDICES: Índice equivalente a '{modelo.document['name']}' já existe em '{migracao.colecao}'.")
+    existentes = set(colecao.index_information())
+    for nome in migracao.remover:
+        if nome in existentes:
+            colecao.drop_index(nome)
+            logger.info(f"INDICES: Índice redundante '{nome}' removido de '{migracao.colecao}'.")
+
+
+def aplicar_migracoes() -> int:
+    """Aplica (em ordem) as migrações ainda não registradas. Retorna quantas foram aplicadas."""
+    try:
+        db = banco.db_sync()
+        aplicadas = {doc["_id"] for doc in db[COLECAO_MIGRACOES].find({}, {"_id": 1})}
+    except Exception as e:
+        logger.error(f"INDICES: ❌ Não foi possível ler as migrações aplicadas: {e}")
+        return 0
+    total = 0
+    for migracao in sorted(MIGRACOES, key=lambda m: m.versao):
+        if migracao.versao in aplicadas:
+            continue
+        try:
+            _aplicar(db, migracao)
+            _registrar(db, migracao)
+            total += 1
+            logger.info(f"INDICES: ✅ Migração {migracao.versao} aplicada: {migracao.descricao}")
+        except Exception as e:
+            # Para na primeira falha: as seguintes podem depender desta
+            logger.error(f"INDICES: ❌ Falha na migração {migracao.versao} ({migracao.descricao}): {e}")
+            break
+    if total == 0:
+        logger.info("INDICES: Nenhuma migração de índice pendente.")
+    return total
+
+
+# ----------------------------------------------------------------------
+# Formas de consulta da aplicação (valores de exemplo; o plano depende só da forma)
+@dataclass
+class FormaConsulta:
+    nome: str
+    colecao: str
+    filtro: Callable[[], Dict[str, Any]]
+    ordenacao: Optional[Dict[str, int]] = None
+    limite: Optional[int] = None
+    projecao: Optional[Dict[str, Any]] = None
+    varredura_esperada: bool = False  # ex: consulta de manutenção que lê tudo de propósito
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+FORMAS_CONSULTA: List[FormaConsulta] = [
+    FormaConsulta("contexto_por_telefone", "contextos", lambda: {"tel": "5500000000000"}),
+    FormaConsulta(
+        "contexto_versao", "contextos", lambda: {"tel": "5500000000000"},
+        projecao={"_id": 0, "tel": 1, "versao": 1},
+    ),
+    FormaConsulta(
+        "temporizador_followups_vencendo", "contextos",
+        lambda: {"proximo_followup_em": {"$lte": _agora() + timedelta(minutes=5)}},
+        ordenacao={"proximo_followup_em": 1}, limite=5000,
+        projecao={"tel": 1, "proximo_followup_em": 1, "proximo_followup_tipo": 1, "_id": 0},
+    ),
+    FormaConsulta(
+        "semeadura_followup_pagamento", "contextos",
+        lambda: {
+            "estado": {"$in": ["AGUARDANDO_PAGAMENTO"]},
+            "proximo_followup_em": {"$exists": False},
+            "meta_conversa.followup_pagamento_enviado": {"$ne": True},
+            "ts": {"$type": "date"},
+        },
+    ),
+    FormaConsulta(
+        "outbox_proxima_entrega", "outbox",
+        lambda: {"status": "pendente", "disponivel_em": {"$lte": _agora()}},
+        ordenacao={"prioridade": 1, "disponivel_em": 1}, limite=1,
+    ),
+    FormaConsulta(
+        "outbox_vez_do_telefone", "outbox",
+        lambda: {"telefone": "5500000000000", "status": {"$in": ["pendente", "enviando"]}},
+        ordenacao={"criado_em": 1, "_id": 1}, limite=1, projecao={"_id": 1},
+    ),
+    FormaConsulta(
+        "outbox_saidas_recentes", "contextos",
+        lambda: {"saidas.criado_em": {"$gte": _agora() - timedelta(minutes=10)}},
+        projecao={"_id": 0, "saidas": 1},
+    ),
+    FormaConsulta(
+        "campanha_pagina_publico", "contextos",
+        lambda: {"$and": [
+            {"estado": {"$in": ["FINALIZADO_SEM_VENDA", "AGUARDANDO_PAGAMENTO"]}},
+            {"estado": {"$nin": ["AGUARDANDO_ATENDENTE", "RISCO_DETECTADO"]}, "meta_conversa.ultimo_risco": {"$in": [None, ""]}, "opt_out": {"$ne": True}},
+        ], "tel": {"$gt": "5500000000000"}},
+        ordenacao={"tel": 1}, limite=200,
+    ),
+    FormaConsulta(
+        "campanha_pagina_publico_frios", "contextos_frios",
+        lambda: {"$and": [
+            {"estado": {"$in": ["FINALIZADO_SEM_VENDA", "AGUARDANDO_PAGAMENTO"]}},
+            {"estado": {"$nin": ["AGUARDANDO_ATENDENTE", "RISCO_DETECTADO"]}, "meta_conversa.ultimo_risco": {"$in": [None, ""]}, "opt_out": {"$ne": True}},
+        ], "tel": {"$gt": "5500000000000"}},
+        ordenacao={"tel": 1}, limite=200,
+    ),
+    FormaConsulta(
+        "campanha_pendentes_outbox", "outbox",
+        lambda: {"campanha_id": "000000000000000000000000", "status": "pendente"},
+    ),
+    FormaConsulta(
+        "kanban_coluna", "kanban_cards",
+        lambda: {"coluna": "entrada"}, ordenacao={"ts": -1, "_id": -1}, limite=51,
+    ),
+    FormaConsulta(
+        "sync_cards_alterados", "kanban_cards",
+        lambda: {"atualizado_em": {"$gte": _agora() - timedelta(minutes=5)}},
+        ordenacao={"atualizado_em": 1, "_id": 1}, limite=501,
+    ),
+    FormaConsulta(
+        "sync_mensagens_conversas_abertas", "respostas_ia",
+        lambda: {"telefone": {"$in": ["5500000000000", "5500000000001"]}, "criado_em": {"$gte": _agora() - timedelta(minutes=5)}},
+        ordenacao={"criado_em": 1, "_id": 1}, limite=501,
+    ),
+    FormaConsulta(
+        "kanban_coluna_pagina_seguinte", "kanban_cards",
+        lambda: {"coluna": "entrada", "$or": [
+            {"ts": {"$lt": _agora()}}, {"ts": _agora(), "_id": {"$lt": "5500000000000"}},
+        ]},
+        ordenacao={"ts": -1, "_id": -1}, limite=51,
+    ),
+    FormaConsulta("kpi_pagos_24h", "contextos", lambda: {"ts": {"$gt": _agora() - timedelta(days=1)}, "estado": "PAGAMENTO_OK"}),
+    FormaConsulta(
+        "historico_legado_por_telefone", "respostas_ia",
+        lambda: {"telefone": "5500000000000"}, ordenacao={"criado_em": -1}, limite=5,
+    ),
+    FormaConsulta(
+        "kanban_risco_ativos", "respostas_ia",
+        lambda: {"risco_detectado": True, "criado_em": {"$gte": _agora() - timedelta(hours=48)}},
+    ),
+    FormaConsulta(
+        "historico_bucket_aberto", "historico_buckets",
+        lambda: {"telefone": "5500000000000", "aberto": True, "n": {"$lt": 50}},
+    ),
+    FormaConsulta(
+        "historico_bucket_recente", "historico_buckets",
+        lambda: {"telefone": "5500000000000"}, ordenacao={"fim": -1}, limite=2,
+    ),
+    FormaConsulta(
+        "agenda_horarios_ocupados", "consultas_agendadas",
+        lambda: {"horario_utc": {"$gte": _agora()}, "status": {"$in": ["agendado", "confirmado"]}},
+        ordenacao={"horario_utc": 1}, limite=500, projecao={"horario_utc": 1, "_id": 0},
+    ),
+    FormaConsulta("pagamento_por_sessao", "pagamentos", lambda: {"id_sessao_stripe": "cs_exemplo"}),
+    FormaConsulta(
+        "retencao_lote_respostas_ia", "respostas_ia",
+        lambda: {"criado_em": {"$lt": _agora() - timedelta(days=90)}}, ordenacao={"criado_em": 1}, limite=500,
+    ),
+    FormaConsulta(
+        "retencao_lote_historico", "historico_buckets",
+        lambda: {"fim": {"$lt": _agora() - timedelta(days=180)}}, ordenacao={"fim": 1}, limite=500,
+    ),
+    FormaConsulta(
+        "eventos_por_telefone", "eventos",
+        lambda: {"telefone": "5500000000000"}, ordenacao={"timestamp": -1}, limite=50,
+    ),
+]
+
+
+def _estagios(plano: Dict[str, Any]) -> List[Dict[str, Any]]:
+    estagios = [plano]
+    for chave in ("inputStage", "queryPlan"):
+        if isinstance(plano.get(chave), dict):
+            estagios += _estagios(plano[chave])
+    for filho in plano.get("inputStages", []):
+        estagios += _estagios(filho)
+    return estagios
+
+
+def analisar_forma(db, forma: FormaConsulta) -> Dict[str, Any]:
+    """explain(executionStats) de uma forma de consulta, resumido."""
+    comando: Dict[str, Any] = {"find": forma.colecao, "filter": forma.filtro()}
+    if forma.ordenacao:
+        comando["sort"] = forma.ordenacao
+    if forma.limite:
+        comando["limit"] = forma.limite
+    if forma.projecao:
+        comando["projection"] = forma.projecao
+    explain = db.command({"explain": comando, "verbosity": "executionStats"})
+    estagios = _estagios(explain.get("queryPlanner", {}).get("winningPlan", {}))
+    nomes = [e.get("stage") for e in estagios]
+    stats = explain.get("executionStats", {})
+    examinados = stats.get("totalDocsExamined", 0)
+    retornados = stats.get("nReturned", 0)
+    problemas = []
+    if "COLLSCAN" in nomes and not forma.varredura_esperada:
+        problemas.append("COLLSCAN")
+    if "SORT" in nomes:
+        problemas.append("SORT_EM_MEMORIA")
+    return {
+        "nome": forma.nome,
+        "colecao": forma.colecao,
+        "indices": sorted({e["indexName"] for e in estagios if e.get("indexName")}),
+        "estagios": nomes,
+        "docs_examinados": examinados,
+        "chaves_examinadas": stats.get("totalKeysExamined", 0),
+        "retornados": retornados,
+        "razao_examinados": round(examinados / retornados, 2) if retornados else (float(examinados) if examinados else 0.0),
+        "tempo_ms": stats.get("executionTimeMillis", 0),
+        "problemas": problemas,
+    }
+
+
+def analisar_formas(formas: Optional[List[FormaConsulta]] = None) -> List[Dict[str, Any]]:
+    db = banco.db_sync()
+    resultados = []
+    for forma in formas or FORMAS_CONSULTA:
+        try:
+            resultados.append(analisar_forma(db, forma))
+        except Exception as e:
+            resultados.append({"nome": forma.nome, "colecao": forma.colecao, "erro": str(e), "problemas": ["ERRO"]})
+    return resultados
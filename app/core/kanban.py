@@ -0,0 +1,327 @@
+# ===========================================================
+# Arquivo: core/kanban.py
+# Quadro Kanban materializado em `kanban_cards` (um card por conversa).
+# - COLUNAS: mapa único estado -> coluna, usado por /kanban e /dashboard/kanban.
+# - salvar_contexto chama `marcar` com o documento em memória: o card é
+#   montado na hora e fica pendente; várias gravações do mesmo turno viram
+#   UM upsert, gravado em lote a cada KANBAN_INTERVALO_S. `parar()` espera
+#   a gravação em voo; lote cancelado volta para os pendentes.
+# - Upsert condicionado a `ts`: um card mais antigo nunca sobrescreve um
+#   mais novo (outro worker); o duplicate key resultante é ignorado.
+# - Cards gravados viram eventos `card` no painel ao vivo (core/painel_ao_vivo.py).
+# - `atualizado_em` (hora da gravação, índice próprio) alimenta o delta
+#   do /dashboard/sync (core/sincronizacao.py). Conversa apagada vira
+#   lápide (`removido`, sem coluna), recolhida pelo TTL de core/retencao.py.
+# - Leitura por coluna, ordenada por ts (índice coluna+ts+_id), paginada
+#   por cursor (`apos`), sem varrer `contextos`.
+# - `reconstruir` refaz os cards a partir de `contextos` em lotes (job
+#   diário sob lease: primeira carga e rede de segurança para escritas
+#   feitas fora do salvar_contexto). Só regrava card com ts mais novo, para
+#   não jogar o quadro inteiro no delta dos dashboards.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter, Gauge
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from app.config import settings
+from app.core import banco, painel_ao_vivo
+
+logger = logging.getLogger("famdomes.kanban")
+
+COLECAO_CARDS = "kanban_cards"
+INTERVALO_S = float(getattr(settings, "KANBAN_INTERVALO_S", 1.0))
+CARDS_POR_COLUNA = int(getattr(settings, "KANBAN_CARDS_POR_COLUNA", 50))
+LOTE_RECONSTRUCAO = int(getattr(settings, "KANBAN_LOTE_RECONSTRUCAO", 1000))
+PRAZO_PARADA_S = float(getattr(settings, "KANBAN_PRAZO_PARADA_S", 15))  # espera pela gravação em voo no shutdown
+
+# (id, título, estados) — ordem das colunas no quadro
+COLUNAS: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("entrada", "Entrada", ("INICIAL", "ACOLHIMENTO_ENVIADO", "IDENTIFICANDO_NECESSIDADE")),
+    ("qualificacao", "Qualificação", ("MICRO_COMPROMISSO", "SUPORTE_FAQ", "IA_RESPONDENDO", "AGUARDANDO_RESPOSTA_QUALIFICACAO")),
+    ("proposta", "Proposta", ("PITCH_PLANO1", "PITCH_PLANO3", "COMERCIAL_DETALHES_PLANO", "EXPLICANDO_CONSULTA")),
+    ("pagamento_pendente", "Pagamento Pendente", ("CALL_TO_ACTION", "AGUARDANDO_PAGAMENTO")),
+    ("triagem", "Triagem Pós-Pgto", ("PAGAMENTO_OK", "TRIAGEM_INICIAL", "COLETANDO_RESPOSTA_QUESTIONARIO")),
+    ("agendado", "Agendado", ("FINALIZANDO_ONBOARDING", "CONFIRMANDO_AGENDAMENTO", "AGUARDANDO_CONSULTA")),
+    ("atendimento_humano", "Atendimento Humano", (
+        "AGUARDANDO_ATENDENTE", "RISCO_DETECTADO", "ATENDIMENTO_EM_ANDAMENTO", "COM_PROFISSIONAL", "ESCALONADO",
+    )),
+    ("followup", "Follow-up", ("RECUSA_PRECO",)),
+    ("concluido", "Concluído/Perdido", ("LEAD_MATERIAL_GRATUITO", "FINALIZADO_SEM_VENDA", "FINALIZADO", "ENCERRADO")),
+]
+COLUNA_PADRAO = "concluido"
+TITULOS: Dict[str, str] = {col_id: titulo for col_id, titulo, _ in COLUNAS}
+COLUNA_DO_ESTADO: Dict[str, str] = {estado: col_id for col_id, _, estados in COLUNAS for estado in estados}
+ESTADOS_HUMANO = {"AGUARDANDO_ATENDENTE", "RISCO_DETECTADO"}
+
+# Campos de `contextos` que o card usa (reconstrução / releitura)
+PROJECAO_CONTEXTO = {
+    "_id": 0, "tel": 1, "nome": 1, "estado": 1, "ts": 1, "criado_em": 1,
+    "ultimo_texto_bot": 1, "ultimo_texto_usuario": 1,
+    "meta_conversa.nome_cliente": 1, "meta_conversa.nome_paciente": 1, "meta_conversa.score_lead": 1,
+    "meta_conversa.ultimo_sentimento_detectado": 1, "meta_conversa.ultimo_risco": 1,
+}
+
+CARDS_GRAVADOS = Counter("domo_kanban_cards_gravados_total", "Cards do Kanban gravados", ["origem"])
+CARDS_PENDENTES = Gauge("domo_kanban_cards_pendentes", "Cards do Kanban aguardando gravação")
+
+
+def coluna_do_estado(estado: Optional[str]) -> str:
+    return COLUNA_DO_ESTADO.get(estado or "INICIAL", COLUNA_PADRAO)
+
+
+def _sentimento(valor: Any) -> Optional[str]:
+    """Sentimento predominante: o dict de scores vira a maior chave; texto passa direto."""
+    if isinstance(valor, dict):
+        return max(valor, key=valor.get) if valor else None
+    return str(valor) if valor else None
+
+
+def montar_card(ctx: Dict[str, Any]) -> Dict[str, Any]:
+    """Card do quadro a partir de um documento de contexto (não altera o documento)."""
+    meta = ctx.get("meta_conversa") or {}
+    if not isinstance(meta, dict):
+        meta = {}
+    estado = ctx.get("estado") or "INICIAL"
+    tel = str(ctx["tel"])
+    return {
+        "_id": tel,
+        "tel": tel,
+        "nome": meta.get("nome_cliente") or meta.get("nome_paciente") or ctx.get("nome"),
+        "estado": estado,
+        "coluna": coluna_do_estado(estado),
+        "ts": ctx.get("ts") or ctx.get("criado_em") or datetime.now(timezone.utc),
+        "snippet": (ctx.get("ultimo_texto_bot") or ctx.get("ultimo_texto_usuario") or "")[:80],
+        "sentimento": _sentimento(meta.get("ultimo_sentimento_detectado")),
+        "score_lead": meta.get("score_lead"),
+        "risco": bool(meta.get("ultimo_risco")),
+        "atendente_humano_necessario": estado in ESTADOS_HUMANO,
+    }
+
+
+def lapide(telefone: str, agora: datetime) -> Dict[str, Any]:
+    """Card de conversa apagada: sai das colunas, mas o delta do dashboard ainda vê a remoção."""
+    return {
+        "_id": telefone, "tel": telefone, "removido": True, "coluna": None,
+        "ts": agora, "atualizado_em": agora, "removido_em": agora,
+    }
+
+
+def _upsert(card: Dict[str, Any], estrito: bool) -> ReplaceOne:
+    # Card existente com ts mais novo (ou igual, se estrito) não casa -> upsert vira duplicate key (ignorado)
+    return ReplaceOne({"_id": card["_id"], "ts": {"$lt" if estrito else "$lte": card["ts"]}}, card, upsert=True)
+
+
+async def _gravar(cards: List[Dict[str, Any]], estrito: bool = False) -> None:
+    agora = datetime.now(timezone.utc)
+    for card in cards:
+        card["atualizado_em"] = agora
+    try:
+        await banco.colecao(COLECAO_CARDS).bulk_write([_upsert(c, estrito) for c in cards], ordered=False)
+    except BulkWriteError as e:
+        outros = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if outros or e.details.get("writeConcernErrors"):
+            raise
+
+
+# ----------------------------------------------------------------------
+class MaterializadorKanban:
+    """Acumula os cards alterados e grava em lote (um upsert por conversa por ciclo)."""
+
+    def __init__(self, intervalo_s: float = INTERVALO_S):
+        self.intervalo_s = intervalo_s
+        self._pendentes: Dict[str, Optional[Dict[str, Any]]] = {}  # None = reler do banco
+        self._task: Optional[asyncio.Task] = None
+        self._acordar: Optional[asyncio.Event] = None
+        self._parando = False
+        self.gravados = 0
+        self.falhas = 0
+
+    def marcar(self, telefone: str, ctx: Optional[Dict[str, Any]] = None) -> None:
+        """Card de `telefone` mudou. Com `ctx` (documento atual) o card sai da memória; sem, é relido."""
+        try:
+            self._pendentes[telefone] = montar_card(ctx) if ctx else None
+        except Exception as e:
+            logger.warning(f"KANBAN: ⚠️ Card de {telefone} não montado da memória ({e}); será relido.")
+            self._pendentes[telefone] = None
+        CARDS_PENDENTES.set(len(self._pendentes))
+        self._garantir_task()
+
+    def descartar(self, telefone: str) -> None:
+        self._pendentes.pop(telefone, None)
+        CARDS_PENDENTES.set(len(self._pendentes))
+
+    async def descarregar(self) -> int:
+        if not self._pendentes:
+            return 0
+        pendentes, self._pendentes = self._pendentes, {}
+        try:
+            reler = [tel for tel, card in pendentes.items() if card is None]
+            if reler:
+                docs = await banco.colecao("contextos").find({"tel": {"$in": reler}}, PROJECAO_CONTEXTO).to_list(None)
+                for doc in docs:
+                    pendentes[doc["tel"]] = montar_card(doc)
+            cards = [card for card in pendentes.values() if card]
+            if cards:
+                await _gravar(cards)
+                painel_ao_vivo.publicar_cards(cards)
+            self.gravados += len(cards)
+            CARDS_GRAVADOS.labels(origem="incremental").inc(len(cards))
+            return len(cards)
+        except asyncio.CancelledError:
+            self._devolver(pendentes)
+            raise
+        except Exception as e:
+            self._devolver(pendentes)
+            self.falhas += 1
+            logger.error(f"KANBAN: ❌ Falha ao gravar {len(pendentes)} card(s): {e}")
+            return 0
+        finally:
+            CARDS_PENDENTES.set(len(self._pendentes))
+
+    def _devolver(self, pendentes: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        """Devolve o que não gravou, sem passar por cima de cards mais novos."""
+        for tel, card in pendentes.items():
+            self._pendentes.setdefault(tel, card)
+
+    def _garantir_task(self) -> None:
+        if self._parando or (self._task is not None and not self._task.done()):
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._acordar = asyncio.Event()
+        self._task = loop.create_task(self._loop())
+
+    async def _loop(self) -> None:
+        while not self._parando:
+            try:
+                await asyncio.wait_for(self._acordar.wait(), timeout=self.intervalo_s)
+            except asyncio.TimeoutError:
+                pass
+            if self._parando:
+                break
+            await self.descarregar()
+
+    async def parar(self, prazo_s: float = PRAZO_PARADA_S) -> None:
+        """Para o ciclo depois da gravação em voo e grava o restante."""
+        self._parando = True
+        if self._task is not None:
+            self._acordar.set()
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=prazo_s)
+            except asyncio.TimeoutError:
+                # Gravação travada: cancela (o lote em voo volta para os pendentes)
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+        try:
+            await self.descarregar()
+            if self._pendentes:
+                logger.error(f"KANBAN: ❌ {len(self._pendentes)} card(s) não gravado(s) no shutdown.")
+        finally:
+            self._parando = False
+
+    def estado(self) -> dict:
+        return {"pendentes": len(self._pendentes), "gravados": self.gravados, "falhas": self.falhas}
+
+
+materializador = MaterializadorKanban()
+
+
+def marcar(telefone: str, ctx: Optional[Dict[str, Any]] = None) -> None:
+    materializador.marcar(telefone, ctx)
+
+
+async def remover(telefone: str) -> None:
+    """Conversa apagada (reset/limpeza): tira o card do quadro (fica a lápide)."""
+    materializador.descartar(telefone)
+    try:
+        await banco.colecao(COLECAO_CARDS).replace_one({"_id": telefone}, lapide(telefone, datetime.now(timezone.utc)), upsert=True)
+        painel_ao_vivo.publicar_card_removido(telefone)
+    except Exception as e:
+        logger.error(f"KANBAN: ❌ Erro ao remover card de {telefone}: {e}")
+
+
+def gravar_sync(telefone: str) -> None:
+    """Refaz o card de uma conversa pelo cliente síncrono (shims *_sync de scripts)."""
+    doc = banco.colecao_sync("contextos").find_one({"tel": telefone}, PROJECAO_CONTEXTO)
+    cards = banco.colecao_sync(COLECAO_CARDS)
+    agora = datetime.now(timezone.utc)
+    card = montar_card(doc) if doc else lapide(telefone, agora)
+    card["atualizado_em"] = agora
+    cards.replace_one({"_id": telefone}, card, upsert=True)
+
+
+async def parar() -> None:
+    """Grava os cards pendentes (shutdown)."""
+    await materializador.parar()
+
+
+# ----------------------------------------------------------------------
+# Leitura
+def _cursor(card: Dict[str, Any]) -> str:
+    return f"{card['ts'].isoformat()}|{card['_id']}"
+
+
+def _filtro_pagina(coluna: str, apos: Optional[str]) -> Dict[str, Any]:
+    filtro: Dict[str, Any] = {"coluna": coluna}
+    if apos:
+        try:
+            ts_txt, tel = apos.rsplit("|", 1)
+            ts = datetime.fromisoformat(ts_txt)
+        except ValueError:
+            raise ValueError(f"Cursor inválido: {apos}")
+        filtro["$or"] = [{"ts": {"$lt": ts}}, {"ts": ts, "_id": {"$lt": tel}}]
+    return filtro
+
+
+async def pagina(coluna: str, limite: int = CARDS_POR_COLUNA, apos: Optional[str] = None) -> Dict[str, Any]:
+    """Cards de uma coluna, mais recentes primeiro. `proximo` é o cursor da página seguinte (ou None)."""
+    if coluna not in TITULOS:
+        raise ValueError(f"Coluna desconhecida: {coluna}")
+    cards_col = banco.colecao(COLECAO_CARDS, "painel")
+    cards, total = await asyncio.gather(
+        cards_col.find(_filtro_pagina(coluna, apos)).sort([("ts", -1), ("_id", -1)]).limit(limite + 1).to_list(limite + 1),
+        cards_col.count_documents({"coluna": coluna}),
+    )
+    proximo = _cursor(cards[limite - 1]) if len(cards) > limite and limite > 0 else None
+    return {"id": coluna, "titulo": TITULOS[coluna], "cards": cards[:limite], "total": total, "proximo": proximo}
+
+
+async def carregar_quadro(limite: int = CARDS_POR_COLUNA) -> List[Dict[str, Any]]:
+    """Primeira página de todas as colunas, na ordem de COLUNAS (uma consulta indexada por coluna)."""
+    return list(await asyncio.gather(*(pagina(col_id, limite) for col_id, _, _ in COLUNAS)))
+
+
+# ----------------------------------------------------------------------
+# Reconstrução
+async def reconstruir() -> Dict[str, Any]:
+    """Refaz os cards das conversas quentes, paginando `contextos` por tel. Card com o mesmo ts fica como está."""
+    inicio = datetime.now(timezone.utc)
+    contextos = banco.colecao("contextos")
+    ultimo: Optional[str] = None
+    total = 0
+    while True:
+        filtro = {"tel": {"$gt": ultimo}} if ultimo is not None else {}
+        docs = await contextos.find(filtro, PROJECAO_CONTEXTO).sort("tel", 1).limit(LOTE_RECONSTRUCAO).to_list(LOTE_RECONSTRUCAO)
+        if not docs:
+            break
+        await _gravar([montar_card(d) for d in docs if d.get("tel")], estrito=True)
+        total += len(docs)
+        ultimo = docs[-1]["tel"]
+        await asyncio.sleep(0)  # não monopoliza o loop entre lotes
+    CARDS_GRAVADOS.labels(origem="reconstrucao").inc(total)
+    duracao = (datetime.now(timezone.utc) - inicio).total_seconds()
+    logger.info(f"KANBAN: ✅ Quadro reconstruído: {total} card(s) em {duracao:.1f}s.")
+    return {"cards": total, "duracao_s": round(duracao, 2)}
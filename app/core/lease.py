@@ -0,0 +1,135 @@
+# ===========================================================
+# Arquivo: core/lease.py
+# Lease distribuído de jobs (vários workers do uvicorn, um scheduler cada).
+# - Um documento por job em `locks_jobs`: {_id: job, dono, expira_em}.
+# - Adquirir = find_one_and_update com upsert só se o lease expirou ou
+#   já é nosso; se outro worker detém, o upsert bate no _id (DuplicateKey).
+# - Enquanto o job roda, um heartbeat renova `expira_em`; se o worker
+#   morre, o lease expira sozinho e o próximo disparo assume.
+# - Lease perdido durante a execução (renovação não encontra o documento
+#   como nosso): o heartbeat cancela o job, para não rodar junto com o
+#   worker que assumiu.
+# - Jobs periódicos retêm o lease por parte do intervalo após terminar,
+#   para os outros workers não repetirem o mesmo ciclo.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.core import banco
+
+logger = logging.getLogger("famdomes.lease")
+
+COLECAO_LOCKS = "locks_jobs"
+LEASE_TTL_S = float(getattr(settings, "LEASE_TTL_S", 60))  # heartbeat a cada TTL/3
+
+# Identifica este processo (host:pid:aleatório)
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def preparar() -> None:
+    """Índice TTL que recolhe leases abandonados (startup síncrono)."""
+    try:
+        banco.colecao_sync(COLECAO_LOCKS).create_index(
+            [("expira_em", ASCENDING)], name="expira_em_ttl_idx", expireAfterSeconds=3600
+        )
+    except Exception as e:
+        logger.warning(f"LEASE: ⚠️ Falha ao criar índice de '{COLECAO_LOCKS}': {e}")
+
+
+async def adquirir(nome: str, ttl_s: float = LEASE_TTL_S) -> bool:
+    agora = datetime.now(timezone.utc)
+    try:
+        doc = await banco.colecao(COLECAO_LOCKS, "duravel").find_one_and_update(
+            {"_id": nome, "$or": [{"expira_em": {"$lt": agora}}, {"dono": WORKER_ID}]},
+            {"$set": {"dono": WORKER_ID, "expira_em": agora + timedelta(seconds=ttl_s), "renovado_em": agora}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return bool(doc and doc.get("dono") == WORKER_ID)
+    except DuplicateKeyError:
+        return False  # outro worker detém o lease
+
+
+async def renovar(nome: str, ttl_s: float = LEASE_TTL_S) -> bool:
+    agora = datetime.now(timezone.utc)
+    resultado = await banco.colecao(COLECAO_LOCKS, "duravel").update_one(
+        {"_id": nome, "dono": WORKER_ID},
+        {"$set": {"expira_em": agora + timedelta(seconds=ttl_s), "renovado_em": agora}},
+    )
+    return resultado.matched_count == 1
+
+
+async def liberar(nome: str, reter_s: float = 0) -> None:
+    """Solta o lease. Com `reter_s`, mantém por mais esse tempo (os outros workers
+    pulam o disparo deste ciclo em vez de repetir o job recém-concluído)."""
+    colecao = banco.colecao(COLECAO_LOCKS, "duravel")
+    try:
+        if reter_s > 0:
+            await colecao.update_one(
+                {"_id": nome, "dono": WORKER_ID},
+                {"$set": {"expira_em": datetime.now(timezone.utc) + timedelta(seconds=reter_s)}},
+            )
+        else:
+            await colecao.delete_one({"_id": nome, "dono": WORKER_ID})
+    except Exception as e:
+        logger.warning(f"LEASE: ⚠️ Falha ao liberar lease '{nome}': {e}")
+
+
+async def _heartbeat(nome: str, ttl_s: float, tarefa: asyncio.Future) -> bool:
+    """Renova o lease enquanto `tarefa` roda. Lease perdido: cancela a tarefa e retorna True."""
+    while True:
+        await asyncio.sleep(ttl_s / 3)
+        try:
+            if not await renovar(nome, ttl_s):
+                logger.error(f"LEASE: ❌ Lease '{nome}' perdido por {WORKER_ID} durante a execução; job cancelado.")
+                tarefa.cancel()
+                return True
+        except Exception as e:
+            logger.warning(f"LEASE: ⚠️ Falha ao renovar lease '{nome}': {e}")
+
+
+async def executar_com_lease(
+    nome: str, job: Callable[[], Awaitable[Any]], ttl_s: float = LEASE_TTL_S, reter_s: float = 0
+) -> Optional[Any]:
+    """Roda `job` só se este worker conseguir o lease `nome`. Retorna None se outro worker
+    detém o lease ou se ele foi perdido durante a execução (o job é cancelado)."""
+    try:
+        if not await adquirir(nome, ttl_s):
+            logger.debug(f"LEASE: Job '{nome}' em execução em outro worker; pulando.")
+            return None
+    except Exception as e:
+        logger.error(f"LEASE: ❌ Não foi possível adquirir lease '{nome}': {e}")
+        return None
+    tarefa = asyncio.ensure_future(job())
+    batimento = asyncio.create_task(_heartbeat(nome, ttl_s, tarefa))
+    try:
+        return await tarefa
+    except asyncio.CancelledError:
+        if batimento.done() and not batimento.cancelled() and batimento.result():
+            return None  # cancelado pelo heartbeat: lease perdido
+        raise
+    finally:
+        batimento.cancel()
+        await liberar(nome, reter_s)
+
+
+def com_lease(nome: str, ttl_s: float = LEASE_TTL_S, reter_s: float = 0):
+    """Decorator para jobs do scheduler: `sched.add_job(com_lease("x")(job), ...)`."""
+    def decorador(job: Callable[[], Awaitable[Any]]):
+        @functools.wraps(job)
+        async def envoltorio():
+            return await executar_com_lease(nome, job, ttl_s, reter_s)
+        return envoltorio
+    return decorador
@@ -0,0 +1,449 @@
+# ===========================================================
+# Arquivo: core/llm.py
+# Cliente compartilhado para a API do Ollama (/api/generate).
+# - Um único httpx.AsyncClient com pool de conexões persistente.
+# - Cache opcional de respostas por chamada (opt-in por call-site):
+#   chave = hash(modelo + opções + formato + prompt), LRU em memória
+#   na frente de uma coleção MongoDB com TTL ('cache_llm').
+# - Respostas personalizadas NÃO devem usar cache (padrão desligado).
+# - Só `response`/`model` vão para o cache; o call-site fica ao lado
+#   (campo `site`), nunca dentro da resposta devolvida ao chamador.
+# - Modo streaming: consome tokens incrementalmente e entrega a
+#   primeira frase/parágrafo antes do fim da geração (só se ainda vier
+#   texto depois dela; resposta curta sai numa mensagem só).
+# - Várias instâncias Ollama: cada requisição passa pelo pool de
+#   backends (core/llm_backends.py), com afinidade opcional por conversa.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+from prometheus_client import Counter
+
+from app.config import settings
+from app.core import banco
+from app.core.llm_backends import PoolBackends, urls_configuradas
+
+logger = logging.getLogger("famdomes.llm")
+
+TIMEOUT_PADRAO_S = float(getattr(settings, "MCP_TIMEOUT_S", 10))
+CACHE_LRU_MAX = int(getattr(settings, "LLM_CACHE_LRU_MAX", 512))
+CACHE_TTL_S = int(getattr(settings, "LLM_CACHE_TTL_S", 7 * 24 * 3600))
+COLECAO_CACHE = "cache_llm"
+STREAM_MIN_CHARS = int(getattr(settings, "LLM_STREAM_MIN_CHARS", 20))
+
+# Fim de frase (. ! ? …) seguido de espaço, ou quebra de parágrafo
+_FIM_TRECHO = re.compile(r"[.!?…](?=\s)|\n\s*\n")
+# Idem, aceitando o fim do texto (stream interrompido)
+_FIM_FRASE = re.compile(r"[.!?…](?=\s|$)|\n\s*\n")
+
+CACHE_CONSULTAS = Counter(
+    "domo_llm_cache_consultas_total",
+    "Consultas ao cache de respostas da IA",
+    ["site", "resultado"],  # resultado: memoria | mongo | miss
+)
+
+class StreamInterrompido(RuntimeError):
+    """O stream falhou depois que o primeiro trecho já tinha sido entregue."""
+
+    def __init__(self, parcial: str, prefixo: str, causa: BaseException):
+        super().__init__(f"stream interrompido após o primeiro trecho: {causa}")
+        self.parcial = parcial
+        self.prefixo = prefixo
+
+
+_cliente: Optional[httpx.AsyncClient] = None
+_pool: Optional[PoolBackends] = None
+_lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _obter_pool() -> PoolBackends:
+    global _pool
+    if _pool is None:
+        _pool = PoolBackends(urls_configuradas())
+        logger.info(f"LLM: Pool com {len(_pool.backends)} backend(s) Ollama.")
+    return _pool
+
+
+def _obter_cliente() -> httpx.AsyncClient:
+    """Cria (uma vez) o cliente HTTP compartilhado com keep-alive."""
+    global _cliente
+    if _cliente is None or _cliente.is_closed:
+        _cliente = httpx.AsyncClient(
+            timeout=TIMEOUT_PADRAO_S,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _cliente
+
+
+async def iniciar_monitor() -> None:
+    """Inicia o health check dos backends Ollama (startup da aplicação)."""
+    _obter_pool().iniciar_health(_obter_cliente)
+
+
+def estado_backends() -> list:
+    """Estado atual de cada backend (saúde, fila, latência EWMA)."""
+    return _obter_pool().estado()
+
+
+async def fechar() -> None:
+    """Para o health check e fecha o cliente HTTP compartilhado (shutdown da aplicação)."""
+    global _cliente
+    if _pool is not None:
+        await _pool.parar_health()
+    if _cliente is not None and not _cliente.is_closed:
+        await _cliente.aclose()
+    _cliente = None
+
+
+# ----------------------------------------------------------------------
+# Cache
+def chave_cache(modelo: str, prompt: str, opcoes: Optional[Dict[str, Any]] = None, formato: Optional[str] = None) -> str:
+    """Fingerprint estável de uma chamada (modelo + opções + formato + prompt)."""
+    base = json.dumps(
+        {"model": modelo, "options": opcoes or {}, "format": formato, "prompt": prompt},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+
+def _colecao_cache():
+    # Índices (TTL em expira_em, site) na migração 19 de core/indices.py
+    return banco.colecao(COLECAO_CACHE)
+
+
+def _lru_get(chave: str) -> Dict[str, Any] | None:
+    item = _lru.get(chave)
+    if item is None:
+        return None
+    if item["expira_em"] <= datetime.now(timezone.utc):
+        _lru.pop(chave, None)
+        return None
+    _lru.move_to_end(chave)
+    return dict(item["resposta"])
+
+
+def _lru_put(chave: str, site: str, resposta: Dict[str, Any], expira_em: datetime) -> None:
+    _lru[chave] = {"resposta": resposta, "site": site, "expira_em": expira_em}
+    _lru.move_to_end(chave)
+    while len(_lru) > CACHE_LRU_MAX:
+        _lru.popitem(last=False)
+
+
+async def _mongo_get(chave: str) -> Dict[str, Any] | None:
+    return await _colecao_cache().find_one({"_id": chave, "expira_em": {"$gt": datetime.now(timezone.utc)}})
+
+
+async def _mongo_put(chave: str, site: str, resposta: Dict[str, Any], expira_em: datetime) -> None:
+    await _colecao_cache().update_one(
+        {"_id": chave},
+        {"$set": {"site": site, "resposta": resposta, "criado_em": datetime.now(timezone.utc), "expira_em": expira_em}},
+        upsert=True,
+    )
+
+
+async def _cache_buscar(chave: str, site: str) -> Dict[str, Any] | None:
+    resposta = _lru_get(chave)
+    if resposta is not None:
+        CACHE_CONSULTAS.labels(site=site, resultado="memoria").inc()
+        return resposta
+    try:
+        doc = await _mongo_get(chave)
+    except Exception as e:
+        logger.warning(f"LLM: Falha ao consultar cache no MongoDB: {e}")
+        doc = None
+    if doc:
+        CACHE_CONSULTAS.labels(site=site, resultado="mongo").inc()
+        expira_em = doc["expira_em"]
+        if expira_em.tzinfo is None:
+            expira_em = expira_em.replace(tzinfo=timezone.utc)
+        resposta = doc["resposta"]
+        _lru_put(chave, site, resposta, expira_em)
+        return dict(resposta)
+    CACHE_CONSULTAS.labels(site=site, resultado="miss").inc()
+    return None
+
+
+async def _cache_salvar(chave: str, site: str, resposta: Dict[str, Any], ttl_s: int) -> None:
+    expira_em = datetime.now(timezone.utc) + timedelta(seconds=ttl_s)
+    _lru_put(chave, site, resposta, expira_em)
+    try:
+        await _mongo_put(chave, site, resposta, expira_em)
+    except Exception as e:
+        logger.warning(f"LLM: Falha ao gravar cache no MongoDB: {e}")
+
+
+async def consultar_cache(
+    prompt: str,
+    *,
+    site: str,
+    modelo: Optional[str] = None,
+    opcoes: Optional[Dict[str, Any]] = None,
+    formato: Optional[str] = None,
+) -> Dict[str, Any] | None:
+    """Consulta o cache para o prompt informado (mesma chave usada por `gerar`)."""
+    return await _cache_buscar(chave_cache(modelo or settings.OLLAMA_MODEL, prompt, opcoes, formato), site)
+
+
+async def gravar_cache(
+    prompt: str,
+    texto_resposta: str,
+    *,
+    site: str,
+    modelo: Optional[str] = None,
+    opcoes: Optional[Dict[str, Any]] = None,
+    formato: Optional[str] = None,
+    ttl_s: Optional[int] = None,
+) -> None:
+    """Grava no cache uma resposta obtida por outro caminho (ex: lote de classificação)."""
+    modelo = modelo or settings.OLLAMA_MODEL
+    chave = chave_cache(modelo, prompt, opcoes, formato)
+    await _cache_salvar(chave, site, {"response": texto_resposta, "model": modelo}, ttl_s or CACHE_TTL_S)
+
+
+def estatisticas_cache() -> Dict[str, Any]:
+    """Hits/misses agregados por call-site e taxa de acerto."""
+    por_site: Dict[str, Dict[str, float]] = {}
+    for metrica in CACHE_CONSULTAS.collect():
+        for amostra in metrica.samples:
+            if not amostra.name.endswith("_total"):
+                continue
+            site = amostra.labels["site"]
+            por_site.setdefault(site, {"memoria": 0, "mongo": 0, "miss": 0})[amostra.labels["resultado"]] = amostra.value
+    for valores in por_site.values():
+        total = valores["memoria"] + valores["mongo"] + valores["miss"]
+        valores["taxa_acerto"] = round((valores["memoria"] + valores["mongo"]) / total, 4) if total else 0.0
+    return {"lru_itens": len(_lru), "sites": por_site}
+
+
+async def purgar_cache(site: Optional[str] = None) -> int:
+    """Remove entradas do cache (todas ou de um call-site). Retorna removidas no MongoDB.
+    Roda no event loop, como todo acesso ao LRU (que não é thread-safe)."""
+    if site is None:
+        _lru.clear()
+    else:
+        for chave in [k for k, v in _lru.items() if v["site"] == site]:
+            _lru.pop(chave, None)
+    filtro = {"site": site} if site else {}
+    removidos = (await _colecao_cache().delete_many(filtro)).deleted_count
+    logger.info(f"LLM: Cache purgado (site={site or 'todos'}). {removidos} entrada(s) removida(s).")
+    return removidos
+
+
+# ----------------------------------------------------------------------
+async def gerar(
+    prompt: str,
+    *,
+    modelo: Optional[str] = None,
+    opcoes: Optional[Dict[str, Any]] = None,
+    formato: Optional[str] = None,
+    timeout: Optional[float] = None,
+    cache: bool = False,
+    site: str = "geral",
+    cache_ttl_s: Optional[int] = None,
+    afinidade: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Chama /api/generate (sem streaming) e retorna o JSON do Ollama.
+    Levanta as exceções do httpx para o chamador tratar.
+
+    Args:
+        cache: Ativa o cache de respostas para esta chamada. Use apenas
+               quando o prompt não contém dados pessoais do usuário.
+        site: Identificador do call-site (métricas e purga seletiva).
+        afinidade: Chave da conversa (ex: telefone) para fixar o backend
+                   quando LLM_KV_STICKY estiver ligado.
+    """
+    modelo = modelo or settings.OLLAMA_MODEL
+    chave = None
+    if cache:
+        chave = chave_cache(modelo, prompt, opcoes, formato)
+        em_cache = await _cache_buscar(chave, site)
+        if em_cache is not None:
+            return em_cache
+
+    pool = _obter_pool()
+    tentativas = 2 if len(pool.backends) > 1 else 1
+    falhou = None
+    for tentativa in range(tentativas):
+        try:
+            async with pool.usar(afinidade, evitar=falhou) as backend:
+                resp = await _obter_cliente().post(
+                    f"{backend.url}/api/generate",
+                    json=_corpo(prompt, modelo, opcoes, formato, stream=False),
+                    timeout=timeout if timeout is not None else TIMEOUT_PADRAO_S,
+                )
+                resp.raise_for_status()
+                dados = resp.json()
+            break
+        except httpx.TransportError as e:
+            # Falha de conexão: tenta uma vez em outro backend
+            if tentativa + 1 >= tentativas:
+                raise
+            logger.warning(f"LLM: Backend {backend.url} falhou ({e}). Tentando outro backend.")
+            falhou = backend
+
+    if cache and chave and dados.get("response"):
+        # Guarda só o necessário (sem o vetor 'context' do Ollama)
+        enxuto = {"response": dados.get("response"), "model": dados.get("model")}
+        await _cache_salvar(chave, site, enxuto, cache_ttl_s or CACHE_TTL_S)
+    return dados
+
+
+# ----------------------------------------------------------------------
+# Streaming
+def _corpo(prompt: str, modelo: str, opcoes, formato, stream: bool) -> Dict[str, Any]:
+    body: Dict[str, Any] = {"model": modelo, "prompt": prompt, "stream": stream}
+    if opcoes:
+        body["options"] = opcoes
+    if formato:
+        body["format"] = formato
+    return body
+
+
+async def gerar_stream(
+    prompt: str,
+    *,
+    modelo: Optional[str] = None,
+    opcoes: Optional[Dict[str, Any]] = None,
+    formato: Optional[str] = None,
+    timeout: Optional[float] = None,
+    afinidade: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Chama /api/generate com stream=True e devolve os fragmentos de texto
+    conforme o Ollama os produz (NDJSON, uma linha por fragmento).
+    Falha de conexão antes do primeiro fragmento troca de backend (como `gerar`).
+    Levanta as exceções do httpx para o chamador tratar.
+    """
+    modelo = modelo or settings.OLLAMA_MODEL
+    pool = _obter_pool()
+    tentativas = 2 if len(pool.backends) > 1 else 1
+    falhou = None
+    for tentativa in range(tentativas):
+        produziu = False
+        try:
+            async with pool.usar(afinidade, evitar=falhou) as backend, _obter_cliente().stream(
+                "POST",
+                f"{backend.url}/api/generate",
+                json=_corpo(prompt, modelo, opcoes, formato, stream=True),
+                timeout=timeout if timeout is not None else TIMEOUT_PADRAO_S,
+            ) as resp:
+                if resp.is_error:
+                    await resp.aread()  # corpo disponível para quem tratar o HTTPStatusError
+                resp.raise_for_status()
+                async for linha in resp.aiter_lines():
+                    if not linha.strip():
+                        continue
+                    try:
+                        parte = json.loads(linha)
+                    except json.JSONDecodeError:
+                        logger.warning(f"LLM: Linha de stream inválida ignorada: {linha[:80]}")
+                        continue
+                    if parte.get("error"):
+                        raise RuntimeError(f"Ollama: {parte['error']}")
+                    if parte.get("response"):
+                        produziu = True
+                        yield parte["response"]
+                    if parte.get("done"):
+                        break
+            return
+        except httpx.TransportError as e:
+            # Falha de conexão antes do primeiro fragmento: tenta uma vez em outro backend
+            if produziu or tentativa + 1 >= tentativas:
+                raise
+            logger.warning(f"LLM: Backend {backend.url} falhou no stream ({e}). Tentando outro backend.")
+            falhou = backend
+
+
+def primeiro_trecho(texto: str, min_chars: int = STREAM_MIN_CHARS) -> int:
+    """
+    Posição final da primeira frase/parágrafo completo em `texto`, ou 0.
+    Nunca corta dentro de um bloco JSON/código (ex: JSON de metadados no final).
+    """
+    for m in _FIM_TRECHO.finditer(texto):
+        fim = m.end()
+        if fim < min_chars:
+            continue
+        if "{" in texto[:fim] or "```" in texto[:fim]:
+            return 0
+        return fim
+    return 0
+
+
+def ultimo_fim_frase(texto: str) -> int:
+    """Posição final da última frase completa em `texto` (0 se nenhuma ou se houver bloco JSON/código)."""
+    fim = 0
+    for m in _FIM_FRASE.finditer(texto):
+        fim = m.end()
+    if "{" in texto[:fim] or "```" in texto[:fim]:
+        return 0
+    return fim
+
+
+async def _aguardar_entrega(entrega: Optional[asyncio.Task], prefixo: str) -> str:
+    """Prefixo efetivamente entregue ("" se não houve entrega ou se ela falhou)."""
+    if entrega is None:
+        return ""
+    try:
+        if await entrega is False:
+            return ""
+    except Exception as e:
+        logger.warning(f"LLM: Falha ao entregar o primeiro trecho: {e}")
+        return ""
+    return prefixo
+
+
+async def gerar_texto_stream(prompt: str, **kwargs: Any) -> str:
+    """Consome `gerar_stream` inteiro e devolve o texto completo (ex: resposta com JSON no final)."""
+    return "".join([fragmento async for fragmento in gerar_stream(prompt, **kwargs)])
+
+
+async def gerar_com_envio_antecipado(
+    prompt: str,
+    ao_primeiro_trecho: Callable[[str], Awaitable[Any]],
+    *,
+    modelo: Optional[str] = None,
+    opcoes: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = None,
+    afinidade: Optional[str] = None,
+) -> Tuple[str, str]:
+    """
+    Gera em streaming e chama `ao_primeiro_trecho` com a primeira frase ou
+    parágrafo completo assim que chega mais texto depois dele (a geração
+    ainda está rodando). A entrega roda em paralelo ao consumo do stream.
+    Se o callback retornar False ou levantar exceção, nada é considerado entregue.
+    Se o stream falhar depois de uma entrega, levanta StreamInterrompido
+    com o texto parcial e o prefixo entregue.
+
+    Returns:
+        (texto_completo, prefixo_entregue) — o restante é texto_completo[len(prefixo):].
+    """
+    buffer = ""
+    candidato = 0  # fim do primeiro trecho, esperando prova de que a geração continua
+    prefixo = ""
+    entrega: Optional[asyncio.Task] = None
+    try:
+        async for fragmento in gerar_stream(prompt, modelo=modelo, opcoes=opcoes, timeout=timeout, afinidade=afinidade):
+            if candidato and entrega is None:
+                prefixo = buffer[:candidato]
+                entrega = asyncio.create_task(ao_primeiro_trecho(prefixo.strip()))
+            buffer += fragmento
+            if not candidato:
+                candidato = primeiro_trecho(buffer)
+    except Exception as e:
+        prefixo = await _aguardar_entrega(entrega, prefixo)
+        if prefixo:
+            raise StreamInterrompido(buffer, prefixo, e) from e
+        raise
+    return buffer, await _aguardar_entrega(entrega, prefixo)
@@ -0,0 +1,212 @@
+# ===========================================================
+# Arquivo: core/llm_backends.py
+# Pool de instâncias Ollama com balanceamento de carga.
+# - Backends de OLLAMA_API_URLS (separados por vírgula) ou, na falta,
+#   do OLLAMA_API_URL único.
+# - Roteamento: menor nº de requisições pendentes ponderado pela
+#   latência observada (EWMA).
+# - Health check ativo (GET /api/tags): ejeta após falhas seguidas e
+#   readmite após sondas OK. Falhas de requisição também contam.
+# - Afinidade por conversa (rendezvous hashing) quando LLM_KV_STICKY
+#   está ligado, para reaproveitar o contexto/KV cache do backend.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+from prometheus_client import Counter, Gauge
+
+from app.config import settings
+
+logger = logging.getLogger("famdomes.llm_backends")
+
+EWMA_ALFA = 0.3
+LATENCIA_INICIAL_S = 1.0
+MAX_FALHAS = int(getattr(settings, "LLM_BACKEND_MAX_FALHAS", 3))
+SONDAS_READMISSAO = int(getattr(settings, "LLM_BACKEND_SONDAS_READMISSAO", 2))
+INTERVALO_HEALTH_S = float(getattr(settings, "LLM_HEALTH_INTERVALO_S", 10))
+TIMEOUT_HEALTH_S = float(getattr(settings, "LLM_HEALTH_TIMEOUT_S", 2))
+KV_STICKY = str(getattr(settings, "LLM_KV_STICKY", "false")).lower() in ("1", "true", "sim", "yes")
+# Afinidade é abandonada se o backend preferido estiver com fila maior que isto
+STICKY_MAX_PENDENTES = int(getattr(settings, "LLM_STICKY_MAX_PENDENTES", 4))
+
+BACKEND_PENDENTES = Gauge("domo_llm_backend_pendentes", "Requisições em andamento por backend Ollama", ["backend"])
+BACKEND_SAUDAVEL = Gauge("domo_llm_backend_saudavel", "1 se o backend Ollama está no pool", ["backend"])
+BACKEND_REQUISICOES = Counter(
+    "domo_llm_backend_requisicoes_total",
+    "Requisições ao Ollama por backend",
+    ["backend", "resultado"],  # resultado: ok | erro
+)
+
+
+class Backend:
+    """Estado observado de uma instância Ollama."""
+
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip("/")
+        self.pendentes = 0
+        self.latencia_ewma = LATENCIA_INICIAL_S
+        self.saudavel = True
+        self.falhas_seguidas = 0
+        self.sondas_ok = 0
+        BACKEND_SAUDAVEL.labels(backend=self.url).set(1)
+        BACKEND_PENDENTES.labels(backend=self.url).set(0)
+
+    def custo(self) -> float:
+        return (self.pendentes + 1) * self.latencia_ewma
+
+    def registrar_sucesso(self, duracao_s: float) -> None:
+        self.latencia_ewma = EWMA_ALFA * duracao_s + (1 - EWMA_ALFA) * self.latencia_ewma
+        self.falhas_seguidas = 0
+        BACKEND_REQUISICOES.labels(backend=self.url, resultado="ok").inc()
+
+    def registrar_falha(self) -> None:
+        self.falhas_seguidas += 1
+        BACKEND_REQUISICOES.labels(backend=self.url, resultado="erro").inc()
+        if self.saudavel and self.falhas_seguidas >= MAX_FALHAS:
+            self.ejetar()
+
+    def ejetar(self) -> None:
+        self.saudavel = False
+        self.sondas_ok = 0
+        BACKEND_SAUDAVEL.labels(backend=self.url).set(0)
+        logger.warning(f"LLM_BACKENDS: ❌ Backend {self.url} ejetado após {self.falhas_seguidas} falha(s).")
+
+    def readmitir(self) -> None:
+        self.saudavel = True
+        self.falhas_seguidas = 0
+        BACKEND_SAUDAVEL.labels(backend=self.url).set(1)
+        logger.info(f"LLM_BACKENDS: ✅ Backend {self.url} readmitido no pool.")
+
+    def estado(self) -> Dict[str, object]:
+        return {
+            "url": self.url,
+            "saudavel": self.saudavel,
+            "pendentes": self.pendentes,
+            "latencia_ewma_s": round(self.latencia_ewma, 4),
+            "falhas_seguidas": self.falhas_seguidas,
+        }
+
+
+class PoolBackends:
+    """
+    Seleciona o backend de cada requisição e mantém o health check.
+
+    Args:
+        urls: URLs base dos backends (ex: ["http://10.0.0.1:11434", ...]).
+        sticky: Ativa afinidade por conversa (padrão: LLM_KV_STICKY).
+    """
+
+    def __init__(self, urls: List[str], *, sticky: bool = KV_STICKY) -> None:
+        if not urls:
+            raise ValueError("Pool de backends Ollama vazio.")
+        self.backends = [Backend(u) for u in dict.fromkeys(u.rstrip("/") for u in urls)]
+        self.sticky = sticky
+        self._task_health: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------
+    def _candidatos(self, evitar: Optional[Backend] = None) -> List[Backend]:
+        saudaveis = [b for b in self.backends if b.saudavel and b is not evitar]
+        # Fail-open: com todos ejetados, tenta qualquer um em vez de falhar direto
+        return saudaveis or [b for b in self.backends if b is not evitar] or self.backends
+
+    @staticmethod
+    def _peso_rendezvous(afinidade: str, backend: Backend) -> int:
+        return int(hashlib.sha1(f"{afinidade}|{backend.url}".encode("utf-8")).hexdigest()[:16], 16)
+
+    def escolher(self, afinidade: Optional[str] = None, evitar: Optional[Backend] = None) -> Backend:
+        candidatos = self._candidatos(evitar)
+        if self.sticky and afinidade:
+            preferido = max(candidatos, key=lambda b: self._peso_rendezvous(afinidade, b))
+            if preferido.pendentes <= STICKY_MAX_PENDENTES:
+                return preferido
+        menor = min(b.custo() for b in candidatos)
+        return random.choice([b for b in candidatos if b.custo() == menor])
+
+    @asynccontextmanager
+    async def usar(self, afinidade: Optional[str] = None, evitar: Optional[Backend] = None) -> AsyncIterator[Backend]:
+        """Reserva um backend durante a requisição e registra latência/falha."""
+        backend = self.escolher(afinidade, evitar)
+        backend.pendentes += 1
+        BACKEND_PENDENTES.labels(backend=backend.url).set(backend.pendentes)
+        inicio = time.monotonic()
+        try:
+            yield backend
+        except (httpx.TransportError, httpx.HTTPStatusError) as exc:
+            # 4xx é erro do pedido, não do backend
+            if not (isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code < 500):
+                backend.registrar_falha()
+            raise
+        else:
+            backend.registrar_sucesso(time.monotonic() - inicio)
+        finally:
+            backend.pendentes -= 1
+            BACKEND_PENDENTES.labels(backend=backend.url).set(backend.pendentes)
+
+    # ------------------------------------------------------
+    async def sondar(self, cliente: httpx.AsyncClient) -> None:
+        """Uma rodada de health check em todos os backends."""
+        async def _sonda(backend: Backend) -> None:
+            try:
+                resp = await cliente.get(f"{backend.url}/api/tags", timeout=TIMEOUT_HEALTH_S)
+                ok = resp.status_code == 200
+            except Exception:
+                ok = False
+            if ok:
+                if backend.saudavel:
+                    backend.falhas_seguidas = 0
+                else:
+                    backend.sondas_ok += 1
+                    if backend.sondas_ok >= SONDAS_READMISSAO:
+                        backend.readmitir()
+            else:
+                backend.sondas_ok = 0
+                backend.falhas_seguidas += 1
+                if backend.saudavel and backend.falhas_seguidas >= MAX_FALHAS:
+                    backend.ejetar()
+
+        await asyncio.gather(*(_sonda(b) for b in self.backends))
+
+    def iniciar_health(self, cliente_factory, intervalo_s: float = INTERVALO_HEALTH_S) -> None:
+        """Inicia o loop de health check (idempotente). `cliente_factory` devolve o httpx.AsyncClient."""
+        if self._task_health is not None and not self._task_health.done():
+            return
+
+        async def _loop() -> None:
+            while True:
+                try:
+                    await self.sondar(cliente_factory())
+                except Exception as e:
+                    logger.error(f"LLM_BACKENDS: Erro no health check: {e}")
+                await asyncio.sleep(intervalo_s)
+
+        self._task_health = asyncio.get_running_loop().create_task(_loop())
+        logger.info(f"LLM_BACKENDS: Health check iniciado para {len(self.backends)} backend(s) a cada {intervalo_s}s.")
+
+    async def parar_health(self) -> None:
+        if self._task_health is not None:
+            self._task_health.cancel()
+            try:
+                await self._task_health
+            except asyncio.CancelledError:
+                pass
+            self._task_health = None
+
+    def estado(self) -> List[Dict[str, object]]:
+        return [b.estado() for b in self.backends]
+
+
+def urls_configuradas() -> List[str]:
+    """Lê OLLAMA_API_URLS (vírgula) com fallback para OLLAMA_API_URL."""
+    lista = getattr(settings, "OLLAMA_API_URLS", None)
+    if isinstance(lista, str):
+        lista = [u.strip() for u in lista.split(",")]
+    urls = [str(u) for u in (lista or []) if u]
+    return urls or [str(settings.OLLAMA_API_URL)]
@@ -0,0 +1,174 @@
+# ===========================================================
+# Arquivo: core/llm_lote.py
+# Micro-batching online de chamadas de classificação ao Ollama.
+# - Junta requisições concorrentes (sentimento, intenção) por uma
+#   janela curta (ms) ou até o tamanho máximo do lote.
+# - Envia UM prompt estruturado com vários itens (format=json) e
+#   distribui o resultado de volta para cada chamador.
+# - Se o lote falhar ou vier inconsistente, cai para chamadas
+#   individuais em paralelo no cliente HTTP compartilhado; itens vazios
+#   de um lote válido são refeitos individualmente.
+# - Só respostas de chamadas individuais vão para o cache: a chave é a
+#   do prompt individual, e a resposta de um lote veio de outro prompt.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from prometheus_client import Histogram
+
+from app.config import settings
+from app.core import llm
+
+logger = logging.getLogger("famdomes.llm_lote")
+
+JANELA_MS = float(getattr(settings, "LLM_LOTE_JANELA_MS", 15))
+TAMANHO_MAX = int(getattr(settings, "LLM_LOTE_TAMANHO_MAX", 16))
+
+LOTE_TAMANHO = Histogram(
+    "domo_llm_lote_tamanho",
+    "Itens por lote de classificação enviado ao Ollama",
+    ["lote"],
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+LOTE_LATENCIA = Histogram(
+    "domo_llm_lote_latencia_segundos",
+    "Latência por item (espera na janela + chamada) por faixa de tamanho do lote",
+    ["lote", "faixa_tamanho"],
+)
+
+
+def _faixa(n: int) -> str:
+    if n <= 1:
+        return "1"
+    if n <= 4:
+        return "2-4"
+    if n <= 8:
+        return "5-8"
+    return "9+"
+
+
+@dataclass
+class _Item:
+    texto: str
+    futuro: asyncio.Future
+    inicio: float = field(default_factory=time.monotonic)
+
+
+class LoteClassificacao:
+    """
+    Estágio de batching para um tipo de classificação.
+
+    Args:
+        nome: Identificador (métricas, logs e call-site do cache).
+        prompt_item: Monta o prompt individual de um texto (mesmo das chamadas avulsas).
+        prompt_lote: Monta o prompt com vários textos numerados.
+        interpretar_lote: Converte a resposta do lote em uma lista de respostas
+                          individuais (no mesmo formato de texto da chamada avulsa),
+                          ou None se a resposta for inválida.
+    """
+
+    def __init__(
+        self,
+        nome: str,
+        *,
+        prompt_item: Callable[[str], str],
+        prompt_lote: Callable[[List[str]], str],
+        interpretar_lote: Callable[[str, int], Optional[List[Optional[str]]]],
+        janela_ms: float = JANELA_MS,
+        tamanho_max: int = TAMANHO_MAX,
+    ) -> None:
+        self.nome = nome
+        self.prompt_item = prompt_item
+        self.prompt_lote = prompt_lote
+        self.interpretar_lote = interpretar_lote
+        self.janela_s = max(0.0, janela_ms) / 1000
+        self.tamanho_max = max(1, tamanho_max)
+        self._pendentes: List[_Item] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    # ------------------------------------------------------
+    async def classificar(self, texto: str, *, usar_cache: bool = False) -> str | None:
+        """Enfileira o texto no lote atual e aguarda a resposta bruta do modelo."""
+        prompt = self.prompt_item(texto)
+        if usar_cache:
+            em_cache = await llm.consultar_cache(prompt, site=self.nome)
+            if em_cache is not None:
+                return em_cache.get("response")
+
+        if self.janela_s == 0 or self.tamanho_max == 1:
+            resposta = await self._individual(texto)
+        else:
+            loop = asyncio.get_running_loop()
+            item = _Item(texto=texto, futuro=loop.create_future())
+            self._pendentes.append(item)
+            if len(self._pendentes) >= self.tamanho_max:
+                self._despachar_agora()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.janela_s, self._despachar_agora)
+            resposta, individual = await item.futuro
+            usar_cache = usar_cache and individual
+
+        if usar_cache and resposta:
+            await llm.gravar_cache(prompt, resposta, site=self.nome)
+        return resposta
+
+    # ------------------------------------------------------
+    def _despachar_agora(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        itens, self._pendentes = self._pendentes, []
+        if itens:
+            asyncio.get_running_loop().create_task(self._processar(itens))
+
+    async def _individual(self, texto: str) -> str | None:
+        try:
+            dados = await llm.gerar(self.prompt_item(texto), timeout=settings.MCP_TIMEOUT_S, site=self.nome)
+            return dados.get("response")
+        except Exception as exc:
+            logger.warning(f"LLM_LOTE[{self.nome}]: ❌ Chamada individual falhou: {exc}")
+            return None
+
+    async def _processar(self, itens: List[_Item]) -> None:
+        n = len(itens)
+        textos = [i.texto for i in itens]
+        resultados: Optional[List[Optional[str]]] = None
+        individuais = [True] * n  # False: resposta veio do prompt de lote
+        try:
+            if n == 1:
+                resultados = [await self._individual(textos[0])]
+            else:
+                try:
+                    dados = await llm.gerar(
+                        self.prompt_lote(textos), formato="json",
+                        timeout=settings.MCP_TIMEOUT_S * 2, site=self.nome,
+                    )
+                    resultados = self.interpretar_lote(dados.get("response") or "", n)
+                except Exception as exc:
+                    logger.warning(f"LLM_LOTE[{self.nome}]: ❌ Lote de {n} falhou: {exc}")
+                if resultados is None or len(resultados) != n:
+                    logger.info(f"LLM_LOTE[{self.nome}]: Lote de {n} inválido. Usando chamadas individuais em paralelo.")
+                    resultados = list(await asyncio.gather(*(self._individual(t) for t in textos)))
+                else:
+                    individuais = [False] * n
+                    vazios = [i for i, r in enumerate(resultados) if not r]
+                    if vazios:
+                        refeitos = await asyncio.gather(*(self._individual(textos[i]) for i in vazios))
+                        for i, resultado in zip(vazios, refeitos):
+                            resultados[i], individuais[i] = resultado, True
+        except Exception as exc:  # pragma: no cover
+            logger.exception(f"LLM_LOTE[{self.nome}]: Erro inesperado no lote: {exc}")
+            resultados = [None] * n
+        finally:
+            LOTE_TAMANHO.labels(lote=self.nome).observe(n)
+            agora = time.monotonic()
+            faixa = _faixa(n)
+            for item, resultado, individual in zip(itens, resultados or [None] * n, individuais):
+                LOTE_LATENCIA.labels(lote=self.nome, faixa_tamanho=faixa).observe(agora - item.inicio)
+                if not item.futuro.done():
+                    item.futuro.set_result((resultado, individual))
@@ -7,6 +7,8 @@
 # • Chamada de agente com mensagem original
 # • Tratamento de erro mais robusto
 # • CORRIGIDO: Chamada para salvar_contexto com argumento 'estado' correto.
+# • Contexto gravado no MongoDB ao fim de cada turno (cache write-behind)
+# • Avisos de erro enfileirados no outbox (mesma ordem por telefone das respostas)
 # ===========================================================
 from __future__ import annotations
 import logging
@@ -17,9 +19,9 @@ from typing import Dict, Type, Any
 from app.core.ia_analisador import detectar_intencao, analisar_sentimento
 from app.core.intents import buscar_por_trigger, obter_intent
 from app.core.scoring import score_lead
-from app.utils.contexto import obter_contexto, salvar_contexto
+from app.utils.contexto import obter_contexto, salvar_contexto, descarregar_contexto
 from app.core.rastreamento import registrar_evento
-from app.utils.mensageria import enviar_mensagem # Para fallback de erro
+from app.core.outbox import remetente as remetente_outbox # Avisos de erro também saem pelo outbox
 
 # Classe base do agente
 from app.agents.agente_base import AgenteBase
@@ -128,14 +130,21 @@ class MCPOrquestrador:
         """
         Processa uma mensagem recebida, determina a intenção,
         analisa o sentimento, seleciona e executa o agente apropriado.
+        Ao final do turno grava o contexto acumulado em memória.
         """
+        try:
+            await self._processar_turno(tel, texto)
+        finally:
+            await descarregar_contexto(tel)
+
+    async def _processar_turno(self, tel: str, texto: str) -> None:
         logger.info(f"MCP ▶ Iniciando processamento para tel={tel}, texto='{texto[:50]}...'")
-        ctx = obter_contexto(tel)
+        ctx = await obter_contexto(tel)
         # Garante que ctx seja um dicionário antes de prosseguir
         if not isinstance(ctx, dict):
              logger.error(f"MCP: Falha ao obter contexto válido para {tel}. Abortando processamento.")
              # Tentar enviar mensagem de erro genérica
-             await enviar_mensagem(tel, "Desculpe, ocorreu um erro ao carregar sua conversa. Tente novamente.")
+             await remetente_outbox.enfileirar(tel, "Desculpe, ocorreu um erro ao carregar sua conversa. Tente novamente.", agente="MCP")
              return
 
         estado_anterior = ctx.get("estado", "INICIAL")
@@ -212,7 +221,7 @@ class MCPOrquestrador:
 
         # --- 6. Salvar Contexto Intermediário (Importante!) ---
         # Salva o estado ANTES da execução do agente, incluindo a intent detectada e meta atualizada
-        sucesso_save_interm = salvar_contexto(
+        sucesso_save_interm = await salvar_contexto(
             telefone=tel,
             texto_usuario=texto,
             # CORREÇÃO: Usar o argumento 'estado' para salvar o estado ANTERIOR aqui
@@ -225,7 +234,7 @@ class MCPOrquestrador:
              logger.error(f"MCP: Falha ao salvar contexto intermediário para {tel}. Risco de inconsistência.")
              # Considerar abortar ou logar criticamente
         else:
-            registrar_evento(tel, etapa="analise_concluida", dados={"intent": intent, "score": score_atual, "sentimento": sentimento_atual, "estado_anterior": estado_anterior})
+            await registrar_evento(tel, etapa="analise_concluida", dados={"intent": intent, "score": score_atual, "sentimento": sentimento_atual, "estado_anterior": estado_anterior})
 
         # --- 7. Executar Agente ---
         # Passa a intent detectada e o sentimento atualizado para o agente
@@ -276,8 +285,8 @@ class MCPOrquestrador:
 
         if not agente_cls:
             logger.error(f"MCP: Não foi possível resolver um agente para a intent '{intent}'. Nenhuma resposta será enviada.")
-            registrar_evento(tel, etapa="erro_resolucao_agente", dados={"intent": intent})
-            await enviar_mensagem(tel, "Desculpe, tive um problema interno para processar sua solicitação.")
+            await registrar_evento(tel, etapa="erro_resolucao_agente", dados={"intent": intent})
+            await remetente_outbox.enfileirar(tel, "Desculpe, tive um problema interno para processar sua solicitação.", agente="MCP", intent=intent)
             return
 
         agente_nome = agente_cls.__name__
@@ -287,14 +296,17 @@ class MCPOrquestrador:
 
         try:
             # Executa o agente
-            await agente.executar(tel, texto_usuario)
+            if not await agente.executar(tel, texto_usuario):
+                logger.error(f"MCP: ❌ Agente '{agente_nome}' não conseguiu gravar a resposta para {tel}; nada foi enviado.")
+                await registrar_evento(tel, etapa="erro_gravacao_resposta", dados={"agente": agente_nome, "intent": intent})
+                return
             logger.info(f"MCP: Agente '{agente_nome}' executado com sucesso para {tel}.")
-            registrar_evento(tel, etapa="execucao_agente_sucesso", dados={"agente": agente_nome, "intent": intent})
+            await registrar_evento(tel, etapa="execucao_agente_sucesso", dados={"agente": agente_nome, "intent": intent})
 
             # --- Atualização de Estado Pós-Agente ---
             # O agente pode ter chamado salvar_contexto e alterado o estado ou meta.
             # Recarregamos para garantir que o estado final seja o correto.
-            ctx_final = obter_contexto(tel)
+            ctx_final = await obter_contexto(tel)
             estado_final = ctx_final.get("estado", estado_anterior) # Usa estado atualizado se o agente mudou
             meta_final = ctx_final.get("meta_conversa", meta_conversa)
             ultimo_bot = ctx_final.get("ultimo_texto_bot", "") # Resposta que o agente enviou (se ele salvou)
@@ -313,9 +325,9 @@ class MCPOrquestrador:
 
         except Exception as exc:
             logger.exception(f"MCP: Erro durante execução do Agente '{agente_nome}' para {tel}: {exc}")
-            registrar_evento(tel, etapa="erro_execucao_agente", dados={"agente": agente_nome, "intent": intent, "err": str(exc)})
-            try:
-                await enviar_mensagem(tel, "Desculpe, ocorreu um erro ao processar sua solicitação. Tente novamente.")
-            except Exception as send_err:
-                 logger.error(f"MCP: Falha ao enviar mensagem de erro para {tel} após falha do agente: {send_err}")
+            await registrar_evento(tel, etapa="erro_execucao_agente", dados={"agente": agente_nome, "intent": intent, "err": str(exc)})
+            if await remetente_outbox.enfileirar(
+                tel, "Desculpe, ocorreu um erro ao processar sua solicitação. Tente novamente.", agente="MCP", intent=intent
+            ) is None:
+                logger.error(f"MCP: Falha ao enfileirar mensagem de erro para {tel} após falha do agente.")
 
@@ -1,11 +1,22 @@
 """
 Coleta KPIs e expõe para Prometheus + JSON.
+Também mede o atraso do event loop (tempo em que o loop ficou travado).
 """
+import asyncio
+import logging
+import time
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient
-from prometheus_client import Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
-from app.config import MONGO_URI
+from app.core import banco, retencao, scheduler
+from app.core.llm import estatisticas_cache, estado_backends
+from app.core.rastreamento import escritor_eventos
+from app.core.cache_contextos import cache as cache_contextos
+from app.core.outbox import remetente as remetente_outbox
+from app.core.status_entrega import escritor_status
+from app.core.kanban import materializador as materializador_kanban
+from app.core.painel_ao_vivo import barramento as barramento_painel
+from app.utils import mensageria
 
 # ---------- Gauges ----------
 LEADS         = Gauge("domo_leads_total", "Leads captados nas últimas 24h")
@@ -13,23 +24,64 @@ QUALIFICADOS  = Gauge("domo_qualificados_total", "Leads com score >=2 últimas 2
 PAGOS         = Gauge("domo_pagamentos_total", "Pagamentos confirmados últimas 24h")
 TEMPO_PG_SECS = Gauge("domo_tempo_medio_pg_segundos", "Tempo médio lead→pagamento (s)")
 
+# ---------- Event loop ----------
+LOOP_ATRASO = Histogram(
+    "domo_event_loop_atraso_segundos",
+    "Atraso observado ao acordar do sleep no event loop (loop bloqueado)",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+LOOP_ATRASO_MAX = Gauge("domo_event_loop_atraso_max_segundos", "Maior atraso do event loop desde a última coleta")
+INTERVALO_MONITOR_LOOP_S = 0.5
+
+logger = logging.getLogger("famdomes.metrics")
+_task_monitor_loop = None
+_atraso_max = 0.0
+
+
+async def _monitorar_loop():
+    global _atraso_max
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(INTERVALO_MONITOR_LOOP_S)
+        atraso = max(0.0, time.perf_counter() - inicio - INTERVALO_MONITOR_LOOP_S)
+        LOOP_ATRASO.observe(atraso)
+        _atraso_max = max(_atraso_max, atraso)
+        LOOP_ATRASO_MAX.set(_atraso_max)
+
+
+async def iniciar_monitor_loop():
+    """Inicia (uma vez) a task que mede o atraso do event loop."""
+    global _task_monitor_loop
+    if _task_monitor_loop is None or _task_monitor_loop.done():
+        _task_monitor_loop = asyncio.get_running_loop().create_task(_monitorar_loop())
+        logger.info("METRICS: Monitor de atraso do event loop iniciado.")
+
+
+def _coletar_atraso_loop() -> dict:
+    global _atraso_max
+    amostras = {a.name: a.value for a in LOOP_ATRASO.collect()[0].samples if not a.labels.get("le")}
+    total = amostras.get("domo_event_loop_atraso_segundos_count", 0)
+    soma = amostras.get("domo_event_loop_atraso_segundos_sum", 0)
+    resultado = {"medio_s": round(soma / total, 6) if total else 0.0, "max_s": round(_atraso_max, 6)}
+    _atraso_max = 0.0
+    return resultado
+
 # ---------- Coleta ----------
-def atualizar():
-    mongo = MongoClient(MONGO_URI)
-    ctx   = mongo["famdomes"]["contextos"]
+async def atualizar():
+    ctx = banco.colecao("contextos", "painel")
 
     ini = datetime.now(timezone.utc) - timedelta(days=1)
 
     # Leads = primeira interação nas 24h
-    leads = ctx.count_documents({"ts": {"$gt": ini}, "interacoes": 1})
+    leads = await ctx.count_documents({"ts": {"$gt": ini}, "interacoes": 1})
     LEADS.set(leads)
 
     # Qualificados = score_lead >=2
-    qual = ctx.count_documents({"ts": {"$gt": ini}, "meta_conversa.score_lead": {"$gte": 2}})
+    qual = await ctx.count_documents({"ts": {"$gt": ini}, "meta_conversa.score_lead": {"$gte": 2}})
     QUALIFICADOS.set(qual)
 
     # Pagos
-    pagos = ctx.count_documents({"ts": {"$gt": ini}, "estado": "PAGAMENTO_OK"})
+    pagos = await ctx.count_documents({"ts": {"$gt": ini}, "estado": "PAGAMENTO_OK"})
     PAGOS.set(pagos)
 
     # Tempo médio até pagamento
@@ -38,18 +90,31 @@ def atualizar():
         {"$project": {"delta": {"$subtract": ["$ts", "$criado_em"]}}},
         {"$group": {"_id": None, "avg": {"$avg": "$delta"}}},
     ]
-    res = list(ctx.aggregate(pipeline))
+    res = await (await ctx.aggregate(pipeline)).to_list(1)
     TEMPO_PG_SECS.set(res[0]["avg"] / 1000 if res else 0)  # ms→s
 
-def prometheus_response():
-    atualizar()
+async def prometheus_response():
+    await atualizar()
     return generate_latest(), CONTENT_TYPE_LATEST
 
-def json_response():
-    atualizar()
+async def json_response():
+    await atualizar()
     return {
         "leads": LEADS.collect()[0].samples[0].value,
         "qualificados": QUALIFICADOS.collect()[0].samples[0].value,
         "pagamentos": PAGOS.collect()[0].samples[0].value,
         "tempo_medio_pg_s": TEMPO_PG_SECS.collect()[0].samples[0].value,
+        "cache_llm": estatisticas_cache(),
+        "llm_backends": estado_backends(),
+        "event_loop_atraso": _coletar_atraso_loop(),
+        "mongo_pool": banco.estado_pool(),
+        "eventos_lote": escritor_eventos.estado(),
+        "cache_contextos": cache_contextos.estado(),
+        "retencao": retencao.estado(),
+        "followups": scheduler.estado(),
+        "whatsapp": mensageria.estado(),
+        "outbox": remetente_outbox.estado(),
+        "status_lote": escritor_status.estado(),
+        "kanban": materializador_kanban.estado(),
+        "painel_ao_vivo": barramento_painel.estado(),
     }
@@ -0,0 +1,451 @@
+# ===========================================================
+# Arquivo: core/outbox.py
+# Outbox de mensagens de saída (geração desacoplada da entrega).
+# - Resposta de agente: a entrada vai DENTRO do update do contexto
+#   (`saidas`, $push com $slice), na mesma gravação do documento que leva
+#   `ultimo_texto_bot` — ou as duas coisas ficam gravadas, ou nenhuma.
+#   Depois da gravação (hook do cache de contextos) a entrada é copiada
+#   para `outbox` com o mesmo `_id` (cópia idempotente); um processo que
+#   morra entre as duas coisas é coberto por `recuperar_saidas`.
+# - `enfileirar` grava direto em `outbox` (perfil duravel) o que não
+#   acompanha gravação de contexto (primeiro trecho em streaming, avisos).
+# - Pool de remetentes (OUTBOX_CONCORRENCIA tasks por worker): cada um
+#   reivindica uma entrada com find_one_and_update (pendente -> enviando,
+#   com prazo), entrega via utils/mensageria e marca enviado + wamid.
+# - Ordem por telefone garantida no banco, valendo para todos os workers:
+#   só é reivindicada a entrada mais antiga (criado_em, _id) entre as
+#   pendentes/enviando do telefone — uma em backoff segura as seguintes —
+#   e o índice único parcial (telefone, status=enviando) impede duas em
+#   voo para o mesmo número. A reivindicação pagina as prontas excluindo
+#   telefones já examinados, então telefones travados não a bloqueiam.
+# - Falha transitória: volta a pendente com backoff exponencial + jitter.
+#   Erro definitivo (4xx, entrada inválida) ou tentativas esgotadas: a
+#   entrada vai para `outbox_dlq` (reprocessável por `reprocessar_dlq`).
+# - Reivindicação vencida (worker morreu no meio do envio) volta à fila.
+# - Prioridade menor sai primeiro: 0 = resposta de conversa.
+# - Entradas enviadas expiram pelo TTL de core/retencao.py.
+# - `recebido_em_atual` (contextvar, definido pelo webhook) vai junto
+#   com a resposta: base da latência ponta a ponta (core/status_entrega.py).
+# - `apos_wamid`: callbacks chamados com a wamid depois que ela é gravada
+#   (core/status_entrega.py concilia status que chegaram antes).
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.config import settings
+from app.core import banco
+from app.core.lease import WORKER_ID
+from app.utils.mensageria import enviar_mensagem
+
+logger = logging.getLogger("famdomes.outbox")
+
+COLECAO_OUTBOX = "outbox"
+COLECAO_DLQ = "outbox_dlq"
+
+PRIORIDADE_CONVERSA = 0
+PRIORIDADE_SISTEMA = 5
+PRIORIDADE_CAMPANHA = 10
+
+CONCORRENCIA = int(getattr(settings, "OUTBOX_CONCORRENCIA", 10))
+MAX_TENTATIVAS = int(getattr(settings, "OUTBOX_MAX_TENTATIVAS", 8))
+BACKOFF_BASE_S = float(getattr(settings, "OUTBOX_BACKOFF_BASE_S", 5))
+BACKOFF_MAX_S = float(getattr(settings, "OUTBOX_BACKOFF_MAX_S", 600))
+REIVINDICACAO_S = float(getattr(settings, "OUTBOX_REIVINDICACAO_S", 300))  # > pior caso das retentativas da mensageria
+INTERVALO_OCIOSO_S = float(getattr(settings, "OUTBOX_INTERVALO_S", 1.0))
+CANDIDATOS = int(getattr(settings, "OUTBOX_CANDIDATOS", 20))  # entradas prontas por consulta da reivindicação
+# Saídas embutidas no contexto: quantas ficam no documento e por quanto tempo são conferidas
+CAMPO_SAIDAS = "saidas"
+SAIDAS_MAX = int(getattr(settings, "OUTBOX_SAIDAS_MAX", 20))
+JANELA_SAIDAS_S = float(getattr(settings, "OUTBOX_JANELA_SAIDAS_S", 600))
+
+# Quando a mensagem do usuário que originou este processamento chegou ao webhook
+recebido_em_atual: ContextVar[Optional[datetime]] = ContextVar("recebido_em_atual", default=None)
+
+# Status da entrega que não adianta repetir (ver utils/mensageria.py)
+_DEFINITIVOS = {"erro_input", "erro_config"}
+
+ENTREGAS = Counter("domo_outbox_entregas_total", "Entradas do outbox processadas", ["resultado"])
+PENDENTES = Gauge("domo_outbox_pendentes", "Entradas pendentes no outbox (última contagem)")
+ESPERA_ENTREGA = Histogram(
+    "domo_outbox_espera_segundos",
+    "Tempo entre enfileirar e a entrega confirmada pelo WhatsApp",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 15, 60, 300, 1800),
+)
+
+
+def _agora() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _utc(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _definitivo(resultado: Dict[str, Any]) -> bool:
+    if resultado.get("status") in _DEFINITIVOS:
+        return True
+    code = resultado.get("code")
+    return isinstance(code, int) and 400 <= code < 500 and code not in (408, 429)
+
+
+def _backoff(tentativas: int) -> float:
+    teto = min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** max(0, tentativas - 1)))
+    return random.uniform(teto / 2, teto)
+
+
+def montar_entrada(
+    telefone: str,
+    texto: str,
+    *,
+    agente: Optional[str] = None,
+    intent: Optional[str] = None,
+    prioridade: int = PRIORIDADE_CONVERSA,
+    extra: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Entrada do outbox com `_id` já definido (o mesmo no contexto e em `outbox`)."""
+    agora = _agora()
+    doc = {
+        "_id": ObjectId(),
+        "telefone": telefone,
+        "texto": texto,
+        "agente": agente,
+        "intent": intent,
+        "prioridade": prioridade,
+        "status": "pendente",
+        "tentativas": 0,
+        "disponivel_em": agora,
+        "criado_em": agora,
+        **(extra or {}),
+    }
+    recebido_em = recebido_em_atual.get()
+    if recebido_em is not None:
+        doc.setdefault("recebido_em", recebido_em)
+    return doc
+
+
+def update_saida(entrada: Dict[str, Any]) -> Dict[str, Any]:
+    """Trecho de update do contexto que grava a entrada junto com o resto do documento."""
+    return {"$push": {CAMPO_SAIDAS: {"$each": [entrada], "$slice": -SAIDAS_MAX}}}
+
+
+def saidas_do_update(update: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Entradas do outbox novas em um update de contexto já gravado ($push)."""
+    valor = update.get("$push", {}).get(CAMPO_SAIDAS)
+    if valor is None:
+        return []
+    return list(valor["$each"]) if isinstance(valor, dict) and "$each" in valor else [valor]
+
+
+class RemetenteOutbox:
+    """Pool de tasks que drena o outbox deste worker (e de workers mortos)."""
+
+    def __init__(self, concorrencia: int = CONCORRENCIA):
+        self.concorrencia = concorrencia
+        self._tasks: List[asyncio.Task] = []
+        self._acordar: Optional[asyncio.Event] = None
+        self.em_voo = 0  # envios em andamento neste worker
+        self.apos_wamid: List[Callable[[str], Awaitable[None]]] = []
+        self.entregues = 0
+        self.falhas = 0
+        self.mortas = 0
+        self.pendentes: Optional[int] = None
+
+    # ------------------------------------------------------
+    async def enfileirar(
+        self,
+        telefone: str,
+        texto: str,
+        *,
+        agente: Optional[str] = None,
+        intent: Optional[str] = None,
+        prioridade: int = PRIORIDADE_CONVERSA,
+        extra: Optional[Dict[str, Any]] = None,
+    ) -> Optional[str]:
+        """Grava a mensagem no outbox. Retorna o id da entrada (None se o banco falhou)."""
+        doc = montar_entrada(telefone, texto, agente=agente, intent=intent, prioridade=prioridade, extra=extra)
+        try:
+            resultado = await banco.colecao(COLECAO_OUTBOX, "duravel").insert_one(doc)
+        except Exception as e:
+            logger.error(f"OUTBOX: ❌ Falha ao enfileirar mensagem para {telefone}: {e}")
+            return None
+        self.acordar()
+        return str(resultado.inserted_id)
+
+    async def enfileirar_lote(self, docs: List[Dict[str, Any]], *, prioridade: int = PRIORIDADE_CAMPANHA) -> int:
+        """insert_many de várias mensagens (campanhas). `_id` determinístico torna o
+        reenvio idempotente: duplicatas são ignoradas. Retorna quantas entraram."""
+        if not docs:
+            return 0
+        agora = _agora()
+        for doc in docs:
+            doc.setdefault("prioridade", prioridade)
+            doc.update({"status": "pendente", "tentativas": 0, "disponivel_em": agora, "criado_em": agora})
+        return await self._inserir_sem_duplicatas(docs)
+
+    async def publicar_saidas(self, entradas: List[Dict[str, Any]]) -> int:
+        """Copia para `outbox` entradas já gravadas no contexto. Idempotente pelo `_id`."""
+        if not entradas:
+            return 0
+        return await self._inserir_sem_duplicatas([dict(e) for e in entradas])
+
+    async def _inserir_sem_duplicatas(self, docs: List[Dict[str, Any]]) -> int:
+        try:
+            resultado = await banco.colecao(COLECAO_OUTBOX, "duravel").insert_many(docs, ordered=False)
+            inseridos = len(resultado.inserted_ids)
+        except BulkWriteError as e:
+            erros = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in erros):
+                raise
+            inseridos = e.details.get("nInserted", 0)
+        self.acordar()
+        return inseridos
+
+    async def apos_gravar_contexto(self, telefone: str, update: Dict[str, Any]) -> None:
+        """Hook do cache de contextos: a gravação que levou `saidas` libera as entradas."""
+        await self.publicar_saidas(saidas_do_update(update))
+        lista = update.get("$set", {}).get(CAMPO_SAIDAS)
+        if lista:
+            # O cache fixou a lista inteira (colisão de caminhos): só o que ainda não saiu
+            await self._publicar_ausentes(lista)
+
+    async def recuperar_saidas(self) -> int:
+        """Entradas gravadas em contextos recentes que não chegaram a `outbox` (processo
+        morreu entre a gravação e a cópia). Não ressuscita o que já foi para a DLQ."""
+        limite = _agora() - timedelta(seconds=JANELA_SAIDAS_S)
+        entradas: List[Dict[str, Any]] = []
+        cursor = banco.colecao("contextos").find(
+            {f"{CAMPO_SAIDAS}.criado_em": {"$gte": limite}}, {"_id": 0, CAMPO_SAIDAS: 1}
+        )
+        async for ctx in cursor:
+            entradas.extend(ctx.get(CAMPO_SAIDAS) or [])
+        recuperadas = await self._publicar_ausentes(entradas)
+        if recuperadas:
+            logger.warning(f"OUTBOX: ⚠️ {recuperadas} saída(s) gravada(s) em contextos sem entrada no outbox; enfileiradas agora.")
+        return recuperadas
+
+    async def _publicar_ausentes(self, entradas: List[Dict[str, Any]]) -> int:
+        """Publica entradas recentes que não estão no outbox nem na DLQ. Entradas antigas
+        ficam de fora: a enviada pode já ter expirado do outbox pelo TTL."""
+        limite = _agora() - timedelta(seconds=JANELA_SAIDAS_S)
+        candidatas = {e["_id"]: e for e in entradas if _utc(e["criado_em"]) >= limite}
+        if not candidatas:
+            return 0
+        ids = list(candidatas)
+        for nome in (COLECAO_OUTBOX, COLECAO_DLQ):
+            async for doc in banco.colecao(nome).find({"_id": {"$in": ids}}, {"_id": 1}):
+                candidatas.pop(doc["_id"], None)
+        return await self.publicar_saidas(list(candidatas.values()))
+
+    def acordar(self) -> None:
+        if self._acordar is not None:
+            self._acordar.set()
+
+    # ------------------------------------------------------
+    async def _reivindicar(self) -> Optional[Dict[str, Any]]:
+        agora = _agora()
+        colecao = banco.colecao(COLECAO_OUTBOX)
+        # Telefones já examinados saem da consulta seguinte: telefones travados (entrada
+        # anterior em backoff ou em voo) não ocupam as CANDIDATOS vagas para sempre
+        vistos: List[str] = []
+        while True:
+            filtro: Dict[str, Any] = {"status": "pendente", "disponivel_em": {"$lte": agora}}
+            if vistos:
+                filtro["telefone"] = {"$nin": vistos}
+            prontas = await colecao.find(filtro, {"_id": 1, "telefone": 1}) \
+                .sort([("prioridade", 1), ("disponivel_em", 1)]).limit(CANDIDATOS).to_list(CANDIDATOS)
+            if not prontas:
+                return None
+            for candidata in prontas:
+                if candidata["telefone"] in vistos:
+                    continue
+                vistos.append(candidata["telefone"])
+                # A vez é da entrada mais antiga do telefone, que pode vir depois na página;
+                # se ela está em backoff ou em voo, o telefone espera
+                vez = await self._vez_do_telefone(candidata["telefone"])
+                if vez is None:
+                    continue
+                try:
+                    doc = await colecao.find_one_and_update(
+                        {"_id": vez, "status": "pendente", "disponivel_em": {"$lte": agora}},
+                        {
+                            "$set": {"status": "enviando", "dono": WORKER_ID, "reivindicado_ate": agora + timedelta(seconds=REIVINDICACAO_S)},
+                            "$inc": {"tentativas": 1},
+                        },
+                        return_document=ReturnDocument.AFTER,
+                    )
+                except DuplicateKeyError:
+                    continue  # outra entrada do telefone já está em voo (índice telefone_enviando_uniq)
+                if doc is not None:
+                    return doc
+
+    async def _vez_do_telefone(self, telefone: str) -> Any:
+        """`_id` da entrada mais antiga ainda não resolvida do telefone (a única que pode sair)."""
+        primeira = await banco.colecao(COLECAO_OUTBOX).find_one(
+            {"telefone": telefone, "status": {"$in": ["pendente", "enviando"]}},
+            {"_id": 1},
+            sort=[("criado_em", 1), ("_id", 1)],
+        )
+        return primeira["_id"] if primeira else None
+
+    async def _marcar_enviado(self, doc: Dict[str, Any], resultado: Dict[str, Any]) -> None:
+        wamid = None
+        try:
+            wamid = (resultado.get("retorno") or {}).get("messages", [{}])[0].get("id")
+        except (AttributeError, IndexError, TypeError):
+            pass
+        agora = _agora()
+        await banco.colecao(COLECAO_OUTBOX).update_one(
+            {"_id": doc["_id"], "dono": WORKER_ID},
+            {"$set": {"status": "enviado", "enviado_em": agora, "wamid": wamid}, "$unset": {"reivindicado_ate": "", "ultimo_erro": ""}},
+        )
+        ESPERA_ENTREGA.observe((agora - _utc(doc["criado_em"])).total_seconds())
+        self.entregues += 1
+        ENTREGAS.labels("enviado").inc()
+        if wamid:
+            for callback in self.apos_wamid:
+                try:
+                    await callback(wamid)
+                except Exception as e:
+                    logger.error(f"OUTBOX: ❌ Callback da wamid {wamid} falhou: {e}")
+
+    async def _marcar_falha(self, doc: Dict[str, Any], resultado: Dict[str, Any]) -> None:
+        erro = {"status": resultado.get("status"), "code": resultado.get("code"), "erro": str(resultado.get("erro"))[:500]}
+        if _definitivo(resultado) or doc.get("tentativas", 0) >= MAX_TENTATIVAS:
+            await self._para_dlq(doc, erro)
+            return
+        espera = _backoff(doc.get("tentativas", 1))
+        await banco.colecao(COLECAO_OUTBOX).update_one(
+            {"_id": doc["_id"], "dono": WORKER_ID},
+            {
+                "$set": {"status": "pendente", "disponivel_em": _agora() + timedelta(seconds=espera), "ultimo_erro": erro},
+                "$unset": {"dono": "", "reivindicado_ate": ""},
+            },
+        )
+        self.falhas += 1
+        ENTREGAS.labels("repetir").inc()
+        logger.warning(f"OUTBOX: ⚠️ Envio para {doc['telefone']} falhou ({erro['status']}); tentativa {doc.get('tentativas')} de {MAX_TENTATIVAS}, nova em {espera:.0f}s.")
+
+    async def _para_dlq(self, doc: Dict[str, Any], erro: Dict[str, Any]) -> None:
+        morta = {**doc, "status": "morta", "ultimo_erro": erro, "morta_em": _agora()}
+        morta.pop("reivindicado_ate", None)
+        try:
+            await banco.colecao(COLECAO_DLQ, "duravel").replace_one({"_id": doc["_id"]}, morta, upsert=True)
+            await banco.colecao(COLECAO_OUTBOX).delete_one({"_id": doc["_id"], "dono": WORKER_ID})
+        except Exception as e:
+            logger.error(f"OUTBOX: ❌ Falha ao mover {doc['_id']} para a DLQ: {e}")
+            return
+        self.mortas += 1
+        ENTREGAS.labels("dlq").inc()
+        logger.error(f"OUTBOX: ❌ Mensagem para {doc['telefone']} na DLQ após {doc.get('tentativas')} tentativa(s): {erro}")
+
+    async def _entregar(self, doc: Dict[str, Any]) -> None:
+        self.em_voo += 1
+        try:
+            resultado = await enviar_mensagem(doc["telefone"], doc.get("texto") or "")
+            if resultado.get("status") == "enviado":
+                await self._marcar_enviado(doc, resultado)
+            else:
+                await self._marcar_falha(doc, resultado)
+        finally:
+            self.em_voo -= 1
+
+    # ------------------------------------------------------
+    async def _remetente(self) -> None:
+        while True:
+            try:
+                doc = await self._reivindicar()
+                if doc is None:
+                    try:
+                        await asyncio.wait_for(self._acordar.wait(), timeout=INTERVALO_OCIOSO_S)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._acordar.clear()
+                    continue
+                await self._entregar(doc)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"OUTBOX: ❌ Erro no remetente: {e}")
+                await asyncio.sleep(INTERVALO_OCIOSO_S)
+
+    async def recuperar_vencidas(self) -> int:
+        """Devolve à fila entradas presas em 'enviando' cujo dono sumiu e copia saídas
+        de contexto que não chegaram ao outbox (job periódico)."""
+        await self.recuperar_saidas()
+        resultado = await banco.colecao(COLECAO_OUTBOX).update_many(
+            {"status": "enviando", "reivindicado_ate": {"$lt": _agora()}},
+            {"$set": {"status": "pendente", "disponivel_em": _agora()}, "$unset": {"dono": "", "reivindicado_ate": ""}},
+        )
+        if resultado.modified_count:
+            logger.warning(f"OUTBOX: ⚠️ {resultado.modified_count} entrada(s) com reivindicação vencida devolvidas à fila.")
+            self.acordar()
+        self.pendentes = await banco.colecao(COLECAO_OUTBOX).count_documents({"status": "pendente"})
+        PENDENTES.set(self.pendentes)
+        return resultado.modified_count
+
+    async def reprocessar_dlq(self, limite: int = 100) -> int:
+        """Devolve até `limite` mensagens da DLQ ao outbox (ex.: após corrigir um template)."""
+        movidas = 0
+        async for doc in banco.colecao(COLECAO_DLQ).find({}).sort("morta_em", 1).limit(limite):
+            doc.update({"status": "pendente", "tentativas": 0, "disponivel_em": _agora()})
+            for campo in ("morta_em", "dono"):
+                doc.pop(campo, None)
+            await banco.colecao(COLECAO_OUTBOX, "duravel").replace_one({"_id": doc["_id"]}, doc, upsert=True)
+            await banco.colecao(COLECAO_DLQ).delete_one({"_id": doc["_id"]})
+            movidas += 1
+        if movidas:
+            self.acordar()
+        return movidas
+
+    async def consultar(self, id_entrada: str) -> Optional[Dict[str, Any]]:
+        # Respostas usam ObjectId; campanhas, `_id` textual "<campanha>:<telefone>"
+        _id: Any = ObjectId(id_entrada) if ObjectId.is_valid(id_entrada) else id_entrada
+        return await banco.colecao(COLECAO_OUTBOX).find_one({"_id": _id}) or await banco.colecao(COLECAO_DLQ).find_one({"_id": _id})
+
+    # ------------------------------------------------------
+    async def iniciar(self) -> None:
+        if self._tasks:
+            return
+        self._acordar = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._remetente()) for _ in range(self.concorrencia)]
+        logger.info(f"OUTBOX: ✅ {self.concorrencia} remetente(s) ativos ({WORKER_ID}).")
+
+    async def parar(self) -> None:
+        """Cancela os remetentes. Envios interrompidos voltam à fila pela reivindicação vencida."""
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def estado(self) -> dict:
+        return {
+            "remetentes": len(self._tasks),
+            "em_voo": self.em_voo,
+            "entregues": self.entregues,
+            "falhas_transitorias": self.falhas,
+            "dlq": self.mortas,
+            "pendentes_ultima_contagem": self.pendentes,
+        }
+
+
+remetente = RemetenteOutbox()
+
+
+async def iniciar() -> None:
+    await remetente.iniciar()
+
+
+async def parar() -> None:
+    await remetente.parar()
@@ -0,0 +1,309 @@
+# ===========================================================
+# Arquivo: core/painel_ao_vivo.py
+# Eventos em tempo real para o Domo Hub (SSE em /dashboard/eventos).
+# - Barramento em memória: `publicar` numera o evento (<época>-<seq>),
+#   monta o quadro SSE uma vez, guarda num buffer circular e entrega na
+#   fila de cada assinante. Não faz I/O e nunca bloqueia quem publica.
+# - Fila limitada por cliente (PAINEL_FILA_CLIENTE): cliente lento que
+#   enche a fila perde o que estava nela e recebe um único `resync`
+#   (buscar o delta em /dashboard/sync) em vez de segurar memória ou o barramento.
+# - Retomada: Last-Event-ID da mesma época e ainda no buffer
+#   (PAINEL_BUFFER_EVENTOS) reenvia o que faltou; senão, `resync`.
+# - Fontes locais: cards gravados (core/kanban.py) -> `card` /
+#   `card_removido`; turnos salvos (utils/contexto.py) -> `mensagem` e,
+#   com risco, `risco`.
+# - Vários workers: PAINEL_CHANGE_STREAMS=true (exige replica set) faz
+#   cada worker assistir kanban_cards e respostas_ia e publicar tudo,
+#   inclusive o que outro worker gravou; as fontes locais se desligam.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Deque, Dict, FrozenSet, List, Optional
+
+from prometheus_client import Counter, Gauge
+from pymongo.errors import OperationFailure
+
+from app.config import settings
+from app.core import banco
+
+logger = logging.getLogger("famdomes.painel_ao_vivo")
+
+FILA_CLIENTE = int(getattr(settings, "PAINEL_FILA_CLIENTE", 500))
+BUFFER_EVENTOS = int(getattr(settings, "PAINEL_BUFFER_EVENTOS", 5000))
+MAX_CLIENTES = int(getattr(settings, "PAINEL_MAX_CLIENTES", 200))
+HEARTBEAT_S = float(getattr(settings, "PAINEL_HEARTBEAT_S", 15))
+CHANGE_STREAMS = str(getattr(settings, "PAINEL_CHANGE_STREAMS", "false")).lower() in ("1", "true", "sim")
+
+# Muda a cada processo: id de outro worker/reinício não é retomável aqui
+EPOCA = uuid.uuid4().hex[:8]
+
+CLIENTES = Gauge("domo_painel_clientes", "Dashboards conectados ao fluxo de eventos")
+EVENTOS = Counter("domo_painel_eventos_total", "Eventos publicados para os dashboards", ["tipo"])
+RESYNCS = Counter("domo_painel_resync_total", "Clientes mandados recarregar o quadro", ["motivo"])
+DESCARTADOS = Counter("domo_painel_eventos_descartados_total", "Eventos descartados em filas de clientes lentos")
+
+
+class LimiteClientes(RuntimeError):
+    pass
+
+
+def _json(valor: Any) -> Any:
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return str(valor)
+
+
+@dataclass
+class Evento:
+    seq: int
+    tipo: str
+    telefone: Optional[str]
+    quadro: str  # já no formato SSE
+
+    @property
+    def id(self) -> str:
+        return f"{EPOCA}-{self.seq}"
+
+
+def _quadro(id_evento: Optional[str], tipo: str, dados: Dict[str, Any]) -> str:
+    linhas = [f"id: {id_evento}"] if id_evento else []
+    linhas += [f"event: {tipo}", f"data: {json.dumps(dados, default=_json, ensure_ascii=False)}"]
+    return "\n".join(linhas) + "\n\n"
+
+
+RESYNC = _quadro(None, "resync", {"motivo": "recarregar"})
+
+
+@dataclass(eq=False)
+class Assinante:
+    usuario: str
+    telefone: Optional[str] = None
+    tipos: Optional[FrozenSet[str]] = None
+    fila: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=FILA_CLIENTE))
+    descartados: int = 0
+
+    def quer(self, evento: Evento) -> bool:
+        if self.telefone is not None and evento.telefone != self.telefone:
+            return False
+        return self.tipos is None or evento.tipo in self.tipos
+
+    def entregar(self, quadro: str) -> None:
+        try:
+            self.fila.put_nowait(quadro)
+        except asyncio.QueueFull:
+            self.resync("fila_cheia")
+
+    def resync(self, motivo: str) -> None:
+        """Troca o que está na fila por um único `resync` (o cliente recarrega o quadro)."""
+        while not self.fila.empty():
+            self.fila.get_nowait()
+            self.descartados += 1
+            DESCARTADOS.inc()
+        self.fila.put_nowait(RESYNC)
+        RESYNCS.labels(motivo=motivo).inc()
+
+
+# ----------------------------------------------------------------------
+class BarramentoPainel:
+    def __init__(self, tamanho_buffer: int = BUFFER_EVENTOS, max_clientes: int = MAX_CLIENTES):
+        self.max_clientes = max_clientes
+        self._buffer: Deque[Evento] = deque(maxlen=tamanho_buffer)
+        self._assinantes: set = set()
+        self._seq = 0
+        self.publicados = 0
+
+    def publicar(self, tipo: str, dados: Dict[str, Any], telefone: Optional[str] = None) -> None:
+        self._seq += 1
+        evento = Evento(self._seq, tipo, telefone, "")
+        evento.quadro = _quadro(evento.id, tipo, dados)
+        self._buffer.append(evento)
+        self.publicados += 1
+        EVENTOS.labels(tipo=tipo).inc()
+        for assinante in self._assinantes:
+            if assinante.quer(evento):
+                assinante.entregar(evento.quadro)
+
+    def inscrever(self, assinante: Assinante, ultimo_id: Optional[str] = None) -> Assinante:
+        """Registra o assinante; com `ultimo_id`, já enfileira o que ele perdeu (ou um resync)."""
+        if len(self._assinantes) >= self.max_clientes:
+            raise LimiteClientes(f"limite de {self.max_clientes} dashboards conectados")
+        if ultimo_id:
+            self._retomar(assinante, ultimo_id)
+        self._assinantes.add(assinante)
+        CLIENTES.set(len(self._assinantes))
+        return assinante
+
+    def _retomar(self, assinante: Assinante, ultimo_id: str) -> None:
+        epoca, _, seq_txt = ultimo_id.partition("-")
+        try:
+            seq = int(seq_txt)
+        except ValueError:
+            seq = -1
+        primeiro = self._buffer[0].seq if self._buffer else self._seq + 1
+        if epoca != EPOCA or seq < 0 or seq > self._seq or seq < primeiro - 1:
+            assinante.resync("retomada")
+            return
+        for evento in self._buffer:
+            if evento.seq > seq and assinante.quer(evento):
+                assinante.entregar(evento.quadro)
+
+    def resync_todos(self, motivo: str) -> None:
+        for assinante in self._assinantes:
+            assinante.resync(motivo)
+
+    def cancelar(self, assinante: Assinante) -> None:
+        self._assinantes.discard(assinante)
+        CLIENTES.set(len(self._assinantes))
+
+    def estado(self) -> dict:
+        return {
+            "epoca": EPOCA,
+            "clientes": len(self._assinantes),
+            "publicados": self.publicados,
+            "buffer": len(self._buffer),
+            "fonte": "change_streams" if _vigia is not None and not _vigia.done() else "local",
+            "filas": sorted((a.fila.qsize() for a in self._assinantes), reverse=True)[:5],
+        }
+
+
+barramento = BarramentoPainel()
+_fonte_local = not CHANGE_STREAMS
+_vigia: Optional[asyncio.Task] = None
+
+
+# ----------------------------------------------------------------------
+# Eventos (mesmo formato para fonte local e change streams)
+def _card(card: Dict[str, Any]) -> None:
+    barramento.publicar("card", {k: v for k, v in card.items() if k != "_id"}, card.get("tel"))
+
+
+def _card_removido(telefone: str) -> None:
+    barramento.publicar("card_removido", {"tel": telefone}, telefone)
+
+
+def _turno(doc: Dict[str, Any]) -> None:
+    telefone = doc.get("telefone")
+    barramento.publicar("mensagem", {
+        "telefone": telefone,
+        "criado_em": doc.get("criado_em"),
+        "mensagem_usuario": doc.get("mensagem_usuario"),
+        "resposta_gerada": doc.get("resposta_gerada"),
+        "intent": doc.get("intent_detectada"),
+        "agente": doc.get("nome_agente"),
+        "enviado_por_humano": bool(doc.get("enviado_por_humano")),
+    }, telefone)
+    if doc.get("risco_detectado"):
+        barramento.publicar("risco", {
+            "telefone": telefone,
+            "criado_em": doc.get("criado_em"),
+            "intent": doc.get("intent_detectada"),
+            "mensagem_usuario": (doc.get("mensagem_usuario") or "")[:200],
+        }, telefone)
+
+
+def publicar_cards(cards: List[Dict[str, Any]]) -> None:
+    if _fonte_local:
+        for card in cards:
+            _card(card)
+
+
+def publicar_card_removido(telefone: str) -> None:
+    if _fonte_local:
+        _card_removido(telefone)
+
+
+def publicar_turno(doc: Dict[str, Any]) -> None:
+    if _fonte_local:
+        _turno(doc)
+
+
+# ----------------------------------------------------------------------
+# Change streams (vários workers)
+_PIPELINE_VIGIA = [{"$match": {
+    "ns.coll": {"$in": ["kanban_cards", "respostas_ia"]},
+    "operationType": {"$in": ["insert", "replace", "update", "delete"]},
+}}]
+
+
+def _tratar_mudanca(mudanca: Dict[str, Any]) -> None:
+    colecao, operacao = mudanca["ns"]["coll"], mudanca["operationType"]
+    doc = mudanca.get("fullDocument")
+    if colecao == "kanban_cards":
+        if operacao == "delete" or (doc and doc.get("removido")):
+            _card_removido(mudanca["documentKey"]["_id"])
+        elif doc:
+            _card(doc)
+    elif colecao == "respostas_ia" and operacao == "insert" and doc:
+        _turno(doc)
+
+
+async def _vigiar() -> None:
+    global _fonte_local
+    token = None
+    espera = 1.0
+    while True:
+        try:
+            fluxo = await banco.db().watch(_PIPELINE_VIGIA, full_document="updateLookup", resume_after=token)
+            try:
+                logger.info("PAINEL: ✅ Change streams ativos (kanban_cards, respostas_ia).")
+                espera = 1.0
+                async for mudanca in fluxo:
+                    token = fluxo.resume_token
+                    _tratar_mudanca(mudanca)
+            finally:
+                await fluxo.close()
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            if e.code in (40573, 20):  # sem replica set / change streams indisponíveis
+                logger.error(f"PAINEL: ❌ Change streams indisponíveis ({e}); usando eventos locais deste worker.")
+                _fonte_local = True
+                return
+            if e.code == 286:  # token de retomada fora do oplog: o que se perdeu vira resync
+                token = None
+                barramento.resync_todos("oplog")
+            logger.warning(f"PAINEL: ⚠️ Change stream interrompido ({e}); reabrindo em {espera:.0f}s.")
+        except Exception as e:
+            logger.warning(f"PAINEL: ⚠️ Change stream interrompido ({e}); reabrindo em {espera:.0f}s.")
+        await asyncio.sleep(espera)
+        espera = min(espera * 2, 30.0)
+
+
+async def iniciar() -> None:
+    global _vigia
+    if CHANGE_STREAMS and (_vigia is None or _vigia.done()):
+        _vigia = asyncio.get_running_loop().create_task(_vigiar())
+
+
+async def parar() -> None:
+    global _vigia
+    if _vigia is not None:
+        _vigia.cancel()
+        try:
+            await _vigia
+        except asyncio.CancelledError:
+            pass
+        _vigia = None
+
+
+# ----------------------------------------------------------------------
+async def fluxo_sse(assinante: Assinante):
+    """Gerador do corpo SSE: eventos da fila, com comentário de heartbeat quando ocioso."""
+    try:
+        yield f"retry: 3000\n: epoca {EPOCA}\n\n"
+        while True:
+            try:
+                quadro = await asyncio.wait_for(assinante.fila.get(), timeout=HEARTBEAT_S)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield quadro
+    finally:
+        barramento.cancelar(assinante)
@@ -1,24 +1,37 @@
 """
 Persistência de logs de decisão e telemetria.
+Os eventos passam por um escritor em lote (core/escritor_lote.py): registrar
+um evento só enfileira em memória; a gravação em `eventos` é feita em fundo.
 """
 from datetime import datetime, timezone
-from pymongo import MongoClient
-from app.config import MONGO_URI
+from app.config import settings
+from app.core.escritor_lote import EscritorEmLote
 import logging
 
-mongo = MongoClient(MONGO_URI)
-col_eventos = mongo["famdomes"]["eventos"]
-
 logger = logging.getLogger("famdomes.trace")
 
-def registrar_evento(telefone: str, *, etapa: str, dados: dict) -> None:
+escritor_eventos = EscritorEmLote(
+    "eventos",
+    tamanho_lote=int(getattr(settings, "EVENTOS_LOTE_TAMANHO", 200)),
+    intervalo_s=float(getattr(settings, "EVENTOS_LOTE_INTERVALO_S", 1.0)),
+    capacidade=int(getattr(settings, "EVENTOS_BUFFER_MAX", 10000)),
+    politica=getattr(settings, "EVENTOS_POLITICA_DESCARTE", "descartar_antigos"),
+    taxa_amostragem=float(getattr(settings, "EVENTOS_TAXA_AMOSTRAGEM", 0.1)),
+)
+
+async def registrar_evento(telefone: str, *, etapa: str, dados: dict) -> None:
     doc = {
         "telefone": telefone,
         "etapa": etapa,
         "dados": dados,
         "timestamp": datetime.now(timezone.utc),
     }
-    try:
-        col_eventos.insert_one(doc)
-    except Exception as exc:  # pragma: no cover
-        logger.warning("Falha ao gravar evento em MongoDB: %s", exc)
+    if not escritor_eventos.adicionar(doc):
+        logger.debug("Evento '%s' de %s descartado (buffer de eventos sob pressão).", etapa, telefone)
+
+async def iniciar() -> None:
+    await escritor_eventos.iniciar()
+
+async def parar() -> None:
+    """Grava os eventos pendentes (shutdown)."""
+    await escritor_eventos.parar()
@@ -0,0 +1,455 @@
+# ===========================================================
+# Arquivo: core/retencao.py
+# Retenção de dados em camadas.
+# - Janela quente: `respostas_ia` e `historico_buckets` guardam só os
+#   últimos N dias; o que passa disso é movido em lotes para
+#   `<colecao>_arquivo` (coleção criada com compressão zstd).
+# - Dados descartáveis (`eventos`, `status_mensagens`, `outbox` já
+#   enviado, `status_sem_vinculo`, lápides de `kanban_cards`) expiram por
+#   índice TTL no servidor.
+# - Purga em lotes com pausa entre eles (não derruba o working set nem
+#   a replicação); usada também para expirar o próprio arquivo.
+# - Contextos ociosos há N dias (ou em estado terminal) vão para
+#   `contextos_frios`; `reidratar()` os traz de volta quando o telefone
+#   escreve de novo. Consultas quentes só veem conversas ativas; o
+#   público de campanhas e as escritas de tags/opt-out
+#   (`atualizar_contextos`) cobrem as duas camadas.
+# - `executar()` roda como job do scheduler e guarda um relatório com
+#   documentos movidos/purgados e bytes liberados nas coleções vivas.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import bson
+from prometheus_client import Counter
+from pymongo import ASCENDING, DeleteOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+
+from app.config import settings
+from app.core import banco
+from app.core.cache_contextos import cache as cache_contextos
+
+logger = logging.getLogger("famdomes.retencao")
+
+# --- Configuração (0 dias = desativado / manter para sempre) ---
+RESPOSTAS_IA_DIAS = int(getattr(settings, "RETENCAO_RESPOSTAS_IA_DIAS", 90))
+HISTORICO_DIAS = int(getattr(settings, "RETENCAO_HISTORICO_DIAS", 180))
+EVENTOS_DIAS = int(getattr(settings, "RETENCAO_EVENTOS_DIAS", 30))
+OUTBOX_DIAS = int(getattr(settings, "RETENCAO_OUTBOX_DIAS", 7))  # entradas já enviadas
+STATUS_DIAS = int(getattr(settings, "RETENCAO_STATUS_MENSAGENS_DIAS", 30))
+STATUS_SEM_VINCULO_DIAS = int(getattr(settings, "RETENCAO_STATUS_SEM_VINCULO_DIAS", 1))  # status à espera da wamid
+KANBAN_REMOVIDOS_DIAS = int(getattr(settings, "RETENCAO_KANBAN_REMOVIDOS_DIAS", 7))  # lápides do delta
+ARQUIVO_DIAS = int(getattr(settings, "RETENCAO_ARQUIVO_DIAS", 0))
+TAMANHO_LOTE = int(getattr(settings, "RETENCAO_LOTE", 500))
+PAUSA_ENTRE_LOTES_S = float(getattr(settings, "RETENCAO_PAUSA_S", 0.2))
+MAX_LOTES_POR_EXECUCAO = int(getattr(settings, "RETENCAO_MAX_LOTES", 200))
+INTERVALO_HORAS = float(getattr(settings, "RETENCAO_INTERVALO_HORAS", 6))
+COMPRESSOR_ARQUIVO = getattr(settings, "RETENCAO_COMPRESSOR", "zstd")
+CONTEXTO_FRIO_DIAS = int(getattr(settings, "CONTEXTO_FRIO_DIAS", 30))
+CONTEXTO_FRIO_TERMINAL_HORAS = float(getattr(settings, "CONTEXTO_FRIO_TERMINAL_HORAS", 24))
+ESTADOS_TERMINAIS = [
+    e.strip() for e in getattr(settings, "CONTEXTO_ESTADOS_TERMINAIS", "FINALIZADO_SEM_VENDA,FINALIZADO,ENCERRADO").split(",")
+    if e.strip()
+]
+
+SUFIXO_ARQUIVO = "_arquivo"
+COLECAO_CONTEXTOS_FRIOS = "contextos_frios"
+
+
+@dataclass
+class Politica:
+    colecao: str
+    campo_data: str
+    janela_dias: int
+
+    @property
+    def arquivo(self) -> str:
+        return self.colecao + SUFIXO_ARQUIVO
+
+
+POLITICAS: List[Politica] = [
+    Politica("respostas_ia", "criado_em", RESPOSTAS_IA_DIAS),
+    Politica("historico_buckets", "fim", HISTORICO_DIAS),
+]
+
+# Coleção descartável -> (campo de data, dias até expirar)
+TTL: Dict[str, tuple] = {
+    "eventos": ("timestamp", EVENTOS_DIAS),
+    "status_mensagens": ("timestamp", STATUS_DIAS),
+    "outbox": ("enviado_em", OUTBOX_DIAS),
+    "status_sem_vinculo": ("criado_em", STATUS_SEM_VINCULO_DIAS),
+    "kanban_cards": ("removido_em", KANBAN_REMOVIDOS_DIAS),  # só lápides têm o campo
+}
+
+DOCS_RETENCAO = Counter(
+    "domo_retencao_documentos_total",
+    "Documentos tratados pela retenção",
+    ["colecao", "acao"],  # acao: arquivado | purgado
+)
+CONTEXTOS_CAMADA = Counter(
+    "domo_contextos_camada_total",
+    "Contextos movidos entre as camadas quente e fria",
+    ["acao"],  # congelado | reidratado | devolvido (mudou durante a movimentação)
+)
+BYTES_LIBERADOS = Counter(
+    "domo_retencao_bytes_liberados_total",
+    "Bytes (BSON) removidos das coleções pela retenção",
+    ["colecao"],
+)
+
+ultimo_relatorio: Dict[str, Any] = {}
+
+
+# ----------------------------------------------------------------------
+# Startup (síncrono, como aplicar_migracoes): coleções de arquivo e índices TTL
+def preparar() -> None:
+    """Cria as coleções de arquivo comprimidas e ajusta os índices TTL."""
+    try:
+        db = banco.db_sync()
+        existentes = set(db.list_collection_names())
+    except Exception as e:
+        logger.error(f"RETENCAO: ❌ Não foi possível preparar as coleções de arquivo: {e}")
+        return
+
+    for politica in POLITICAS:
+        if politica.arquivo not in existentes:
+            try:
+                db.create_collection(
+                    politica.arquivo,
+                    storageEngine={"wiredTiger": {"configString": f"block_compressor={COMPRESSOR_ARQUIVO}"}},
+                )
+                logger.info(f"RETENCAO: Coleção '{politica.arquivo}' criada ({COMPRESSOR_ARQUIVO}).")
+            except CollectionInvalid:
+                pass  # outro worker criou antes
+            except Exception as e:
+                logger.warning(f"RETENCAO: ⚠️ Falha ao criar '{politica.arquivo}' com {COMPRESSOR_ARQUIVO}: {e}")
+        try:
+            arquivo = db[politica.arquivo]
+            arquivo.create_index([("telefone", ASCENDING)], name="telefone_idx")
+            arquivo.create_index([(politica.campo_data, ASCENDING)], name=f"{politica.campo_data}_idx")
+        except Exception as e:
+            logger.warning(f"RETENCAO: ⚠️ Falha ao criar índices de '{politica.arquivo}': {e}")
+
+    try:
+        frios = db[COLECAO_CONTEXTOS_FRIOS]
+        frios.create_index([("tel", ASCENDING)], name="tel_unique_idx", unique=True)
+        frios.create_index([("congelado_em", ASCENDING)], name="congelado_em_idx")
+        # Público de campanhas (core/campanhas.py) também pagina a camada fria
+        frios.create_index([("estado", ASCENDING), ("tel", ASCENDING)], name="estado_tel_idx")
+        frios.create_index([("tags", ASCENDING), ("tel", ASCENDING)], name="tags_tel_idx", sparse=True)
+    except Exception as e:
+        logger.warning(f"RETENCAO: ⚠️ Falha ao criar índices de '{COLECAO_CONTEXTOS_FRIOS}': {e}")
+
+    for nome, (campo, dias) in TTL.items():
+        _garantir_ttl(db, nome, campo, dias)
+
+
+def _garantir_ttl(db, nome: str, campo: str, dias: int) -> None:
+    indice = f"{campo}_ttl_idx"
+    try:
+        atual = db[nome].index_information().get(indice)
+        if dias <= 0:
+            if atual:
+                db[nome].drop_index(indice)
+                logger.info(f"RETENCAO: TTL de '{nome}' desativado.")
+            return
+        segundos = dias * 86400
+        if atual is None:
+            db[nome].create_index([(campo, ASCENDING)], name=indice, expireAfterSeconds=segundos)
+            logger.info(f"RETENCAO: ✅ TTL de {dias} dia(s) criado em '{nome}.{campo}'.")
+        elif atual.get("expireAfterSeconds") != segundos:
+            db.command("collMod", nome, index={"name": indice, "expireAfterSeconds": segundos})
+            logger.info(f"RETENCAO: ✅ TTL de '{nome}.{campo}' ajustado para {dias} dia(s).")
+    except OperationFailure as e:
+        logger.warning(f"RETENCAO: ⚠️ Falha ao ajustar TTL de '{nome}': {e}")
+    except Exception as e:
+        logger.error(f"RETENCAO: ❌ Erro ao ajustar TTL de '{nome}': {e}")
+
+
+# ----------------------------------------------------------------------
+# Movimentação e purga em lotes
+def _bytes(docs: List[Dict[str, Any]]) -> int:
+    return sum(len(bson.encode(d)) for d in docs)
+
+
+async def _arquivar_lote(politica: Politica, corte: datetime) -> tuple:
+    """Copia um lote para o arquivo e só então remove da coleção viva. Retorna (docs, bytes)."""
+    origem = banco.colecao(politica.colecao)
+    filtro = {politica.campo_data: {"$lt": corte}}
+    docs = await origem.find(filtro).sort(politica.campo_data, ASCENDING).limit(TAMANHO_LOTE).to_list(length=TAMANHO_LOTE)
+    if not docs:
+        return 0, 0
+    try:
+        await banco.colecao(politica.arquivo, "duravel").insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        # _id duplicado = lote já copiado numa execução interrompida; o resto é erro de verdade
+        outros = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if outros or e.details.get("writeConcernErrors"):
+            raise
+    resultado = await origem.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+    return resultado.deleted_count, _bytes(docs)
+
+
+async def purgar(nome: str, filtro: Dict[str, Any], *, lote: int = TAMANHO_LOTE,
+                 pausa_s: float = PAUSA_ENTRE_LOTES_S, max_lotes: Optional[int] = None) -> int:
+    """delete_many em lotes de `_id` com pausa entre eles. Retorna quantos documentos saíram."""
+    colecao = banco.colecao(nome)
+    total = 0
+    lotes = 0
+    while max_lotes is None or lotes < max_lotes:
+        ids = [d["_id"] for d in await colecao.find(filtro, {"_id": 1}).limit(lote).to_list(length=lote)]
+        if not ids:
+            break
+        total += (await colecao.delete_many({"_id": {"$in": ids}})).deleted_count
+        lotes += 1
+        if len(ids) < lote:
+            break
+        await asyncio.sleep(pausa_s)
+    if total:
+        DOCS_RETENCAO.labels(nome, "purgado").inc(total)
+    return total
+
+
+async def _tamanho(nome: str) -> Dict[str, int]:
+    try:
+        stats = await banco.db().command("collStats", nome)
+        return {k: int(stats.get(k, 0)) for k in ("count", "size", "storageSize", "freeStorageSize")}
+    except Exception:
+        return {}
+
+
+async def _aplicar_politica(politica: Politica, agora: datetime) -> Dict[str, Any]:
+    antes = await _tamanho(politica.colecao)
+    corte = agora - timedelta(days=politica.janela_dias)
+    movidos = bytes_liberados = lotes = 0
+    while lotes < MAX_LOTES_POR_EXECUCAO:
+        n, b = await _arquivar_lote(politica, corte)
+        if not n:
+            break
+        movidos += n
+        bytes_liberados += b
+        lotes += 1
+        await asyncio.sleep(PAUSA_ENTRE_LOTES_S)
+    if movidos:
+        DOCS_RETENCAO.labels(politica.colecao, "arquivado").inc(movidos)
+        BYTES_LIBERADOS.labels(politica.colecao).inc(bytes_liberados)
+
+    purgados_arquivo = 0
+    if ARQUIVO_DIAS > 0:
+        corte_arquivo = agora - timedelta(days=ARQUIVO_DIAS)
+        purgados_arquivo = await purgar(
+            politica.arquivo, {politica.campo_data: {"$lt": corte_arquivo}}, max_lotes=MAX_LOTES_POR_EXECUCAO
+        )
+
+    return {
+        "arquivados": movidos,
+        "bytes_liberados": bytes_liberados,
+        "lotes": lotes,
+        "incompleto": lotes >= MAX_LOTES_POR_EXECUCAO,
+        "purgados_arquivo": purgados_arquivo,
+        "tamanho_antes": antes,
+        "tamanho_depois": await _tamanho(politica.colecao),
+    }
+
+
+# ----------------------------------------------------------------------
+# Camadas de contexto (quente: `contextos` / fria: `contextos_frios`)
+def _filtro_frios(agora: datetime) -> Dict[str, Any]:
+    condicoes: List[Dict[str, Any]] = []
+    if CONTEXTO_FRIO_DIAS > 0:
+        condicoes.append({"ts": {"$lt": agora - timedelta(days=CONTEXTO_FRIO_DIAS)}})
+    if ESTADOS_TERMINAIS:
+        condicoes.append({
+            "estado": {"$in": ESTADOS_TERMINAIS},
+            "ts": {"$lt": agora - timedelta(hours=CONTEXTO_FRIO_TERMINAL_HORAS)},
+        })
+    return {"$or": condicoes} if condicoes else {}
+
+
+def _mesma_versao(doc: Dict[str, Any]) -> Dict[str, Any]:
+    if "versao" in doc:
+        return {"_id": doc["_id"], "versao": doc["versao"]}
+    return {"_id": doc["_id"], "versao": {"$exists": False}}
+
+
+async def _congelar_lote(filtro: Dict[str, Any], pulados: set, agora: datetime) -> tuple:
+    """Move um lote de contextos para a camada fria. Retorna (lidos, congelados)."""
+    quentes = banco.colecao("contextos")
+    frios = banco.colecao(COLECAO_CONTEXTOS_FRIOS, "duravel")
+    consulta = dict(filtro)
+    if pulados:
+        consulta["tel"] = {"$nin": list(pulados)}
+    docs = await quentes.find(consulta).limit(TAMANHO_LOTE).to_list(length=TAMANHO_LOTE)
+    if not docs:
+        return 0, 0
+    # Conversa com entrada no cache está ativa agora: fica quente
+    ativos = {d.get("tel") for d in docs if d.get("tel") in cache_contextos}
+    pulados.update(ativos)
+    docs = [d for d in docs if d.get("tel") not in ativos]
+    if not docs:
+        return len(ativos), 0
+
+    for d in docs:
+        d["congelado_em"] = agora
+    lidos = len(docs) + len(ativos)
+    try:
+        await frios.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        outros = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if outros or e.details.get("writeConcernErrors"):
+            raise
+        # Já há cópia fria do telefone (movimentação interrompida): a quente não é apagada
+        repetidos = {err["index"] for err in e.details.get("writeErrors", [])}
+        pulados.update(docs[i].get("tel") for i in repetidos)
+        docs = [d for i, d in enumerate(docs) if i not in repetidos]
+        logger.warning(f"RETENCAO: ⚠️ {len(repetidos)} contexto(s) já com cópia na camada fria mantidos na quente.")
+        if not docs:
+            return lidos, 0
+
+    # Só sai da camada quente se não mudou desde a leitura (mesma `versao`)
+    await quentes.bulk_write([DeleteOne(_mesma_versao(d)) for d in docs], ordered=False)
+    ids = [d["_id"] for d in docs]
+    mudaram = {d["_id"] for d in await quentes.find({"_id": {"$in": ids}}, {"_id": 1}).to_list(length=len(ids))}
+    if mudaram:
+        await frios.delete_many({"_id": {"$in": list(mudaram)}})
+        pulados.update(d.get("tel") for d in docs if d["_id"] in mudaram)
+        CONTEXTOS_CAMADA.labels("devolvido").inc(len(mudaram))
+
+    # Mensagem chegou durante a movimentação: volta já para a camada quente
+    congelados = [d for d in docs if d["_id"] not in mudaram]
+    for d in congelados:
+        if d.get("tel") in cache_contextos:
+            await reidratar(d["tel"])
+    CONTEXTOS_CAMADA.labels("congelado").inc(len(congelados))
+    return lidos, len(congelados)
+
+
+async def congelar_contextos(agora: Optional[datetime] = None) -> Dict[str, Any]:
+    """Move contextos ociosos/terminais para `contextos_frios`, em lotes."""
+    agora = agora or datetime.now(timezone.utc)
+    filtro = _filtro_frios(agora)
+    if not filtro:
+        return {"congelados": 0}
+    antes = await _tamanho("contextos")
+    pulados: set = set()
+    total = lotes = 0
+    while lotes < MAX_LOTES_POR_EXECUCAO:
+        lidos, congelados = await _congelar_lote(filtro, pulados, agora)
+        if not lidos:
+            break
+        total += congelados
+        lotes += 1
+        await asyncio.sleep(PAUSA_ENTRE_LOTES_S)
+    return {
+        "congelados": total,
+        "lotes": lotes,
+        "incompleto": lotes >= MAX_LOTES_POR_EXECUCAO,
+        "tamanho_antes": antes,
+        "tamanho_depois": await _tamanho("contextos"),
+    }
+
+
+def _completar(quente: Dict[str, Any], frio: Dict[str, Any]) -> None:
+    """Acrescenta ao documento quente o que só o frio tem (o quente prevalece campo a campo)."""
+    for chave, valor in frio.items():
+        if chave not in quente:
+            quente[chave] = valor
+        elif isinstance(quente[chave], dict) and isinstance(valor, dict):
+            _completar(quente[chave], valor)
+
+
+async def _mesclar_na_quente(doc: Dict[str, Any]) -> bool:
+    """Já existe documento quente do telefone (reidratado por outra requisição ou criado
+    por uma escrita com upsert depois do congelamento): completa-o com o frio. False se
+    não conseguiu gravar a mescla (o frio fica para a próxima tentativa)."""
+    quentes = banco.colecao("contextos")
+    for _ in range(3):
+        quente = await quentes.find_one({"tel": doc["tel"]})
+        if quente is None:
+            return False
+        if quente["_id"] == doc["_id"]:
+            return True  # a mesma cópia, já reidratada
+        mesclado = dict(quente)
+        _completar(mesclado, {k: v for k, v in doc.items() if k != "_id"})
+        mesclado["versao"] = int(quente.get("versao") or 0) + 1
+        if (await quentes.replace_one(_mesma_versao(quente), mesclado)).matched_count:
+            logger.warning(f"RETENCAO: ⚠️ {doc['tel']}: documento quente parcial completado com a camada fria.")
+            return True
+    return False
+
+
+async def reidratar(telefone: str) -> bool:
+    """Traz um contexto da camada fria de volta para `contextos`. True se havia contexto frio."""
+    frios = banco.colecao(COLECAO_CONTEXTOS_FRIOS)
+    doc = await frios.find_one({"tel": telefone})
+    if not doc:
+        return False
+    doc.pop("congelado_em", None)
+    try:
+        await banco.colecao("contextos").insert_one(doc)
+    except DuplicateKeyError:
+        # Só apaga o frio depois que o conteúdo dele está na camada quente
+        if not await _mesclar_na_quente(doc):
+            logger.error(f"RETENCAO: ❌ Contexto frio de {telefone} não mesclado ao quente; mantido na camada fria.")
+            return True
+    await frios.delete_one({"_id": doc["_id"]})
+    CONTEXTOS_CAMADA.labels("reidratado").inc()
+    logger.info(f"RETENCAO: Contexto de {telefone} reidratado da camada fria.")
+    return True
+
+
+async def atualizar_contextos(filtro: Dict[str, Any], atualizacao: Dict[str, Any]) -> int:
+    """update_many nas duas camadas, para escritas que valem também para conversa
+    congelada (tags, opt-out). A fria primeiro: contexto reidratado no meio do caminho
+    leva a alteração consigo ou já está na quente. Retorna documentos alterados."""
+    frios = await banco.colecao(COLECAO_CONTEXTOS_FRIOS, "duravel").update_many(filtro, atualizacao)
+    quentes = await banco.colecao("contextos", "duravel").update_many(filtro, atualizacao)
+    return frios.modified_count + quentes.modified_count
+
+
+async def executar() -> Dict[str, Any]:
+    """Job de retenção: arquiva o que saiu da janela quente e expira o arquivo antigo."""
+    global ultimo_relatorio
+    inicio = time.monotonic()
+    agora = datetime.now(timezone.utc)
+    relatorio: Dict[str, Any] = {"executado_em": agora.isoformat(), "colecoes": {}}
+    for politica in POLITICAS:
+        if politica.janela_dias <= 0:
+            continue
+        try:
+            resumo = await _aplicar_politica(politica, agora)
+            relatorio["colecoes"][politica.colecao] = resumo
+            if resumo["arquivados"] or resumo["purgados_arquivo"]:
+                logger.info(
+                    f"RETENCAO: ✅ '{politica.colecao}': {resumo['arquivados']} arquivados "
+                    f"({resumo['bytes_liberados'] / 1_048_576:.1f} MiB liberados), "
+                    f"{resumo['purgados_arquivo']} expirados do arquivo."
+                )
+        except Exception as e:
+            logger.exception(f"RETENCAO: ❌ Falha ao aplicar retenção em '{politica.colecao}': {e}")
+            relatorio["colecoes"][politica.colecao] = {"erro": str(e)}
+    try:
+        relatorio["contextos"] = await congelar_contextos(agora)
+    except Exception as e:
+        logger.exception(f"RETENCAO: ❌ Falha ao mover contextos para a camada fria: {e}")
+        relatorio["contextos"] = {"erro": str(e)}
+    relatorio["duracao_s"] = round(time.monotonic() - inicio, 2)
+    relatorio["bytes_liberados"] = sum(c.get("bytes_liberados", 0) for c in relatorio["colecoes"].values())
+    ultimo_relatorio = relatorio
+    return relatorio
+
+
+def estado() -> Dict[str, Any]:
+    return {
+        "janelas_dias": {p.colecao: p.janela_dias for p in POLITICAS},
+        "ttl_dias": {nome: dias for nome, (_, dias) in TTL.items()},
+        "arquivo_dias": ARQUIVO_DIAS,
+        "contexto_frio": {"dias": CONTEXTO_FRIO_DIAS, "estados_terminais": ESTADOS_TERMINAIS},
+        "ultimo_relatorio": ultimo_relatorio,
+    }
@@ -4,16 +4,43 @@
 # - Implementa follow-up para qualificação parada.
 # - Implementa follow-up para pagamento pendente.
 # - Usa flags no contexto para evitar envios repetidos.
+# - Follow-ups disparam no vencimento (`proximo_followup_em`, via
+#   core/temporizador.py), não por varredura horária; uma semeadura
+#   diária agenda conversas que ainda não têm vencimento.
+# - Envios com concorrência limitada e teto de envios/s (token bucket);
+#   flags gravadas com bulk_write.
+# - Multi-worker: lease por job (core/lease.py) e reivindicação atômica
+#   de cada conversa antes do envio (find_one_and_update).
 # ===========================================================
 import asyncio
 import logging
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, List, Tuple
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from pymongo import MongoClient
+from prometheus_client import Counter, Histogram
+from pymongo import UpdateOne
 
 # Imports de configuração e agentes/orquestrador
-from app.config import MONGO_URI, settings # Usar settings para robustez
+from app.config import settings # Usar settings para robustez
+from app.core import banco # MongoDB assíncrono (não bloqueia o loop durante a job)
 from app.agents.domo_followup import DomoFollowUp
+from app.utils.variantes import gerar_pools, INTERVALO_JOB_MINUTOS as INTERVALO_VARIANTES_MINUTOS
+from app.core import retencao # Arquivamento/purga de dados fora da janela quente
+from app.core.lease import com_lease # Um worker por job quando há vários processos
+from app.core.outbox import remetente as remetente_outbox # Entregas presas de workers mortos
+from app.core import campanhas # Executores de campanha órfãos (restart/worker morto)
+from app.core import kanban # Quadro materializado (reconstrução de segurança)
+from app.core.temporizador import (
+    CAMPO_TIPO,
+    CAMPO_VENCIMENTO,
+    TIPOS_FOLLOWUP,
+    reagendar as reagendar_followup,
+    retirar as retirar_followup,
+    temporizador,
+)
+from app.utils.limitador import BaldeTokens
 # from app.core.mcp_orquestrador import MCPOrquestrador # Descomentar se usar orquestrador
 
 logger = logging.getLogger("famdomes.scheduler")
@@ -28,144 +55,268 @@ except Exception as e:
     sched = AsyncIOScheduler(timezone="UTC")
 
 
-# Intervalos de verificação e follow-up (em horas)
-INTERVALO_CHECK_JOB_HORAS = getattr(settings, "SCHEDULER_CHECK_INTERVAL_HOURS", 1)
-INTERVALO_FOLLOWUP_QUALIFICACAO_HORAS = getattr(settings, "SCHEDULER_FOLLOWUP_QUAL_HOURS", 4)
-INTERVALO_FOLLOWUP_PAGAMENTO_HORAS = getattr(settings, "SCHEDULER_FOLLOWUP_PAY_HOURS", 24)
+# Tipos de follow-up (estados, prazo, intent, flag) ficam em core/temporizador.py.
+# Semeadura: agenda conversas sem `proximo_followup_em` (dados antigos ou
+# gravados fora do salvar_contexto) — rede de segurança, não o disparo.
+INTERVALO_SEMEADURA_HORAS = float(getattr(settings, "FOLLOWUP_SEMEADURA_INTERVALO_HORAS", 24))
+INTERVALO_KANBAN_HORAS = float(getattr(settings, "KANBAN_RECONSTRUCAO_INTERVALO_HORAS", 24))
 
-# Intents a serem usadas para o follow-up (devem existir nos JSONs)
-INTENT_FOLLOWUP_QUALIFICACAO = "FOLLOW_UP_QUALIFICACAO"
-INTENT_FOLLOWUP_PAGAMENTO = "FOLLOW_UP_24H" # Ou outra intent específica
+# Despacho dos follow-ups: envios simultâneos, teto de envios/s e lote das flags
+FOLLOWUP_CONCORRENCIA = int(getattr(settings, "FOLLOWUP_CONCORRENCIA", 20))
+FOLLOWUP_MAX_POR_SEGUNDO = float(getattr(settings, "FOLLOWUP_MAX_POR_SEGUNDO", 10))
+FOLLOWUP_LOTE_FLAGS = int(getattr(settings, "FOLLOWUP_LOTE_FLAGS", 200))
+FOLLOWUP_REIVINDICACAO_EXPIRA_MIN = float(getattr(settings, "FOLLOWUP_REIVINDICACAO_EXPIRA_MIN", 30))
+FOLLOWUP_REPETIR_APOS_S = float(getattr(settings, "FOLLOWUP_REPETIR_APOS_S", 900))
+limitador_followup = BaldeTokens(FOLLOWUP_MAX_POR_SEGUNDO)
 
-# Estados que indicam qualificação/pitch em andamento
-ESTADOS_QUALIFICACAO_ATIVOS = [
-    "MICRO_COMPROMISSO", # Durante as perguntas
-    "PITCH_PLANO1",      # Após apresentar plano 1
-    "PITCH_PLANO3",      # Após apresentar plano 3
-    "COMERCIAL_DETALHES_PLANO" # Após dar detalhes
-]
-# Estado que indica link de pagamento enviado
-ESTADO_AGUARDANDO_PAGAMENTO = "AGUARDANDO_PAGAMENTO" # Ou "CALL_TO_ACTION" se for o último antes do link
+FOLLOWUPS = Counter("domo_followup_total", "Follow-ups processados", ["tipo", "resultado"])
+DURACAO_FOLLOWUP = Histogram(
+    "domo_followup_execucao_segundos", "Duração de cada despacho de follow-ups", ["tipo"],
+    buckets=(1, 5, 15, 60, 300, 900, 1800, 3600),
+)
+ultima_execucao: dict = {}
 
-async def _job_verificar_followups():
+def _executar_envio(tel: str, intent: str):
+    """Dispara o agente de follow-up (mensagem de sistema: sentimento/mensagem vazios)."""
+    agente_followup = DomoFollowUp(intent=intent, sentimento={})
+    return agente_followup.executar(telefone=tel, mensagem_original="")
+
+
+def _campo_reivindicacao(tipo: str) -> str:
+    return f"meta_conversa.followup_{tipo}_reivindicado_em"
+
+
+async def _reivindicar(col_contextos, tel: str, tipo: str, flag: str) -> bool:
     """
-    Job executado periodicamente para verificar usuários que precisam de follow-up.
+    Marca a conversa como "em envio" ANTES de enviar. Só um worker consegue;
+    uma reivindicação antiga (worker morreu no meio) pode ser retomada.
     """
-    logger.info("SCHEDULER: Iniciando verificação de follow-ups...")
+    agora = datetime.now(timezone.utc)
+    campo = _campo_reivindicacao(tipo)
+    doc = await col_contextos.find_one_and_update(
+        {
+            "tel": tel,
+            f"meta_conversa.{flag}": {"$ne": True},
+            "$or": [
+                {campo: {"$exists": False}},
+                {campo: {"$lt": agora - timedelta(minutes=FOLLOWUP_REIVINDICACAO_EXPIRA_MIN)}},
+            ],
+        },
+        {"$set": {campo: agora}, "$inc": {"versao": 1}},
+        projection={"_id": 1},
+    )
+    return doc is not None
+
+
+async def _desistir(col_contextos, tel: str, tipo: str) -> None:
+    """Envio falhou: solta a reivindicação e devolve o follow-up ao temporizador."""
     try:
-        mongo = MongoClient(MONGO_URI)
-        db = mongo["famdomes"] # Usar nome do DB de settings se disponível
-        col_contextos = db["contextos"]
+        await col_contextos.update_one(
+            {"tel": tel}, {"$unset": {_campo_reivindicacao(tipo): ""}, "$inc": {"versao": 1}}
+        )
+        await reagendar_followup(tel, tipo, FOLLOWUP_REPETIR_APOS_S)
     except Exception as e:
-        logger.exception(f"SCHEDULER: Erro ao conectar ao MongoDB: {e}")
-        return # Aborta a job se não conectar ao DB
+        logger.warning(f"SCHEDULER: ⚠️ Falha ao soltar reivindicação de {tipo} de {tel}: {e}")
 
-    agora_utc = datetime.now(timezone.utc)
-    # orquestrador = MCPOrquestrador() # Instanciar se for chamar via orquestrador
 
-    # --- 1. Follow-up para Qualificação Incompleta ---
-    try:
-        limite_qualificacao = agora_utc - timedelta(hours=INTERVALO_FOLLOWUP_QUALIFICACAO_HORAS)
-        filtro_qualificacao = {
-            "estado": {"$in": ESTADOS_QUALIFICACAO_ATIVOS},
-            "ts": {"$lt": limite_qualificacao}, # Última interação foi há muito tempo
-            # Verifica se o follow-up específico JÁ foi enviado
-            "meta_conversa.followup_qualificacao_enviado": {"$ne": True}
-        }
-        # Busca apenas o telefone para evitar carregar dados desnecessários
-        usuarios_qualificacao = list(col_contextos.find(filtro_qualificacao, {"tel": 1, "_id": 0}))
-        logger.info(f"SCHEDULER: {len(usuarios_qualificacao)} usuários encontrados para follow-up de qualificação.")
-
-        for user_data in usuarios_qualificacao:
-            tel = user_data.get("tel")
-            if not tel: continue
-
-            logger.info(f"SCHEDULER: Enviando follow-up de qualificação para {tel}")
-            try:
-                # --- Execução do Agente de Follow-up ---
-                # Opção 1: Chamar diretamente o agente (mais simples)
-                agente_followup = DomoFollowUp(intent=INTENT_FOLLOWUP_QUALIFICACAO, sentimento={}) # Sentimento vazio para msg de sistema
-                await agente_followup.executar(telefone=tel, mensagem_original="") # Mensagem original vazia
-
-                # Opção 2: Chamar via Orquestrador (garante fluxo completo, mais complexo)
-                # await orquestrador.processar_mensagem(tel, f"trigger:{INTENT_FOLLOWUP_QUALIFICACAO}")
-
-                # --- Marcar Follow-up como Enviado ---
-                # Atualiza a flag DENTRO da meta_conversa para evitar poluir o doc principal
-                col_contextos.update_one(
-                    {"tel": tel},
-                    {"$set": {"meta_conversa.followup_qualificacao_enviado": True}}
-                )
-                await asyncio.sleep(0.1) # Pequena pausa para não sobrecarregar
-
-            except Exception as e:
-                logger.error(f"SCHEDULER: Erro ao processar follow-up de qualificação para {tel}: {e}")
+async def _gravar_flags(col_contextos, tels: list, tipo: str, flag: str) -> None:
+    if not tels:
+        return
+    # Flag DENTRO da meta_conversa; versão avisa o cache de contextos
+    await col_contextos.bulk_write(
+        [
+            UpdateOne(
+                {"tel": tel},
+                {"$set": {f"meta_conversa.{flag}": True}, "$unset": {_campo_reivindicacao(tipo): ""}, "$inc": {"versao": 1}},
+            )
+            for tel in tels
+        ],
+        ordered=False,
+    )
 
-    except Exception as e:
-        logger.exception(f"SCHEDULER: Erro geral ao buscar usuários para follow-up de qualificação: {e}")
 
+async def _despachar_followups(tipo: str, candidatos: AsyncIterator[str]) -> dict:
+    """
+    Consome os candidatos aos poucos (sem montar a lista toda), envia com
+    concorrência limitada e sob o balde de tokens, e grava as flags em lote.
+    """
+    intent, flag = TIPOS_FOLLOWUP[tipo].intent, TIPOS_FOLLOWUP[tipo].flag
+    col_contextos = banco.colecao("contextos")
+    inicio = time.monotonic()
+    semaforo = asyncio.Semaphore(FOLLOWUP_CONCORRENCIA)
+    tarefas: set = set()
+    enviados: list = []
+    stats = {"candidatos": 0, "enviados": 0, "falhas": 0, "ja_reivindicados": 0}
 
-    # --- 2. Follow-up para Pagamento Pendente ---
-    try:
-        limite_pagamento = agora_utc - timedelta(hours=INTERVALO_FOLLOWUP_PAGAMENTO_HORAS)
-        filtro_pagamento = {
-            "estado": ESTADO_AGUARDANDO_PAGAMENTO,
-            "ts": {"$lt": limite_pagamento},
-            "meta_conversa.followup_pagamento_enviado": {"$ne": True}
-        }
-        usuarios_pagamento = list(col_contextos.find(filtro_pagamento, {"tel": 1, "_id": 0}))
-        logger.info(f"SCHEDULER: {len(usuarios_pagamento)} usuários encontrados para follow-up de pagamento.")
-
-        for user_data in usuarios_pagamento:
-            tel = user_data.get("tel")
-            if not tel: continue
-
-            logger.info(f"SCHEDULER: Enviando follow-up de pagamento para {tel}")
-            try:
-                # --- Execução do Agente de Follow-up ---
-                agente_followup = DomoFollowUp(intent=INTENT_FOLLOWUP_PAGAMENTO, sentimento={})
-                await agente_followup.executar(telefone=tel, mensagem_original="")
-
-                # --- Marcar Follow-up como Enviado ---
-                col_contextos.update_one(
-                    {"tel": tel},
-                    {"$set": {"meta_conversa.followup_pagamento_enviado": True}}
-                )
-                await asyncio.sleep(0.1)
-
-            except Exception as e:
-                logger.error(f"SCHEDULER: Erro ao processar follow-up de pagamento para {tel}: {e}")
+    async def _enviar(tel: str) -> None:
+        reivindicado = False
+        try:
+            if not await _reivindicar(col_contextos, tel, tipo, flag):
+                stats["ja_reivindicados"] += 1  # outro worker já está enviando / já enviou
+                FOLLOWUPS.labels(tipo, "ja_reivindicado").inc()
+                return
+            reivindicado = True
+            await limitador_followup.aguardar()
+            logger.debug(f"SCHEDULER: Enviando follow-up de {tipo} para {tel}")
+            if not await _executar_envio(tel, intent):
+                # Nem a resposta nem a entrada do outbox foram gravadas: nada saiu
+                stats["falhas"] += 1
+                FOLLOWUPS.labels(tipo, "falha").inc()
+                logger.error(f"SCHEDULER: ❌ Follow-up de {tipo} para {tel} não foi gravado; volta ao temporizador.")
+                await _desistir(col_contextos, tel, tipo)
+                return
+            enviados.append(tel)
+            stats["enviados"] += 1
+            FOLLOWUPS.labels(tipo, "enviado").inc()
+        except Exception as e:
+            stats["falhas"] += 1
+            FOLLOWUPS.labels(tipo, "falha").inc()
+            logger.error(f"SCHEDULER: Erro ao processar follow-up de {tipo} para {tel}: {e}")
+            if reivindicado:
+                await _desistir(col_contextos, tel, tipo)
+        finally:
+            semaforo.release()
 
-    except Exception as e:
-        logger.exception(f"SCHEDULER: Erro geral ao buscar usuários para follow-up de pagamento: {e}")
+    async for tel in candidatos:
+        stats["candidatos"] += 1
+        await semaforo.acquire()  # segura a leitura dos candidatos quando todos os slots estão ocupados
+        tarefa = asyncio.create_task(_enviar(tel))
+        tarefas.add(tarefa)
+        tarefa.add_done_callback(tarefas.discard)
+        if len(enviados) >= FOLLOWUP_LOTE_FLAGS:
+            lote, enviados[:] = list(enviados), []
+            await _gravar_flags(col_contextos, lote, tipo, flag)
+
+    if tarefas:
+        await asyncio.gather(*tarefas)
+    await _gravar_flags(col_contextos, enviados, tipo, flag)
+
+    duracao = time.monotonic() - inicio
+    DURACAO_FOLLOWUP.labels(tipo).observe(duracao)
+    stats["duracao_s"] = round(duracao, 2)
+    stats["envios_por_s"] = round(stats["enviados"] / duracao, 2) if duracao > 0 else 0.0
+    logger.info(
+        f"SCHEDULER: ✅ Follow-up de {tipo}: {stats['enviados']}/{stats['candidatos']} enviados, "
+        f"{stats['falhas']} falha(s) em {stats['duracao_s']}s ({stats['envios_por_s']} envios/s)."
+    )
+    return stats
+
+
+async def _disparar_vencidos(vencidos: List[Tuple[str, str, datetime]]) -> None:
+    """Callback do temporizador: follow-ups que acabaram de vencer."""
+    por_tipo: Dict[str, list] = defaultdict(list)
+    for tel, tipo, vencimento in vencidos:
+        por_tipo[tipo].append((tel, vencimento))
+
+    for tipo, itens in por_tipo.items():
+        async def _retirados(itens=itens):
+            # Só segue quem ainda está com este vencimento (não reagendou, outro worker não levou)
+            for tel, vencimento in itens:
+                if await retirar_followup(tel, vencimento):
+                    yield tel
+        try:
+            ultima_execucao[tipo] = await _despachar_followups(tipo, _retirados())
+        except Exception as e:
+            logger.exception(f"SCHEDULER: Erro geral ao disparar follow-ups de {tipo}: {e}")
+
+
+async def _job_semear_followups():
+    """Agenda o follow-up das conversas elegíveis que ainda não têm vencimento."""
+    col_contextos = banco.colecao("contextos")
+    for tipo in TIPOS_FOLLOWUP.values():
+        try:
+            resultado = await col_contextos.update_many(
+                {
+                    "estado": {"$in": list(tipo.estados)},
+                    CAMPO_VENCIMENTO: {"$exists": False},
+                    f"meta_conversa.{tipo.flag}": {"$ne": True},
+                    "ts": {"$type": "date"},
+                },
+                [{"$set": {
+                    CAMPO_VENCIMENTO: {"$add": ["$ts", int(tipo.horas * 3_600_000)]},
+                    CAMPO_TIPO: tipo.nome,
+                    "versao": {"$add": [{"$ifNull": ["$versao", 0]}, 1]},  # avisa o cache de contextos
+                }}],
+            )
+            if resultado.modified_count:
+                logger.info(f"SCHEDULER: {resultado.modified_count} conversa(s) agendadas para follow-up de {tipo.nome}.")
+        except Exception as e:
+            logger.exception(f"SCHEDULER: Erro ao semear follow-ups de {tipo.nome}: {e}")
 
-    # --- Limpeza de Flags Antigas (Opcional) ---
-    # Para permitir novos follow-ups após um tempo, pode-se remover as flags
-    # Ex: Remover flags de follow-up de qualificação após 3 dias
-    # limite_limpeza = agora_utc - timedelta(days=3)
-    # col_contextos.update_many(
-    #     {"meta_conversa.followup_qualificacao_enviado": True, "ts": {"$lt": limite_limpeza}},
-    #     {"$unset": {"meta_conversa.followup_qualificacao_enviado": ""}}
-    # )
 
-    logger.info("SCHEDULER: Verificação de follow-ups concluída.")
+def estado() -> dict:
+    return {
+        "ultima_execucao": ultima_execucao,
+        "limitador": limitador_followup.estado(),
+        "temporizador": temporizador.estado(),
+    }
 
 
 def iniciar():
     """Adiciona a job ao scheduler e o inicia, se ainda não estiver rodando."""
     if not sched.running:
         try:
-            # Adiciona a job para rodar a cada X horas
+            # Follow-ups disparam pelo temporizador (core/temporizador.py) no vencimento
+            temporizador.iniciar(_disparar_vencidos)
+            # Cada worker tem seu scheduler; o lease (core/lease.py) garante um executor por job
             sched.add_job(
-                _job_verificar_followups,
+                com_lease("semear_followups", reter_s=INTERVALO_SEMEADURA_HORAS * 1800)(_job_semear_followups),
                 "interval",
-                hours=INTERVALO_CHECK_JOB_HORAS,
-                id="verificar_followups_diarios", # ID único para a job
+                hours=INTERVALO_SEMEADURA_HORAS,
+                id="semear_followups",
                 replace_existing=True, # Substitui se já existir com mesmo ID
                 next_run_time=datetime.now(pytz.timezone(TIMEZONE_SCHEDULER)) + timedelta(seconds=15) # Roda logo após iniciar
             )
+            # Job para completar os pools de variações de frases pré-geradas
+            sched.add_job(
+                com_lease("gerar_variantes_frases", reter_s=INTERVALO_VARIANTES_MINUTOS * 30)(gerar_pools),
+                "interval",
+                minutes=INTERVALO_VARIANTES_MINUTOS,
+                id="gerar_variantes_frases",
+                replace_existing=True,
+                next_run_time=datetime.now(pytz.timezone(TIMEZONE_SCHEDULER)) + timedelta(seconds=30)
+            )
+            # Job de retenção (arquiva respostas_ia/historico antigos em lotes)
+            sched.add_job(
+                com_lease("retencao_arquivamento", reter_s=retencao.INTERVALO_HORAS * 1800)(retencao.executar),
+                "interval",
+                hours=retencao.INTERVALO_HORAS,
+                id="retencao_arquivamento",
+                replace_existing=True,
+                max_instances=1,
+                next_run_time=datetime.now(pytz.timezone(TIMEZONE_SCHEDULER)) + timedelta(minutes=5)
+            )
+            # Outbox: devolve à fila entregas reivindicadas por workers que morreram
+            sched.add_job(
+                com_lease("outbox_recuperar_vencidas", reter_s=30)(remetente_outbox.recuperar_vencidas),
+                "interval",
+                minutes=1,
+                id="outbox_recuperar_vencidas",
+                replace_existing=True,
+                max_instances=1,
+            )
+            # Campanhas em execução sem executor (cada campanha tem o próprio lease)
+            sched.add_job(
+                campanhas.retomar_orfas,
+                "interval",
+                minutes=1,
+                id="campanhas_retomar_orfas",
+                replace_existing=True,
+                max_instances=1,
+                next_run_time=datetime.now(pytz.timezone(TIMEZONE_SCHEDULER)) + timedelta(seconds=20)
+            )
+            # Quadro materializado: primeira carga e correção de escritas fora do salvar_contexto
+            sched.add_job(
+                com_lease("kanban_reconstruir", reter_s=INTERVALO_KANBAN_HORAS * 1800)(kanban.reconstruir),
+                "interval",
+                hours=INTERVALO_KANBAN_HORAS,
+                id="kanban_reconstruir",
+                replace_existing=True,
+                max_instances=1,
+                next_run_time=datetime.now(pytz.timezone(TIMEZONE_SCHEDULER)) + timedelta(seconds=25)
+            )
             sched.start()
-            logger.info(f"SCHEDULER: Agendador iniciado no timezone '{TIMEZONE_SCHEDULER}'. Verificações a cada {INTERVALO_CHECK_JOB_HORAS} hora(s).")
+            logger.info(f"SCHEDULER: Agendador iniciado no timezone '{TIMEZONE_SCHEDULER}'.")
         except Exception as e:
              logger.exception(f"SCHEDULER: Falha ao iniciar o agendador: {e}")
     else:
@@ -173,6 +324,7 @@ def iniciar():
 
 def parar():
     """Para o scheduler de forma graciosa."""
+    temporizador.parar()
     if sched.running:
         try:
             sched.shutdown()
@@ -0,0 +1,149 @@
+# ===========================================================
+# Arquivo: core/sincronizacao.py
+# Delta do dashboard: só o que mudou depois de um cursor.
+# - Cards: `kanban_cards` por `atualizado_em` (hora da gravação, índice
+#   atualizado_em+_id); lápides viram `removidos`.
+# - Mensagens: `respostas_ia` por `criado_em`, só das conversas pedidas
+#   (as abertas no painel), no mesmo formato de /conversations/{tel}.
+# - Cursor opaco com uma marca (ms, _id) por fluxo; paginação por chave,
+#   `mais` indica que há outra página.
+# - Ao alcançar o presente, a marca recua SYNC_SOBREPOSICAO_S: gravações
+#   de outros workers com hora um pouco anterior não se perdem (o cliente
+#   aplica por id, repetir é inofensivo).
+# - Sem cursor, ou cursor mais velho que as lápides: `completo` (recarregar
+#   o quadro e seguir com o cursor devolvido).
+# ===========================================================
+from __future__ import annotations
+
+import base64
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from app.config import settings
+from app.core import banco, retencao
+from app.core.kanban import COLECAO_CARDS
+
+logger = logging.getLogger("famdomes.sincronizacao")
+
+SOBREPOSICAO_S = float(getattr(settings, "SYNC_SOBREPOSICAO_S", 5))
+LIMITE = int(getattr(settings, "SYNC_LIMITE", 500))
+MAX_TELEFONES = int(getattr(settings, "SYNC_MAX_TELEFONES", 50))
+
+_PROJECAO_CARD = {"atualizado_em": 1, "tel": 1, "nome": 1, "estado": 1, "coluna": 1, "ts": 1, "snippet": 1,
+                  "sentimento": 1, "score_lead": 1, "risco": 1, "atendente_humano_necessario": 1, "removido": 1}
+_PROJECAO_TURNO = {"telefone": 1, "criado_em": 1, "mensagem_usuario": 1, "resposta_gerada": 1,
+                   "intent_detectada": 1, "enviado_por_humano": 1}
+
+Marca = Tuple[int, str]  # (epoch ms, _id)
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def _utc(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def _ms(dt: datetime) -> int:
+    return int(_utc(dt).timestamp() * 1000)
+
+
+def _de_ms(ms: int) -> datetime:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+def codificar(marcas: Dict[str, Marca]) -> str:
+    bruto = json.dumps({k: list(v) for k, v in marcas.items()}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+
+
+def decodificar(cursor: str) -> Dict[str, Marca]:
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        return {k: (int(v[0]), str(v[1])) for k, v in json.loads(bruto).items()}
+    except (ValueError, TypeError, IndexError, KeyError) as e:
+        raise CursorInvalido(f"Cursor inválido: {e}")
+
+
+async def _pagina(colecao, filtro: Dict[str, Any], campo: str, marca: Marca, id_tipado, projecao, limite: int,
+                  agora: datetime) -> Tuple[List[Dict[str, Any]], Marca, bool]:
+    """Documentos depois da marca, em ordem (campo, _id); devolve a próxima marca e se há mais."""
+    ms, ultimo_id = marca
+    ts = _de_ms(ms)
+    if ultimo_id:
+        filtro = {**filtro, "$or": [{campo: {"$gt": ts}}, {campo: ts, "_id": {"$gt": id_tipado(ultimo_id)}}]}
+    else:
+        filtro = {**filtro, campo: {"$gte": ts}}
+    docs = await colecao.find(filtro, projecao).sort([(campo, 1), ("_id", 1)]).limit(limite + 1).to_list(limite + 1)
+    mais = len(docs) > limite
+    docs = docs[:limite]
+    if not docs:
+        return docs, marca, False
+    ultimo = docs[-1]
+    proxima: Marca = (_ms(ultimo[campo]), str(ultimo["_id"]))
+    seguro = agora - timedelta(seconds=SOBREPOSICAO_S)
+    if not mais and _utc(ultimo[campo]) > seguro:
+        proxima = (min(proxima[0], _ms(seguro)), "")  # a janela recente é relida na próxima chamada
+    return docs, proxima, mais
+
+
+def _object_id(txt: str) -> ObjectId:
+    try:
+        return ObjectId(txt)
+    except InvalidId:
+        raise CursorInvalido(f"Cursor inválido: id {txt}")
+
+
+def _mensagens(turno: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Mesmos ids e campos de /dashboard/conversations/{tel} (usuário: `<id>_user`)."""
+    doc_id, criado_em = str(turno["_id"]), turno.get("criado_em")
+    saida = []
+    if turno.get("mensagem_usuario"):
+        saida.append({"id": f"{doc_id}_user", "telefone": turno.get("telefone"), "timestamp": criado_em,
+                      "sender": "user", "text": turno["mensagem_usuario"], "intent": turno.get("intent_detectada")})
+    if turno.get("resposta_gerada"):
+        saida.append({"id": doc_id, "telefone": turno.get("telefone"), "timestamp": criado_em,
+                      "sender": "human" if turno.get("enviado_por_humano") else "bot", "text": turno["resposta_gerada"]})
+    return saida
+
+
+async def delta(cursor: Optional[str], telefones: Optional[List[str]] = None, limite: int = LIMITE) -> Dict[str, Any]:
+    agora = datetime.now(timezone.utc)
+    inicio: Marca = (_ms(agora - timedelta(seconds=SOBREPOSICAO_S)), "")
+    marcas = decodificar(cursor) if cursor else {}
+    limite_lapides = agora - timedelta(days=retencao.KANBAN_REMOVIDOS_DIAS) if retencao.KANBAN_REMOVIDOS_DIAS > 0 else None
+    if "c" not in marcas or (limite_lapides is not None and _de_ms(marcas["c"][0]) < limite_lapides):
+        # Sem base para delta: o cliente recarrega o quadro e segue daqui
+        return {"cursor": codificar({"c": inicio, "m": inicio}), "completo": True,
+                "cards": [], "removidos": [], "mensagens": [], "mais": False}
+
+    cards, marcas["c"], mais_cards = await _pagina(
+        banco.colecao(COLECAO_CARDS, "painel"), {}, "atualizado_em", marcas["c"], str, _PROJECAO_CARD, limite, agora,
+    )
+    mensagens: List[Dict[str, Any]] = []
+    mais_mensagens = False
+    telefones = list(dict.fromkeys(telefones or []))[:MAX_TELEFONES]
+    if telefones:
+        turnos, marcas["m"], mais_mensagens = await _pagina(
+            banco.colecao("respostas_ia", "painel"), {"telefone": {"$in": telefones}}, "criado_em",
+            marcas.get("m", inicio), _object_id, _PROJECAO_TURNO, limite, agora,
+        )
+        for turno in turnos:
+            mensagens.extend(_mensagens(turno))
+    else:
+        marcas["m"] = inicio  # nenhuma conversa aberta: ao abrir, o cliente carrega a transcrição inteira
+
+    return {
+        "cursor": codificar(marcas),
+        "completo": False,
+        "cards": [{k: v for k, v in c.items() if k not in ("_id", "atualizado_em", "removido")} for c in cards if not c.get("removido")],
+        "removidos": [c["tel"] for c in cards if c.get("removido")],
+        "mensagens": mensagens,
+        "mais": mais_cards or mais_mensagens,
+    }
@@ -0,0 +1,190 @@
+# ===========================================================
+# Arquivo: core/status_entrega.py
+# Status de entrega do WhatsApp (sent, delivered, read, failed).
+# - O webhook só enfileira (`registrar`); o escritor em lote grava os
+#   eventos crus em `status_mensagens` com insert_many.
+# - Depois de cada lote: uma consulta por wamid no outbox traz agente,
+#   intent, recebido_em e criado_em; um bulk_write grava na entrada do
+#   outbox o primeiro horário de cada status e o status mais avançado.
+# - Status cuja wamid ainda não está no outbox (chegou antes de
+#   `_marcar_enviado`, ou mensagem que não saiu pelo outbox) fica em
+#   `status_sem_vinculo` (TTL curto, core/retencao.py). Quando o outbox
+#   grava a wamid (`apos_wamid`), `conciliar` aplica o que estava à espera.
+#   O lote reconfere o outbox depois de guardar os órfãos: a wamid gravada
+#   no meio do caminho não escapa de nenhum dos dois lados.
+# - Histogramas (só na primeira vez que cada status chega):
+#   recebido no webhook -> status, por agente/intent (o SLA de verdade);
+#   saída do outbox -> status, por agente (campanhas, sem mensagem de origem).
+# ===========================================================
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from prometheus_client import Counter, Histogram
+from pymongo import UpdateOne
+
+from app.config import settings
+from app.core import banco
+from app.core.escritor_lote import EscritorEmLote
+from app.core.outbox import COLECAO_OUTBOX, remetente as remetente_outbox
+
+logger = logging.getLogger("famdomes.status_entrega")
+
+COLECAO_STATUS = "status_mensagens"
+COLECAO_SEM_VINCULO = "status_sem_vinculo"
+
+# Status do WhatsApp -> (nível de progresso, campo com o primeiro horário na entrada do outbox)
+NIVEIS: Dict[str, tuple] = {
+    "sent": (1, "wa_enviado_em"),
+    "delivered": (2, "entregue_em"),
+    "read": (3, "lido_em"),
+    "failed": (4, "falhou_em"),
+}
+
+STATUS_RECEBIDOS = Counter("domo_whatsapp_status_total", "Status de entrega recebidos do WhatsApp", ["status"])
+FALHAS_ENTREGA = Counter("domo_whatsapp_falhas_entrega_total", "Status 'failed' por código de erro da Meta", ["codigo"])
+SEM_VINCULO = Counter("domo_whatsapp_status_sem_vinculo_total", "Status cujo wamid não está no outbox")
+CONCILIADOS = Counter("domo_whatsapp_status_conciliados_total", "Status vinculados depois que a wamid chegou ao outbox")
+_BUCKETS = (0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60, 120, 300, 900, 3600)
+LATENCIA_PONTA_A_PONTA = Histogram(
+    "domo_whatsapp_latencia_ponta_a_ponta_segundos",
+    "Da mensagem do usuário no webhook até o status da resposta no WhatsApp",
+    ["agente", "intent", "status"],
+    buckets=_BUCKETS,
+)
+LATENCIA_SAIDA = Histogram(
+    "domo_whatsapp_saida_ate_status_segundos",
+    "Da entrada no outbox até o status da mensagem no WhatsApp",
+    ["agente", "status"],
+    buckets=_BUCKETS,
+)
+
+
+def _utc(dt: Optional[datetime]) -> Optional[datetime]:
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def registrar(statuses: List[Dict[str, Any]]) -> int:
+    """Enfileira os `value.statuses` de um webhook. Não faz I/O. Retorna quantos entraram."""
+    aceitos = 0
+    for st in statuses or []:
+        status, wamid = st.get("status"), st.get("id")
+        if status not in NIVEIS or not wamid:
+            continue
+        try:
+            momento = datetime.fromtimestamp(int(st.get("timestamp")), tz=timezone.utc)
+        except (TypeError, ValueError):
+            momento = datetime.now(timezone.utc)
+        doc = {"wamid": wamid, "status": status, "telefone": st.get("recipient_id"), "timestamp": momento}
+        if st.get("errors"):
+            doc["erros"] = st["errors"]
+            for erro in st["errors"]:
+                FALHAS_ENTREGA.labels(codigo=str(erro.get("code", "?"))).inc()
+        STATUS_RECEBIDOS.labels(status=status).inc()
+        aceitos += escritor_status.adicionar(doc)
+    return aceitos
+
+
+def _resumir(eventos: List[Dict[str, Any]]):
+    """Primeiro horário de cada status por wamid + erros da Meta."""
+    primeiros: Dict[str, Dict[str, datetime]] = {}
+    erros: Dict[str, Any] = {}
+    for ev in eventos:
+        por_status = primeiros.setdefault(ev["wamid"], {})
+        momento = _utc(ev["timestamp"])
+        if ev["status"] not in por_status or momento < por_status[ev["status"]]:
+            por_status[ev["status"]] = momento
+        if ev.get("erros"):
+            erros[ev["wamid"]] = ev["erros"]
+    return primeiros, erros
+
+
+async def _aplicar(primeiros: Dict[str, Dict[str, datetime]], erros: Dict[str, Any]) -> set:
+    """Grava os status nas entradas do outbox e alimenta os histogramas. Retorna as wamids vinculadas."""
+    campos = {"wamid": 1, "agente": 1, "intent": 1, "recebido_em": 1, "criado_em": 1, "status_entrega_nivel": 1}
+    campos.update({campo: 1 for _, campo in NIVEIS.values()})
+    saidas = await banco.colecao(COLECAO_OUTBOX).find({"wamid": {"$in": list(primeiros)}}, campos).to_list(None)
+
+    operacoes = []
+    for saida in saidas:
+        agente = saida.get("agente") or "desconhecido"
+        intent = saida.get("intent") or "desconhecida"
+        recebido_em, criado_em = _utc(saida.get("recebido_em")), _utc(saida.get("criado_em"))
+        nivel_atual = saida.get("status_entrega_nivel") or 0
+        set_campos: Dict[str, Any] = {}
+        min_campos: Dict[str, Any] = {}
+        for status, momento in primeiros[saida["wamid"]].items():
+            nivel, campo = NIVEIS[status]
+            min_campos[campo] = momento
+            if saida.get(campo) is None:  # primeira vez deste status: conta na latência
+                if recebido_em is not None:
+                    LATENCIA_PONTA_A_PONTA.labels(agente, intent, status).observe(max(0.0, (momento - recebido_em).total_seconds()))
+                if criado_em is not None:
+                    LATENCIA_SAIDA.labels(agente, status).observe(max(0.0, (momento - criado_em).total_seconds()))
+            if nivel > nivel_atual:  # status chegam fora de ordem: guarda o mais avançado
+                nivel_atual = nivel
+                set_campos.update({"status_entrega": status, "status_entrega_nivel": nivel})
+        if saida["wamid"] in erros:
+            set_campos["erros_entrega"] = erros[saida["wamid"]]
+        atualizacao: Dict[str, Any] = {"$min": min_campos}
+        if set_campos:
+            atualizacao["$set"] = set_campos
+        operacoes.append(UpdateOne({"_id": saida["_id"]}, atualizacao))
+    if operacoes:
+        await banco.colecao(COLECAO_OUTBOX).bulk_write(operacoes, ordered=False)
+    return {saida["wamid"] for saida in saidas}
+
+
+async def _vincular(lote: List[Dict[str, Any]]) -> None:
+    """Leva o lote de status às entradas do outbox; o que não achou a wamid fica à espera."""
+    primeiros, erros = _resumir(lote)
+    vinculados = await _aplicar(primeiros, erros)
+    orfaos = set(primeiros) - vinculados
+    if not orfaos:
+        return
+    agora = datetime.now(timezone.utc)
+    await banco.colecao(COLECAO_SEM_VINCULO).insert_many([
+        {**{k: v for k, v in ev.items() if k != "_id"}, "criado_em": agora} for ev in lote if ev["wamid"] in orfaos
+    ])
+    # A wamid pode ter sido gravada entre a consulta e o insert (conciliar não viu os órfãos)
+    tardios = await _aplicar({w: primeiros[w] for w in orfaos}, erros)
+    if tardios:
+        await banco.colecao(COLECAO_SEM_VINCULO).delete_many({"wamid": {"$in": list(tardios)}})
+    SEM_VINCULO.inc(len(orfaos) - len(tardios))
+
+
+async def conciliar(wamid: str) -> int:
+    """Aplica os status que chegaram antes da wamid ser gravada no outbox (callback do outbox)."""
+    eventos = await banco.colecao(COLECAO_SEM_VINCULO).find({"wamid": wamid}).to_list(None)
+    if not eventos:
+        return 0
+    primeiros, erros = _resumir(eventos)
+    if not await _aplicar(primeiros, erros):
+        return 0
+    await banco.colecao(COLECAO_SEM_VINCULO).delete_many({"wamid": wamid})
+    CONCILIADOS.inc(len(eventos))
+    return len(eventos)
+
+
+escritor_status = EscritorEmLote(
+    COLECAO_STATUS,
+    tamanho_lote=int(getattr(settings, "STATUS_LOTE_TAMANHO", 500)),
+    intervalo_s=float(getattr(settings, "STATUS_LOTE_INTERVALO_S", 1.0)),
+    capacidade=int(getattr(settings, "STATUS_BUFFER_MAX", 20000)),
+    politica="descartar_antigos",
+    apos_gravar=_vincular,
+)
+remetente_outbox.apos_wamid.append(conciliar)
+
+
+async def iniciar() -> None:
+    await escritor_status.iniciar()
+
+
+async def parar() -> None:
+    """Grava os status pendentes (shutdown)."""
+    await escritor_status.parar()
@@ -0,0 +1,250 @@
+# ===========================================================
+# Arquivo: core/temporizador.py
+# Follow-ups por temporizador (em vez de varrer `contextos` toda hora).
+# - Cada contexto guarda `proximo_followup_em` / `proximo_followup_tipo`,
+#   recalculados pelo salvar_contexto a cada interação/mudança de estado.
+# - A fila de vencimentos é o próprio `contextos` (índice esparso em
+#   `proximo_followup_em`): a cada meio horizonte o temporizador carrega
+#   só o que vence nos próximos HORIZONTE segundos para um heap em memória
+#   e dorme até o próximo vencimento. Custo ∝ itens vencendo.
+# - Disparar = `retirar` (unset condicional: só um worker leva) + callback
+#   registrado pelo scheduler. Estado fica no Mongo: sobrevive a restart.
+# - Invalidação preguiçosa: no heap há no máximo uma entrada por telefone;
+#   nova mensagem só atualiza o vencimento conhecido (`_prazos`), sem
+#   mexer no heap nem acordar o laço. Quando a entrada vence, o prazo é
+#   reconferido: adiado volta ao heap, cancelado é descartado.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import heapq
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import Histogram
+
+from app.config import settings
+from app.core import banco
+
+logger = logging.getLogger("famdomes.temporizador")
+
+CAMPO_VENCIMENTO = "proximo_followup_em"
+CAMPO_TIPO = "proximo_followup_tipo"
+
+HORIZONTE_S = float(getattr(settings, "FOLLOWUP_TIMER_HORIZONTE_S", 300))
+MAX_CARGA = int(getattr(settings, "FOLLOWUP_TIMER_MAX_CARGA", 5000))
+
+
+@dataclass(frozen=True)
+class TipoFollowup:
+    nome: str
+    estados: Tuple[str, ...]
+    horas: float
+    intent: str  # deve existir nos JSONs
+    flag: str    # meta_conversa.<flag> = True depois de enviado
+
+
+TIPOS_FOLLOWUP: Dict[str, TipoFollowup] = {
+    "qualificacao": TipoFollowup(
+        "qualificacao",
+        # Qualificação/pitch em andamento
+        ("MICRO_COMPROMISSO", "PITCH_PLANO1", "PITCH_PLANO3", "COMERCIAL_DETALHES_PLANO"),
+        float(getattr(settings, "SCHEDULER_FOLLOWUP_QUAL_HOURS", 4)),
+        "FOLLOW_UP_QUALIFICACAO",
+        "followup_qualificacao_enviado",
+    ),
+    "pagamento": TipoFollowup(
+        "pagamento",
+        ("AGUARDANDO_PAGAMENTO",),  # link de pagamento enviado
+        float(getattr(settings, "SCHEDULER_FOLLOWUP_PAY_HOURS", 24)),
+        "FOLLOW_UP_24H",
+        "followup_pagamento_enviado",
+    ),
+}
+_TIPO_POR_ESTADO = {estado: tipo for tipo in TIPOS_FOLLOWUP.values() for estado in tipo.estados}
+
+ATRASO_DISPARO = Histogram(
+    "domo_followup_atraso_disparo_segundos",
+    "Atraso entre o vencimento do follow-up e o disparo",
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+
+
+def _utc(dt: datetime) -> datetime:
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
+
+
+def proximo_followup(estado: Optional[str], ts: datetime) -> Optional[Tuple[datetime, str]]:
+    """(vencimento, tipo) do follow-up de uma conversa neste estado, ou None."""
+    tipo = _TIPO_POR_ESTADO.get(estado or "")
+    if tipo is None:
+        return None
+    return _utc(ts) + timedelta(hours=tipo.horas), tipo.nome
+
+
+def mesclar_no_update(update: Dict[str, Any], estado: Optional[str], ts: datetime) -> Optional[Tuple[datetime, str]]:
+    """Acrescenta ao update de contexto o $set/$unset do próximo follow-up."""
+    proximo = proximo_followup(estado, ts)
+    if proximo is None:
+        update.setdefault("$unset", {}).update({CAMPO_VENCIMENTO: "", CAMPO_TIPO: ""})
+    else:
+        update.setdefault("$set", {}).update({CAMPO_VENCIMENTO: proximo[0], CAMPO_TIPO: proximo[1]})
+    return proximo
+
+
+async def retirar(telefone: str, vencimento: datetime) -> bool:
+    """Tira o follow-up da fila se ainda é este vencimento (False: reagendado ou outro worker levou)."""
+    doc = await banco.colecao("contextos").find_one_and_update(
+        {"tel": telefone, CAMPO_VENCIMENTO: vencimento},
+        {"$unset": {CAMPO_VENCIMENTO: "", CAMPO_TIPO: ""}, "$inc": {"versao": 1}},
+        projection={"_id": 1},
+    )
+    return doc is not None
+
+
+async def reagendar(telefone: str, tipo: str, atraso_s: float) -> None:
+    """Volta o follow-up para a fila (ex.: envio falhou), se nada novo foi agendado."""
+    await banco.colecao("contextos").update_one(
+        {"tel": telefone, CAMPO_VENCIMENTO: {"$exists": False}},
+        {
+            "$set": {CAMPO_VENCIMENTO: datetime.now(timezone.utc) + timedelta(seconds=atraso_s), CAMPO_TIPO: tipo},
+            "$inc": {"versao": 1},
+        },
+    )
+
+
+Disparador = Callable[[List[Tuple[str, str, datetime]]], Awaitable[None]]
+
+
+class Temporizador:
+    def __init__(self, horizonte_s: float = HORIZONTE_S, max_carga: int = MAX_CARGA):
+        self.horizonte_s = horizonte_s
+        self.max_carga = max_carga
+        self._heap: List[Tuple[datetime, str]] = []
+        self._na_fila: Dict[str, datetime] = {}  # entrada válida de cada telefone no heap
+        self._prazos: Dict[str, Tuple[datetime, str]] = {}  # último vencimento conhecido (e tipo)
+        self._task: Optional[asyncio.Task] = None
+        self._acordar: Optional[asyncio.Event] = None
+        self._disparar: Optional[Disparador] = None
+        self.disparados = 0
+        self.cargas = 0
+
+    def _armar(self, vencimento: datetime, telefone: str, tipo: str) -> bool:
+        """Registra o vencimento. Só empilha se o telefone não tem entrada que vença antes.
+        True se a nova entrada é o próximo vencimento (o laço precisa acordar)."""
+        self._prazos[telefone] = (vencimento, tipo)
+        na_fila = self._na_fila.get(telefone)
+        if na_fila is not None and na_fila <= vencimento:
+            return False  # a entrada atual vence antes e reconfere o prazo
+        self._na_fila[telefone] = vencimento
+        heapq.heappush(self._heap, (vencimento, telefone))
+        return self._heap[0] == (vencimento, telefone)
+
+    def agendar(self, telefone: str, vencimento: datetime, tipo: str) -> None:
+        """Atalho local: vencimento dentro do horizonte entra no heap sem esperar a próxima carga."""
+        if self._task is None:
+            return
+        vencimento = _utc(vencimento)
+        if vencimento > datetime.now(timezone.utc) + timedelta(seconds=self.horizonte_s):
+            if telefone in self._prazos:
+                self._prazos[telefone] = (vencimento, tipo)  # adiado para além do horizonte: a carga traz de volta
+            return
+        if self._armar(vencimento, telefone, tipo) and self._acordar is not None:
+            self._acordar.set()
+
+    def cancelar(self, telefone: str) -> None:
+        """Conversa saiu dos estados com follow-up: a entrada no heap é descartada quando vencer."""
+        self._prazos.pop(telefone, None)
+
+    async def _carregar(self) -> int:
+        limite = datetime.now(timezone.utc) + timedelta(seconds=self.horizonte_s)
+        cursor = banco.colecao("contextos").find(
+            {CAMPO_VENCIMENTO: {"$lte": limite}},
+            {"tel": 1, CAMPO_VENCIMENTO: 1, CAMPO_TIPO: 1, "_id": 0},
+        ).sort(CAMPO_VENCIMENTO, 1).limit(self.max_carga)
+        lidos = 0
+        async for doc in cursor:
+            lidos += 1
+            if doc.get("tel") and doc.get(CAMPO_TIPO) in TIPOS_FOLLOWUP:
+                self._armar(_utc(doc[CAMPO_VENCIMENTO]), doc["tel"], doc[CAMPO_TIPO])
+        self.cargas += 1
+        return lidos
+
+    def _vencidos(self) -> List[Tuple[str, str, datetime]]:
+        agora = datetime.now(timezone.utc)
+        vencidos = []
+        limite = agora + timedelta(seconds=self.horizonte_s)
+        while self._heap and self._heap[0][0] <= agora:
+            vencimento, telefone = heapq.heappop(self._heap)
+            if self._na_fila.get(telefone) != vencimento:
+                continue  # superada por uma entrada mais cedo do mesmo telefone
+            del self._na_fila[telefone]
+            prazo = self._prazos.get(telefone)
+            if prazo is None:
+                continue  # cancelado
+            if prazo[0] > agora:
+                if prazo[0] <= limite:
+                    self._na_fila[telefone] = prazo[0]
+                    heapq.heappush(self._heap, (prazo[0], telefone))
+                else:
+                    del self._prazos[telefone]
+                continue
+            del self._prazos[telefone]
+            ATRASO_DISPARO.observe((agora - prazo[0]).total_seconds())
+            vencidos.append((telefone, prazo[1], prazo[0]))
+        return vencidos
+
+    async def _loop(self) -> None:
+        proxima_carga = 0.0
+        while True:
+            try:
+                cheia = False
+                if time.monotonic() >= proxima_carga:
+                    cheia = await self._carregar() >= self.max_carga
+                    proxima_carga = time.monotonic() + self.horizonte_s / 2
+                vencidos = self._vencidos()
+                if vencidos and self._disparar is not None:
+                    self.disparados += len(vencidos)
+                    await self._disparar(vencidos)
+                    if cheia:
+                        proxima_carga = 0.0  # fila acumulada (ex.: após restart): busca o resto já
+                espera = proxima_carga - time.monotonic()
+                if self._heap:
+                    espera = min(espera, (self._heap[0][0] - datetime.now(timezone.utc)).total_seconds())
+                try:
+                    await asyncio.wait_for(self._acordar.wait(), timeout=max(0.05, espera))
+                except asyncio.TimeoutError:
+                    pass
+                self._acordar.clear()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"TEMPORIZADOR: ❌ Erro no laço de follow-ups: {e}")
+                await asyncio.sleep(5)
+
+    def iniciar(self, disparar: Disparador) -> None:
+        """Chamado dentro do event loop (startup do scheduler)."""
+        self._disparar = disparar
+        if self._task is None or self._task.done():
+            self._acordar = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._loop())
+            logger.info(f"TEMPORIZADOR: Follow-ups por vencimento ativos (horizonte {self.horizonte_s:.0f}s).")
+
+    def parar(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def estado(self) -> dict:
+        return {
+            "na_fila_memoria": len(self._na_fila),
+            "proximo_vencimento": self._heap[0][0].isoformat() if self._heap else None,
+            "disparados": self.disparados,
+            "cargas": self.cargas,
+        }
+
+
+temporizador = Temporizador()
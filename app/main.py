@@ -26,15 +26,30 @@ sys.path.insert(0, str(APP_DIR.parent)) # Adiciona famdomes_backend/ ao path
 try:
     from app.core.scheduler import iniciar as iniciar_scheduler, parar as parar_scheduler
     from app.config import settings # Usar settings centralizadas
-    from app.utils.contexto import conectar_db # Para conectar ao iniciar
+    from app.utils.variantes import carregar_pools as carregar_variantes # Pools de frases pré-geradas
     # Roteadores existentes
-    from app.routes import whatsapp, ia, stripe, agendamento # Adicione outros se tiver
+    from app.routes import whatsapp, ia, stripe, agendamento, admin # Adicione outros se tiver
+    from app.core.llm import fechar as fechar_cliente_llm, iniciar_monitor as iniciar_monitor_llm # Cliente/pool do Ollama
+    from app.core.outbox import iniciar as iniciar_outbox, parar as parar_outbox # Remetentes do outbox
+    from app.core.campanhas import parar as parar_campanhas # Executores de campanha
+    from app.utils.mensageria import fechar as fechar_cliente_whatsapp # Pool HTTP da WhatsApp Cloud API
+    from app.core.banco import verificar as verificar_banco, fechar as fechar_banco # MongoDB assíncrono
+    from app.core.indices import aplicar_migracoes as aplicar_migracoes_indices # Índices versionados
+    from app.core.retencao import preparar as preparar_retencao # Coleções de arquivo + TTL
+    from app.core.lease import preparar as preparar_leases # Leases de jobs entre workers
+    from app.core.metrics import iniciar_monitor_loop # Atraso do event loop
+    from app.core.rastreamento import iniciar as iniciar_eventos, parar as parar_eventos # Escrita em lote de eventos
+    from app.core.cache_contextos import cache as cache_contextos # Contextos write-behind
+    from app.core.status_entrega import iniciar as iniciar_status, parar as parar_status # Status do WhatsApp em lote
+    from app.core.kanban import parar as parar_kanban # Cards do quadro materializado
+    from app.core.painel_ao_vivo import iniciar as iniciar_painel, parar as parar_painel # Eventos SSE do Domo Hub
     # Roteador MCP (se separado)
     # from app.routes.entrada import router as entrada_router
     # Roteador Admin (se separado)
     # from app.routes.admin import router as admin_router
     # NOVO Roteador do Dashboard
     from app.routes.dashboard import router as dashboard_router
+    from app.routes.campanhas import router as campanhas_router # Campanhas/broadcast
 except ImportError as e:
     logging.basicConfig(level="INFO") # Configuração mínima para logar o erro
     logger = logging.getLogger("famdomes.main_import_error")
@@ -57,8 +72,8 @@ app = FastAPI(
 title="FAMDOMES API + Dashboard Backend",
 description="Servidor MCP do FAMDOMES com API para o Domo Hub.",
 version="1.2.0", # Incrementa versão
-on_startup=[conectar_db, iniciar_scheduler], # Conecta DB e inicia scheduler no startup
-on_shutdown=[parar_scheduler] # Para o scheduler no shutdown
+on_startup=[preparar_retencao, preparar_leases, aplicar_migracoes_indices, verificar_banco, cache_contextos.iniciar, carregar_variantes, iniciar_scheduler, iniciar_monitor_llm, iniciar_monitor_loop, iniciar_eventos, iniciar_status, iniciar_outbox, iniciar_painel], # Conecta DB, carrega pools, inicia scheduler e monitores
+on_shutdown=[parar_scheduler, parar_painel, parar_campanhas, cache_contextos.parar, parar_kanban, parar_eventos, parar_status, fechar_cliente_llm, parar_outbox, fechar_cliente_whatsapp, fechar_banco] # Para o scheduler e fecha conexões no shutdown
 )
 
 # ---------- CORS Middleware ----------
@@ -108,6 +123,7 @@ app.include_router(ia.router)
 app.include_router(stripe.router)
 app.include_router(agendamento.router)
 app.include_router(dashboard_analytics.router)
+app.include_router(admin.router) # Métricas, stats e cache da IA (protegido por API_KEY)
 app.include_router(kanban_router)
 # Adicione outros roteadores existentes aqui (entrada, admin, etc.)
 # Exemplo:
@@ -116,6 +132,7 @@ app.include_router(kanban_router)
 
 # Inclui o NOVO roteador do Dashboard
 app.include_router(dashboard_router) # O prefixo "/dashboard" já está definido no roteador
+app.include_router(campanhas_router) # Prefixo "/campanhas" (mesma autenticação do dashboard)
 
 # ---------- Rota Raiz / Health Check ----------
 @app.get("/", tags=["Root"])
@@ -1,5 +1,7 @@
+from typing import Optional
 from fastapi import APIRouter, Response, Depends, HTTPException
 from app.core.metrics import prometheus_response, json_response
+from app.core.llm import estatisticas_cache, purgar_cache
 from app.config import settings
 
 router = APIRouter(prefix="/admin", tags=["Admin"])
@@ -9,10 +11,18 @@ def _auth(token: str):
         raise HTTPException(status_code=403)
 
 @router.get("/metrics")
-def metrics(token: str = Depends(_auth)):
-    data, content_type = prometheus_response()
+async def metrics(token: str = Depends(_auth)):
+    data, content_type = await prometheus_response()
     return Response(content=data, media_type=content_type)
 
 @router.get("/stats")
-def stats(token: str = Depends(_auth)):
-    return json_response()
+async def stats(token: str = Depends(_auth)):
+    return await json_response()
+
+@router.get("/cache-llm")
+def cache_llm_stats(token: str = Depends(_auth)):
+    return estatisticas_cache()
+
+@router.delete("/cache-llm")
+async def cache_llm_purgar(site: Optional[str] = None, token: str = Depends(_auth)):
+    return {"status": "purgado", "site": site or "todos", "removidos": await purgar_cache(site)}
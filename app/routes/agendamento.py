@@ -24,7 +24,7 @@ async def proximo_agendamento_disponivel():
     logging.info("AGENDAMENTO Route: Consultando próximo horário disponível...")
     try:
         # Chama a função correta para obter o próximo horário UTC
-        horario_utc = consultar_proximo_horario_disponivel()
+        horario_utc = await consultar_proximo_horario_disponivel()
 
         if horario_utc:
             # Formata o horário para o fuso local
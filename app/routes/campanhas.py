@@ -0,0 +1,165 @@
+# ===========================================================
+# Arquivo: app/routes/campanhas.py
+# API de campanhas (core/campanhas.py) para o Domo Hub.
+# - Criar (com prévia do público), iniciar, pausar, retomar, cancelar.
+# - Progresso, vazão de enfileiramento e entregas por campanha.
+# - Tags de conversa (`contextos.tags`) usadas na seleção de público.
+# - Opt-out de campanhas por contato (`contextos.opt_out`).
+# - Tags e opt-out valem também para conversas na camada fria
+#   (`contextos_frios`, core/retencao.py).
+# ===========================================================
+import logging
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel, Field
+
+from app.core import campanhas, retencao
+from app.core.auth import get_current_active_user
+from app.schemas.dashboard import User
+
+logger = logging.getLogger("famdomes.campanhas_api")
+router = APIRouter(prefix="/campanhas", tags=["Campanhas"])
+
+
+class PublicoReq(BaseModel):
+    estados: List[str] = Field(default_factory=list, description="Estados da conversa (ex: FINALIZADO_SEM_VENDA)")
+    excluir_estados: List[str] = Field(default_factory=list)
+    score_min: Optional[int] = Field(None, description="meta_conversa.score_lead mínimo")
+    score_max: Optional[int] = None
+    tags: List[str] = Field(default_factory=list, description="Conversa precisa ter todas")
+    inativo_ha_horas: Optional[float] = Field(None, description="Sem interação há pelo menos N horas")
+
+
+class TemplateReq(BaseModel):
+    texto: Optional[str] = Field(None, description="Texto livre com {nome}, {primeiro_nome}, {tel}, {estado}")
+    intent: Optional[str] = Field(None, description="Usa a resposta da intent (ex: PRESENCA_VIVA)")
+    trilha: Optional[str] = Field(None, description="Nome da trilha em app/trilhas (ex: presenca_viva)")
+    etapa: Optional[str] = None
+
+
+class CampanhaReq(BaseModel):
+    nome: str
+    publico: PublicoReq
+    template: TemplateReq
+    taxa_por_s: Optional[float] = Field(None, gt=0, description="Mensagens/s desta campanha")
+    iniciar: bool = False
+
+
+class PreviaReq(BaseModel):
+    publico: PublicoReq
+    template: TemplateReq
+    amostra: int = Field(5, ge=0, le=50)
+
+
+class TagsReq(BaseModel):
+    telefones: List[str]
+    adicionar: List[str] = Field(default_factory=list)
+    remover: List[str] = Field(default_factory=list)
+
+
+class OptOutReq(BaseModel):
+    telefones: List[str]
+    ativo: bool = Field(True, description="True = não recebe campanhas; False = volta a receber")
+
+
+def _serializar(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc["id"] = str(doc.pop("_id"))
+    return doc
+
+
+async def _controlar(acao, id_campanha: str, usuario: User, verbo: str) -> Dict[str, Any]:
+    try:
+        doc = await acao(id_campanha)
+    except campanhas.CampanhaInvalida as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if doc is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Campanha inexistente ou não pode ser {verbo} no estado atual.")
+    logger.info(f"Usuário '{usuario.username}': campanha {id_campanha} {verbo}.")
+    return {"id": id_campanha, "status": doc["status"]}
+
+
+@router.post("", status_code=status.HTTP_201_CREATED, summary="Cria uma campanha")
+async def criar_campanha(req: CampanhaReq, current_user: User = Depends(get_current_active_user)):
+    try:
+        doc = await campanhas.criar(
+            req.nome, req.publico.model_dump(), req.template.model_dump(exclude_none=True),
+            taxa_por_s=req.taxa_por_s, criado_por=current_user.username,
+        )
+    except campanhas.CampanhaInvalida as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if req.iniciar:
+        await campanhas.iniciar(str(doc["_id"]))
+        doc["status"] = "executando"
+    return _serializar(doc)
+
+
+@router.post("/previa", summary="Tamanho do público e mensagens de exemplo")
+async def previa_campanha(req: PreviaReq, current_user: User = Depends(get_current_active_user)):
+    try:
+        return await campanhas.previa(req.publico.model_dump(), req.template.model_dump(exclude_none=True), req.amostra)
+    except campanhas.CampanhaInvalida as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("", summary="Lista campanhas recentes")
+async def listar_campanhas(limite: int = 50, current_user: User = Depends(get_current_active_user)):
+    return [_serializar(doc) for doc in await campanhas.listar(min(limite, 200))]
+
+
+@router.get("/{id_campanha}", summary="Progresso, vazão e entregas de uma campanha")
+async def obter_campanha(id_campanha: str, current_user: User = Depends(get_current_active_user)):
+    try:
+        doc = await campanhas.obter(id_campanha)
+    except campanhas.CampanhaInvalida as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if doc is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campanha não encontrada.")
+    return _serializar(doc)
+
+
+@router.post("/{id_campanha}/iniciar", summary="Inicia (ou retoma) uma campanha")
+async def iniciar_campanha(id_campanha: str, current_user: User = Depends(get_current_active_user)):
+    return await _controlar(campanhas.iniciar, id_campanha, current_user, "iniciada")
+
+
+@router.post("/{id_campanha}/pausar", summary="Pausa uma campanha em execução")
+async def pausar_campanha(id_campanha: str, current_user: User = Depends(get_current_active_user)):
+    return await _controlar(campanhas.pausar, id_campanha, current_user, "pausada")
+
+
+@router.post("/{id_campanha}/retomar", summary="Retoma uma campanha pausada")
+async def retomar_campanha(id_campanha: str, current_user: User = Depends(get_current_active_user)):
+    return await _controlar(campanhas.iniciar, id_campanha, current_user, "retomada")
+
+
+@router.post("/{id_campanha}/cancelar", summary="Cancela uma campanha e retira o que não saiu do outbox")
+async def cancelar_campanha(id_campanha: str, current_user: User = Depends(get_current_active_user)):
+    return await _controlar(campanhas.cancelar, id_campanha, current_user, "cancelada")
+
+
+@router.post("/tags", summary="Adiciona/remove tags de conversas (seleção de público)")
+async def atualizar_tags(req: TagsReq, current_user: User = Depends(get_current_active_user)):
+    if not req.telefones or not (req.adicionar or req.remover):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Informe telefones e tags.")
+    filtro = {"tel": {"$in": req.telefones}}
+    alterados = 0
+    # $addToSet e $pull no mesmo campo não cabem num update só
+    if req.adicionar:
+        n = await retencao.atualizar_contextos(filtro, {"$addToSet": {"tags": {"$each": req.adicionar}}, "$inc": {"versao": 1}})
+        alterados = max(alterados, n)
+    if req.remover:
+        n = await retencao.atualizar_contextos(filtro, {"$pullAll": {"tags": req.remover}, "$inc": {"versao": 1}})
+        alterados = max(alterados, n)
+    logger.info(f"Usuário '{current_user.username}' atualizou tags de {alterados} conversa(s).")
+    return {"alterados": alterados}
+
+
+@router.post("/opt-out", summary="Marca/desmarca contatos que não recebem campanhas")
+async def atualizar_opt_out(req: OptOutReq, current_user: User = Depends(get_current_active_user)):
+    if not req.telefones:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Informe telefones.")
+    operacao = {"$set": {campanhas.CAMPO_OPT_OUT: True}} if req.ativo else {"$unset": {campanhas.CAMPO_OPT_OUT: ""}}
+    alterados = await retencao.atualizar_contextos({"tel": {"$in": req.telefones}}, {**operacao, "$inc": {"versao": 1}})
+    logger.info(f"Usuário '{current_user.username}' {'ativou' if req.ativo else 'removeu'} opt-out de {alterados} conversa(s).")
+    return {"alterados": alterados}
@@ -5,7 +5,8 @@
 # devem começar na coluna 1, sem espaços antes.
 # ===========================================================
 import logging # <-- SEM ESPAÇOS ANTES
-from fastapi import APIRouter, Depends, HTTPException, status, Body
+from fastapi import APIRouter, Depends, HTTPException, status, Body, Request
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import List, Dict, Any, Optional
 from datetime import timedelta, datetime, timezone
@@ -20,10 +21,16 @@ try:
     # Usar a versão temporária de auth.py que ignora a senha
     from app.core.auth import (
         create_access_token, get_current_active_user, # MANTÉM ESTES
+        get_current_active_user_stream, create_stream_ticket, # Ticket ?ticket= do EventSource
+        STREAM_TICKET_EXPIRE_SECONDS,
         ACCESS_TOKEN_EXPIRE_MINUTES, oauth2_scheme
         # authenticate_user # Comentado na versão temporária
     )
-    from app.utils.contexto import obter_contexto, salvar_contexto, respostas_ia_db, contextos_db
+    from app.utils.contexto import obter_contexto, salvar_contexto
+    from app.core import kanban # Quadro materializado (kanban_cards)
+    from app.core import painel_ao_vivo # Eventos em tempo real (SSE)
+    from app.core import sincronizacao # Delta desde um cursor
+    from app.utils import historico # Histórico em buckets
     from app.utils.mensageria import enviar_mensagem
     from app.core.mcp_orquestrador import MCPOrquestrador
 # Indentação correta
@@ -70,92 +77,121 @@ async def read_users_me(current_user: User = Depends(get_current_active_user)):
     return current_user
 
 # --- Rota do Kanban ---
+def _conversation_card(card: Dict[str, Any]) -> ConversationCard:
+    snippet = card.get("snippet") or ""
+    return ConversationCard(
+        tel=card["tel"], nome=card.get("nome"), estado=card["estado"], ts=card["ts"],
+        ultima_mensagem_snippet=(snippet[:50] + "...") if snippet else None,
+        sentimento_predominante=card.get("sentimento"), score_lead=card.get("score_lead"),
+        risco_detectado=bool(card.get("risco")), atendente_humano_necessario=card.get("atendente_humano_necessario", False),
+    )
+
+
+def _kanban_column(col: Dict[str, Any]) -> KanbanColumn:
+    return KanbanColumn(
+        id=col["id"], title=col["titulo"], cards=[_conversation_card(c) for c in col["cards"]],
+        total=col["total"], proximo=col["proximo"],
+    )
+
+
 @router.get("/kanban", response_model=KanbanBoard, summary="Obtém dados do quadro Kanban")
-async def get_kanban_board(current_user: User = Depends(get_current_active_user)):
-    """Busca conversas no MongoDB e as organiza nas colunas do Kanban."""
+async def get_kanban_board(limite: int = 50, current_user: User = Depends(get_current_active_user)):
+    """Primeira página de cada coluna do quadro materializado (core/kanban.py)."""
     logger.info(f"Usuário '{current_user.username}' solicitou dados do Kanban.")
-    if contextos_db is None:
-         logger.error("API Kanban: DB não conectado.")
-         raise HTTPException(status_code=503, detail="Serviço indisponível (DB)")
-
-    colunas_definidas: Dict[str, str] = {
-        "entrada": "Entrada", "qualificacao": "Qualificação", "proposta": "Proposta",
-        "pagamento_pendente": "Pagamento Pendente", "triagem": "Triagem Pós-Pgto",
-        "agendado": "Agendado", "atendimento_humano": "Atendimento Humano",
-        "followup": "Follow-up", "concluido": "Concluído/Perdido",
-    }
-    mapa_estado_coluna: Dict[str, str] = {
-        "INICIAL": "entrada", "ACOLHIMENTO_ENVIADO": "entrada",
-        "MICRO_COMPROMISSO": "qualificacao",
-        "PITCH_PLANO1": "proposta", "PITCH_PLANO3": "proposta", "COMERCIAL_DETALHES_PLANO": "proposta",
-        "CALL_TO_ACTION": "pagamento_pendente", "AGUARDANDO_PAGAMENTO": "pagamento_pendente",
-        "TRIAGEM_INICIAL": "triagem", "COLETANDO_RESPOSTA_QUESTIONARIO": "triagem",
-        "FINALIZANDO_ONBOARDING": "agendado", "AGUARDANDO_CONSULTA": "agendado",
-        "AGUARDANDO_ATENDENTE": "atendimento_humano", "RISCO_DETECTADO": "atendimento_humano", "ATENDIMENTO_EM_ANDAMENTO": "atendimento_humano",
-        "RECUSA_PRECO": "followup",
-        "LEAD_MATERIAL_GRATUITO": "concluido", "FINALIZADO_SEM_VENDA": "concluido",
-    }
-    coluna_default = "concluido"
-
     try:
-        all_contexts_cursor = contextos_db.find().sort("ts", -1).limit(200)
-        all_contexts = list(all_contexts_cursor)
-        logger.info(f"API Kanban: {len(all_contexts)} contextos encontrados.")
-
-        cards_por_coluna: Dict[str, List[ConversationCard]] = {col_id: [] for col_id in colunas_definidas}
-
-        for ctx in all_contexts:
-            estado_atual = ctx.get("estado", "INICIAL")
-            coluna_id = mapa_estado_coluna.get(estado_atual, coluna_default)
-            meta = ctx.get("meta_conversa", {})
-            if not isinstance(meta, dict): meta = {}
-
-            card_data = {
-                "tel": ctx.get("tel", "N/A"),
-                "nome": meta.get("nome_cliente") or ctx.get("nome"),
-                "estado": estado_atual,
-                "ts": ctx.get("ts", datetime.now(timezone.utc)),
-                "ultima_mensagem_snippet": (ctx.get("ultimo_texto_bot") or ctx.get("ultimo_texto_usuario", ""))[:50] + "...",
-                "score_lead": meta.get("score_lead"),
-                "risco_detectado": meta.get("ultimo_risco") is not None,
-                "atendente_humano_necessario": estado_atual in ["AGUARDANDO_ATENDENTE", "RISCO_DETECTADO"]
-            }
-            sentimento = meta.get("ultimo_sentimento_detectado")
-            if isinstance(sentimento, dict) and sentimento:
-                 card_data["sentimento_predominante"] = max(sentimento, key=sentimento.get, default=None)
-
-            cards_por_coluna.get(coluna_id, cards_por_coluna[coluna_default]).append(ConversationCard(**card_data))
-
-        kanban_columns = [
-            KanbanColumn(id=col_id, title=title, cards=cards_por_coluna[col_id])
-            for col_id, title in colunas_definidas.items()
-        ]
-        return KanbanBoard(columns=kanban_columns)
-
+        colunas = await kanban.carregar_quadro(max(1, min(limite, 500)))
+        return KanbanBoard(columns=[_kanban_column(col) for col in colunas])
     except Exception as e:
         logger.exception(f"API Kanban: Erro ao buscar ou processar dados: {e}")
         raise HTTPException(status_code=500, detail="Erro ao gerar dados do Kanban.")
 
+
+@router.get("/kanban/{coluna_id}", response_model=KanbanColumn, summary="Próximas páginas de uma coluna do Kanban")
+async def get_kanban_column(
+    coluna_id: str, limite: int = 50, apos: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+):
+    """Cards de uma coluna depois do cursor `apos` (campo `proximo` da página anterior)."""
+    try:
+        return _kanban_column(await kanban.pagina(coluna_id, max(1, min(limite, 500)), apos))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Delta desde o último cursor ---
+@router.get("/sync", summary="Cards e mensagens alterados desde um cursor")
+async def sync_painel(
+    since: Optional[str] = None,
+    telefones: Optional[str] = None,
+    limite: int = 500,
+    current_user: User = Depends(get_current_active_user),
+):
+    """
+    Na reconexão/refresh, devolve só o que mudou depois de `since` (o `cursor`
+    da chamada anterior): cards alterados, conversas removidas e, para as
+    conversas em `telefones` (separados por vírgula), as mensagens novas.
+    `completo=true`: recarregar /dashboard/kanban e seguir com o cursor devolvido.
+    `mais=true`: chamar de novo com o novo cursor.
+    """
+    lista = [t.strip() for t in telefones.split(",") if t.strip()] if telefones else None
+    try:
+        return await sincronizacao.delta(since, lista, max(1, min(limite, 2000)))
+    except sincronizacao.CursorInvalido as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+# --- Eventos em tempo real (SSE) ---
+@router.post("/eventos/ticket", summary="Ticket de curta duração para abrir o fluxo de eventos")
+async def ticket_eventos(current_user: User = Depends(get_current_active_user)):
+    """EventSource não envia Authorization: o cliente troca o token por um ticket e usa ?ticket=."""
+    return {"ticket": create_stream_ticket(current_user.username), "expira_em_s": STREAM_TICKET_EXPIRE_SECONDS}
+
+@router.get("/eventos", summary="Fluxo de eventos do painel (Server-Sent Events)")
+async def stream_eventos(
+    request: Request,
+    telefone: Optional[str] = None,
+    tipos: Optional[str] = None,
+    ultimo_id: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user_stream),
+):
+    """
+    Eventos `card`, `card_removido`, `mensagem` e `risco` assim que acontecem.
+    `telefone` acompanha uma conversa; `tipos` filtra (ex: card,risco).
+    Reconexão: Last-Event-ID (ou `ultimo_id`) reenvia o que faltou; `resync`
+    pede para buscar o delta em /dashboard/sync. Autenticação: `?ticket=` de
+    POST /dashboard/eventos/ticket (ticket vencido = pedir outro e reabrir).
+    """
+    assinante = painel_ao_vivo.Assinante(
+        usuario=current_user.username,
+        telefone=telefone,
+        tipos=frozenset(t.strip() for t in tipos.split(",") if t.strip()) if tipos else None,
+    )
+    try:
+        painel_ao_vivo.barramento.inscrever(assinante, request.headers.get("last-event-id") or ultimo_id)
+    except painel_ao_vivo.LimiteClientes as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    logger.info(f"Usuário '{current_user.username}' conectado ao fluxo de eventos do painel.")
+    return StreamingResponse(
+        painel_ao_vivo.fluxo_sse(assinante),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --- Rotas de Conversa ---
 @router.get("/conversations/{telefone}", response_model=ConversationDetail, summary="Obtém detalhes de uma conversa")
 async def get_conversation_detail(telefone: str, current_user: User = Depends(get_current_active_user)):
     """Busca o contexto e o histórico de mensagens para um telefone específico."""
     logger.info(f"Usuário '{current_user.username}' solicitou detalhes da conversa de {telefone}.")
-    if contextos_db is None or respostas_ia_db is None:
-         logger.error(f"API Detalhes ({telefone}): DB não conectado.")
-         raise HTTPException(status_code=503, detail="Serviço indisponível (DB)")
 
     try:
-        contexto_doc = obter_contexto(telefone)
+        contexto_doc = await obter_contexto(telefone)
         if not contexto_doc or "tel" not in contexto_doc :
              logger.warning(f"API Detalhes ({telefone}): Contexto não encontrado ou inválido.")
              raise HTTPException(status_code=404, detail="Conversa não encontrada.")
 
-        historico_cursor = respostas_ia_db.find({"telefone": telefone}).sort("criado_em", 1).limit(200)
+        turnos = await historico.transcricao(telefone, limite=200)
 
         historico_formatado: List[Message] = []
         last_timestamp = None
-        for msg_doc in historico_cursor:
+        for msg_doc in turnos:
             doc_id = str(msg_doc.get("_id"))
             timestamp = msg_doc.get("criado_em", datetime.now(timezone.utc))
 
@@ -209,7 +245,7 @@ async def update_conversation_state(
     novo_estado = request_body.novo_estado
     logger.info(f"Usuário '{current_user.username}' solicitou mudança de estado para '{novo_estado}' para {telefone}.")
 
-    sucesso = salvar_contexto(
+    sucesso = await salvar_contexto(
         telefone=telefone,
         estado=novo_estado,
         incrementar_interacoes=False
@@ -241,7 +277,7 @@ async def send_human_message(
              raise HTTPException(status_code=502, detail=f"Falha ao enviar mensagem: {resultado_envio.get('erro')}")
 
         from app.utils.contexto import salvar_resposta_ia
-        salvou_hist = salvar_resposta_ia(
+        salvou_hist = await salvar_resposta_ia(
             telefone=telefone,
             canal="dashboard",
             mensagem_usuario="",
@@ -253,7 +289,7 @@ async def send_human_message(
         if not salvou_hist:
              logger.error(f"API Send Human ({telefone}): Mensagem enviada, mas FALHA ao salvar no histórico.")
 
-        salvou_ctx = salvar_contexto(telefone=telefone, estado="ATENDIMENTO_EM_ANDAMENTO", incrementar_interacoes=False)
+        salvou_ctx = await salvar_contexto(telefone=telefone, estado="ATENDIMENTO_EM_ANDAMENTO", incrementar_interacoes=False)
         if not salvou_ctx:
              logger.error(f"API Send Human ({telefone}): Mensagem enviada e histórico salvo, mas FALHA ao atualizar estado.")
 
@@ -283,7 +319,7 @@ async def simulate_user_message(
     try:
         orquestrador = MCPOrquestrador()
         await orquestrador.processar_mensagem(telefone, texto_simulado)
-        contexto_atualizado = obter_contexto(telefone)
+        contexto_atualizado = await obter_contexto(telefone)
 
         logger.info(f"API Simulate User ({telefone}): Simulação processada. Estado final: {contexto_atualizado.get('estado')}")
         return {
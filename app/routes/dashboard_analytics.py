@@ -7,8 +7,8 @@ router = APIRouter(prefix="/dashboard/analytics", tags=["Dashboard"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="dashboard/token")  # reaproveita auth existente
 
-def _collect() -> dict:
-    atualizar()  # atualiza gauges
+async def _collect() -> dict:
+    await atualizar()  # atualiza gauges (cliente Mongo assíncrono)
     return {
         "leads": LEADS._value.get(),
         "qualificados": QUALIFICADOS._value.get(),
@@ -18,4 +18,4 @@ def _collect() -> dict:
 
 @router.get("", summary="KPIs para o dashboard")
 async def get_analytics(_: str = Depends(oauth2_scheme)):
-    return _collect()
+    return await _collect()
@@ -160,7 +160,7 @@ async def processar_comando(dados: dict) -> dict:
         logging.info(f"IA Route: Processando cancelamento de consulta para {telefone}...")
         # Chama a função para cancelar consultas futuras
         # TODO: Implementar a função cancelar_consulta em utils/agenda.py
-        consultas_canceladas = cancelar_consulta(telefone) # Assume que retorna int
+        consultas_canceladas = await cancelar_consulta(telefone) # Assume que retorna int
         if consultas_canceladas > 0:
             msg = f"✅ Sua(s) {consultas_canceladas} consulta(s) futura(s) foi(ram) cancelada(s) com sucesso."
             # await enviar_mensagem(telefone, msg)
@@ -175,7 +175,7 @@ async def processar_comando(dados: dict) -> dict:
         logging.info(f"IA Route: Consultando próximo horário disponível para {telefone}...")
         # Chama a função para consultar o próximo horário livre
         # TODO: Implementar consultar_proximo_horario_disponivel e formatar_horario_local em utils/agenda.py
-        proximo_horario_utc = consultar_proximo_horario_disponivel() # Assume que retorna datetime UTC ou None
+        proximo_horario_utc = await consultar_proximo_horario_disponivel() # Assume que retorna datetime UTC ou None
         if proximo_horario_utc:
             # Formata o horário para o fuso local antes de enviar
             horario_formatado = formatar_horario_local(proximo_horario_utc, 'America/Sao_Paulo') # Exemplo de fuso
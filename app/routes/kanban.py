@@ -2,8 +2,9 @@
 Rotas Kanban e Conversas – FAMDOMES
 Autor: Diego Feijó de Abreu
 Descrição: fornece a API REST para o dashboard Kanban de conversas
-            (Novos → IA Respondendo → Triagem Emocional → Aguardando Agendamento
-            → Com Profissional → Escalonado → Finalizado)
+            (colunas de core/kanban.py: Entrada → Qualificação → Proposta →
+            Pagamento Pendente → Triagem → Agendado → Atendimento Humano →
+            Follow-up → Concluído/Perdido), lidas do quadro materializado
 """
 
 from __future__ import annotations
@@ -11,13 +12,13 @@ from __future__ import annotations
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Any, Optional
 
-from fastapi import APIRouter, HTTPException, status, Body, Path
+from fastapi import APIRouter, HTTPException, status, Body, Path, Query
 from pydantic import BaseModel, Field
 from bson import ObjectId
 
+from app.core import banco, kanban, retencao
+from app.utils import historico
 from app.utils.contexto import (
-    contextos_db,
-    respostas_ia_db,
     obter_contexto,
     salvar_contexto,
     salvar_resposta_ia,
@@ -47,6 +48,14 @@ class KanbanQuadro(BaseModel):
     colunas: Dict[str, List[KanbanCard]]
 
 
+class KanbanPagina(BaseModel):
+    id: str
+    nome: str
+    cards: List[KanbanCard]
+    total: int
+    proximo: Optional[str] = Field(None, description="Cursor da próxima página (parâmetro `apos`)")
+
+
 class AtualizaEstadoReq(BaseModel):
     novo_estado: str = Field(..., description="Novo estado da conversa")
 
@@ -61,15 +70,8 @@ class RespostaHumanaReq(BaseModel):
 # ⬇️  Constantes e Utilidades
 # ---------------------------
 
-ESTADOS_KANBAN = {
-    "Novos": ["INICIAL", "IDENTIFICANDO_NECESSIDADE"],
-    "IA Respondendo": ["SUPORTE_FAQ", "IA_RESPONDENDO"],
-    "Triagem Emocional": ["AGUARDANDO_RESPOSTA_QUALIFICACAO", "COLETANDO_RESPOSTA_QUESTIONARIO"],
-    "Aguardando Agendamento": ["EXPLICANDO_CONSULTA", "AGUARDANDO_PAGAMENTO", "CONFIRMANDO_AGENDAMENTO"],
-    "Com Profissional": ["AGUARDANDO_ATENDENTE", "COM_PROFISSIONAL"],
-    "Escalonado": ["ESCALONADO", "RISCO_DETECTADO"],
-    "Finalizado": ["FINALIZANDO_ONBOARDING", "FINALIZADO", "ENCERRADO"],
-}
+# Colunas e mapa estado -> coluna: core/kanban.py (o mesmo do /dashboard/kanban)
+ESTADOS_VALIDOS = set(kanban.COLUNA_DO_ESTADO)
 
 EMOJI_SENTIMENTO = {
     "positivo": "🙂",
@@ -86,38 +88,20 @@ def _sentimento_to_emoji(sent: Optional[str]) -> str:
     return EMOJI_SENTIMENTO.get(str(sent).lower(), "🟡")
 
 
-def _contexto_para_card(ctx: Dict[str, Any]) -> KanbanCard:
-    meta = ctx.get("meta_conversa", {}) or {}
-    tel = ctx["tel"]
-    nome = meta.get("nome_paciente") or ctx.get("nome") or "Paciente"
-    sentimento = meta.get("ultimo_sentimento_detectado")
-    risco_flag = bool(meta.get("ultimo_risco"))
-    ts = ctx.get("ts") or ctx.get("criado_em") or datetime.now(timezone.utc)
+def _card_para_kanban(card: Dict[str, Any]) -> KanbanCard:
     return KanbanCard(
-        id=str(tel),
-        nome=nome,
-        emoji_sentimento=_sentimento_to_emoji(sentimento),
-        risco=risco_flag,
-        ultima_mensagem_ts=ts,
+        id=card["tel"],
+        nome=card.get("nome") or "Paciente",
+        emoji_sentimento=_sentimento_to_emoji(card.get("sentimento")),
+        risco=bool(card.get("risco")),
+        ultima_mensagem_ts=card["ts"],
     )
 
 
-def _carregar_quadro() -> KanbanQuadro:
-    quadro: Dict[str, List[KanbanCard]] = {col: [] for col in ESTADOS_KANBAN}
-    cursor = contextos_db.find({}, {"_id": 0})
-    for ctx in cursor:
-        estado = ctx.get("estado", "INICIAL")
-        coluna_destino = next(
-            (col for col, estados in ESTADOS_KANBAN.items() if estado in estados),
-            "Novos",
-        )
-        quadro[coluna_destino].append(_contexto_para_card(ctx))
-
-    # Ordena cada coluna pela data da última mensagem (mais recente no topo)
-    for col in quadro:
-        quadro[col].sort(key=lambda c: c.ultima_mensagem_ts, reverse=True)
-
-    return KanbanQuadro(colunas=quadro)
+async def _carregar_quadro(limite: int) -> KanbanQuadro:
+    # Cards materializados (kanban_cards): uma consulta indexada por coluna, já ordenada
+    colunas = await kanban.carregar_quadro(limite)
+    return KanbanQuadro(colunas={col["titulo"]: [_card_para_kanban(c) for c in col["cards"]] for col in colunas})
 
 
 # ---------------------------
@@ -125,12 +109,31 @@ def _carregar_quadro() -> KanbanQuadro:
 # ---------------------------
 
 
-@router.get("/", response_model=KanbanQuadro, summary="Quadro Kanban completo")
-async def get_kanban() -> KanbanQuadro:
+@router.get("/", response_model=KanbanQuadro, summary="Quadro Kanban (primeira página de cada coluna)")
+async def get_kanban(
+    limite: int = Query(kanban.CARDS_POR_COLUNA, ge=1, le=500, description="Cards por coluna"),
+) -> KanbanQuadro:
     """
-    Retorna todas as conversas agrupadas por estado Kanban.
+    Retorna as conversas mais recentes de cada coluna do Kanban.
+    Demais cards: /kanban/coluna/{coluna_id}.
     """
-    return _carregar_quadro()
+    return await _carregar_quadro(limite)
+
+
+@router.get("/coluna/{coluna_id}", response_model=KanbanPagina, summary="Página de uma coluna do Kanban")
+async def get_kanban_coluna(
+    coluna_id: str = Path(..., description="Id da coluna (ex: entrada, proposta)"),
+    limite: int = Query(kanban.CARDS_POR_COLUNA, ge=1, le=500),
+    apos: Optional[str] = Query(None, description="Cursor `proximo` da página anterior"),
+) -> KanbanPagina:
+    try:
+        col = await kanban.pagina(coluna_id, limite, apos)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return KanbanPagina(
+        id=col["id"], nome=col["titulo"], cards=[_card_para_kanban(c) for c in col["cards"]],
+        total=col["total"], proximo=col["proximo"],
+    )
 
 
 @router.put(
@@ -146,13 +149,19 @@ async def atualizar_estado_conversa(
     Move a conversa para outra coluna/estado.
     """
     novo_estado = payload.novo_estado
-    if novo_estado not in {e for lst in ESTADOS_KANBAN.values() for e in lst}:
+    if novo_estado not in ESTADOS_VALIDOS:
         raise HTTPException(400, "Estado inválido")
 
-    res = contextos_db.update_one({"tel": conversa_id}, {"$set": {"estado": novo_estado}})
-    if res.matched_count == 0:
+    if (
+        not await banco.colecao("contextos").count_documents({"tel": conversa_id}, limit=1)
+        and not await retencao.reidratar(conversa_id)  # conversa na camada fria
+    ):
         raise HTTPException(404, "Conversa não encontrada")
 
+    # Passa pelo salvar_contexto (versionado) para não atropelar um turno em andamento
+    if not await salvar_contexto(conversa_id, estado=novo_estado, incrementar_interacoes=False):
+        raise HTTPException(500, "Falha ao atualizar estado da conversa")
+
     return {"status": "ok"}            # ← devolve algo, já que é 200
 
 
@@ -166,11 +175,8 @@ async def get_conversa(telefone: str) -> List[Dict[str, Any]]:
     Retorna o histórico da conversa em ordem cronológica crescente.
     Inclui mensagens do usuário, IA e humanos.
     """
-    cursor = respostas_ia_db.find(
-        {"telefone": telefone},
-        {"_id": 0},
-    ).sort("criado_em", 1)
-    return list(cursor)
+    turnos = await historico.transcricao(telefone)
+    return [{**{k: v for k, v in t.items() if k != "_id"}, "telefone": telefone} for t in turnos]
 
 
 @router.post(
@@ -183,11 +189,11 @@ async def responder_humano(req: RespostaHumanaReq) -> Dict[str, str]:
     Profissional envia uma resposta manual ao paciente;
     registra no histórico e bloqueia IA se necessário.
     """
-    ctx = obter_contexto(req.telefone)
+    ctx = await obter_contexto(req.telefone)
     if not ctx:
         raise HTTPException(status_code=404, detail="Conversa não encontrada")
 
-    salvar_resposta_ia(
+    await salvar_resposta_ia(
         telefone=req.telefone,
         canal="whatsapp",
         mensagem_usuario=f"[HUMANO {req.respondente}]",
@@ -200,7 +206,7 @@ async def responder_humano(req: RespostaHumanaReq) -> Dict[str, str]:
     )
 
     # Desativa IA se conversa for assumida por humano
-    salvar_contexto(req.telefone, estado="COM_PROFISSIONAL")
+    await salvar_contexto(req.telefone, estado="COM_PROFISSIONAL")
     return {"status": "ok"}
 
 
@@ -224,7 +230,8 @@ async def get_risco_ativos() -> List[Dict[str, Any]]:
         },
         {"$sort": {"ultima_msg": -1}},
     ]
-    resultados = list(respostas_ia_db.aggregate(pipeline))
+    cursor = await banco.colecao("respostas_ia", "painel").aggregate(pipeline)
+    resultados = await cursor.to_list(length=None)
     return [
         {
             "telefone": r["_id"],
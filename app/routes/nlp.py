@@ -17,7 +17,7 @@ async def chat_nlp(request: Request):
 
     resultado = await processar_mensagem(mensagem, paciente_id, canal)
 
-    salvar_lead(
+    await salvar_lead(
         paciente_id=paciente_id,
         canal=canal,
         mensagem=mensagem,
@@ -24,7 +24,7 @@ async def stripe_webhook(request: Request):
         nome = session["metadata"].get("nome", "Paciente")
         email = session["metadata"].get("email")
 
-        horario = agendar_consulta(telefone, nome, email)
+        horario = await agendar_consulta(telefone, nome, email)
 
         msg_paciente = (
             f"✅ Olá {nome}, seu agendamento está confirmado!\n"
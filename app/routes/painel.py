@@ -1,12 +1,8 @@
 from fastapi import APIRouter
-from pymongo import MongoClient
-from app.config import MONGO_URI
+from app.utils import historico as historico_conversa
 
 router = APIRouter()
 
-mongo = MongoClient(MONGO_URI)
-colecao = mongo["famdomes"]["respostas_ia"]
-
 @router.get("/consulta/{token}")
 async def status_consulta(token: str):
     return {
@@ -17,7 +13,7 @@ async def status_consulta(token: str):
 
 @router.get("/historico/{telefone}")
 async def historico_respostas(telefone: str):
-    resultados = colecao.find({"telefone": telefone}).sort("criado_em", -1)
+    resultados = reversed(await historico_conversa.transcricao(telefone))
     historico = []
     for doc in resultados:
         historico.append({
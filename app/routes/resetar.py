@@ -4,12 +4,12 @@ from app.utils.contexto import limpar_contexto
 router = APIRouter()
 
 @router.post("/painel/resetar-contexto/{telefone}")
-def resetar_contexto(telefone: str):
+async def resetar_contexto(telefone: str):
     if not telefone:
         raise HTTPException(status_code=400, detail="Telefone é obrigatório.")
     
     try:
-        sucesso = limpar_contexto(telefone)
+        sucesso = await limpar_contexto(telefone)
         if sucesso:
             return {"status": "resetado", "telefone": telefone}
         else:
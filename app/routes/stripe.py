@@ -16,6 +16,7 @@ from app.config import settings # Usar settings para acesso seguro às configs
 from app.utils.followup import marcar_pagamento # Função que marca pago E agenda
 from app.utils.agenda import formatar_horario_local # Para formatar horário na msg
 from app.utils.contexto import salvar_contexto # Para mudar o estado do usuário
+from app.utils.meta_conversa import MetaConversa
 from app.utils.mensageria import enviar_mensagem # Para notificar usuário
 
 logger = logging.getLogger("famdomes.stripe_webhook")
@@ -165,10 +166,10 @@ async def processar_evento_stripe(event: dict):
                 # Muda o estado para que o Orquestrador saiba que a próxima interação
                 # deve iniciar o questionário de triagem.
                 logger.info(f"STRIPE BG Task: Atualizando estado para 'TRIAGEM_INICIAL' para {telefone_cliente}")
-                sucesso_save = salvar_contexto(
+                sucesso_save = await salvar_contexto(
                     telefone=telefone_cliente,
                     estado="TRIAGEM_INICIAL", # Estado que o Orquestrador usará para chamar DomoTriagem
-                    meta_conversa={"email_cliente": email_cliente, "nome_cliente": nome_agendado} # Atualiza meta com dados do pagamento
+                    meta_conversa=MetaConversa.parcial({"email_cliente": email_cliente, "nome_cliente": nome_agendado}) # Mescla dados do pagamento na meta existente
                 )
                 if not sucesso_save:
                      logger.error(f"STRIPE BG Task: ❌ FALHA CRÍTICA ao atualizar estado para TRIAGEM_INICIAL para {telefone_cliente} após pagamento.")
@@ -24,7 +24,7 @@ class SugestaoResp(BaseModel):
     summary="IA sugere próximo passo para a conversa",
 )
 async def sugerir_proximo_passo(telefone: str) -> SugestaoResp:
-    ctx = obter_contexto(telefone)
+    ctx = await obter_contexto(telefone)
     if not ctx:
         raise HTTPException(404, "Conversa não encontrada")
 
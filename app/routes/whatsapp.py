@@ -6,12 +6,15 @@ from __future__ import annotations
 
 import json
 import logging
+from datetime import datetime, timezone
 from fastapi import APIRouter, BackgroundTasks, Request, Response, status, HTTPException
 from pydantic import BaseModel, constr
 from app.config import WHATSAPP_VERIFY_TOKEN
 from app.core.mcp_orquestrador import MCPOrquestrador
 from app.utils.mensageria import enviar_mensagem
 from app.utils.contexto import limpar_contexto
+from app.core import status_entrega # sent/delivered/read/failed em lote
+from app.core.outbox import recebido_em_atual # base da latência ponta a ponta
 
 logger = logging.getLogger("famdomes.whatsapp")
 
@@ -48,6 +51,7 @@ async def receber_mensagem(
     Recebe payload da Cloud API, extrai texto e delega ao MCP
     em task de background (latência mínima p/ Meta).
     """
+    recebido_em = datetime.now(timezone.utc)
     data = await request.json()
     try:
         entry = data["entry"][0]
@@ -57,7 +61,10 @@ async def receber_mensagem(
         # payload diferente (status, etc.) ⇒ apenas 200
         return Response(status_code=200)
 
-    # Eventos de status não contêm 'messages'
+    # Eventos de status (sent/delivered/read/failed): só enfileira, grava em lote
+    if value.get("statuses"):
+        status_entrega.registrar(value["statuses"])
+
     messages = value.get("messages", [])
     if not messages:
         return Response(status_code=200)
@@ -76,13 +83,13 @@ async def receber_mensagem(
         return Response(status_code=200)
 
     # Normal: delega ao MCP em background
-    background_tasks.add_task(_processar_mcp, telefone, texto)
+    background_tasks.add_task(_processar_mcp, telefone, texto, recebido_em)
     return Response(status_code=200)
 
 # ----------------------------------------------------------------------
 # 4 · Task: reset
 async def _resetar_conversa(telefone: str) -> None:
-    limpar_contexto(telefone)        # ignoramos retorno: sempre zera
+    await limpar_contexto(telefone)        # ignoramos retorno: sempre zera
     await enviar_mensagem(
         telefone,
         "🔄 Sua conversa foi reiniciada. Pode começar de novo!",
@@ -92,7 +99,8 @@ async def _resetar_conversa(telefone: str) -> None:
 
 # ----------------------------------------------------------------------
 # 5 · Task: encaminhar para MCP
-async def _processar_mcp(telefone: str, texto: str) -> None:
+async def _processar_mcp(telefone: str, texto: str, recebido_em: datetime | None = None) -> None:
+    recebido_em_atual.set(recebido_em)  # respostas enfileiradas neste processamento herdam
     try:
         await MCPOrquestrador().processar_mensagem(telefone, texto)
     except Exception as exc:  # pragma: no cover
@@ -27,6 +27,8 @@ class KanbanColumn(BaseModel):
             id: str # Ex: 'entrada', 'qualificacao'
             title: str # Ex: 'Entrada', 'Qualificação'
             cards: List[ConversationCard]
+            total: Optional[int] = None # Cards na coluna inteira
+            proximo: Optional[str] = None # Cursor da próxima página (parâmetro `apos`)
 
 class KanbanBoard(BaseModel):
             """Modelo para o quadro Kanban completo."""
@@ -3,12 +3,11 @@
 # (Implementação das funções de agendamento com DB)
 # ===========================================================
 from datetime import datetime, timedelta, timezone
-from pymongo import MongoClient, ReturnDocument
-from pymongo.errors import ConnectionFailure, DuplicateKeyError
-# Ajuste o import se config.py estiver em um diretório diferente
-from app.config import MONGO_URI
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import logging
 import pytz # Para lidar com fusos horários corretamente
+from app.core import banco # Acesso assíncrono (não bloqueia o event loop)
 
 # Configuração básica de logging
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -21,32 +20,10 @@ HORARIO_OPERACAO_FIM = 18  # Horário de fim (não agenda às 18:00, último blo
 DIAS_UTEIS = [0, 1, 2, 3, 4] # 0=Segunda, 1=Terça, ..., 4=Sexta
 FUSO_HORARIO_LOCAL = 'America/Sao_Paulo' # Fuso horário de operação
 
-# --- Conexão com MongoDB ---
-mongo_agenda = None
-db_agenda = None
-consultas_db = None
-
-try:
-    # Estabelece conexão com MongoDB
-    if MONGO_URI:
-        mongo_agenda = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-        mongo_agenda.server_info() # Testa a conexão
-        db_agenda = mongo_agenda["famdomes"] # Nome do banco de dados
-        consultas_db = db_agenda["consultas_agendadas"] # Coleção para agendamentos
-        # Cria índice único para garantir que não haja duas consultas no mesmo horário (UTC)
-        consultas_db.create_index("horario_utc", unique=True)
-        consultas_db.create_index("telefone") # Índice para busca por telefone
-        consultas_db.create_index([("status", 1), ("horario_utc", 1)]) # Índice composto
-        logging.info("AGENDA: Conexão com MongoDB estabelecida e índices verificados/criados.")
-    else:
-        logging.error("AGENDA: ❌ MONGO_URI não definido. Não foi possível conectar ao MongoDB.")
-except ConnectionFailure as e:
-     logging.error(f"AGENDA: ❌ Falha na conexão com MongoDB: {e}")
-except Exception as e:
-    logging.error(f"AGENDA: ❌ ERRO ao conectar com MongoDB ou criar índices: {e}")
-    mongo_agenda = None
-    db_agenda = None
-    consultas_db = None
+# --- Coleção ---
+# As funções principais usam a coleção assíncrona; o shim *_sync de scripts,
+# a síncrona. Ambas vêm de core/banco.py; índices em core/indices.py.
+COLECAO_CONSULTAS = "consultas_agendadas"
 
 # --- Funções Auxiliares ---
 
@@ -124,14 +101,12 @@ def formatar_horario_local(horario_utc: datetime | None, fuso_destino: str = FUS
 
 # --- Funções Principais da Agenda ---
 
-def agendar_consulta(telefone: str, nome: str, email: str | None = None) -> datetime | None:
+async def agendar_consulta(telefone: str, nome: str, email: str | None = None) -> datetime | None:
     """
     Encontra o próximo horário livre e tenta agendar a consulta.
     Retorna o datetime UTC do horário agendado ou None se não conseguir.
     """
-    if consultas_db is None:
-        logging.error("AGENDA: ❌ Não é possível agendar: Sem conexão com DB.")
-        return None
+    consultas = banco.colecao(COLECAO_CONSULTAS)
 
     # Usar UTC para armazenamento e lógica interna
     agora_utc = datetime.now(timezone.utc)
@@ -154,7 +129,7 @@ def agendar_consulta(telefone: str, nome: str, email: str | None = None) -> date
         try:
             # Tenta inserir o documento. Se o horário já estiver ocupado,
             # o índice único ("horario_utc") causará um DuplicateKeyError.
-            result = consultas_db.insert_one(consulta_doc)
+            result = await consultas.insert_one(consulta_doc)
             if result.inserted_id:
                 horario_formatado = formatar_horario_local(horario_tentativa_utc)
                 logging.info(f"AGENDA: ✅ Consulta marcada para {nome} ({telefone}) em {horario_formatado} ({horario_tentativa_utc.isoformat()} UTC)")
@@ -179,14 +154,11 @@ def agendar_consulta(telefone: str, nome: str, email: str | None = None) -> date
     logging.warning(f"AGENDA: ⚠️ Não foram encontrados horários disponíveis para {telefone} ({nome}) após {MAX_TENTATIVAS_AGENDAMENTO} tentativas.")
     return None
 
-def cancelar_consulta(telefone: str) -> int:
+async def cancelar_consulta(telefone: str) -> int:
     """
     Cancela todas as consultas futuras com status 'agendado' para um telefone.
     Retorna o número de consultas canceladas.
     """
-    if consultas_db is None:
-        logging.error("AGENDA: ❌ Não é possível cancelar: Sem conexão com DB.")
-        return 0
 
     agora_utc = datetime.now(timezone.utc)
     try:
@@ -197,7 +169,7 @@ def cancelar_consulta(telefone: str) -> int:
             "status": "agendado" # Apenas consultas que ainda estão agendadas
         }
         # Atualiza o status para 'cancelado_usuario' em vez de deletar (mantém histórico)
-        resultado = consultas_db.update_many(
+        resultado = await banco.colecao(COLECAO_CONSULTAS).update_many(
             filtro,
             {"$set": {"status": "cancelado_usuario", "cancelado_em": agora_utc}}
         )
@@ -212,41 +184,60 @@ def cancelar_consulta(telefone: str) -> int:
         logging.error(f"AGENDA: ❌ ERRO ao cancelar consulta(s) para {telefone}: {e}")
         return 0
 
-def consultar_proximo_horario_disponivel() -> datetime | None:
+def _primeiro_horario_livre(inicio_procura_utc: datetime, ocupados: set) -> datetime | None:
+    """Percorre os blocos válidos a partir de `inicio_procura_utc` e retorna o primeiro fora de `ocupados`."""
+    for _ in range(MAX_TENTATIVAS_AGENDAMENTO):
+        horario_tentativa_utc = _proximo_horario_util(inicio_procura_utc)
+        if horario_tentativa_utc.replace(tzinfo=None) not in ocupados:
+            return horario_tentativa_utc
+        logging.debug(f"AGENDA: Horário {horario_tentativa_utc.isoformat()} UTC ocupado. Tentando próximo.")
+        inicio_procura_utc = horario_tentativa_utc + timedelta(minutes=1) # Avança 1 min
+    return None
+
+
+def _filtro_ocupados(inicio_procura_utc: datetime) -> dict:
+    # Considera agendado e confirmado como ocupados
+    return {"horario_utc": {"$gte": inicio_procura_utc}, "status": {"$in": ["agendado", "confirmado"]}}
+
+
+def _log_proximo_horario(horario_utc: datetime | None) -> None:
+    if horario_utc:
+        logging.info(f"AGENDA: Próximo horário disponível encontrado: {formatar_horario_local(horario_utc)} ({horario_utc.isoformat()} UTC)")
+    else:
+        logging.warning(f"AGENDA: ⚠️ Nenhum horário disponível encontrado na consulta após {MAX_TENTATIVAS_AGENDAMENTO} tentativas.")
+
+
+async def consultar_proximo_horario_disponivel() -> datetime | None:
     """
     Consulta o próximo horário disponível sem agendar.
+    Carrega os horários ocupados em UMA consulta (índice status+horario_utc)
+    em vez de um find_one por bloco.
     Retorna o datetime UTC do horário ou None se não encontrar/erro.
     """
-    if consultas_db is None:
-        logging.error("AGENDA: ❌ Não é possível consultar horário: Sem conexão com DB.")
-        return None
-
-    agora_utc = datetime.now(timezone.utc)
     # Começa a procurar um pouco à frente
-    inicio_procura_utc = agora_utc + timedelta(minutes=5) # Pequena margem
+    inicio_procura_utc = datetime.now(timezone.utc) + timedelta(minutes=5) # Pequena margem
+    try:
+        cursor = banco.colecao(COLECAO_CONSULTAS).find(
+            _filtro_ocupados(inicio_procura_utc), {"horario_utc": 1, "_id": 0}
+        ).sort("horario_utc", 1).limit(MAX_TENTATIVAS_AGENDAMENTO)
+        ocupados = {doc["horario_utc"].replace(tzinfo=None) async for doc in cursor}
+    except Exception as e:
+        logging.error(f"AGENDA: ❌ ERRO ao consultar próximo horário: {e}")
+        return None # Retorna None em caso de erro na consulta
+    horario = _primeiro_horario_livre(inicio_procura_utc, ocupados)
+    _log_proximo_horario(horario)
+    return horario
 
-    for i in range(MAX_TENTATIVAS_AGENDAMENTO):
-        horario_tentativa_utc = _proximo_horario_util(inicio_procura_utc)
-        try:
-            # Verifica se existe alguma consulta agendada ou confirmada para este horário
-            filtro_conflito = {
-                "horario_utc": horario_tentativa_utc,
-                "status": {"$in": ["agendado", "confirmado"]} # Considera ambos como ocupados
-            }
-            conflito = consultas_db.find_one(filtro_conflito)
-            if not conflito:
-                # Encontrou horário livre
-                logging.info(f"AGENDA: Próximo horário disponível encontrado: {formatar_horario_local(horario_tentativa_utc)} ({horario_tentativa_utc.isoformat()} UTC)")
-                return horario_tentativa_utc # Retorna horário em UTC
-            else:
-                # Horário ocupado, avança para o próximo bloco
-                logging.debug(f"AGENDA: Horário {horario_tentativa_utc.isoformat()} UTC ocupado (Status: {conflito.get('status')}). Tentando próximo.")
-                inicio_procura_utc = horario_tentativa_utc + timedelta(minutes=1) # Avança 1 min
-                continue
-        except Exception as e:
-            logging.error(f"AGENDA: ❌ ERRO ao consultar próximo horário ({horario_tentativa_utc}): {e}")
-            return None # Retorna None em caso de erro na consulta
 
-    # Se o loop terminar
-    logging.warning(f"AGENDA: ⚠️ Nenhum horário disponível encontrado na consulta após {MAX_TENTATIVAS_AGENDAMENTO} tentativas.")
-    return None
+def consultar_proximo_horario_disponivel_sync() -> datetime | None:
+    """Shim síncrono de `consultar_proximo_horario_disponivel` — apenas para scripts."""
+    inicio_procura_utc = datetime.now(timezone.utc) + timedelta(minutes=5)
+    try:
+        cursor = banco.colecao_sync(COLECAO_CONSULTAS).find(_filtro_ocupados(inicio_procura_utc), {"horario_utc": 1, "_id": 0}).sort("horario_utc", 1).limit(MAX_TENTATIVAS_AGENDAMENTO)
+        ocupados = {doc["horario_utc"].replace(tzinfo=None) for doc in cursor}
+    except Exception as e:
+        logging.error(f"AGENDA: ❌ ERRO ao consultar próximo horário: {e}")
+        return None
+    horario = _primeiro_horario_livre(inicio_procura_utc, ocupados)
+    _log_proximo_horario(horario)
+    return horario
@@ -8,131 +8,87 @@
 # - Adicionado salvamento de texto do bot.
 # - Funções para obter e limpar contexto mantidas.
 # - Salvar flags de follow-up dentro de meta_conversa.
+# - Funções de leitura/escrita são ASSÍNCRONAS (core/banco.py) para não
+#   bloquear o event loop; versões *_sync existem só para scripts.
+# - Cliente síncrono (shims) vem do registro de core/banco.py; nenhum
+#   I/O no import. Índices ficam nas migrações de core/indices.py.
+# - Leituras/escritas assíncronas passam pelo cache write-behind de
+#   core/cache_contextos.py; `descarregar_contexto` grava no fim do turno.
+# - `versao` no documento: gravações condicionais (ver cache_contextos);
+#   escritas diretas sempre fazem $inc em `versao`.
+# - Cada turno vai para `respostas_ia`, para o bucket de utils/historico.py
+#   e para `ultimos_turnos` no próprio contexto.
+# - Cada gravação recalcula `proximo_followup_em` (core/temporizador.py).
+# - Contexto ausente em `contextos` é procurado na camada fria
+#   (core/retencao.py) e reidratado antes de cair no padrão; o cache
+#   usa o mesmo caminho quando o documento some entre leitura e gravação.
+# - meta_conversa volta como MetaConversa: salvar grava só os campos
+#   alterados ($set/$unset com ponto). Um dict comum ainda substitui tudo.
+# - `saida` (entrada de core/outbox.py) vai no MESMO update do documento
+#   e força a gravação na hora; depois de gravada, o outbox a publica
+#   (hook `apos_gravar` do cache).
+# - Cada gravação atualiza o card da conversa no quadro materializado
+#   (core/kanban.py); limpar_contexto tira o card.
 # ===========================================================
 from __future__ import annotations
 
+import asyncio
 import logging
 from datetime import datetime, timezone
-from pymongo import MongoClient, ASCENDING, IndexModel
-from pymongo.errors import ConnectionFailure, OperationFailure # Import OperationFailure
 from typing import Dict, Any, Optional
 
-# Importar configurações de forma segura
-try:
-    from app.config import MONGO_URI
-except ImportError:
-    import os
-    MONGO_URI = os.getenv("MONGO_URI")
-    if not MONGO_URI:
-        logging.critical("CONTEXTO: Falha ao importar MONGO_URI de app.config e variável de ambiente MONGO_URI não definida.")
-        MONGO_URI = None
+from app.core import banco, retencao
+from app.core import kanban, outbox, painel_ao_vivo
+from app.core import temporizador as temporizador_followup
+from app.core.cache_contextos import cache as cache_contextos, ESTADOS_DURAVEIS
+from app.utils.meta_conversa import MetaConversa
+from app.utils import historico
 
 logger = logging.getLogger("famdomes.contexto")
 
-# --- Conexão e Configuração do Banco de Dados ---
-mongo_client: Optional[MongoClient] = None
-db: Optional[Any] = None # Tipo genérico para Database
-contextos_db: Optional[Any] = None # Tipo genérico para Collection
-respostas_ia_db: Optional[Any] = None # Tipo genérico para Collection
+# Saídas gravadas no contexto entram na fila do outbox depois de cada gravação do cache
+cache_contextos.apos_gravar.append(outbox.remetente.apos_gravar_contexto)
+# Gravação de contexto congelado depois de lido: o cache o traz de volta antes de reaplicar
+cache_contextos.reidratar = retencao.reidratar
 
-def conectar_db():
-    """Estabelece conexão com o MongoDB e configura coleções e índices."""
-    global mongo_client, db, contextos_db, respostas_ia_db
+# ----------------------------------------------------------------------
+def _contexto_padrao(telefone: str) -> Dict[str, Any]:
+    return {"estado": "INICIAL", "meta_conversa": {}, "interacoes": 0, "tel": telefone}
 
-    # CORREÇÃO: Verifica todos os objetos comparando com None
-    if mongo_client is not None and db is not None and contextos_db is not None and respostas_ia_db is not None:
-        logger.debug("CONTEXTO: Conexão com MongoDB já estabelecida.")
-        return
 
-    if MONGO_URI is None:
-        logger.error("CONTEXTO: ❌ MONGO_URI não definido. Não é possível conectar ao MongoDB.")
-        return
+def _com_meta_rastreada(doc: Dict[str, Any]) -> Dict[str, Any]:
+    meta = doc.get("meta_conversa")
+    if isinstance(meta, dict) and not isinstance(meta, MetaConversa):
+        doc["meta_conversa"] = MetaConversa(meta)
+    return doc
 
-    try:
-        logger.info(f"CONTEXTO: Tentando conectar ao MongoDB em {MONGO_URI[:20]}...")
-        mongo_client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, connectTimeoutMS=5000, socketTimeoutMS=10000)
-        mongo_client.server_info()
-        db = mongo_client["famdomes"] # Ajuste o nome do DB se necessário
-        contextos_db = db["contextos"]
-        respostas_ia_db = db["respostas_ia"]
-
-        # --- Criação de Índices ---
-        indexes_contextos = [
-            IndexModel([("tel", ASCENDING)], name="tel_unique_idx", unique=True),
-            IndexModel([("ts", ASCENDING)], name="ts_idx"),
-            IndexModel([("estado", ASCENDING)], name="estado_idx")
-        ]
-        indexes_respostas = [
-            IndexModel([("telefone", ASCENDING)], name="telefone_idx"),
-            IndexModel([("criado_em", ASCENDING)], name="criado_em_idx")
-        ]
-
-        # Tenta criar os índices para 'contextos'
-        try:
-            contextos_db.create_indexes(indexes_contextos)
-            logger.info("CONTEXTO: Índices da coleção 'contextos' verificados/criados.")
-        except OperationFailure as e:
-            if e.code == 85:
-                logger.info("CONTEXTO: Índices para 'contextos' já existem (possivelmente com nomes diferentes).")
-            else:
-                logger.warning(f"CONTEXTO: Aviso durante criação de índices para 'contextos': {e}")
-        except Exception as e:
-             logger.warning(f"CONTEXTO: Erro inesperado ao criar índices para 'contextos': {e}")
-
-        # Tenta criar os índices para 'respostas_ia'
-        try:
-            respostas_ia_db.create_indexes(indexes_respostas)
-            logger.info("CONTEXTO: Índices da coleção 'respostas_ia' verificados/criados.")
-        except OperationFailure as e:
-            if e.code == 85:
-                logger.info("CONTEXTO: Índices para 'respostas_ia' já existem (possivelmente com nomes diferentes).")
-            else:
-                logger.warning(f"CONTEXTO: Aviso durante criação de índices para 'respostas_ia': {e}")
-        except Exception as e:
-             logger.warning(f"CONTEXTO: Erro inesperado ao criar índices para 'respostas_ia': {e}")
-
-        logger.info("CONTEXTO: ✅ Conexão com MongoDB estabelecida e configuração de índices concluída.")
-
-    except ConnectionFailure as e:
-        logger.error(f"CONTEXTO: ❌ Falha na conexão com MongoDB: {e}")
-        mongo_client = db = contextos_db = respostas_ia_db = None
-    except Exception as e:
-        logger.exception(f"CONTEXTO: ❌ ERRO inesperado ao conectar/configurar MongoDB: {e}")
-        mongo_client = db = contextos_db = respostas_ia_db = None
-
-# Tenta conectar na inicialização do módulo
-conectar_db()
 
-# ----------------------------------------------------------------------
-def salvar_contexto(
+def _montar_update_contexto(
+    texto_usuario: Optional[str],
+    estado: Optional[str],
+    meta_conversa: Optional[Dict[str, Any]],
+    intent_detectada: Optional[str],
+    ultimo_texto_bot: Optional[str],
+    incrementar_interacoes: bool,
     telefone: str,
-    *,
-    texto_usuario: Optional[str] = None,
-    estado: Optional[str] = None,
-    meta_conversa: Optional[Dict[str, Any]] = None,
-    intent_detectada: Optional[str] = None,
-    ultimo_texto_bot: Optional[str] = None,
-    incrementar_interacoes: bool = True
-) -> bool:
-    """
-    Atualiza (ou cria) o documento de contexto para um telefone no MongoDB.
-    Retorna True se a operação foi bem-sucedida.
-    """
-    # Verifica se a coleção está disponível
-    if contextos_db is None:
-        logger.error(f"CONTEXTO: Falha ao salvar contexto para {telefone}. Coleção 'contextos' indisponível.")
-        conectar_db() # Tenta reconectar
-        if contextos_db is None: return False
-
+) -> Dict[str, Any]:
+    """Monta o update ($set/$inc/$setOnInsert) usado por salvar_contexto."""
     set_fields: Dict[str, Any] = {"ts": datetime.now(timezone.utc)}
     if texto_usuario is not None: set_fields["ultimo_texto_usuario"] = texto_usuario
     if estado is not None: set_fields["estado"] = estado
-    if meta_conversa is not None: set_fields["meta_conversa"] = meta_conversa
+    unset_fields: Dict[str, Any] = {}
+    if isinstance(meta_conversa, MetaConversa):
+        diff_meta = meta_conversa.diff()
+        set_fields.update(diff_meta.get("$set", {}))
+        unset_fields.update(diff_meta.get("$unset", {}))
+    elif meta_conversa is not None:
+        set_fields["meta_conversa"] = meta_conversa
     if intent_detectada is not None: set_fields["ultima_intent_detectada"] = intent_detectada
     if ultimo_texto_bot is not None: set_fields["ultimo_texto_bot"] = ultimo_texto_bot
 
     update_operation: Dict[str, Any] = {}
     if set_fields: update_operation["$set"] = set_fields
+    if unset_fields: update_operation["$unset"] = unset_fields
     if incrementar_interacoes: update_operation["$inc"] = {"interacoes": 1}
 
     agora = datetime.now(timezone.utc)
@@ -154,55 +110,137 @@ def salvar_contexto(
 
     if set_on_insert_data:
         update_operation["$setOnInsert"] = set_on_insert_data
+    return update_operation
+
 
-    if not update_operation.get("$set") and not update_operation.get("$inc") and not update_operation.get("$setOnInsert"):
-         logger.debug(f"CONTEXTO: Nenhuma operação de atualização para salvar contexto de {telefone}.")
-         return True
+def _log_resultado_contexto(telefone: str, estado: Optional[str], result) -> None:
+    logger.debug(f"CONTEXTO: Resultado do update para {telefone}: matched={result.matched_count}, modified={result.modified_count}, upserted_id={result.upserted_id}")
+    if result.modified_count > 0 or result.upserted_id is not None:
+         log_estado = estado if estado is not None else '(estado inalterado)'
+         logger.info(f"CONTEXTO: Contexto salvo/atualizado para {telefone}. Estado: {log_estado}")
+    else:
+         logger.info(f"CONTEXTO: Contexto para {telefone} não modificado.")
+
+
+def _normalizar_contexto(doc: Dict[str, Any], telefone: str) -> Dict[str, Any]:
+    logger.debug(f"CONTEXTO: Contexto encontrado para {telefone}. Estado: {doc.get('estado')}")
+    doc.setdefault("estado", "INICIAL")
+    doc.setdefault("meta_conversa", {})
+    doc.setdefault("interacoes", 0)
+    doc.setdefault("tel", telefone)
+    return doc
+
+
+def _montar_documento_resposta(
+    telefone, canal, mensagem_usuario, resposta_gerada, intent, entidades,
+    risco_detectado, sentimento_detectado, nome_agente, enviado_por_humano,
+) -> Dict[str, Any]:
+    entidades_validas = entidades if isinstance(entidades, dict) else {}
+    sentimento_valido = sentimento_detectado if isinstance(sentimento_detectado, dict) else None
+    return {
+        "telefone": telefone,
+        "canal": canal,
+        "mensagem_usuario": mensagem_usuario,
+        "resposta_gerada": resposta_gerada,
+        "intent_detectada": intent,
+        "entidades_extraidas": entidades_validas,
+        "risco_detectado": bool(risco_detectado),
+        "sentimento_detectado": sentimento_valido,
+        "nome_agente": nome_agente,
+        "enviado_por_humano": enviado_por_humano, # Salva o novo campo
+        "criado_em": datetime.now(timezone.utc),
+    }
 
+# ----------------------------------------------------------------------
+async def salvar_contexto(
+    telefone: str,
+    *,
+    texto_usuario: Optional[str] = None,
+    estado: Optional[str] = None,
+    meta_conversa: Optional[Dict[str, Any]] = None,
+    intent_detectada: Optional[str] = None,
+    ultimo_texto_bot: Optional[str] = None,
+    incrementar_interacoes: bool = True,
+    saida: Optional[Dict[str, Any]] = None,
+) -> bool:
+    """
+    Atualiza (ou cria) o documento de contexto para um telefone no MongoDB.
+    `saida` (outbox.montar_entrada) é gravada no mesmo update e só entra na
+    fila de envio se a gravação der certo.
+    Retorna True se a operação foi bem-sucedida.
+    """
+    direto = telefone not in cache_contextos
+    if direto:
+        # Conversa fora do cache (webhook, painel): carrega a versão atual e grava já, versionado
+        await obter_contexto(telefone)
+    update_operation = _montar_update_contexto(
+        texto_usuario, estado, meta_conversa, intent_detectada, ultimo_texto_bot, incrementar_interacoes, telefone
+    )
+    # Próximo follow-up (core/temporizador.py) recalculado a cada interação
+    estado_efetivo = estado or cache_contextos.campo(telefone, "estado")
+    proximo_followup = None
+    if estado_efetivo:
+        proximo_followup = temporizador_followup.mesclar_no_update(update_operation, estado_efetivo, update_operation["$set"]["ts"])
+    if saida is not None:
+        update_operation.setdefault("$push", {}).update(outbox.update_saida(saida)["$push"])
+    if cache_contextos.registrar(telefone, update_operation):
+        logger.debug(f"CONTEXTO: Contexto de {telefone} atualizado em memória (estado: {estado or '(inalterado)'}).")
+        if isinstance(meta_conversa, MetaConversa): meta_conversa.marcar_salvo()
+        if proximo_followup: temporizador_followup.temporizador.agendar(telefone, *proximo_followup)
+        elif estado_efetivo: temporizador_followup.temporizador.cancelar(telefone)
+        kanban.marcar(telefone, cache_contextos.espiar(telefone))
+        if direto:
+            return await cache_contextos.descarregar(telefone, motivo="direto")
+        if saida is not None:
+            # Resposta na fila só depois de gravada junto com o contexto
+            return await cache_contextos.descarregar(telefone, motivo="saida")
+        if estado in ESTADOS_DURAVEIS:
+            # Transição que não pode se perder: grava agora junto com o que estava pendente
+            return await cache_contextos.descarregar(telefone, motivo="duravel")
+        return True
+    update_operation.setdefault("$inc", {})["versao"] = 1
     try:
-        result = contextos_db.update_one({"tel": telefone}, update_operation, upsert=True)
-        logger.debug(f"CONTEXTO: Resultado do update para {telefone}: matched={result.matched_count}, modified={result.modified_count}, upserted_id={result.upserted_id}")
-        if result.modified_count > 0 or result.upserted_id is not None:
-             log_estado = estado if estado is not None else '(estado inalterado)'
-             logger.info(f"CONTEXTO: Contexto salvo/atualizado para {telefone}. Estado: {log_estado}")
-             return True
-        else:
-             logger.info(f"CONTEXTO: Contexto para {telefone} não modificado.")
-             return True
+        result = await banco.colecao("contextos").update_one({"tel": telefone}, update_operation, upsert=True)
+        _log_resultado_contexto(telefone, estado, result)
+        if isinstance(meta_conversa, MetaConversa): meta_conversa.marcar_salvo()
+        kanban.marcar(telefone)  # fora do cache: card relido do banco
+        if saida is not None:
+            await _publicar_saida(telefone, update_operation)
+        return True
     except Exception as e:
         logger.exception(f"CONTEXTO: ❌ ERRO ao salvar contexto para {telefone}: {e}")
         return False
 
+async def _publicar_saida(telefone: str, update_operation: Dict[str, Any]) -> None:
+    try:
+        await outbox.remetente.apos_gravar_contexto(telefone, update_operation)
+    except Exception as e:
+        # Já gravada no contexto: recuperar_saidas (job do outbox) publica depois
+        logger.error(f"CONTEXTO: ❌ Saída gravada para {telefone} não foi publicada no outbox: {e}")
+
 # ----------------------------------------------------------------------
-def obter_contexto(telefone: str) -> Dict[str, Any]:
+async def obter_contexto(telefone: str) -> Dict[str, Any]:
     """
     Recupera o documento de contexto atual para um telefone do MongoDB.
     Retorna um dicionário com valores padrão se não encontrado ou erro.
     """
-    # Verifica se a coleção está disponível
-    if contextos_db is None:
-        logger.error(f"CONTEXTO: Falha ao obter contexto para {telefone}. Coleção 'contextos' indisponível.")
-        conectar_db() # Tenta reconectar
-        if contextos_db is None: return {"estado": "INICIAL", "meta_conversa": {}, "interacoes": 0, "tel": telefone}
-
+    doc = await cache_contextos.obter_atual(telefone)
+    if doc is not None:
+        return _com_meta_rastreada(doc)
     try:
-        doc = contextos_db.find_one({"tel": telefone}, {"_id": 0})
+        doc = await banco.colecao("contextos").find_one({"tel": telefone}, {"_id": 0})
+        if not doc and await retencao.reidratar(telefone):  # conversa parada voltando
+            doc = await banco.colecao("contextos").find_one({"tel": telefone}, {"_id": 0})
         if doc:
-            logger.debug(f"CONTEXTO: Contexto encontrado para {telefone}. Estado: {doc.get('estado')}")
-            doc.setdefault("estado", "INICIAL")
-            doc.setdefault("meta_conversa", {})
-            doc.setdefault("interacoes", 0)
-            doc.setdefault("tel", telefone)
-            return doc
-        else:
-            logger.info(f"CONTEXTO: Nenhum contexto encontrado para {telefone}. Retornando padrão.")
-            return {"estado": "INICIAL", "meta_conversa": {}, "interacoes": 0, "tel": telefone}
+            return _com_meta_rastreada(cache_contextos.guardar(telefone, _normalizar_contexto(doc, telefone)))
+        logger.info(f"CONTEXTO: Nenhum contexto encontrado para {telefone}. Retornando padrão.")
+        return _com_meta_rastreada(cache_contextos.guardar(telefone, _contexto_padrao(telefone)))
     except Exception as e:
         logger.exception(f"CONTEXTO: ❌ ERRO ao obter contexto para {telefone}: {e}")
-        return {"estado": "INICIAL", "meta_conversa": {}, "interacoes": 0, "tel": telefone}
+        return _com_meta_rastreada(_contexto_padrao(telefone))
 
 # ----------------------------------------------------------------------
-def salvar_resposta_ia(
+async def salvar_resposta_ia(
     telefone: str,
     canal: str,
     mensagem_usuario: str,
@@ -215,65 +253,62 @@ def salvar_resposta_ia(
     enviado_por_humano: bool = False # Novo campo para diferenciar msg humana
 ) -> bool:
     """
-    Grava um registro da interação na coleção de histórico `respostas_ia`.
-    Retorna True se a inserção foi bem-sucedida.
+    Grava um registro da interação na coleção de histórico `respostas_ia`,
+    no bucket de histórico do telefone e em `ultimos_turnos` do contexto.
+    Retorna True se a inserção em `respostas_ia` foi bem-sucedida.
     """
-    # Verifica se a coleção está disponível
-    if respostas_ia_db is None:
-        logger.error(f"CONTEXTO: Falha ao salvar resposta IA para {telefone}. Coleção 'respostas_ia' indisponível.")
-        conectar_db() # Tenta reconectar
-        if respostas_ia_db is None: return False
-
-    entidades_validas = entidades if isinstance(entidades, dict) else {}
-    sentimento_valido = sentimento_detectado if isinstance(sentimento_detectado, dict) else None
-
-    documento = {
-        "telefone": telefone,
-        "canal": canal,
-        "mensagem_usuario": mensagem_usuario,
-        "resposta_gerada": resposta_gerada,
-        "intent_detectada": intent,
-        "entidades_extraidas": entidades_validas,
-        "risco_detectado": bool(risco_detectado),
-        "sentimento_detectado": sentimento_valido,
-        "nome_agente": nome_agente,
-        "enviado_por_humano": enviado_por_humano, # Salva o novo campo
-        "criado_em": datetime.now(timezone.utc),
-    }
-
+    documento = _montar_documento_resposta(
+        telefone, canal, mensagem_usuario, resposta_gerada, intent, entidades,
+        risco_detectado, sentimento_detectado, nome_agente, enviado_por_humano,
+    )
+    turno = historico.montar_turno(documento)
+    await _embutir_turno(telefone, turno)
     try:
-        result = respostas_ia_db.insert_one(documento)
+        result, _ = await asyncio.gather(
+            banco.colecao("respostas_ia").insert_one(documento),
+            historico.anexar_turno(telefone, turno),
+        )
         if result.inserted_id:
+            painel_ao_vivo.publicar_turno(documento)  # dashboards conectados recebem na hora
             logger.debug(f"CONTEXTO: Resposta IA salva no histórico para {telefone} (Intent: {intent}, Humano: {enviado_por_humano}).")
             return True
-        else:
-            logger.error(f"CONTEXTO: ❌ Falha desconhecida ao inserir resposta IA no histórico para {telefone} (inserted_id nulo).")
-            return False
+        logger.error(f"CONTEXTO: ❌ Falha desconhecida ao inserir resposta IA no histórico para {telefone} (inserted_id nulo).")
+        return False
     except Exception as e:
         logger.exception(f"CONTEXTO: ❌ ERRO ao salvar resposta IA no histórico para {telefone}: {e}")
         return False
 
+async def _embutir_turno(telefone: str, turno: Dict[str, Any]) -> None:
+    """Mantém os últimos turnos dentro do contexto (em memória se estiver no cache)."""
+    update = historico.update_ultimos_turnos(turno)
+    if cache_contextos.registrar(telefone, update):
+        return
+    update["$inc"] = {"versao": 1}
+    try:
+        await banco.colecao("contextos").update_one({"tel": telefone}, update)
+    except Exception as e:
+        logger.error(f"CONTEXTO: ❌ ERRO ao embutir turno no contexto de {telefone}: {e}")
+
 # ----------------------------------------------------------------------
-def limpar_contexto(telefone: str) -> bool:
+async def limpar_contexto(telefone: str) -> bool:
     """
     Remove o documento de contexto e todos os registros de histórico
     associados a um telefone específico do MongoDB.
     Retorna True se algo foi apagado.
     """
-    # Verifica se as coleções estão disponíveis
-    if contextos_db is None or respostas_ia_db is None:
-        logger.error(f"CONTEXTO: Falha ao limpar contexto para {telefone}. Coleções indisponíveis.")
-        conectar_db() # Tenta reconectar
-        if contextos_db is None or respostas_ia_db is None: return False
-
     contexto_apagado = False
     historico_apagado = False
     sucesso_geral = True
+    await cache_contextos.invalidar(telefone, descartar_pendente=True)
 
     try:
         logger.debug(f"CONTEXTO: Tentando remover contexto para {telefone}...")
-        result_ctx = contextos_db.delete_one({"tel": telefone})
-        if result_ctx.deleted_count > 0:
+        result_ctx, result_frio, _ = await asyncio.gather(
+            banco.colecao("contextos").delete_one({"tel": telefone}),
+            banco.colecao(retencao.COLECAO_CONTEXTOS_FRIOS).delete_one({"tel": telefone}),
+            kanban.remover(telefone),
+        )
+        if result_ctx.deleted_count > 0 or result_frio.deleted_count > 0:
             contexto_apagado = True
             logger.info(f"CONTEXTO: Documento de contexto removido para {telefone}.")
         else:
@@ -284,10 +319,15 @@ def limpar_contexto(telefone: str) -> bool:
 
     try:
         logger.debug(f"CONTEXTO: Tentando remover histórico para {telefone}...")
-        result_hist = respostas_ia_db.delete_many({"telefone": telefone})
-        if result_hist.deleted_count > 0:
+        result_hist, arquivados_apagados, buckets_apagados = await asyncio.gather(
+            banco.colecao("respostas_ia").delete_many({"telefone": telefone}),
+            retencao.purgar("respostas_ia" + retencao.SUFIXO_ARQUIVO, {"telefone": telefone}),
+            historico.apagar(telefone),
+        )
+        registros_apagados = result_hist.deleted_count + arquivados_apagados
+        if registros_apagados > 0 or buckets_apagados > 0:
             historico_apagado = True
-            logger.info(f"CONTEXTO: {result_hist.deleted_count} registro(s) de histórico removido(s) para {telefone}.")
+            logger.info(f"CONTEXTO: {registros_apagados} registro(s) de histórico e {buckets_apagados} bucket(s) removido(s) para {telefone}.")
         else:
              logger.info(f"CONTEXTO: Nenhum registro de histórico encontrado para remover para {telefone}.")
     except Exception as e:
@@ -296,3 +336,51 @@ def limpar_contexto(telefone: str) -> bool:
 
     return sucesso_geral and (contexto_apagado or historico_apagado)
 
+# ----------------------------------------------------------------------
+async def descarregar_contexto(telefone: str) -> bool:
+    """Grava no MongoDB as escritas de contexto ainda em memória (fim do turno)."""
+    return await cache_contextos.descarregar(telefone, motivo="turno")
+
+# ----------------------------------------------------------------------
+# Shim síncrono — APENAS para scripts/CLI fora do event loop.
+def salvar_contexto_sync(
+    telefone: str,
+    *,
+    texto_usuario: Optional[str] = None,
+    estado: Optional[str] = None,
+    meta_conversa: Optional[Dict[str, Any]] = None,
+    intent_detectada: Optional[str] = None,
+    ultimo_texto_bot: Optional[str] = None,
+    incrementar_interacoes: bool = True
+) -> bool:
+    update_operation = _montar_update_contexto(
+        texto_usuario, estado, meta_conversa, intent_detectada, ultimo_texto_bot, incrementar_interacoes, telefone
+    )
+    update_operation.setdefault("$inc", {})["versao"] = 1 # Escritores com cache detectam a mudança
+    try:
+        _log_resultado_contexto(telefone, estado, banco.colecao_sync("contextos").update_one({"tel": telefone}, update_operation, upsert=True))
+        kanban.gravar_sync(telefone)
+        return True
+    except Exception as e:
+        logger.exception(f"CONTEXTO: ❌ ERRO ao salvar contexto para {telefone}: {e}")
+        return False
+
+
+def obter_contexto_sync(telefone: str) -> Dict[str, Any]:
+    try:
+        doc = banco.colecao_sync("contextos").find_one({"tel": telefone}, {"_id": 0})
+        return _normalizar_contexto(doc, telefone) if doc else _contexto_padrao(telefone)
+    except Exception as e:
+        logger.exception(f"CONTEXTO: ❌ ERRO ao obter contexto para {telefone}: {e}")
+        return _contexto_padrao(telefone)
+
+
+def limpar_contexto_sync(telefone: str) -> bool:
+    try:
+        apagados = banco.colecao_sync("contextos").delete_one({"tel": telefone}).deleted_count
+        apagados += banco.colecao_sync("respostas_ia").delete_many({"telefone": telefone}).deleted_count
+        kanban.gravar_sync(telefone)  # sem contexto: remove o card
+        return apagados > 0
+    except Exception as e:
+        logger.exception(f"CONTEXTO: ❌ ERRO ao limpar contexto para {telefone}: {e}")
+        return False
@@ -3,45 +3,19 @@
 # (Implementação das funções de acompanhamento de pagamento)
 # ===========================================================
 from datetime import datetime, timezone
-from pymongo import MongoClient, ReturnDocument
-from pymongo.errors import ConnectionFailure
-# Ajuste o import se config.py estiver em um diretório diferente
-from app.config import MONGO_URI
+from pymongo import ReturnDocument
 # Importa a função de agendamento para ser chamada após o pagamento
 # Ajuste o import se agenda.py estiver em um diretório diferente
 from app.utils.agenda import agendar_consulta, formatar_horario_local
+from app.core import banco # Acesso assíncrono (não bloqueia o event loop)
 import logging
 
 # Configuração básica de logging
 # logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# --- Conexão com MongoDB ---
-mongo_followup = None
-db_followup = None
-pagamentos_db = None # Coleção para rastrear status de pagamento
-
-try:
-    # Estabelece conexão com MongoDB
-    if MONGO_URI:
-        mongo_followup = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-        mongo_followup.server_info() # Testa a conexão
-        db_followup = mongo_followup["famdomes"] # Nome do banco de dados
-        pagamentos_db = db_followup["pagamentos"] # Coleção para pagamentos
-        # Cria índices se não existirem
-        pagamentos_db.create_index("telefone")
-        pagamentos_db.create_index("id_sessao_stripe", sparse=True, unique=True) # ID da sessão deve ser único
-        pagamentos_db.create_index("status")
-        pagamentos_db.create_index("criado_em")
-        logging.info("FOLLOWUP: Conexão com MongoDB estabelecida para Pagamentos.")
-    else:
-        logging.error("FOLLOWUP: ❌ MONGO_URI não definido. Não foi possível conectar ao MongoDB.")
-except ConnectionFailure as e:
-     logging.error(f"FOLLOWUP: ❌ Falha na conexão com MongoDB: {e}")
-except Exception as e:
-    logging.error(f"FOLLOWUP: ❌ ERRO ao conectar com MongoDB ou criar índices: {e}")
-    mongo_followup = None
-    db_followup = None
-    pagamentos_db = None
+# --- Coleção ---
+# "pagamentos" (perfil "duravel") do registro único de core/banco.py;
+# índices em core/indices.py.
 
 # --- Funções de Follow-up ---
 
@@ -56,10 +30,6 @@ def iniciar_sessao(telefone: str, nome: str, id_sessao_stripe: str | None = None
         nome (str): Nome do usuário.
         id_sessao_stripe (str | None): ID da sessão de checkout do Stripe.
     """
-    if pagamentos_db is None:
-        logging.error("FOLLOWUP: ❌ Falha ao iniciar sessão: DB indisponível.")
-        return
-
     try:
         agora = datetime.now(timezone.utc)
         # Filtro: usa id_sessao_stripe se disponível, senão cria um novo (ou atualiza baseado em telefone?)
@@ -83,7 +53,7 @@ def iniciar_sessao(telefone: str, nome: str, id_sessao_stripe: str | None = None
             update_data["$set"]["id_sessao_stripe"] = id_sessao_stripe
 
 
-        result = pagamentos_db.update_one(filtro, update_data, upsert=True)
+        result = banco.colecao_sync("pagamentos").update_one(filtro, update_data, upsert=True)
 
         if result.upserted_id:
             logging.info(f"FOLLOWUP: 📍 Nova sessão de pagamento iniciada para {telefone} ({nome}). Sessão: {id_sessao_stripe or 'N/A'}.")
@@ -95,7 +65,7 @@ def iniciar_sessao(telefone: str, nome: str, id_sessao_stripe: str | None = None
     except Exception as e:
         logging.exception(f"FOLLOWUP: ❌ ERRO ao iniciar/atualizar sessão de pagamento para {telefone}:")
 
-def marcar_pagamento(
+async def marcar_pagamento(
     telefone: str | None = None,
     id_sessao_stripe: str | None = None,
     email_cliente: str | None = None,
@@ -116,9 +86,7 @@ def marcar_pagamento(
             - horario_agendado_utc: O horário UTC da consulta agendada, ou None se falhar.
             - nome_final: O nome usado para o agendamento.
     """
-    if pagamentos_db is None:
-        logging.error("FOLLOWUP: ❌ Falha ao marcar pagamento: DB indisponível.")
-        return None, None
+    pagamentos = banco.colecao("pagamentos")
 
     # Precisa do id_sessao para garantir que estamos atualizando o pagamento correto
     if not id_sessao_stripe:
@@ -146,7 +114,7 @@ def marcar_pagamento(
 
         # Encontra e atualiza o registro do pagamento
         # Retorna o documento APÓS a atualização para pegar os dados mais recentes
-        pagamento_atualizado = pagamentos_db.find_one_and_update(
+        pagamento_atualizado = await pagamentos.find_one_and_update(
             filtro,
             update_data,
             return_document=ReturnDocument.AFTER # Pega o documento atualizado
@@ -166,7 +134,7 @@ def marcar_pagamento(
 
             # --- Tenta Agendar a Consulta ---
             logging.info(f"FOLLOWUP: Tentando agendar consulta para {nome_para_agendar} ({tel_para_agendar})...")
-            horario_agendado_utc = agendar_consulta(
+            horario_agendado_utc = await agendar_consulta(
                 telefone=tel_para_agendar,
                 nome=nome_para_agendar,
                 email=email_para_agendar
@@ -175,7 +143,7 @@ def marcar_pagamento(
             if horario_agendado_utc:
                 logging.info(f"FOLLOWUP: ✅ Consulta agendada com sucesso para {tel_para_agendar} em {formatar_horario_local(horario_agendado_utc)}.")
                 # Salva o horário agendado no registro de pagamento
-                pagamentos_db.update_one(
+                await pagamentos.update_one(
                     {"_id": pagamento_atualizado["_id"]},
                     {"$set": {"horario_consulta_agendada_utc": horario_agendado_utc, "status": "agendado"}} # Atualiza status final
                 )
@@ -183,7 +151,7 @@ def marcar_pagamento(
             else:
                 logging.error(f"FOLLOWUP: ❌ Falha ao agendar consulta para {tel_para_agendar} após pagamento.")
                 # O pagamento foi marcado, mas o agendamento falhou. Requer atenção manual.
-                pagamentos_db.update_one(
+                await pagamentos.update_one(
                      {"_id": pagamento_atualizado["_id"]},
                      {"$set": {"status": "pago_erro_agendamento"}} # Marca status especial
                 )
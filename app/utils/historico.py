@@ -0,0 +1,170 @@
+# ===========================================================
+# Arquivo: utils/historico.py
+# Histórico de conversa em buckets por telefone.
+# - Cada documento de `historico_buckets` guarda até HISTORICO_TURNOS_POR_BUCKET
+#   turnos de um telefone (array `turnos`, em ordem), com `inicio`/`fim`.
+# - Anexar um turno é UM update ($push + upsert no bucket aberto).
+#   Só existe um bucket `aberto` por telefone (índice único parcial
+#   telefone+aberto): dois anexos concorrentes não abrem dois buckets; o
+#   perdedor do upsert recebe DuplicateKeyError e tenta de novo. O bucket
+#   que enche é fechado ($unset aberto) por quem gravou o último turno.
+# - Os últimos HISTORICO_TURNOS_CONTEXTO turnos também ficam embutidos no
+#   documento de contexto (`ultimos_turnos`), então montar prompt não
+#   precisa de consulta extra; transcrição lê bucket a bucket.
+# - Buckets fora da janela quente vão para `historico_buckets_arquivo`
+#   (core/retencao.py); a transcrição continua lendo de lá.
+# - Conversas anteriores aos buckets caem para `respostas_ia`.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.config import settings
+from app.core import banco
+
+logger = logging.getLogger("famdomes.historico")
+
+COLECAO_BUCKETS = "historico_buckets"
+COLECAO_ARQUIVO = COLECAO_BUCKETS + "_arquivo"
+TURNOS_POR_BUCKET = int(getattr(settings, "HISTORICO_TURNOS_POR_BUCKET", 50))
+TURNOS_CONTEXTO = int(getattr(settings, "HISTORICO_TURNOS_CONTEXTO", 10))
+MAX_TENTATIVAS_ANEXO = 3
+
+# Campos do turno copiados para `ultimos_turnos` no contexto
+CAMPOS_TURNO_CONTEXTO = ("mensagem_usuario", "resposta_gerada", "intent_detectada", "enviado_por_humano", "criado_em")
+
+
+def montar_turno(documento: Dict[str, Any]) -> Dict[str, Any]:
+    """Turno a partir do documento de `respostas_ia` (ganha um _id próprio para a transcrição)."""
+    turno = {k: v for k, v in documento.items() if k not in ("_id", "telefone")}
+    turno["_id"] = ObjectId()
+    return turno
+
+
+def resumo_turno(turno: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: turno.get(k) for k in CAMPOS_TURNO_CONTEXTO}
+
+
+def update_ultimos_turnos(turno: Dict[str, Any]) -> Dict[str, Any]:
+    """Update de contexto que embute o turno e mantém só os N mais recentes."""
+    return {"$push": {"ultimos_turnos": {"$each": [resumo_turno(turno)], "$slice": -TURNOS_CONTEXTO}}}
+
+
+async def anexar_turno(telefone: str, turno: Dict[str, Any]) -> bool:
+    """Acrescenta o turno ao bucket aberto do telefone (cria um novo quando o atual enche)."""
+    criado_em = turno.get("criado_em")
+    colecao = banco.colecao(COLECAO_BUCKETS)
+    try:
+        for _ in range(MAX_TENTATIVAS_ANEXO):
+            try:
+                bucket = await colecao.find_one_and_update(
+                    {"telefone": telefone, "aberto": True, "n": {"$lt": TURNOS_POR_BUCKET}},
+                    {
+                        "$push": {"turnos": turno},
+                        "$inc": {"n": 1},
+                        "$min": {"inicio": criado_em},
+                        "$max": {"fim": criado_em},
+                    },
+                    projection={"n": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+            except DuplicateKeyError:
+                # Outro anexo abriu o bucket primeiro, ou o aberto encheu e ainda não foi fechado
+                await _fechar_cheios(telefone)
+                continue
+            if bucket and bucket.get("n", 0) >= TURNOS_POR_BUCKET:
+                await colecao.update_one({"_id": bucket["_id"]}, {"$unset": {"aberto": ""}})
+            return True
+        logger.error(f"HISTORICO: ❌ Turno de {telefone} não anexado após {MAX_TENTATIVAS_ANEXO} tentativas (disputa de bucket).")
+        return False
+    except Exception as e:
+        logger.error(f"HISTORICO: ❌ Falha ao anexar turno de {telefone}: {e}")
+        return False
+
+
+async def _fechar_cheios(telefone: str) -> None:
+    await banco.colecao(COLECAO_BUCKETS).update_many(
+        {"telefone": telefone, "aberto": True, "n": {"$gte": TURNOS_POR_BUCKET}},
+        {"$unset": {"aberto": ""}},
+    )
+
+
+async def ultimos_turnos(telefone: str, limite: int) -> List[Dict[str, Any]]:
+    """Últimos `limite` turnos em ordem cronológica (no máximo dois buckets lidos)."""
+    turnos: List[Dict[str, Any]] = []
+    cursor = banco.colecao(COLECAO_BUCKETS).find(
+        {"telefone": telefone}, {"turnos": {"$slice": -limite}, "_id": 0}
+    ).sort("fim", -1).limit(2)
+    async for bucket in cursor:
+        turnos = bucket.get("turnos", []) + turnos
+        if len(turnos) >= limite:
+            break
+    if not turnos:
+        return await _ultimos_legado(telefone, limite)
+    return turnos[-limite:]
+
+
+async def pagina_transcricao(telefone: str, antes_de: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    Uma página (um bucket) da transcrição, do mais recente para trás.
+    Retorna {"turnos": [...], "proxima": <datetime para `antes_de`> | None}.
+    """
+    filtro: Dict[str, Any] = {"telefone": telefone}
+    if antes_de is not None:
+        filtro["fim"] = {"$lt": antes_de}
+    bucket = await banco.colecao(COLECAO_BUCKETS, "painel").find_one(filtro, {"_id": 0}, sort=[("fim", -1)])
+    if not bucket:
+        bucket = await banco.colecao(COLECAO_ARQUIVO, "painel").find_one(filtro, {"_id": 0}, sort=[("fim", -1)])
+    if not bucket:
+        return {"turnos": [], "proxima": None}
+    return {"turnos": bucket.get("turnos", []), "proxima": bucket.get("inicio")}
+
+
+async def transcricao(telefone: str, limite: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Transcrição em ordem cronológica (os `limite` turnos mais recentes, ou todos)."""
+    turnos: List[Dict[str, Any]] = []
+    for nome in (COLECAO_BUCKETS, COLECAO_ARQUIVO):  # arquivo só guarda buckets mais antigos
+        cursor = banco.colecao(nome, "painel").find({"telefone": telefone}, {"_id": 0}).sort("fim", -1)
+        async for bucket in cursor:
+            turnos = bucket.get("turnos", []) + turnos
+            if limite is not None and len(turnos) >= limite:
+                break
+        if limite is not None and len(turnos) >= limite:
+            break
+    if not turnos:
+        return await _transcricao_legado(telefone, limite)
+    return turnos[-limite:] if limite is not None else turnos
+
+
+async def apagar(telefone: str) -> int:
+    vivos, arquivados = await asyncio.gather(
+        banco.colecao(COLECAO_BUCKETS).delete_many({"telefone": telefone}),
+        banco.colecao(COLECAO_ARQUIVO).delete_many({"telefone": telefone}),
+    )
+    return vivos.deleted_count + arquivados.deleted_count
+
+
+# ----------------------------------------------------------------------
+# Conversas gravadas antes dos buckets (apenas `respostas_ia`)
+async def _ultimos_legado(telefone: str, limite: int) -> List[Dict[str, Any]]:
+    cursor = banco.colecao("respostas_ia").find({"telefone": telefone}).sort("criado_em", -1).limit(limite)
+    docs = await cursor.to_list(length=limite)
+    docs.reverse()
+    return docs
+
+
+async def _transcricao_legado(telefone: str, limite: Optional[int]) -> List[Dict[str, Any]]:
+    colecao = banco.colecao("respostas_ia", "painel")
+    if limite is None:
+        return await colecao.find({"telefone": telefone}).sort("criado_em", 1).to_list(length=None)
+    docs = await colecao.find({"telefone": telefone}).sort("criado_em", -1).limit(limite).to_list(length=limite)
+    docs.reverse()
+    return docs
@@ -4,11 +4,9 @@ Wrapper para gerar sugestão de próximo passo usando Ollama (Gemma‑3b)
 
 from __future__ import annotations
 
-import httpx
 from typing import Dict, Any
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
-MODEL = "gemma:3b"
+from app.core import llm
 
 async def gerar_sugestao_proximo_passo(contexto: Dict[str, Any]) -> str:
     """
@@ -23,11 +21,5 @@ async def gerar_sugestao_proximo_passo(contexto: Dict[str, Any]) -> str:
         f"{historico}\n\nSUGESTÃO:"
     )
 
-    async with httpx.AsyncClient(timeout=30) as client:
-        resp = await client.post(
-            OLLAMA_URL,
-            json={"model": MODEL, "prompt": prompt, "stream": False},
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("response", "").strip()
+    data = await llm.gerar(prompt, timeout=30)
+    return data.get("response", "").strip()
@@ -1,12 +1,8 @@
-from pymongo import MongoClient
-from app.config import MONGO_URI
+from app.core import banco
 from datetime import datetime
 
-mongo = MongoClient(MONGO_URI)
-leads = mongo["famdomes"]["leads"]
-
-def salvar_lead(paciente_id: str, canal: str, mensagem: str, intent: str, entidades: dict, risco: bool, tipo: str = "desconhecido"):
-    leads.update_one(
+async def salvar_lead(paciente_id: str, canal: str, mensagem: str, intent: str, entidades: dict, risco: bool, tipo: str = "desconhecido"):
+    await banco.colecao("leads").update_one(
         {"paciente_id": paciente_id},
         {
             "$set": {
@@ -0,0 +1,68 @@
+# ===========================================================
+# Arquivo: utils/limitador.py
+# Limitador de taxa (token bucket) para corrotinas.
+# - `taxa` tokens por segundo, rajada de até `capacidade`.
+# - `aguardar()` dorme só o necessário até haver token; chamadas
+#   concorrentes são atendidas em ordem (lock).
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import time
+
+
+class BaldeTokens:
+    def __init__(self, taxa: float, capacidade: float | None = None):
+        if taxa <= 0:
+            raise ValueError("taxa deve ser positiva")
+        self.taxa = float(taxa)
+        self.capacidade = float(capacidade if capacidade is not None else max(1.0, taxa))
+        self._tokens = self.capacidade
+        self._ultimo = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.esperas = 0
+        self.espera_total_s = 0.0
+
+    def _repor(self) -> None:
+        agora = time.monotonic()
+        self._tokens = min(self.capacidade, self._tokens + (agora - self._ultimo) * self.taxa)
+        self._ultimo = agora
+
+    def tentar(self, tokens: float = 1.0) -> bool:
+        """Consome sem esperar. False se não há tokens agora."""
+        self._repor()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def aguardar(self, tokens: float = 1.0) -> float:
+        """Consome `tokens`, esperando o que for preciso. Retorna o tempo esperado (s)."""
+        inicio = time.monotonic()
+        async with self._lock:
+            while True:
+                self._repor()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    break
+                await asyncio.sleep((tokens - self._tokens) / self.taxa)
+        esperado = time.monotonic() - inicio
+        if esperado > 0.001:
+            self.esperas += 1
+            self.espera_total_s += esperado
+        return esperado
+
+    def pausar(self, segundos: float) -> None:
+        """Zera o balde e adia a reposição (ex.: servidor pediu Retry-After)."""
+        self._repor()
+        self._tokens = min(self._tokens, 0.0) - segundos * self.taxa  # "dívida" paga pela reposição
+
+    def estado(self) -> dict:
+        self._repor()
+        return {
+            "taxa_por_s": self.taxa,
+            "capacidade": self.capacidade,
+            "tokens": round(max(self._tokens, 0.0), 2),
+            "esperas": self.esperas,
+            "espera_total_s": round(self.espera_total_s, 2),
+        }
@@ -1,13 +1,29 @@
 # ===========================================================
 # Arquivo: utils/mensageria.py
 # Envio robusto de mensagens via WhatsApp Cloud API
+# - Um único httpx.AsyncClient com pool de conexões persistente
+#   (fechado no shutdown via `fechar`).
+# - Token bucket (WHATSAPP_MAX_MSG_POR_SEGUNDO) no ritmo do tier da Meta;
+#   todo envio de saída passa por `enviar_payload`.
+# - 429/5xx/timeout/erro de conexão: nova tentativa com backoff
+#   exponencial + jitter; Retry-After do servidor é respeitado (e um 429
+#   pausa o balde inteiro, não só a mensagem que levou o 429).
 # ===========================================================
 from __future__ import annotations
 
-import httpx
+import asyncio
 import logging
-from typing import Any, Dict
-from app.config import WHATSAPP_API_URL, WHATSAPP_TOKEN
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from prometheus_client import Counter, Histogram
+
+from app.config import settings, WHATSAPP_API_URL, WHATSAPP_TOKEN
+from app.utils.limitador import BaldeTokens
 
 logger = logging.getLogger("famdomes.mensageria")
 
@@ -17,12 +33,123 @@ HEADERS = {
 }
 TIMEOUT = httpx.Timeout(timeout=20.0, connect=5.0)
 
+MAX_MSG_POR_SEGUNDO = float(getattr(settings, "WHATSAPP_MAX_MSG_POR_SEGUNDO", 80))
+MAX_TENTATIVAS = int(getattr(settings, "WHATSAPP_MAX_TENTATIVAS", 4))
+BACKOFF_BASE_S = float(getattr(settings, "WHATSAPP_BACKOFF_BASE_S", 0.5))
+BACKOFF_MAX_S = float(getattr(settings, "WHATSAPP_BACKOFF_MAX_S", 30))
+MAX_CONEXOES = int(getattr(settings, "WHATSAPP_MAX_CONEXOES", 50))
 
-async def enviar_mensagem(telefone: str, mensagem: str) -> Dict[str, Any]:
+limitador = BaldeTokens(MAX_MSG_POR_SEGUNDO)
+
+ENVIOS = Counter("domo_whatsapp_envios_total", "Envios à WhatsApp Cloud API", ["status"])
+TENTATIVAS_REPETIDAS = Counter(
+    "domo_whatsapp_retentativas_total", "Novas tentativas de envio ao WhatsApp", ["motivo"]
+)
+LATENCIA = Histogram(
+    "domo_whatsapp_latencia_segundos", "Latência de cada chamada à WhatsApp Cloud API",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20),
+)
+
+_cliente: Optional[httpx.AsyncClient] = None
+
+
+def _obter_cliente() -> httpx.AsyncClient:
+    """Cria (uma vez) o cliente HTTP compartilhado com keep-alive."""
+    global _cliente
+    if _cliente is None or _cliente.is_closed:
+        _cliente = httpx.AsyncClient(
+            timeout=TIMEOUT,
+            headers=HEADERS,
+            limits=httpx.Limits(max_connections=MAX_CONEXOES, max_keepalive_connections=MAX_CONEXOES),
+        )
+    return _cliente
+
+
+async def fechar() -> None:
+    """Fecha o cliente HTTP compartilhado (shutdown da aplicação)."""
+    global _cliente
+    if _cliente is not None and not _cliente.is_closed:
+        await _cliente.aclose()
+    _cliente = None
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    """Segundos pedidos pelo servidor no Retry-After (número ou data HTTP)."""
+    valor = resp.headers.get("Retry-After")
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(valor) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff(tentativa: int) -> float:
+    """Exponencial com jitter completo: uniforme em [0, min(máx, base·2^n)]."""
+    return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** tentativa)))
+
+
+async def enviar_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """POST de um payload da Cloud API com limite de taxa e novas tentativas."""
     if not WHATSAPP_API_URL or not WHATSAPP_TOKEN:
         logger.error("❌ MENSAGERIA: API URL ou Token não configurados.")
         return {"status": "erro_config", "erro": "WhatsApp API não configurada"}
 
+    url = str(WHATSAPP_API_URL)  # 🔧 cast definitivo
+    telefone = payload.get("to")
+    resultado: Dict[str, Any] = {}
+    for tentativa in range(MAX_TENTATIVAS):
+        espera: Optional[float] = None
+        await limitador.aguardar()
+        inicio = time.monotonic()
+        try:
+            resp = await _obter_cliente().post(url, json=payload)
+            LATENCIA.observe(time.monotonic() - inicio)
+            if resp.status_code == 429 or resp.status_code >= 500:
+                motivo = "429" if resp.status_code == 429 else "5xx"
+                espera = _retry_after(resp)
+                if resp.status_code == 429:
+                    # Limite da conta, não da mensagem: segura todos os envios
+                    limitador.pausar(espera if espera is not None else _backoff(tentativa))
+                resultado = {"status": "erro_api", "code": resp.status_code, "erro": resp.text}
+            else:
+                resp.raise_for_status()
+                ENVIOS.labels("enviado").inc()
+                logger.info("✅ Mensagem enviada a %s (HTTP %s)", telefone, resp.status_code)
+                return {"status": "enviado", "code": resp.status_code, "retorno": resp.json()}
+        except httpx.HTTPStatusError as exc:  # 4xx: não adianta repetir
+            logger.error("❌ WHATSAPP %s – %s", exc.response.status_code, exc.response.text)
+            ENVIOS.labels("erro_api").inc()
+            return {"status": "erro_api", "code": exc.response.status_code, "erro": exc.response.text}
+        except httpx.TimeoutException as exc:
+            motivo = "timeout"
+            logger.warning("⏰ Timeout WhatsApp (tentativa %s): %s", tentativa + 1, exc)
+            resultado = {"status": "erro_timeout", "erro": str(exc)}
+        except httpx.RequestError as exc:
+            motivo = "conexao"
+            logger.warning("🌐 Erro de conexão WhatsApp (tentativa %s): %s", tentativa + 1, exc)
+            resultado = {"status": "erro_conexao", "erro": str(exc)}
+        except Exception as exc:  # pragma: no cover
+            logger.exception("💥 Erro inesperado WhatsApp: %s", exc)
+            ENVIOS.labels("erro_desconhecido").inc()
+            return {"status": "erro_desconhecido", "erro": str(exc)}
+
+        if tentativa + 1 < MAX_TENTATIVAS:
+            TENTATIVAS_REPETIDAS.labels(motivo).inc()
+            espera = espera if espera is not None else _backoff(tentativa)
+            logger.warning("🔁 WHATSAPP %s para %s; nova tentativa em %.1fs", motivo, telefone, espera)
+            await asyncio.sleep(espera)
+
+    logger.error("❌ WHATSAPP: envio a %s falhou após %s tentativa(s): %s", telefone, MAX_TENTATIVAS, resultado.get("erro"))
+    ENVIOS.labels(resultado.get("status", "erro_desconhecido")).inc()
+    return resultado
+
+
+async def enviar_mensagem(telefone: str, mensagem: str) -> Dict[str, Any]:
     if not telefone or not mensagem:
         logger.warning("⚠️ MENSAGERIA: Telefone ou mensagem vazios.")
         return {"status": "erro_input", "erro": "Telefone ou mensagem ausente"}
@@ -34,25 +161,13 @@ async def enviar_mensagem(telefone: str, mensagem: str) -> Dict[str, Any]:
         "type": "text",
         "text": {"preview_url": False, "body": mensagem},
     }
+    return await enviar_payload(payload)
 
-    try:
-        url = str(WHATSAPP_API_URL)  # 🔧 cast definitivo
-        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-            resp = await client.post(url, json=payload, headers=HEADERS)
-            resp.raise_for_status()
-
-        logger.info("✅ Mensagem enviada a %s (HTTP %s)", telefone, resp.status_code)
-        return {"status": "enviado", "code": resp.status_code, "retorno": resp.json()}
-
-    except httpx.HTTPStatusError as exc:
-        logger.error("❌ WHATSAPP %s – %s", exc.response.status_code, exc.response.text)
-        return {"status": "erro_api", "code": exc.response.status_code, "erro": exc.response.text}
-    except httpx.TimeoutException as exc:
-        logger.error("⏰ Timeout WhatsApp: %s", exc)
-        return {"status": "erro_timeout", "erro": str(exc)}
-    except httpx.RequestError as exc:
-        logger.error("🌐 Erro de conexão WhatsApp: %s", exc)
-        return {"status": "erro_conexao", "erro": str(exc)}
-    except Exception as exc:  # pragma: no cover
-        logger.exception("💥 Erro inesperado WhatsApp: %s", exc)
-        return {"status": "erro_desconhecido", "erro": str(exc)}
+
+async def enviar_para_varios(telefones: Iterable[str], mensagem: str) -> List[Dict[str, Any]]:
+    """Mesma mensagem para vários destinos (em paralelo, sob o mesmo limite de taxa)."""
+    return list(await asyncio.gather(*(enviar_mensagem(tel, mensagem) for tel in telefones)))
+
+
+def estado() -> dict:
+    return {"limitador": limitador.estado(), "cliente_aberto": _cliente is not None and not _cliente.is_closed}
@@ -0,0 +1,163 @@
+# ===========================================================
+# Arquivo: utils/meta_conversa.py
+# Estado da conversa (`contextos.meta_conversa`) com rastreio de alterações.
+# - MetaConversa é um dict (serializa igual para JSON/BSON e o código
+#   existente continua usando meta["x"], meta.get, meta.pop...).
+# - Guarda uma foto do que veio do banco; `diff()` gera só os
+#   $set/$unset em caminho com ponto ("meta_conversa.score_lead") dos
+#   campos que mudaram, em vez de reescrever o subdocumento inteiro.
+# - Campos conhecidos têm propriedade tipada (score_lead, etapa_quali...).
+# ===========================================================
+from __future__ import annotations
+
+import copy
+from typing import Any, Dict, Optional
+
+PREFIXO = "meta_conversa"
+
+_AUSENTE = object()
+
+
+def _caminho_valido(chave: Any) -> bool:
+    return isinstance(chave, str) and chave != "" and "." not in chave and not chave.startswith("$")
+
+
+class MetaConversa(dict):
+    """
+    Subdocumento meta_conversa com rastreio de campos alterados.
+
+    Args:
+        dados: Conteúdo atual (normalmente lido do banco).
+        original: Foto usada como base do diff. Padrão: cópia de `dados`
+                  (nada alterado). Use `MetaConversa.parcial` para um
+                  conjunto de campos a mesclar sem conhecer o resto.
+    """
+
+    __slots__ = ("_original", "_alterados")
+
+    def __init__(self, dados: Optional[Dict[str, Any]] = None, *, original: Optional[Dict[str, Any]] = None):
+        super().__init__(dados or {})
+        self._original: Dict[str, Any] = copy.deepcopy(dict(self)) if original is None else original
+        self._alterados: set = set()
+
+    @classmethod
+    def parcial(cls, campos: Dict[str, Any]) -> "MetaConversa":
+        """Campos a mesclar no meta_conversa existente (gera apenas $set desses campos)."""
+        meta = cls(campos, original={})
+        meta._alterados.update(campos)
+        return meta
+
+    # --- Propriedades tipadas dos campos mais usados ---------------------
+    @property
+    def score_lead(self) -> int:
+        return int(self.get("score_lead") or 0)
+
+    @score_lead.setter
+    def score_lead(self, valor: int) -> None:
+        self["score_lead"] = int(valor)
+
+    @property
+    def etapa_quali(self) -> int:
+        return int(self.get("etapa_quali") or 0)
+
+    @etapa_quali.setter
+    def etapa_quali(self, valor: int) -> None:
+        self["etapa_quali"] = int(valor)
+
+    @property
+    def cursor_questionario(self) -> Optional[Dict[str, Any]]:
+        return self.get("cursor_questionario")
+
+    @cursor_questionario.setter
+    def cursor_questionario(self, valor: Optional[Dict[str, Any]]) -> None:
+        if valor is None:
+            self.pop("cursor_questionario", None)
+        else:
+            self["cursor_questionario"] = dict(valor)
+
+    @property
+    def ultimo_sentimento_detectado(self) -> Optional[Dict[str, float]]:
+        return self.get("ultimo_sentimento_detectado")
+
+    @ultimo_sentimento_detectado.setter
+    def ultimo_sentimento_detectado(self, valor: Dict[str, float]) -> None:
+        self["ultimo_sentimento_detectado"] = dict(valor)
+
+    # --- Rastreio de alterações -------------------------------------------
+    def __setitem__(self, chave, valor):
+        super().__setitem__(chave, valor)
+        self._alterados.add(chave)
+
+    def __delitem__(self, chave):
+        super().__delitem__(chave)
+        self._alterados.add(chave)
+
+    def pop(self, chave, *padrao):
+        if chave in self:
+            self._alterados.add(chave)
+        return super().pop(chave, *padrao)
+
+    def popitem(self):
+        chave, valor = super().popitem()
+        self._alterados.add(chave)
+        return chave, valor
+
+    def setdefault(self, chave, padrao=None):
+        if chave not in self:
+            self._alterados.add(chave)
+        return super().setdefault(chave, padrao)
+
+    def update(self, *args, **kwargs):
+        for chave, valor in dict(*args, **kwargs).items():
+            self[chave] = valor
+
+    def clear(self):
+        self._alterados.update(self.keys())
+        super().clear()
+
+    def __deepcopy__(self, memo):
+        novo = MetaConversa(copy.deepcopy(dict(self), memo), original=copy.deepcopy(self._original, memo))
+        novo._alterados = set(self._alterados)
+        return novo
+
+    def _candidatos(self):
+        """Campos atribuídos + campos mutáveis (dict/list podem ter sido alterados por dentro)."""
+        candidatos = set(self._alterados)
+        candidatos.update(k for k, v in self.items() if isinstance(v, (dict, list)))
+        candidatos.update(k for k in self._original if k not in self)
+        return candidatos
+
+    def diff(self, prefixo: str = PREFIXO) -> Dict[str, Dict[str, Any]]:
+        """
+        Update mínimo ({"$set": {...}, "$unset": {...}}) com os campos que mudaram
+        desde a foto original. Se alguma chave não puder virar caminho com ponto,
+        devolve $set do subdocumento inteiro.
+        """
+        set_campos: Dict[str, Any] = {}
+        unset_campos: Dict[str, str] = {}
+        for chave in self._candidatos():
+            atual = dict.get(self, chave, _AUSENTE)
+            anterior = self._original.get(chave, _AUSENTE)
+            if atual == anterior:
+                continue
+            if not _caminho_valido(chave):
+                return {"$set": {prefixo: copy.deepcopy(dict(self))}}
+            if atual is _AUSENTE:
+                unset_campos[f"{prefixo}.{chave}"] = ""
+            else:
+                set_campos[f"{prefixo}.{chave}"] = copy.deepcopy(atual)
+        update: Dict[str, Dict[str, Any]] = {}
+        if set_campos:
+            update["$set"] = set_campos
+        if unset_campos:
+            update["$unset"] = unset_campos
+        return update
+
+    @property
+    def alterado(self) -> bool:
+        return bool(self.diff())
+
+    def marcar_salvo(self) -> None:
+        """A foto passa a ser o estado atual (chamado após salvar)."""
+        self._original = copy.deepcopy(dict(self))
+        self._alterados.clear()
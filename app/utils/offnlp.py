@@ -10,11 +10,8 @@ from datetime import datetime
 
 # Ajuste os imports conforme a estrutura do seu projeto
 from app.utils.ollama import chamar_ollama
-# Acesso direto às variáveis globais de contexto.py para DB
-from app.utils.contexto import (
-    obter_contexto, salvar_contexto, salvar_resposta_ia,
-    respostas_ia_db # Acesso à coleção do histórico
-)
+from app.utils.contexto import obter_contexto, salvar_contexto, salvar_resposta_ia
+from app.utils import historico # Histórico em buckets
 from app.utils.faq_respostas import FAQ_RESPOSTAS
 from app.utils.risco import analisar_risco
 from app.routes.ia import processar_comando # Para ações como agendar
@@ -90,18 +87,13 @@ async def analisar_sentimento(texto: str, telefone: str) -> str | None:
         return None
 
 async def buscar_historico_formatado(telefone: str, limite: int = 5) -> str:
-     """ Busca e formata o histórico recente do MongoDB para o prompt da IA. """
-     if respostas_ia_db is None:
-         logging.warning(f"NLP: Histórico indisponível para {telefone} (DB não conectado).")
-         return "Histórico indisponível (DB não conectado)."
+     """ Formata o histórico recente para o prompt da IA (vem embutido no contexto; sem consulta extra). """
      logging.debug(f"NLP: Buscando histórico para {telefone} (limite: {limite})")
      try:
-         historico_cursor = respostas_ia_db.find(
-             {"telefone": telefone},
-             {"mensagem_usuario": 1, "resposta_gerada": 1, "_id": 0}
-         ).sort("criado_em", -1).limit(limite)
-         historico_lista = list(historico_cursor)
-         historico_lista.reverse()
+         contexto = await obter_contexto(telefone)
+         historico_lista = (contexto.get("ultimos_turnos") or [])[-limite:]
+         if not historico_lista:
+             historico_lista = await historico.ultimos_turnos(telefone, limite) # Conversas anteriores aos buckets
          if not historico_lista:
              return "Nenhuma conversa anterior registrada."
          historico_formatado = ""
@@ -252,7 +244,7 @@ async def processar_mensagem(mensagem: str, telefone: str, canal: str) -> dict:
     """
     global meta_conversa
     logging.info(f"NLP: 🔄 Processando mensagem de {telefone}...")
-    contexto = obter_contexto(telefone)
+    contexto = await obter_contexto(telefone)
     estado_atual = contexto.get("estado", "INICIAL")
     meta_conversa = contexto.get("meta_conversa", {})
     texto_mensagem = mensagem.strip()
@@ -273,21 +265,21 @@ async def processar_mensagem(mensagem: str, telefone: str, canal: str) -> dict:
         novo_estado = "RISCO_DETECTADO"
         resposta_final = MENSAGEM_RISCO_DIRECIONAMENTO
         meta_conversa["ultimo_risco"] = datetime.utcnow().isoformat()
-        salvar_contexto(telefone, {"estado": novo_estado, "meta_conversa": meta_conversa})
-        salvar_resposta_ia(telefone, canal, texto_mensagem, resposta_final, "risco_detectado", meta_conversa, True, None)
+        await salvar_contexto(telefone, {"estado": novo_estado, "meta_conversa": meta_conversa})
+        await salvar_resposta_ia(telefone, canal, texto_mensagem, resposta_final, "risco_detectado", meta_conversa, True, None)
         await notificar_risco(telefone, texto_mensagem, analise_risco_resultado)
         return {"resposta": resposta_final, "estado": novo_estado}
 
     # --- 2. Verificação de Comandos Especiais ---
     if texto_lower == "melancia vermelha":
         logging.info(f"NLP: Comando 'melancia vermelha' recebido de {telefone}. Resetando contexto.")
-        limpar_contexto(telefone)
+        await limpar_contexto(telefone)
         resposta_final = MENSAGEM_INICIAL # Envia apenas a saudação inicial após reset
         novo_estado = "IDENTIFICANDO_NECESSIDADE" # Espera a primeira resposta do usuário
         intent = "reset_comando_e_inicio"
         meta_conversa = {}
-        salvar_contexto(telefone, {"estado": novo_estado, "meta_conversa": {}})
-        salvar_resposta_ia(telefone, canal, texto_mensagem, resposta_final, intent, {}, False, None)
+        await salvar_contexto(telefone, {"estado": novo_estado, "meta_conversa": {}})
+        await salvar_resposta_ia(telefone, canal, texto_mensagem, resposta_final, intent, {}, False, None)
         return {"resposta": resposta_final, "estado": novo_estado}
 
     if any(palavra in texto_lower for palavra in PALAVRAS_CHAVE_HUMANO):
@@ -297,8 +289,8 @@ async def processar_mensagem(mensagem: str, telefone: str, canal: str) -> dict:
          resposta_final = MENSAGEM_PEDIDO_HUMANO_CONFIRMACAO
          contexto_para_notificacao = contexto.copy()
          contexto_para_notificacao["estado"] = estado_antes_pedido
-         salvar_contexto(telefone, {"estado": novo_estado, "meta_conversa": meta_conversa})
-         salvar_resposta_ia(telefone, canal, texto_mensagem, resposta_final, "pedido_humano", meta_conversa, False, None)
+         await salvar_contexto(telefone, {"estado": novo_estado, "meta_conversa": meta_conversa})
+         await salvar_resposta_ia(telefone, canal, texto_mensagem, resposta_final, "pedido_humano", meta_conversa, False, None)
          await notificar_escalacao_humana(telefone, contexto_para_notificacao)
          return {"resposta": resposta_final, "estado": novo_estado}
 
@@ -429,12 +421,12 @@ async def processar_mensagem(mensagem: str, telefone: str, canal: str) -> dict:
                  resposta_final = proxima_pergunta
                  novo_estado = "COLETANDO_RESPOSTA_QUESTIONARIO"
                  intent = "iniciou_questionario"
-                 salvar_contexto(telefone, {
+                 await salvar_contexto(telefone, {
                      "estado": novo_estado,
                      "meta_conversa": meta_conversa,
                      "ultima_resposta_bot": resposta_final
                  })
-                 salvar_resposta_ia(telefone, canal, "Sistema: Iniciou Questionário", resposta_final, intent, meta_conversa, False, None)
+                 await salvar_resposta_ia(telefone, canal, "Sistema: Iniciou Questionário", resposta_final, intent, meta_conversa, False, None)
                  return {"resposta": resposta_final, "estado": novo_estado}
              else:
                  logging.warning(f"NLP: Questionário pós-pagamento vazio para {telefone}. Finalizando onboarding.")
@@ -555,8 +547,8 @@ async def processar_mensagem(mensagem: str, telefone: str, canal: str) -> dict:
         "meta_conversa": meta_conversa_final
     }
 
-    salvar_contexto(telefone, contexto_para_salvar)
-    salvar_resposta_ia(telefone, canal, texto_mensagem, resposta_final, intent, entidades, risco_detectado, sentimento)
+    await salvar_contexto(telefone, contexto_para_salvar)
+    await salvar_resposta_ia(telefone, canal, texto_mensagem, resposta_final, intent, entidades, risco_detectado, sentimento)
 
     logging.info(f"NLP: ✅ Processamento concluído para {telefone}. Novo estado: {novo_estado}. Resposta: '{resposta_final[:50]}...'")
     return {"resposta": resposta_final, "estado": novo_estado}
@@ -1,14 +1,11 @@
 import os
 from datetime import datetime
 import logging
-from pymongo import MongoClient
-from app.config import MONGO_URI
+from app.core import banco
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-mongo = MongoClient(MONGO_URI)
-db = mongo["famdomes"]
-colecao_historico = db["respostas_ia"]
+colecao_historico = banco.colecao_sync("respostas_ia")
 
 # Ajuste o caminho conforme sua estrutura – certifique-se de que o arquivo existe ou use o fallback
 CAMINHO_PROMPT_TXT = os.path.join(os.path.dirname(__file__), "..", "PROMPT_MESTRE_FAMDOMES_CORRIGIDO.txt")
@@ -0,0 +1,218 @@
+# ===========================================================
+# Arquivo: utils/variantes.py
+# Pools de variações de frases pré-geradas pela IA.
+# - Tira do caminho quente as chamadas à IA para textos quase estáticos
+#   (refraseamentos, validações curtas, saudações por sentimento).
+# - Cada template (id + bucket de sentimento) tem um pool persistido no
+#   MongoDB (coleção 'variantes_frases') e espelhado em memória.
+# - Templates se registram no primeiro uso; uma task/job em background
+#   preenche os pools. Agentes só geram ao vivo quando o pool está vazio.
+# - O template é gravado (com pool vazio) antes da geração: uma IA fora do
+#   ar não apaga o registro e o job offline completa o pool depois.
+# - Só textos estáticos (id fixo por intent/template) viram pool; o total
+#   de templates é limitado (VARIANTES_MAX_TEMPLATES) e a geração ao vivo
+#   de um mesmo template é compartilhada entre chamadas concorrentes.
+# ===========================================================
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+from app.core import banco
+
+logger = logging.getLogger("famdomes.variantes")
+
+COLECAO_VARIANTES = "variantes_frases"
+POOL_TAMANHO = int(getattr(settings, "VARIANTES_POOL_TAMANHO", 8))
+INTERVALO_JOB_MINUTOS = int(getattr(settings, "VARIANTES_INTERVALO_MIN", 60))
+MAX_TEMPLATES = int(getattr(settings, "VARIANTES_MAX_TEMPLATES", 200))
+TAMANHO_MINIMO_VARIANTE = 2
+
+BUCKET_GERAL = "geral"
+
+# (template_id, bucket) -> prompt usado para gerar as variações
+_TEMPLATES: Dict[Tuple[str, str], str] = {}
+# (template_id, bucket) -> variações disponíveis
+_POOLS: Dict[Tuple[str, str], List[str]] = {}
+# Pools com preenchimento em andamento (evita tasks duplicadas)
+_EM_PREENCHIMENTO: set[Tuple[str, str]] = set()
+# Gerações ao vivo em andamento: chamadas concorrentes esperam a mesma
+_AO_VIVO: Dict[Tuple[str, str], asyncio.Task] = {}
+
+
+def bucket_sentimento(sentimento: Optional[Dict[str, float]], limiar: float = 0.6) -> str:
+    """Reduz o dicionário de sentimento a um bucket ('negativo', 'positivo' ou 'neutro')."""
+    if not sentimento:
+        return "neutro"
+    if sentimento.get("negativo", 0) > limiar:
+        return "negativo"
+    if sentimento.get("positivo", 0) > limiar:
+        return "positivo"
+    return "neutro"
+
+
+# ----------------------------------------------------------------------
+def escolher_variante(template_id: str, bucket: str = BUCKET_GERAL) -> str | None:
+    """
+    Sorteia uma variação pré-gerada do pool em memória.
+    Retorna None se o pool estiver vazio (o chamador deve gerar ao vivo).
+    """
+    pool = _POOLS.get((template_id, bucket))
+    if not pool:
+        return None
+    return random.choice(pool)
+
+
+def registrar_template(template_id: str, prompt: str, bucket: str = BUCKET_GERAL) -> bool:
+    """
+    Registra um template (idempotente) para que seu pool seja gerado em background.
+    Não faz I/O no chamador: a persistência acontece na task de preenchimento.
+    Retorna False se o limite de templates (MAX_TEMPLATES) já foi atingido.
+    """
+    chave = (template_id, bucket)
+    if chave not in _TEMPLATES:
+        if len(_TEMPLATES) >= MAX_TEMPLATES:
+            logger.warning(f"VARIANTES: ⚠️ Limite de {MAX_TEMPLATES} templates atingido; '{template_id}' ({bucket}) sem pool.")
+            return False
+        _TEMPLATES[chave] = prompt
+        logger.info(f"VARIANTES: Template '{template_id}' (bucket '{bucket}') registrado.")
+
+    if len(_POOLS.get(chave, [])) >= POOL_TAMANHO or chave in _EM_PREENCHIMENTO:
+        return True
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return True  # Sem loop (script): o job periódico cuida do preenchimento
+    _EM_PREENCHIMENTO.add(chave)
+    loop.create_task(_preencher_pool(template_id, bucket))
+    return True
+
+
+async def _gerar_ao_vivo(prompt: str) -> str | None:
+    from app.core.ia_direct import gerar_resposta_ia, RESPOSTA_FALLBACK
+
+    texto = _limpar_variante(await gerar_resposta_ia({"prompt_context": prompt}) or "")
+    if texto == RESPOSTA_FALLBACK or len(texto) < TAMANHO_MINIMO_VARIANTE:
+        return None
+    return texto
+
+
+async def variante_ou_gerar(template_id: str, prompt: str, bucket: str = BUCKET_GERAL) -> str | None:
+    """
+    Variação do pool; com o pool vazio, registra o template e gera ao vivo.
+    Chamadas concorrentes para o mesmo template esperam a mesma geração.
+    Retorna None se a IA não produzir texto aproveitável.
+    """
+    variante = escolher_variante(template_id, bucket)
+    if variante:
+        return variante
+    registrar_template(template_id, prompt, bucket)
+    chave = (template_id, bucket)
+    tarefa = _AO_VIVO.get(chave)
+    if tarefa is None:
+        tarefa = _AO_VIVO[chave] = asyncio.get_running_loop().create_task(_gerar_ao_vivo(prompt))
+        tarefa.add_done_callback(lambda _t, chave=chave: _AO_VIVO.pop(chave, None))
+    return await asyncio.shield(tarefa)
+
+
+# ----------------------------------------------------------------------
+async def carregar_pools() -> int:
+    """Carrega os pools persistidos para memória (até MAX_TEMPLATES). Retorna o total de pools."""
+    total = 0
+    try:
+        cursor = banco.colecao(COLECAO_VARIANTES).find(
+            {},
+            {"template_id": 1, "bucket": 1, "prompt": 1, "variantes": 1},
+        ).limit(MAX_TEMPLATES)
+        async for doc in cursor:
+            chave = (doc["template_id"], doc.get("bucket", BUCKET_GERAL))
+            _TEMPLATES.setdefault(chave, doc.get("prompt", ""))
+            _POOLS[chave] = [v for v in doc.get("variantes", []) if v]
+            total += 1
+        logger.info(f"VARIANTES: {total} pool(s) carregado(s) do MongoDB.")
+    except Exception as e:
+        logger.error(f"VARIANTES: Erro ao carregar pools: {e}")
+    return total
+
+
+def _limpar_variante(texto: str) -> str:
+    return texto.strip().strip('"').strip("“”").strip()
+
+
+async def _semear_template(template_id: str, bucket: str, prompt: str) -> None:
+    """Persiste o template (pool vazio se ainda não existe) antes de qualquer geração."""
+    await banco.colecao(COLECAO_VARIANTES).update_one(
+        {"_id": f"{template_id}|{bucket}"},
+        {
+            "$set": {"template_id": template_id, "bucket": bucket, "prompt": prompt},
+            "$setOnInsert": {"variantes": [], "atualizado_em": datetime.now(timezone.utc)},
+        },
+        upsert=True,
+    )
+
+
+async def _preencher_pool(template_id: str, bucket: str, tamanho: int = POOL_TAMANHO) -> int:
+    """Gera variações até o pool atingir `tamanho` e persiste. Retorna quantas foram geradas."""
+    # Import tardio para evitar ciclo agents → utils → core
+    from app.core.ia_direct import gerar_resposta_ia, RESPOSTA_FALLBACK
+
+    chave = (template_id, bucket)
+    prompt = _TEMPLATES.get(chave)
+    geradas = 0
+    try:
+        if not prompt:
+            return 0
+        await _semear_template(template_id, bucket, prompt)
+        pool = list(_POOLS.get(chave, []))
+        tentativas = 0
+        while len(pool) < tamanho and tentativas < tamanho * 2:
+            tentativas += 1
+            texto = _limpar_variante(await gerar_resposta_ia({"prompt_context": prompt}) or "")
+            if texto == RESPOSTA_FALLBACK:
+                break  # IA indisponível: não polui o pool com o texto de fallback
+            if len(texto) < TAMANHO_MINIMO_VARIANTE or texto in pool:
+                continue
+            pool.append(texto)
+            geradas += 1
+        _POOLS[chave] = pool
+
+        if geradas:
+            await banco.colecao(COLECAO_VARIANTES).update_one(
+                {"_id": f"{template_id}|{bucket}"},
+                {"$set": {"variantes": pool, "atualizado_em": datetime.now(timezone.utc)}},
+            )
+            logger.info(f"VARIANTES: {geradas} variação(ões) gerada(s) para '{template_id}' ({bucket}). Pool: {len(pool)}.")
+        return geradas
+    except Exception as e:
+        logger.error(f"VARIANTES: Erro ao preencher pool '{template_id}' ({bucket}): {e}")
+        return geradas
+    finally:
+        _EM_PREENCHIMENTO.discard(chave)
+
+
+async def gerar_pools() -> int:
+    """
+    Job periódico: completa todos os pools registrados abaixo do tamanho alvo.
+    Também pode ser executado offline (python -m app.utils.variantes).
+    """
+    if not _POOLS:
+        await carregar_pools()
+    total = 0
+    for template_id, bucket in list(_TEMPLATES):
+        if len(_POOLS.get((template_id, bucket), [])) >= POOL_TAMANHO:
+            continue
+        if (template_id, bucket) in _EM_PREENCHIMENTO:
+            continue
+        _EM_PREENCHIMENTO.add((template_id, bucket))
+        total += await _preencher_pool(template_id, bucket)
+    logger.info(f"VARIANTES: Job concluído. {total} variação(ões) nova(s).")
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level="INFO")
+    asyncio.run(gerar_pools())
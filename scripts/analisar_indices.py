@@ -0,0 +1,44 @@
+# ===========================================================
+# Arquivo: scripts/analisar_indices.py
+# Roda explain() nas formas de consulta da aplicação (core/indices.py)
+# contra o MongoDB configurado (MONGO_URI) e imprime o relatório.
+#   python scripts/analisar_indices.py            -> só analisa
+#   python scripts/analisar_indices.py --aplicar  -> aplica migrações antes
+# Sai com código 1 se alguma consulta tiver COLLSCAN/SORT em memória.
+# ===========================================================
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.core import indices  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Consultor de índices do FAMDOMES")
+    parser.add_argument("--aplicar", action="store_true", help="aplica as migrações de índice pendentes antes da análise")
+    args = parser.parse_args()
+
+    if args.aplicar:
+        print(f"Migrações aplicadas: {indices.aplicar_migracoes()}")
+
+    resultados = indices.analisar_formas()
+    com_problema = 0
+    print(f"{'consulta':36} {'coleção':20} {'índice':28} {'exam/ret':>12} {'razão':>7}  problemas")
+    for r in resultados:
+        if "erro" in r:
+            print(f"{r['nome']:36} {r['colecao']:20} ERRO: {r['erro']}")
+            com_problema += 1
+            continue
+        indice = ",".join(r["indices"]) or "-"
+        exam_ret = f"{r['docs_examinados']}/{r['retornados']}"
+        print(f"{r['nome']:36} {r['colecao']:20} {indice:28} {exam_ret:>12} {r['razao_examinados']:>7}  {' '.join(r['problemas']) or 'ok'}")
+        if r["problemas"]:
+            com_problema += 1
+    print(f"\n{len(resultados)} consultas analisadas, {com_problema} com problema.")
+    return 1 if com_problema else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
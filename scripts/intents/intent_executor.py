@@ -2,11 +2,15 @@ from datetime import datetime
 from pymongo import MongoClient
 from app.config import MONGO_URI
 from app.utils.risco import analisar_risco
-from app.utils.agenda import consultar_proximo_horario_disponivel as consultar_horario
+from app.utils.agenda import consultar_proximo_horario_disponivel_sync as consultar_horario
 from app.utils.followup import iniciar_sessao
 from app.utils.mensageria import enviar_mensagem
 from app.utils.ia_fallback import chamar_ollama
-from app.utils.contexto import salvar_contexto, obter_contexto, limpar_contexto
+from app.utils.contexto import (
+    salvar_contexto_sync as salvar_contexto,
+    obter_contexto_sync as obter_contexto,
+    limpar_contexto_sync as limpar_contexto,
+)
 from app.intents.intents_map import INTENTS
 import re
 import logging
@@ -0,0 +1,41 @@
+"""
+Configuração comum dos testes.
+- Variáveis obrigatórias de app.config com valores locais (nada é chamado de verdade).
+- Fixture `mongo`: banco em memória (mongomock-motor) no lugar de core/banco.py.
+  Testes que dependem dela são pulados se mongomock-motor não estiver instalado.
+"""
+import os
+
+import pytest
+
+for _chave, _valor in {
+    "MONGO_URI": "mongodb://127.0.0.1:1",
+    "WHATSAPP_API_URL": "http://whatsapp.teste",
+    "WHATSAPP_TOKEN": "teste",
+    "OLLAMA_API_URL": "http://ollama.teste",
+}.items():
+    os.environ.setdefault(_chave, _valor)
+
+
+class _ColecaoMock:
+    """Coleção do mongomock-motor com `aggregate` aguardável, como no AsyncMongoClient do pymongo."""
+
+    def __init__(self, colecao):
+        self._colecao = colecao
+
+    def __getattr__(self, nome):
+        return getattr(self._colecao, nome)
+
+    async def aggregate(self, pipeline, *args, **kwargs):
+        return self._colecao.aggregate(pipeline, *args, **kwargs)
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from app.core import banco
+
+    db = mongomock_motor.AsyncMongoMockClient()["famdomes_teste"]
+    monkeypatch.setattr(banco, "db", lambda: db)
+    monkeypatch.setattr(banco, "colecao", lambda nome, perfil=None: _ColecaoMock(db[nome]))
+    return db
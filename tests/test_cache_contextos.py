@@ -0,0 +1,156 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+from app.core import banco
+from app.core.cache_contextos import CacheContextos
+
+TEL = "5511999990000"
+
+
+@pytest_asyncio.fixture
+async def contextos(mongo):
+    await mongo.contextos.create_index("tel", unique=True)
+    await mongo.contextos.insert_one(
+        {"tel": TEL, "estado": "INICIAL", "meta_conversa": {}, "interacoes": 0, "versao": 1}
+    )
+    return mongo.contextos
+
+
+async def _worker(contextos) -> CacheContextos:
+    """Um cache por worker, cada um com o documento lido do banco."""
+    cache = CacheContextos(intervalo_s=3600)
+    cache.guardar(TEL, await contextos.find_one({"tel": TEL}, {"_id": 0}))
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_conflito_recarrega_e_reaplica_o_pendente(contextos):
+    a, b = await _worker(contextos), await _worker(contextos)
+
+    b.registrar(TEL, {"$set": {"estado": "TRIAGEM"}})
+    assert await b.descarregar(TEL)
+
+    # `a` ainda está na versão 1: a gravação condicional falha e o pendente é reaplicado
+    a.registrar(TEL, {"$set": {"meta_conversa.nome": "Ana"}, "$inc": {"interacoes": 1}})
+    assert await a.descarregar(TEL)
+
+    doc = await contextos.find_one({"tel": TEL})
+    assert doc["estado"] == "TRIAGEM"
+    assert doc["meta_conversa"] == {"nome": "Ana"}
+    assert doc["interacoes"] == 1
+    assert doc["versao"] == 3
+    assert a.obter(TEL)["estado"] == "TRIAGEM"
+    await a.parar()
+    await b.parar()
+
+
+@pytest.mark.asyncio
+async def test_estado_duravel_remoto_prevalece_no_conflito(contextos):
+    a, b = await _worker(contextos), await _worker(contextos)
+
+    b.registrar(TEL, {"$set": {"estado": "PAGAMENTO_OK"}})
+    assert await b.descarregar(TEL)
+    a.registrar(TEL, {"$set": {"estado": "AGUARDANDO_PAGAMENTO", "meta_conversa.plano": "mensal"}})
+    assert await a.descarregar(TEL)
+
+    doc = await contextos.find_one({"tel": TEL})
+    assert doc["estado"] == "PAGAMENTO_OK"
+    assert doc["meta_conversa"]["plano"] == "mensal"
+    await a.parar()
+    await b.parar()
+
+
+@pytest.mark.asyncio
+async def test_leitura_so_confere_versao_quando_ha_sinal(contextos, monkeypatch):
+    a, b = await _worker(contextos), await _worker(contextos)
+    b.registrar(TEL, {"$set": {"estado": "TRIAGEM"}})
+    assert await b.descarregar(TEL)
+
+    consultas = []
+    original = a._validar_versao
+
+    async def contar(telefone, entrada):
+        consultas.append(telefone)
+        await original(telefone, entrada)
+
+    monkeypatch.setattr(a, "_validar_versao", contar)
+
+    # Sem sinal: nenhuma ida ao banco na leitura
+    assert (await a.obter_atual(TEL))["estado"] == "INICIAL"
+    assert consultas == []
+
+    # Eco da própria gravação (mesma versão) não marca a entrada
+    a.tratar_mudanca({"operationType": "update", "fullDocument": {"tel": TEL, "versao": 1}})
+    await a.obter_atual(TEL)
+    assert consultas == []
+
+    # Gravação de outro worker: a próxima leitura recarrega
+    a.tratar_mudanca({"operationType": "update", "fullDocument": {"tel": TEL, "versao": 2}})
+    assert (await a.obter_atual(TEL))["estado"] == "TRIAGEM"
+    assert consultas == [TEL]
+    await a.obter_atual(TEL)
+    assert consultas == [TEL]
+    await a.parar()
+    await b.parar()
+
+
+class _ContextosLentos:
+    """update_one que só termina quando o teste libera."""
+
+    def __init__(self):
+        self.gravados = []
+        self.em_voo = asyncio.Event()
+        self.liberar = asyncio.Event()
+
+    async def update_one(self, filtro, update, upsert=False):
+        self.em_voo.set()
+        await self.liberar.wait()
+        self.gravados.append(update)
+        return SimpleNamespace(matched_count=1)
+
+
+@pytest.fixture
+def contextos_lentos(monkeypatch):
+    colecao = _ContextosLentos()
+    monkeypatch.setattr(banco, "colecao", lambda nome, perfil=None: colecao)
+    return colecao
+
+
+def _sujo(intervalo_s: float = 0.01) -> CacheContextos:
+    cache = CacheContextos(intervalo_s=intervalo_s)
+    cache.guardar(TEL, {"tel": TEL, "estado": "INICIAL", "meta_conversa": {}, "versao": 1})
+    cache.registrar(TEL, {"$set": {"estado": "PAGAMENTO_OK"}})
+    return cache
+
+
+@pytest.mark.asyncio
+async def test_parar_espera_descarga_em_voo(contextos_lentos):
+    cache = _sujo()
+    await contextos_lentos.em_voo.wait()  # ciclo de gravação no meio do update_one
+
+    parada = asyncio.create_task(cache.parar())
+    await asyncio.sleep(0.05)
+    assert not parada.done()  # não cancelou a descarga em andamento
+    contextos_lentos.liberar.set()
+    await parada
+
+    assert [u["$set"]["estado"] for u in contextos_lentos.gravados] == ["PAGAMENTO_OK"]
+    assert cache.sujas == 0
+
+
+@pytest.mark.asyncio
+async def test_descarga_cancelada_devolve_o_pendente(contextos_lentos):
+    cache = _sujo()
+    await contextos_lentos.em_voo.wait()
+
+    # Gravação travada além do prazo: o ciclo é cancelado e o pendente volta para a entrada
+    parada = asyncio.create_task(cache.parar(prazo_s=0.05))
+    await asyncio.sleep(0.1)
+    contextos_lentos.liberar.set()
+    await parada
+
+    assert [u["$set"]["estado"] for u in contextos_lentos.gravados] == ["PAGAMENTO_OK"]
+    assert cache.sujas == 0
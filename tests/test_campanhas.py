@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+from app.core import campanhas, retencao
+from app.core.outbox import COLECAO_OUTBOX, remetente as remetente_outbox
+from app.routes import campanhas as rotas
+
+USUARIO = SimpleNamespace(username="teste")
+
+
+def _contexto(tel: str, **extra) -> dict:
+    return {"tel": tel, "estado": "FINALIZADO_SEM_VENDA", "meta_conversa": {}, "versao": 1, **extra}
+
+
+@pytest_asyncio.fixture
+async def camadas(mongo):
+    await mongo.contextos.insert_many([_contexto("5511000000001"), _contexto("5511000000004")])
+    await mongo[retencao.COLECAO_CONTEXTOS_FRIOS].insert_many([
+        _contexto("5511000000002"),
+        _contexto("5511000000003", opt_out=True),
+    ])
+    return mongo
+
+
+async def _executar(publico: dict) -> str:
+    doc = await campanhas.criar("reengajamento", publico, {"texto": "Oi {tel}"})
+    id_campanha = str(doc["_id"])
+    await campanhas._transicionar(id_campanha, ["rascunho"], "executando")
+    await campanhas._executar(id_campanha)
+    return id_campanha
+
+
+@pytest.mark.asyncio
+async def test_publico_inclui_camada_fria(camadas):
+    id_campanha = await _executar({"estados": ["FINALIZADO_SEM_VENDA"]})
+
+    enviados = sorted(d["telefone"] for d in await camadas[COLECAO_OUTBOX].find({}).to_list(None))
+    assert enviados == ["5511000000001", "5511000000002", "5511000000004"]  # ...003 tem opt-out
+    campanha = await campanhas.obter(id_campanha)
+    assert campanha["status"] == "concluida"
+    assert campanha["cursor"] == "5511000000004"
+
+
+@pytest.mark.asyncio
+async def test_previa_soma_as_duas_camadas(camadas):
+    previa = await campanhas.previa({"estados": ["FINALIZADO_SEM_VENDA"]}, {"texto": "Oi"}, amostra=2)
+    assert previa["publico_total"] == 3
+    assert [e["tel"] for e in previa["exemplos"]] == ["5511000000001", "5511000000002"]
+
+
+@pytest.mark.asyncio
+async def test_opt_out_de_contato_frio_sobrevive_a_reidratacao(camadas):
+    resposta = await rotas.atualizar_opt_out(rotas.OptOutReq(telefones=["5511000000002"], ativo=True), USUARIO)
+    assert resposta == {"alterados": 1}
+
+    assert await retencao.reidratar("5511000000002")
+    assert (await camadas.contextos.find_one({"tel": "5511000000002"}))["opt_out"] is True
+    await _executar({"estados": ["FINALIZADO_SEM_VENDA"]})
+    assert await camadas[COLECAO_OUTBOX].count_documents({"telefone": "5511000000002"}) == 0
+
+
+@pytest.mark.asyncio
+async def test_tags_alcancam_as_duas_camadas(camadas):
+    req = rotas.TagsReq(telefones=["5511000000001", "5511000000002"], adicionar=["volta"])
+    assert await rotas.atualizar_tags(req, USUARIO) == {"alterados": 2}
+
+    await _executar({"tags": ["volta"]})
+    enviados = sorted(d["telefone"] for d in await camadas[COLECAO_OUTBOX].find({}).to_list(None))
+    assert enviados == ["5511000000001", "5511000000002"]
+
+
+@pytest.mark.asyncio
+async def test_pausa_e_retomada_continuam_do_cursor(mongo, monkeypatch):
+    tels = [f"551100000010{i}" for i in range(5)]
+    await mongo.contextos.insert_many([_contexto(t) for t in tels])
+    monkeypatch.setattr(campanhas, "TAMANHO_PAGINA", 2)
+    doc = await campanhas.criar("presenca", {"estados": ["FINALIZADO_SEM_VENDA"]}, {"texto": "Oi"}, taxa_por_s=1000)
+    id_campanha = str(doc["_id"])
+
+    # Pausa pedida enquanto a primeira página é enfileirada: o executor para na próxima
+    enfileirar_lote = remetente_outbox.enfileirar_lote
+    lotes = []
+
+    async def enfileirar_e_pausar(docs, **kwargs):
+        lotes.append([d["telefone"] for d in docs])
+        if len(lotes) == 1:
+            await campanhas.pausar(id_campanha)
+        return await enfileirar_lote(docs, **kwargs)
+
+    monkeypatch.setattr(remetente_outbox, "enfileirar_lote", enfileirar_e_pausar)
+    await campanhas._transicionar(id_campanha, ["rascunho"], "executando")
+    await campanhas._executar(id_campanha)
+    campanha = await campanhas.obter(id_campanha)
+    assert campanha["status"] == "pausada"
+    assert campanha["cursor"] == tels[1]
+
+    await campanhas._transicionar(id_campanha, ["pausada"], "executando")
+    await campanhas._executar(id_campanha)
+    assert lotes == [tels[0:2], tels[2:4], tels[4:]]
+    campanha = await campanhas.obter(id_campanha)
+    assert campanha["status"] == "concluida"
+    assert campanha["progresso"]["enfileirados"] == 5
+    assert campanha["progresso"]["duplicados"] == 0
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from app.core import banco
+from app.core.escritor_lote import EscritorEmLote
+
+
+class _ColecaoLenta:
+    """insert_many que só termina quando o teste libera."""
+
+    def __init__(self):
+        self.gravados = []
+        self.em_voo = asyncio.Event()
+        self.liberar = asyncio.Event()
+
+    async def insert_many(self, docs, ordered=False):
+        self.em_voo.set()
+        await self.liberar.wait()
+        self.gravados.extend(docs)
+
+
+@pytest.fixture
+def colecao_lenta(monkeypatch):
+    colecao = _ColecaoLenta()
+    monkeypatch.setattr(banco, "colecao", lambda nome, perfil=None: colecao)
+    return colecao
+
+
+@pytest.mark.asyncio
+async def test_parar_espera_gravacao_em_voo_e_grava_o_resto(colecao_lenta):
+    escritor = EscritorEmLote("eventos_teste", tamanho_lote=2, intervalo_s=0.01)
+    await escritor.iniciar()
+    for i in range(3):
+        escritor.adicionar({"i": i})
+    await colecao_lenta.em_voo.wait()
+
+    parada = asyncio.create_task(escritor.parar())
+    await asyncio.sleep(0.05)
+    assert not parada.done()  # não cancelou o insert_many em andamento
+    colecao_lenta.liberar.set()
+    await parada
+
+    assert sorted(d["i"] for d in colecao_lenta.gravados) == [0, 1, 2]
+    assert escritor.backlog == 0
+
+
+@pytest.mark.asyncio
+async def test_lote_cancelado_volta_para_o_buffer(colecao_lenta):
+    escritor = EscritorEmLote("eventos_teste", tamanho_lote=2, intervalo_s=0.01)
+    await escritor.iniciar()
+    for i in range(3):
+        escritor.adicionar({"i": i})
+    await colecao_lenta.em_voo.wait()
+
+    # Gravação travada além do prazo: a task é cancelada e o lote em voo não se perde
+    parada = asyncio.create_task(escritor.parar(prazo_s=0.05))
+    await asyncio.sleep(0.1)
+    colecao_lenta.liberar.set()
+    await parada
+
+    assert sorted(d["i"] for d in colecao_lenta.gravados) == [0, 1, 2]
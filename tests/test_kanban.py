@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.core import banco
+from app.core.kanban import MaterializadorKanban
+
+TEL = "5511999990000"
+
+
+class _CardsLentos:
+    """bulk_write que só termina quando o teste libera."""
+
+    def __init__(self):
+        self.gravados = []
+        self.em_voo = asyncio.Event()
+        self.liberar = asyncio.Event()
+
+    async def bulk_write(self, operacoes, ordered=False):
+        self.em_voo.set()
+        await self.liberar.wait()
+        self.gravados.append(len(operacoes))
+
+
+@pytest.fixture
+def cards_lentos(monkeypatch):
+    colecao = _CardsLentos()
+    monkeypatch.setattr(banco, "colecao", lambda nome, perfil=None: colecao)
+    return colecao
+
+
+def _materializador() -> MaterializadorKanban:
+    materializador = MaterializadorKanban(intervalo_s=0.01)
+    materializador.marcar(TEL, {"tel": TEL, "estado": "AGUARDANDO_PAGAMENTO"})
+    return materializador
+
+
+@pytest.mark.asyncio
+async def test_parar_espera_gravacao_em_voo(cards_lentos):
+    materializador = _materializador()
+    await cards_lentos.em_voo.wait()
+
+    parada = asyncio.create_task(materializador.parar())
+    await asyncio.sleep(0.05)
+    assert not parada.done()  # não cancelou o bulk_write em andamento
+    cards_lentos.liberar.set()
+    await parada
+
+    assert cards_lentos.gravados == [1]
+    assert materializador.estado()["pendentes"] == 0
+
+
+@pytest.mark.asyncio
+async def test_lote_cancelado_volta_para_os_pendentes(cards_lentos):
+    materializador = _materializador()
+    await cards_lentos.em_voo.wait()
+
+    # Gravação travada além do prazo: o ciclo é cancelado e o card volta para os pendentes
+    parada = asyncio.create_task(materializador.parar(prazo_s=0.05))
+    await asyncio.sleep(0.1)
+    cards_lentos.liberar.set()
+    await parada
+
+    assert cards_lentos.gravados == [1]
+    assert materializador.estado()["pendentes"] == 0
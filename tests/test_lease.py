@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from app.core import lease
+
+
+@pytest.fixture
+def lease_local(monkeypatch):
+    """Lease sempre adquirido; `renovacoes` diz o que cada renovação responde."""
+    estado = {"renovacoes": [], "liberado": False}
+
+    async def adquirir(nome, ttl_s=lease.LEASE_TTL_S):
+        return True
+
+    async def renovar(nome, ttl_s=lease.LEASE_TTL_S):
+        return estado["renovacoes"].pop(0) if estado["renovacoes"] else True
+
+    async def liberar(nome, reter_s=0):
+        estado["liberado"] = True
+
+    monkeypatch.setattr(lease, "adquirir", adquirir)
+    monkeypatch.setattr(lease, "renovar", renovar)
+    monkeypatch.setattr(lease, "liberar", liberar)
+    return estado
+
+
+@pytest.mark.asyncio
+async def test_lease_perdido_cancela_o_job(lease_local):
+    lease_local["renovacoes"] = [True, False]
+    cancelado = asyncio.Event()
+
+    async def job():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelado.set()
+            raise
+
+    resultado = await asyncio.wait_for(lease.executar_com_lease("campanha:x", job, ttl_s=0.03), timeout=1)
+    assert resultado is None
+    assert cancelado.is_set()
+    assert lease_local["liberado"]
+
+
+@pytest.mark.asyncio
+async def test_job_com_lease_renovado_termina(lease_local):
+    async def job():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    assert await lease.executar_com_lease("campanha:x", job, ttl_s=0.03) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_cancelamento_externo_continua_propagando(lease_local):
+    tarefa = asyncio.create_task(lease.executar_com_lease("campanha:x", lambda: asyncio.sleep(10), ttl_s=3))
+    await asyncio.sleep(0.01)
+    tarefa.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await tarefa
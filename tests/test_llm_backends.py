@@ -0,0 +1,137 @@
+import asyncio
+
+import httpx
+import pytest
+import pytest_asyncio
+
+from app.core import llm, llm_backends
+from app.core.llm_backends import PoolBackends
+
+URLS = ["http://ollama-a.teste", "http://ollama-b.teste", "http://ollama-c.teste"]
+
+
+class _Ollamas:
+    """Backends Ollama de mentira atrás de um httpx.MockTransport, um por host."""
+
+    def __init__(self):
+        self.fora: set = set()
+        self.chamadas: list = []
+        self.segurar = False
+        self.em_voo = 0
+        self.liberar = asyncio.Event()
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        url = f"{request.url.scheme}://{request.url.host}"
+        if url in self.fora:
+            raise httpx.ConnectError("conexão recusada", request=request)
+        if request.url.path == "/api/tags":
+            return httpx.Response(200, json={"models": []})
+        self.chamadas.append(url)
+        if self.segurar:
+            self.em_voo += 1
+            await self.liberar.wait()
+        return httpx.Response(200, json={"response": url, "model": "teste"})
+
+    def cliente(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(self))
+
+
+@pytest_asyncio.fixture
+async def ollamas(monkeypatch):
+    stub = _Ollamas()
+    cliente = stub.cliente()
+    monkeypatch.setattr(llm, "_cliente", cliente)
+    yield stub
+    await cliente.aclose()
+
+
+def _pool(monkeypatch, urls=URLS, sticky=False) -> PoolBackends:
+    pool = PoolBackends(urls, sticky=sticky)
+    monkeypatch.setattr(llm, "_pool", pool)
+    return pool
+
+
+def _backend(pool: PoolBackends, url: str) -> llm_backends.Backend:
+    return next(b for b in pool.backends if b.url == url)
+
+
+@pytest.mark.asyncio
+async def test_requisicoes_simultaneas_vao_para_o_backend_menos_ocupado(monkeypatch, ollamas):
+    _pool(monkeypatch)
+    ollamas.segurar = True
+
+    tarefas = [asyncio.create_task(llm.gerar("oi")) for _ in URLS]
+    while ollamas.em_voo < len(URLS):
+        await asyncio.sleep(0.001)
+    ollamas.liberar.set()
+    await asyncio.gather(*tarefas)
+
+    assert sorted(ollamas.chamadas) == URLS
+
+
+@pytest.mark.asyncio
+async def test_falha_de_conexao_tenta_outro_backend(monkeypatch, ollamas):
+    pool = _pool(monkeypatch, URLS[:2])
+    ollamas.fora.add(URLS[0])
+    _backend(pool, URLS[1]).latencia_ewma = 5.0  # força a primeira escolha no backend fora do ar
+
+    dados = await llm.gerar("oi")
+
+    assert dados["response"] == URLS[1]
+    assert _backend(pool, URLS[0]).falhas_seguidas == 1
+    assert _backend(pool, URLS[0]).saudavel
+
+
+@pytest.mark.asyncio
+async def test_backend_ejetado_sai_do_roteamento_e_volta_apos_sondas(monkeypatch, ollamas):
+    pool = _pool(monkeypatch)
+    ollamas.fora.add(URLS[0])
+
+    for _ in range(llm_backends.MAX_FALHAS):
+        await pool.sondar(llm._cliente)
+    assert not _backend(pool, URLS[0]).saudavel
+
+    for _ in range(10):
+        await llm.gerar("oi")
+    assert URLS[0] not in ollamas.chamadas
+
+    ollamas.fora.clear()
+    for _ in range(llm_backends.SONDAS_READMISSAO - 1):
+        await pool.sondar(llm._cliente)
+    assert not _backend(pool, URLS[0]).saudavel  # uma sonda OK ainda não readmite
+    await pool.sondar(llm._cliente)
+    assert _backend(pool, URLS[0]).saudavel
+
+
+@pytest.mark.asyncio
+async def test_loop_de_health_readmite_backend(ollamas):
+    pool = PoolBackends(URLS[:2])
+    _backend(pool, URLS[0]).ejetar()
+
+    pool.iniciar_health(lambda: llm._cliente, intervalo_s=0.01)
+    try:
+        for _ in range(100):
+            if _backend(pool, URLS[0]).saudavel:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await pool.parar_health()
+
+    assert _backend(pool, URLS[0]).saudavel
+
+
+@pytest.mark.asyncio
+async def test_afinidade_fixa_a_conversa_no_mesmo_backend(monkeypatch, ollamas):
+    pool = _pool(monkeypatch, sticky=True)
+
+    for _ in range(5):
+        await llm.gerar("oi", afinidade="5511999990000")
+    assert len(set(ollamas.chamadas)) == 1
+    preferido = ollamas.chamadas[0]
+
+    # Preferido fora do pool: a conversa vai para outro e volta quando ele é readmitido
+    _backend(pool, preferido).ejetar()
+    outro = (await llm.gerar("oi", afinidade="5511999990000"))["response"]
+    assert outro != preferido
+    _backend(pool, preferido).readmitir()
+    assert (await llm.gerar("oi", afinidade="5511999990000"))["response"] == preferido
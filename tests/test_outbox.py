@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.core import outbox
+from app.core.outbox import COLECAO_OUTBOX, RemetenteOutbox
+
+AGORA = datetime.now(timezone.utc)
+
+
+def _entrada(_id: str, telefone: str, *, criado_s: int, disponivel_s: int = -60, prioridade: int = 0) -> dict:
+    """`criado_s`/`disponivel_s`: segundos relativos a AGORA."""
+    return {
+        "_id": _id,
+        "telefone": telefone,
+        "texto": _id,
+        "status": "pendente",
+        "prioridade": prioridade,
+        "tentativas": 0,
+        "criado_em": AGORA + timedelta(seconds=criado_s),
+        "disponivel_em": AGORA + timedelta(seconds=disponivel_s),
+    }
+
+
+async def _enviar(mongo, doc: dict) -> None:
+    await mongo[COLECAO_OUTBOX].update_one({"_id": doc["_id"]}, {"$set": {"status": "enviado"}})
+
+
+@pytest.mark.asyncio
+async def test_entrada_em_backoff_segura_as_seguintes_do_telefone(mongo, monkeypatch):
+    await mongo[COLECAO_OUTBOX].insert_many([
+        _entrada("a1", "5511000000001", criado_s=-30, disponivel_s=60),  # falhou, em backoff
+        _entrada("a2", "5511000000001", criado_s=-20),
+        _entrada("b1", "5511000000002", criado_s=-10, prioridade=5),
+    ])
+    remetente = RemetenteOutbox(concorrencia=1)
+
+    doc = await remetente._reivindicar()
+    assert doc["_id"] == "b1"  # a2 não passa na frente de a1
+    await _enviar(mongo, doc)
+    assert await remetente._reivindicar() is None
+
+    # Backoff vencido: sai a1 e só depois a2
+    monkeypatch.setattr(outbox, "_agora", lambda: AGORA + timedelta(seconds=120))
+    doc = await remetente._reivindicar()
+    assert doc["_id"] == "a1"
+    assert await remetente._reivindicar() is None  # a1 em voo
+    await _enviar(mongo, doc)
+    assert (await remetente._reivindicar())["_id"] == "a2"
+
+
+@pytest.mark.asyncio
+async def test_telefones_travados_nao_bloqueiam_a_reivindicacao(mongo, monkeypatch):
+    monkeypatch.setattr(outbox, "CANDIDATOS", 2)
+    entradas = []
+    for i in range(3):  # mais telefones travados do que candidatos por consulta
+        tel = f"551100000001{i}"
+        entradas += [
+            _entrada(f"t{i}-1", tel, criado_s=-60, disponivel_s=600),
+            _entrada(f"t{i}-2", tel, criado_s=-50),
+        ]
+    entradas.append(_entrada("livre", "5511000000099", criado_s=-10, prioridade=10))
+    await mongo[COLECAO_OUTBOX].insert_many(entradas)
+
+    doc = await RemetenteOutbox(concorrencia=1)._reivindicar()
+    assert doc["_id"] == "livre"
+    assert doc["status"] == "enviando"
+
+
+def test_migracao_17_deixa_uma_enviando_por_telefone():
+    mongomock = pytest.importorskip("mongomock")
+    from app.core.indices import MIGRACOES
+
+    db = mongomock.MongoClient()["famdomes_teste"]
+    entradas = [
+        _entrada("a1", "5511000000001", criado_s=-30),
+        _entrada("a2", "5511000000001", criado_s=-20),
+        _entrada("b1", "5511000000002", criado_s=-10),
+    ]
+    for entrada in entradas:
+        entrada.update({"status": "enviando", "dono": "w1"})
+    db[COLECAO_OUTBOX].insert_many(entradas)
+
+    migracao = next(m for m in MIGRACOES if m.versao == 17)
+    migracao.preparar(db[COLECAO_OUTBOX])
+    status = {d["_id"]: d["status"] for d in db[COLECAO_OUTBOX].find()}
+    assert status == {"a1": "enviando", "a2": "pendente", "b1": "enviando"}
+    assert "dono" not in db[COLECAO_OUTBOX].find_one({"_id": "a2"})
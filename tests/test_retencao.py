@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+
+from app.core import retencao
+from app.core.cache_contextos import CacheContextos
+
+TEL = "5511999990000"
+
+
+@pytest_asyncio.fixture
+async def camadas(mongo):
+    await mongo.contextos.create_index("tel", unique=True)
+    await mongo[retencao.COLECAO_CONTEXTOS_FRIOS].create_index("tel", unique=True)
+    return mongo
+
+
+@pytest.mark.asyncio
+async def test_gravacao_de_contexto_congelado_depois_de_lido_reidrata(camadas):
+    doc = {"tel": TEL, "estado": "INICIAL", "meta_conversa": {"nome": "Ana"}, "interacoes": 7, "versao": 1}
+    await camadas.contextos.insert_one(dict(doc))
+    cache = CacheContextos(intervalo_s=3600)
+    cache.reidratar = retencao.reidratar
+    cache.guardar(TEL, await camadas.contextos.find_one({"tel": TEL}, {"_id": 0}))
+
+    # Congelado entre a leitura do cache e a gravação
+    frio = await camadas.contextos.find_one({"tel": TEL})
+    await camadas[retencao.COLECAO_CONTEXTOS_FRIOS].insert_one(frio)
+    await camadas.contextos.delete_one({"tel": TEL})
+
+    cache.registrar(TEL, {"$set": {"estado": "TRIAGEM"}, "$inc": {"interacoes": 1}})
+    assert await cache.descarregar(TEL)
+
+    quente = await camadas.contextos.find_one({"tel": TEL})
+    assert quente["estado"] == "TRIAGEM"
+    assert quente["meta_conversa"] == {"nome": "Ana"}
+    assert quente["interacoes"] == 8
+    assert await camadas[retencao.COLECAO_CONTEXTOS_FRIOS].count_documents({}) == 0
+    await cache.parar()
+
+
+@pytest.mark.asyncio
+async def test_reidratar_completa_documento_quente_parcial(camadas):
+    await camadas[retencao.COLECAO_CONTEXTOS_FRIOS].insert_one(
+        {"tel": TEL, "estado": "INICIAL", "meta_conversa": {"nome": "Ana"}, "interacoes": 7, "versao": 4}
+    )
+    await camadas.contextos.insert_one({"tel": TEL, "estado": "TRIAGEM", "meta_conversa": {"score_lead": 3}, "versao": 1})
+
+    assert await retencao.reidratar(TEL)
+
+    quente = await camadas.contextos.find_one({"tel": TEL})
+    assert quente["estado"] == "TRIAGEM"
+    assert quente["meta_conversa"] == {"score_lead": 3, "nome": "Ana"}
+    assert quente["interacoes"] == 7
+    assert quente["versao"] == 2
+    assert await camadas[retencao.COLECAO_CONTEXTOS_FRIOS].count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_congelar_nao_apaga_quente_se_ja_ha_copia_fria(camadas):
+    agora = datetime.now(timezone.utc)
+    antigo = agora - timedelta(days=retencao.CONTEXTO_FRIO_DIAS + 1)
+    await camadas.contextos.insert_one({"tel": TEL, "estado": "INICIAL", "ts": antigo, "versao": 3})
+    await camadas[retencao.COLECAO_CONTEXTOS_FRIOS].insert_one({"tel": TEL, "estado": "INICIAL", "versao": 1})
+
+    pulados: set = set()
+    lidos, congelados = await retencao._congelar_lote(retencao._filtro_frios(agora), pulados, agora)
+
+    assert (lidos, congelados) == (1, 0)
+    assert pulados == {TEL}
+    assert (await camadas.contextos.find_one({"tel": TEL}))["versao"] == 3
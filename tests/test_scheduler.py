@@ -0,0 +1,36 @@
+import pytest
+
+from app.core import scheduler
+from app.core.temporizador import CAMPO_VENCIMENTO
+
+TEL = "5511999990000"
+
+
+async def _candidatos(*tels):
+    for tel in tels:
+        yield tel
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("gravou", [True, False])
+async def test_followup_nao_gravado_volta_ao_temporizador(mongo, monkeypatch, gravou):
+    await mongo.contextos.insert_one({"tel": TEL, "estado": "AGUARDANDO_PAGAMENTO", "meta_conversa": {}, "versao": 1})
+    flags = []
+
+    async def executar_envio(tel, intent):
+        return gravou
+
+    async def gravar_flags(col_contextos, tels, tipo, flag):
+        flags.extend(tels)
+
+    monkeypatch.setattr(scheduler, "_executar_envio", executar_envio)
+    monkeypatch.setattr(scheduler, "_gravar_flags", gravar_flags)
+    stats = await scheduler._despachar_followups("pagamento", _candidatos(TEL))
+
+    doc = await mongo.contextos.find_one({"tel": TEL})
+    if gravou:
+        assert (stats["enviados"], stats["falhas"], flags) == (1, 0, [TEL])
+    else:
+        assert (stats["enviados"], stats["falhas"], flags) == (0, 1, [])
+        assert "followup_pagamento_reivindicado_em" not in doc["meta_conversa"]
+        assert CAMPO_VENCIMENTO in doc  # reagendado para nova tentativa
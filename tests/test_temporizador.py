@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+
+from app.core.temporizador import Temporizador
+
+TEL = "5511999990000"
+
+
+def _temporizador() -> Temporizador:
+    temporizador = Temporizador(horizonte_s=300)
+    temporizador._task = object()  # `agendar` só arma com o laço rodando
+    return temporizador
+
+
+def _em(segundos: float) -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=segundos)
+
+
+def test_adiamento_nao_empilha_e_reconfere_no_vencimento():
+    temporizador = _temporizador()
+    temporizador.agendar(TEL, _em(-1), "qualificacao")
+    adiado = _em(60)
+    temporizador.agendar(TEL, adiado, "pagamento")
+    assert len(temporizador._heap) == 1  # só o prazo conhecido mudou
+
+    assert temporizador._vencidos() == []
+    assert temporizador._heap == [(adiado, TEL)]
+    assert temporizador._prazos[TEL] == (adiado, "pagamento")
+
+
+def test_adiamento_para_alem_do_horizonte_fica_para_a_carga():
+    temporizador = _temporizador()
+    temporizador.agendar(TEL, _em(-1), "qualificacao")
+    temporizador.agendar(TEL, _em(3600), "qualificacao")
+
+    assert temporizador._vencidos() == []
+    assert temporizador._heap == []
+    assert TEL not in temporizador._prazos and TEL not in temporizador._na_fila
+
+
+def test_cancelado_e_descartado_quando_vence():
+    temporizador = _temporizador()
+    temporizador.agendar(TEL, _em(-1), "qualificacao")
+    temporizador.cancelar(TEL)
+
+    assert temporizador._vencidos() == []
+    assert temporizador._heap == [] and temporizador._na_fila == {}
+
+
+def test_reagendado_para_antes_dispara_uma_vez():
+    temporizador = _temporizador()
+    temporizador.agendar(TEL, _em(-10), "qualificacao")
+    antes = _em(-20)
+    temporizador.agendar(TEL, antes, "pagamento")
+    assert len(temporizador._heap) == 2  # a entrada antiga fica e é ignorada ao sair
+
+    assert temporizador._vencidos() == [(TEL, "pagamento", antes)]
+    assert temporizador._heap == [] and temporizador._prazos == {}